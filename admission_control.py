@@ -0,0 +1,243 @@
+"""
+Admission Control for Matt-GPT
+Bounds concurrent pipeline executions per worker and sheds load quickly when saturated
+"""
+
+import asyncio
+import os
+import time
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Priority lanes, highest priority first
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANES = (LANE_INTERACTIVE, LANE_BATCH)
+
+T = TypeVar("T")
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted to the pipeline"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Per-worker admission controller with a fixed number of pipeline slots
+    and a bounded wait queue per priority lane.
+
+    Interactive waiters are always woken before batch waiters. When a lane's
+    queue is full the request is rejected immediately with 429; when a waiter
+    times out before a slot frees up it is rejected with 503.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_queue: Optional[Dict[str, int]] = None,
+        max_wait_seconds: float = 10.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue or {LANE_INTERACTIVE: 16, LANE_BATCH: 32}
+        self.max_wait_seconds = max_wait_seconds
+
+        self._in_flight = 0
+        self._waiters = {lane: deque() for lane in LANES}
+
+        # Metrics
+        self._admitted = {lane: 0 for lane in LANES}
+        self._rejected_queue_full = {lane: 0 for lane in LANES}
+        self._rejected_timeout = {lane: 0 for lane in LANES}
+        self._wait_ms_total = {lane: 0.0 for lane in LANES}
+        self._wait_ms_max = {lane: 0.0 for lane in LANES}
+        self._recent_pipeline_ms = deque(maxlen=100)
+
+        logger.info(
+            f"Admission controller initialized: slots={max_concurrent}, "
+            f"queues={self.max_queue}, max_wait={max_wait_seconds}s"
+        )
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Build a controller from CHAT_* environment variables"""
+        return cls(
+            max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", "4")),
+            max_queue={
+                LANE_INTERACTIVE: int(os.getenv("CHAT_MAX_QUEUE_INTERACTIVE", "16")),
+                LANE_BATCH: int(os.getenv("CHAT_MAX_QUEUE_BATCH", "32")),
+            },
+            max_wait_seconds=float(os.getenv("CHAT_MAX_QUEUE_WAIT_SECONDS", "10")),
+        )
+
+    def _retry_after_seconds(self) -> int:
+        """Estimate how long a rejected client should wait before retrying"""
+        if self._recent_pipeline_ms:
+            avg_ms = sum(self._recent_pipeline_ms) / len(self._recent_pipeline_ms)
+        else:
+            avg_ms = 5000.0
+        queued = sum(self._queue_length(lane) for lane in LANES)
+        # Each slot drains roughly one request per average pipeline duration
+        estimate = avg_ms / 1000.0 * (1 + queued / max(self.max_concurrent, 1))
+        return max(1, int(round(estimate)))
+
+    def _queue_length(self, lane: str) -> int:
+        """Waiters in the lane that are still waiting (not timed out, cancelled or handed a slot)"""
+        return sum(1 for f in self._waiters[lane] if not f.done())
+
+    def _forget(self, lane: str, future: asyncio.Future):
+        """Drop a timed-out or cancelled waiter so it no longer counts against the queue"""
+        try:
+            self._waiters[lane].remove(future)
+        except ValueError:
+            pass  # Already popped by _wake_next
+
+    def _has_priority_waiters(self, lane: str) -> bool:
+        """True if anyone in this lane or a higher-priority lane is already waiting"""
+        for candidate in LANES:
+            if self._queue_length(candidate):
+                return True
+            if candidate == lane:
+                break
+        return False
+
+    def _wake_next(self):
+        """Hand a freed slot to the highest-priority live waiter"""
+        for lane in LANES:
+            queue = self._waiters[lane]
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    self._in_flight += 1
+                    future.set_result(True)
+                    return
+
+    async def acquire(self, lane: str = LANE_INTERACTIVE) -> float:
+        """
+        Acquire a pipeline slot, waiting in the lane's queue if necessary
+
+        Returns:
+            Time spent waiting in milliseconds
+
+        Raises:
+            AdmissionRejected: if the lane queue is full or the wait times out
+        """
+        if lane not in self._waiters:
+            lane = LANE_INTERACTIVE
+
+        start = time.monotonic()
+
+        if self._in_flight < self.max_concurrent and not self._has_priority_waiters(lane):
+            self._in_flight += 1
+            self._admitted[lane] += 1
+            return 0.0
+
+        if self._queue_length(lane) >= self.max_queue.get(lane, 0):
+            self._rejected_queue_full[lane] += 1
+            retry_after = self._retry_after_seconds()
+            logger.warning(f"Admission rejected ({lane}): queue full, retry after {retry_after}s")
+            raise AdmissionRejected(429, f"Server busy: {lane} queue is full", retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Slot was handed over just as we timed out - keep it
+                pass
+            else:
+                future.cancel()
+                self._forget(lane, future)
+                self._rejected_timeout[lane] += 1
+                retry_after = self._retry_after_seconds()
+                logger.warning(f"Admission rejected ({lane}): waited {self.max_wait_seconds}s without a free slot")
+                raise AdmissionRejected(503, f"Server overloaded: no pipeline slot within {self.max_wait_seconds:.0f}s", retry_after)
+        except asyncio.CancelledError:
+            # Client went away - give the slot back if we were just handed one
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+                self._forget(lane, future)
+            raise
+
+        wait_ms = (time.monotonic() - start) * 1000
+        self._admitted[lane] += 1
+        self._wait_ms_total[lane] += wait_ms
+        self._wait_ms_max[lane] = max(self._wait_ms_max[lane], wait_ms)
+        return wait_ms
+
+    def release(self, pipeline_ms: Optional[float] = None):
+        """Release a pipeline slot and wake the next waiter"""
+        if pipeline_ms is not None:
+            self._recent_pipeline_ms.append(pipeline_ms)
+        self._in_flight = max(0, self._in_flight - 1)
+        self._wake_next()
+
+    @asynccontextmanager
+    async def slot(self, lane: str = LANE_INTERACTIVE):
+        """Context manager wrapping acquire/release around a pipeline run"""
+        wait_ms = await self.acquire(lane)
+        start = time.monotonic()
+        try:
+            yield wait_ms
+        finally:
+            self.release((time.monotonic() - start) * 1000)
+
+    def get_stats(self) -> dict:
+        """Snapshot of queue length, wait time and rejection counters"""
+        lanes = {}
+        for lane in LANES:
+            admitted = self._admitted[lane]
+            lanes[lane] = {
+                "queue_length": self._queue_length(lane),
+                "max_queue": self.max_queue.get(lane, 0),
+                "admitted": admitted,
+                "rejected_queue_full": self._rejected_queue_full[lane],
+                "rejected_timeout": self._rejected_timeout[lane],
+                "avg_wait_ms": self._wait_ms_total[lane] / admitted if admitted else 0.0,
+                "max_wait_ms": self._wait_ms_max[lane],
+            }
+
+        return {
+            "pid": os.getpid(),
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self._in_flight,
+            "max_wait_seconds": self.max_wait_seconds,
+            "avg_pipeline_ms": (
+                sum(self._recent_pipeline_ms) / len(self._recent_pipeline_ms)
+                if self._recent_pipeline_ms else None
+            ),
+            "lanes": lanes,
+        }
+
+
+async def retry_admission(run: Callable[[], Awaitable[T]], deadline_seconds: float, label: str = "Request") -> T:
+    """
+    Await run(), backing off by Retry-After whenever it isn't admitted
+
+    For callers that would rather wait than shed (batch items, async jobs),
+    but only for deadline_seconds: once the next retry would start after the
+    deadline, the last AdmissionRejected is raised so the caller can report it.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    while True:
+        try:
+            return await run()
+        except AdmissionRejected as e:
+            if time.monotonic() + e.retry_after > deadline:
+                logger.warning(f"{label} gave up waiting for a pipeline slot after {deadline_seconds:.0f}s")
+                raise
+            logger.info(f"{label} waiting {e.retry_after}s for a pipeline slot")
+            await asyncio.sleep(e.retry_after)
@@ -0,0 +1,411 @@
+"""
+Analytics Maintenance Service for Matt-GPT
+Monthly partitioning, retention and hourly rollups for query_logs and rag_analytics
+"""
+
+import os
+import gzip
+import logging
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from database import engine
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Telemetry tables partitioned by month on created_at
+PARTITIONED_TABLES = ("query_logs", "rag_analytics")
+
+# Secondary indexes recreated on the partitioned parents (propagated to every partition)
+PARTITIONED_INDEXES = {
+    "query_logs": [
+        ("ix_query_logs_conversation_id", "(conversation_id)"),
+        ("ix_query_logs_created_at", "(created_at)"),
+        ("ix_query_logs_conversation_id_created_at", "(conversation_id, created_at)"),
+    ],
+    "rag_analytics": [
+        ("ix_rag_analytics_query_id", "(query_id)"),
+        ("ix_rag_analytics_created_at", "(created_at)"),
+    ],
+}
+
+# Partitions created ahead of time so inserts never land in the default partition
+PARTITION_MONTHS_AHEAD = int(os.getenv("ANALYTICS_PARTITION_MONTHS_AHEAD", "3"))
+# Months of raw telemetry kept attached; rollups are kept forever
+ANALYTICS_RETENTION_MONTHS = int(os.getenv("ANALYTICS_RETENTION_MONTHS", "6"))
+# Hours re-aggregated on every rollup run to pick up rows the telemetry writer flushed late
+ROLLUP_LATENESS_HOURS = int(os.getenv("ANALYTICS_ROLLUP_LATENESS_HOURS", "2"))
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    """Partition naming convention: query_logs_p202610"""
+    return f"{table}_p{month.year:04d}{month.month:02d}"
+
+
+def parse_partition_month(table: str, name: str) -> Optional[date]:
+    """Inverse of partition_name; None for the default partition or foreign tables"""
+    prefix = f"{table}_p"
+    suffix = name[len(prefix):]
+    if not name.startswith(prefix) or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def is_partitioned(conn, table: str) -> bool:
+    result = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :table AND relnamespace = 'public'::regnamespace"),
+        {"table": table}
+    ).scalar()
+    return result == "p"
+
+
+def list_partitions(conn, table: str) -> List[Tuple[str, Optional[date]]]:
+    """Attached partitions of a table as (name, month) - month is None for the default partition"""
+    rows = conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+        ORDER BY child.relname
+    """), {"table": table}).fetchall()
+    return [(row[0], parse_partition_month(table, row[0])) for row in rows]
+
+
+def create_partition(conn, table: str, name: str, month: date, default: Optional[str] = None):
+    """
+    Create one monthly partition, moving any of its rows out of the default partition
+
+    Postgres refuses to create a partition whose range already has rows in the
+    default partition. When there are some (a month that wasn't created ahead
+    in time), the default is detached, the partition created, the rows moved
+    across and the default re-attached, all in the caller's transaction.
+    Inserts into the table wait on the detach's lock until it commits.
+    """
+    bounds = {"start": month, "end": add_months(month, 1)}
+    range_sql = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+    stranded = default is not None and conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE created_at >= :start AND created_at < :end)"),
+        bounds
+    ).scalar()
+    if not stranded:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {range_sql}"))
+        return
+
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {range_sql}"))
+    moved = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {default} WHERE created_at >= :start AND created_at < :end RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds).rowcount
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    logger.warning(f"Moved {moved} rows from {default} into {name} - raise ANALYTICS_PARTITION_MONTHS_AHEAD "
+                   f"or run ensure_partitions more often so months exist before their rows arrive")
+
+
+def ensure_partitions(table: str, months_ahead: int = PARTITION_MONTHS_AHEAD, start: Optional[date] = None) -> List[str]:
+    """
+    Create monthly partitions from `start` (default: this month) through `months_ahead` months ahead
+
+    Returns:
+        Names of partitions that were created
+    """
+    created = []
+    first = month_start(start or datetime.utcnow().date())
+    last = add_months(month_start(datetime.utcnow().date()), months_ahead)
+
+    with engine.begin() as conn:
+        if not is_partitioned(conn, table):
+            logger.warning(f"{table} is not partitioned yet - run scripts/analytics_maintenance.py partition")
+            return created
+
+        partitions = list_partitions(conn, table)
+        existing = {name for name, _ in partitions}
+        default = next((name for name, partition_month in partitions if partition_month is None), None)
+        month = first
+        while month <= last:
+            name = partition_name(table, month)
+            if name not in existing:
+                create_partition(conn, table, name, month, default)
+                created.append(name)
+            month = add_months(month, 1)
+
+    if created:
+        logger.info(f"Created {len(created)} {table} partitions: {', '.join(created)}")
+    return created
+
+
+def partition_table(table: str) -> int:
+    """
+    Convert an existing unpartitioned telemetry table into a monthly range-partitioned one.
+
+    The table is copied into a new partitioned parent inside one transaction
+    and the two are swapped by rename. The primary key becomes (id, created_at)
+    because Postgres requires the partition key in unique constraints. The old
+    table is kept as <table>_unpartitioned; rows that were blocked on its lock
+    during the swap are copied across afterwards.
+
+    Returns:
+        Number of rows copied
+    """
+    new_table = f"{table}_partitioned"
+    old_table = f"{table}_unpartitioned"
+
+    with engine.begin() as conn:
+        if is_partitioned(conn, table):
+            logger.info(f"{table} is already partitioned")
+            return 0
+
+        # Blocks telemetry inserts (not reads) until the swap commits
+        conn.execute(text(f"LOCK TABLE {table} IN EXCLUSIVE MODE"))
+
+        first_created = conn.execute(text(f"SELECT MIN(created_at) FROM {table}")).scalar()
+        first_month = month_start(first_created.date() if first_created else datetime.utcnow().date())
+
+        conn.execute(text(f"""
+            CREATE TABLE {new_table} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY RANGE (created_at)
+        """))
+        conn.execute(text(f"ALTER TABLE {new_table} ADD CONSTRAINT {new_table}_pkey PRIMARY KEY (id, created_at)"))
+        conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {new_table} DEFAULT"))
+
+        last_month = add_months(month_start(datetime.utcnow().date()), PARTITION_MONTHS_AHEAD)
+        month = first_month
+        while month <= last_month:
+            conn.execute(text(f"""
+                CREATE TABLE {partition_name(table, month)} PARTITION OF {new_table}
+                FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')
+            """))
+            month = add_months(month, 1)
+
+        copied = conn.execute(text(f"INSERT INTO {new_table} SELECT * FROM {table}")).rowcount
+
+        # Free the index names for the new parent
+        old_indexes = conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :table AND schemaname = 'public'"),
+            {"table": table}
+        ).fetchall()
+        for (index_name,) in old_indexes:
+            conn.execute(text(f"ALTER INDEX {index_name} RENAME TO {index_name}_unpartitioned"))
+
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {old_table}"))
+        conn.execute(text(f"ALTER TABLE {new_table} RENAME TO {table}"))
+        conn.execute(text(f"ALTER INDEX {new_table}_pkey RENAME TO {table}_pkey"))
+
+        for index_name, columns in PARTITIONED_INDEXES[table]:
+            conn.execute(text(f"CREATE INDEX {index_name} ON {table} {columns}"))
+
+    with engine.begin() as conn:
+        stragglers = conn.execute(text(f"""
+            INSERT INTO {table}
+            SELECT * FROM {old_table} old
+            WHERE NOT EXISTS (SELECT 1 FROM {table} new WHERE new.id = old.id AND new.created_at = old.created_at)
+        """)).rowcount
+
+    logger.info(f"Partitioned {table}: copied {copied} rows (+{stragglers} written during the swap), old table kept as {old_table}")
+    return copied + stragglers
+
+
+def apply_retention(
+    table: str,
+    keep_months: int = ANALYTICS_RETENTION_MONTHS,
+    mode: str = "detach",
+    archive_dir: Optional[str] = None,
+    dry_run: bool = False,
+) -> List[str]:
+    """
+    Remove monthly partitions that ended more than `keep_months` months ago
+
+    Args:
+        mode: 'detach' leaves the partition as a standalone table,
+              'archive' writes it to <archive_dir>/<partition>.csv.gz and drops it,
+              'drop' drops it outright
+        dry_run: only report what would be removed
+
+    Returns:
+        Names of partitions that were (or would be) removed
+    """
+    if mode not in ("detach", "archive", "drop"):
+        raise ValueError(f"Unknown retention mode: {mode}")
+    if mode == "archive" and not archive_dir:
+        raise ValueError("archive_dir is required for archive mode")
+
+    cutoff = add_months(month_start(datetime.utcnow().date()), -keep_months)
+
+    with engine.connect() as conn:
+        expired = [
+            name for name, month in list_partitions(conn, table)
+            if month is not None and add_months(month, 1) <= cutoff
+        ]
+
+    if dry_run or not expired:
+        logger.info(f"{table}: {len(expired)} partitions older than {cutoff} {'would be' if dry_run else ''} removed")
+        return expired
+
+    for name in expired:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+
+        if mode == "archive":
+            path = archive_partition(name, archive_dir)
+            logger.info(f"Archived {name} to {path}")
+
+        if mode in ("archive", "drop"):
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE {name}"))
+
+        logger.info(f"Retention: {mode} {name}")
+
+    return expired
+
+
+def archive_partition(name: str, archive_dir: str) -> Path:
+    """Stream a (detached) partition to a gzipped CSV with a header row"""
+    import psycopg
+
+    directory = Path(archive_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{name}.csv.gz"
+
+    with psycopg.connect(os.getenv("DATABASE_URL")) as conn:
+        with conn.cursor() as cur, gzip.open(path, "wb") as out:
+            with cur.copy(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)") as copy:
+                for chunk in copy:
+                    out.write(chunk)
+    return path
+
+
+ROLLUP_QUERY_LOGS_SQL = """
+INSERT INTO analytics_hourly_rollups (
+    bucket_start, request_count, conversation_count, total_tokens, avg_tokens,
+    latency_p50_ms, latency_p95_ms, latency_p99_ms, updated_at
+)
+SELECT
+    date_trunc('hour', created_at) AS bucket_start,
+    COUNT(*),
+    COUNT(DISTINCT conversation_id),
+    COALESCE(SUM(tokens_used), 0),
+    COALESCE(AVG(tokens_used), 0),
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms),
+    percentile_cont(0.99) WITHIN GROUP (ORDER BY latency_ms),
+    now()
+FROM query_logs
+WHERE created_at >= :since
+GROUP BY 1
+ON CONFLICT (bucket_start) DO UPDATE SET
+    request_count = EXCLUDED.request_count,
+    conversation_count = EXCLUDED.conversation_count,
+    total_tokens = EXCLUDED.total_tokens,
+    avg_tokens = EXCLUDED.avg_tokens,
+    latency_p50_ms = EXCLUDED.latency_p50_ms,
+    latency_p95_ms = EXCLUDED.latency_p95_ms,
+    latency_p99_ms = EXCLUDED.latency_p99_ms,
+    updated_at = EXCLUDED.updated_at
+"""
+
+ROLLUP_RAG_ANALYTICS_SQL = """
+INSERT INTO analytics_hourly_rollups (
+    bucket_start, rag_request_count, fallback_count, fallback_rate,
+    expansion_p50_ms, expansion_p95_ms, retrieval_p50_ms, retrieval_p95_ms,
+    filtering_p50_ms, filtering_p95_ms, rag_total_p50_ms, rag_total_p95_ms, updated_at
+)
+SELECT
+    date_trunc('hour', created_at) AS bucket_start,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE fallback_used),
+    AVG(CASE WHEN fallback_used THEN 1.0 ELSE 0.0 END),
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY query_expansion_ms),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY query_expansion_ms),
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY retrieval_ms),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY retrieval_ms),
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY filtering_ms),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY filtering_ms),
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY total_rag_ms),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY total_rag_ms),
+    now()
+FROM rag_analytics
+WHERE created_at >= :since
+GROUP BY 1
+ON CONFLICT (bucket_start) DO UPDATE SET
+    rag_request_count = EXCLUDED.rag_request_count,
+    fallback_count = EXCLUDED.fallback_count,
+    fallback_rate = EXCLUDED.fallback_rate,
+    expansion_p50_ms = EXCLUDED.expansion_p50_ms,
+    expansion_p95_ms = EXCLUDED.expansion_p95_ms,
+    retrieval_p50_ms = EXCLUDED.retrieval_p50_ms,
+    retrieval_p95_ms = EXCLUDED.retrieval_p95_ms,
+    filtering_p50_ms = EXCLUDED.filtering_p50_ms,
+    filtering_p95_ms = EXCLUDED.filtering_p95_ms,
+    rag_total_p50_ms = EXCLUDED.rag_total_p50_ms,
+    rag_total_p95_ms = EXCLUDED.rag_total_p95_ms,
+    updated_at = EXCLUDED.updated_at
+"""
+
+# Distribution over every conversation passage of the hour, not over per-request averages
+ROLLUP_PASSAGE_TOKENS_SQL = """
+INSERT INTO analytics_hourly_rollups (
+    bucket_start, passage_count, passage_tokens_p50, passage_tokens_p95, passage_tokens_max, updated_at
+)
+SELECT
+    date_trunc('hour', r.created_at) AS bucket_start,
+    COUNT(*),
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY p.tokens::int),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY p.tokens::int),
+    MAX(p.tokens::int),
+    now()
+FROM rag_analytics r
+CROSS JOIN LATERAL json_array_elements_text(r.passage_tokens) AS p(tokens)
+WHERE r.created_at >= :since AND r.passage_tokens IS NOT NULL
+GROUP BY 1
+ON CONFLICT (bucket_start) DO UPDATE SET
+    passage_count = EXCLUDED.passage_count,
+    passage_tokens_p50 = EXCLUDED.passage_tokens_p50,
+    passage_tokens_p95 = EXCLUDED.passage_tokens_p95,
+    passage_tokens_max = EXCLUDED.passage_tokens_max,
+    updated_at = EXCLUDED.updated_at
+"""
+
+
+def refresh_rollups(full: bool = False) -> datetime:
+    """
+    Incrementally refresh analytics_hourly_rollups
+
+    Only hours from the newest rolled-up bucket (minus ROLLUP_LATENESS_HOURS for
+    late telemetry flushes) onwards are re-aggregated, so each run touches at
+    most a few partitions regardless of table size.
+
+    Args:
+        full: re-aggregate all history (e.g. after a backfill)
+
+    Returns:
+        Start of the window that was re-aggregated
+    """
+    with engine.begin() as conn:
+        latest_bucket = None if full else conn.execute(
+            text("SELECT MAX(bucket_start) FROM analytics_hourly_rollups")
+        ).scalar()
+        since = latest_bucket - timedelta(hours=ROLLUP_LATENESS_HOURS) if latest_bucket else datetime(1970, 1, 1)
+
+        query_rows = conn.execute(text(ROLLUP_QUERY_LOGS_SQL), {"since": since}).rowcount
+        rag_rows = conn.execute(text(ROLLUP_RAG_ANALYTICS_SQL), {"since": since}).rowcount
+        conn.execute(text(ROLLUP_PASSAGE_TOKENS_SQL), {"since": since})
+
+    logger.info(f"Refreshed rollups since {since}: {query_rows} query_logs hours, {rag_rows} rag_analytics hours")
+    return since
@@ -0,0 +1,268 @@
+"""
+Analytics Storage Service for Matt-GPT
+Compact passage-reference storage for RAG analytics and query logs, with sampled compressed full capture
+"""
+
+import os
+import json
+import hashlib
+import zlib
+import random
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+# zstandard is optional - zlib is always available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STORAGE_FULL = "full"
+STORAGE_REFS = "refs"
+STORAGE_MODES = (STORAGE_FULL, STORAGE_REFS)
+
+# 'refs' stores message ids / thread-day keys with scores; 'full' stores rendered passage text
+RAG_ANALYTICS_STORAGE = os.getenv("RAG_ANALYTICS_STORAGE", STORAGE_REFS)
+# Fraction of refs-mode requests that also keep a compressed copy of the full passages
+RAG_ANALYTICS_CAPTURE_RATE = float(os.getenv("RAG_ANALYTICS_CAPTURE_RATE", "0.01"))
+
+if RAG_ANALYTICS_STORAGE not in STORAGE_MODES:
+    logger.warning(f"Unknown RAG_ANALYTICS_STORAGE '{RAG_ANALYTICS_STORAGE}', using '{STORAGE_REFS}'")
+    RAG_ANALYTICS_STORAGE = STORAGE_REFS
+
+
+def empty_refs() -> Dict[str, list]:
+    return {"messages": [], "personality_docs": []}
+
+
+def merge_passage_refs(*ref_sets: Optional[dict]) -> Dict[str, list]:
+    """Union of passage refs, keeping the best score per message / document"""
+    messages: Dict[str, dict] = {}
+    docs: Dict[str, dict] = {}
+    for refs in ref_sets:
+        if not refs:
+            continue
+        for hit in refs.get("messages", []):
+            current = messages.get(hit["message_id"])
+            if current is None or hit.get("score", 0) > current.get("score", 0):
+                messages[hit["message_id"]] = hit
+        for doc in refs.get("personality_docs", []):
+            current = docs.get(doc["doc_id"])
+            if current is None or doc.get("score", 0) > current.get("score", 0):
+                docs[doc["doc_id"]] = doc
+    return {"messages": list(messages.values()), "personality_docs": list(docs.values())}
+
+
+def hit_days(hit: dict) -> List[date]:
+    """Days a message hit's passage covers: its context window's span, or its thread-day"""
+    if hit.get("start") and hit.get("end"):
+        day = datetime.fromisoformat(hit["start"]).date()
+        last = datetime.fromisoformat(hit["end"]).date()
+        days = []
+        while day <= last:
+            days.append(day)
+            day += timedelta(days=1)
+        return days
+    if hit.get("day"):
+        return [date.fromisoformat(hit["day"])]
+    return []
+
+
+def drop_thread_refs(refs: Optional[dict], thread_id: Optional[str]) -> Dict[str, list]:
+    """Remove message refs from one thread (e.g. the current Matt-GPT conversation)"""
+    if not refs:
+        return empty_refs()
+    if not thread_id:
+        return refs
+    return {
+        "messages": [hit for hit in refs.get("messages", []) if hit.get("thread_id") != thread_id],
+        "personality_docs": list(refs.get("personality_docs", [])),
+    }
+
+
+def filtered_passage_indexes(raw_passages: List[str], filtered_passages: List[str]) -> List[int]:
+    """
+    Map filtered passages back to their position in the raw retrieval.
+    The filter echoes passages back, so matching is on stripped text; passages
+    the filter rewrote can't be matched and are left out.
+    """
+    positions: Dict[str, List[int]] = {}
+    for i, passage in enumerate(raw_passages):
+        positions.setdefault(passage.strip(), []).append(i)
+
+    indexes = []
+    for passage in filtered_passages:
+        candidates = positions.get(passage.strip())
+        if candidates:
+            indexes.append(candidates.pop(0))
+    return indexes
+
+
+def passage_keys(raw_passages: List[str]) -> List[str]:
+    """
+    Order-independent key of each raw passage: a hash of its text and the
+    '=== Thread X - date ===' header of the block it belongs to
+
+    Identifies the same line in any later rendering of the same refs, however
+    its blocks are ordered and whatever messages were added around it since.
+    """
+    keys = []
+    header = None
+    for passage in raw_passages:
+        text = passage.strip()
+        if passage.startswith("\n=== "):
+            header = text.split("\n", 1)[0]  # A block header line, or a chunk carrying its own
+        elif passage.startswith("=== "):
+            header = None  # Personality doc
+        keys.append(hashlib.sha256(f"{header}\n{text}".encode("utf-8")).hexdigest()[:16])
+    return keys
+
+
+def filtered_passage_keys(raw_passages: List[str], filtered_passages: List[str]) -> List[str]:
+    """passage_keys of the filtered passages, in filter order (unmatched rewrites are left out)"""
+    keys = passage_keys(raw_passages)
+    return [keys[i] for i in filtered_passage_indexes(raw_passages, filtered_passages)]
+
+
+def select_passages(raw_passages: List[str], keys: List[str]) -> List[str]:
+    """Passages of a (re-)rendering matching stored keys, in key order; keys no longer rendered are skipped"""
+    positions: Dict[str, List[int]] = {}
+    for i, key in enumerate(passage_keys(raw_passages)):
+        positions.setdefault(key, []).append(i)
+
+    selected = []
+    for key in keys:
+        candidates = positions.get(key)
+        if candidates:
+            selected.append(raw_passages[candidates.pop(0)])
+    return selected
+
+
+def compress_payload(payload: Any) -> Tuple[bytes, str]:
+    """
+    Serialize and compress a JSON payload
+
+    Returns:
+        Tuple of (compressed bytes, codec name) - codec is 'zstd' or 'zlib'
+    """
+    raw = json.dumps(payload, default=str).encode("utf-8")
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(raw), "zstd"
+    return zlib.compress(raw, 9), "zlib"
+
+
+def decompress_payload(blob: bytes, codec: str) -> Any:
+    """Inverse of compress_payload"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed analytics blobs")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    elif codec == "zlib":
+        raw = zlib.decompress(blob)
+    else:
+        raise ValueError(f"Unknown analytics blob codec: {codec}")
+    return json.loads(raw.decode("utf-8"))
+
+
+def should_capture_full() -> bool:
+    """Sampling decision for full capture in refs mode"""
+    return RAG_ANALYTICS_CAPTURE_RATE > 0 and random.random() < RAG_ANALYTICS_CAPTURE_RATE
+
+
+def build_query_context_log(passages: List[str], refs: Optional[dict], **extra) -> dict:
+    """
+    Build the QueryLog.context_used payload for the configured storage mode.
+    Full mode keeps the first 10 rendered passages; refs mode keeps only the references.
+    """
+    context_log = {"storage_mode": RAG_ANALYTICS_STORAGE}
+    if RAG_ANALYTICS_STORAGE == STORAGE_FULL or refs is None:
+        context_log["passages"] = passages[:10]
+    else:
+        context_log["passage_refs"] = refs
+    context_log.update(extra)
+    return context_log
+
+
+def render_passage_refs(refs: dict, conn_string: Optional[str] = None) -> List[str]:
+    """
+    Re-render passages from stored references for debugging.
+
+    Message hits are expanded back into the context window they were rendered
+    in (or their full thread-day for refs without start/end) with the same
+    formatting the retriever uses, chunk hits (chunk retrieval unit) into
+    their stored window text, followed by the referenced personality docs.
+    Messages edited or deleted since the request will render as they are now,
+    and re-chunked windows are gone.
+    """
+    import psycopg
+    from retrievers import format_context_messages
+    from context_windows import fetch_window_messages
+    from thread_day_cache import render_thread_days
+
+    conn_string = conn_string or os.getenv("DATABASE_URL")
+    if conn_string and conn_string.startswith("postgresql+psycopg://"):
+        conn_string = conn_string.replace("postgresql+psycopg://", "postgresql://")
+
+    message_hits = [
+        hit for hit in refs.get("messages", [])
+        if hit.get("thread_id") and hit.get("day") and not hit.get("chunk_id")
+    ]
+    windows = {
+        (hit["thread_id"], datetime.fromisoformat(hit["start"]), datetime.fromisoformat(hit["end"]))
+        for hit in message_hits if hit.get("start")
+    }
+    thread_dates = {(hit["thread_id"], date.fromisoformat(hit["day"])) for hit in message_hits if not hit.get("start")}
+    chunk_ids = [hit["chunk_id"] for hit in refs.get("messages", []) if hit.get("chunk_id")]
+    doc_ids = [doc["doc_id"] for doc in refs.get("personality_docs", [])]
+
+    passages = []
+    with psycopg.connect(conn_string) as conn:
+        with conn.cursor() as cur:
+            if windows:
+                passages.extend(format_context_messages(fetch_window_messages(cur, sorted(windows))))
+            if thread_dates:
+                passages.extend(render_thread_days(cur, thread_dates))
+
+            if chunk_ids:
+                cur.execute("SELECT id::text, text FROM message_chunks WHERE id::text = ANY(%s)", (chunk_ids,))
+                chunks_by_id = dict(cur.fetchall())
+                passages.extend(chunks_by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in chunks_by_id)
+
+            if doc_ids:
+                cur.execute(
+                    "SELECT id::text, title, content FROM personality_docs WHERE id::text = ANY(%s)",
+                    (doc_ids,)
+                )
+                docs_by_id = {row[0]: row for row in cur.fetchall()}
+                for doc_id in doc_ids:
+                    if doc_id in docs_by_id:
+                        _, title, content = docs_by_id[doc_id]
+                        passages.append(f"=== {title} ===\n{content}")
+
+    logger.info(f"Re-rendered {len(passages)} passages from {len(windows)} windows, {len(thread_dates)} thread-days, "
+                f"{len(chunk_ids)} chunks and {len(doc_ids)} docs")
+    return passages
+
+
+def load_rag_analytics_context(analytics) -> Dict[str, List[str]]:
+    """
+    Return the raw and filtered passages for a RagAnalytics row regardless of storage mode.
+    Uses the compressed capture when present, otherwise re-renders from references.
+    """
+    if analytics.storage_mode != STORAGE_REFS:
+        return {"raw": analytics.raw_retrieved_context or [], "filtered": analytics.filtered_context or []}
+
+    if analytics.context_blob is not None:
+        return decompress_payload(analytics.context_blob, analytics.blob_codec)
+
+    raw = render_passage_refs(analytics.passage_refs or empty_refs())
+    keys = analytics.filtered_passage_keys or []
+    filtered = select_passages(raw, keys)
+    if len(filtered) < len(keys):
+        logger.info(f"{len(keys) - len(filtered)} filtered passages no longer render "
+                    f"(messages edited or deleted since the request)")
+    return {"raw": raw, "filtered": filtered}
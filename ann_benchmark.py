@@ -0,0 +1,205 @@
+"""
+ANN Benchmark Service for Matt-GPT
+Measures recall@k and latency of approximate vector search against exact brute-force results
+"""
+
+import os
+import time
+import random
+import logging
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# WHERE clauses used by the retrievers' message searches
+SEARCH_FILTERS: Dict[str, str] = {
+    # PostgreSQLVectorRetriever._retrieve_messages_with_context
+    "min_length": "AND LENGTH(message_text) > 20",
+    # EnhancedRAGRetriever._retrieve_single_query
+    "matt_gpt_conversations": "AND LENGTH(message_text) > 20 AND source = 'matt-gpt conversation'",
+    "none": "",
+}
+
+SearchFn = Callable[[object, list, int], List[str]]
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    return float(np.percentile(values, pct)) if len(values) else 0.0
+
+
+def recall_at_k(approximate: Sequence[str], exact: Sequence[str]) -> float:
+    """Fraction of the exact top-k that the approximate search also returned"""
+    if not exact:
+        return 1.0
+    return len(set(approximate) & set(exact)) / len(exact)
+
+
+def sample_logged_queries(conn, n: int, seed: int = 42) -> List[list]:
+    """
+    Embed a random sample of real user questions from query_logs.
+    Uses the embedding client (and its cache), so this costs API calls on first run.
+    """
+    from llm_client import OpenRouterClient
+
+    rows = conn.execute(
+        "SELECT DISTINCT query_text FROM query_logs WHERE LENGTH(query_text) > 10 LIMIT %s",
+        (n * 5,)
+    ).fetchall()
+    texts = [row[0] for row in rows]
+    random.Random(seed).shuffle(texts)
+
+    client = OpenRouterClient()
+    return [client.generate_embedding(text) for text in texts[:n]]
+
+
+def sample_synthetic_queries(conn, n: int, noise: float = 0.05, seed: int = 42) -> List[list]:
+    """
+    Synthetic queries: stored message embeddings with gaussian noise, renormalized.
+    Free and reproducible, but easier than real questions (each has a near-exact match).
+    """
+    conn.execute("SELECT setseed(%s)", (seed / 1000.0,))
+    rows = conn.execute(
+        "SELECT embedding FROM messages WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s",
+        (n,)
+    ).fetchall()
+
+    rng = np.random.default_rng(seed)
+    queries = []
+    for (embedding,) in rows:
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector + rng.normal(0, noise, vector.shape).astype(np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        queries.append(vector.tolist())
+    return queries
+
+
+def hnsw_search(where: str = "", table: str = "messages", column: str = "embedding") -> SearchFn:
+    """Search function matching the retrievers' ORDER BY <=> LIMIT query"""
+    sql = f"""
+        SELECT id::text FROM {table}
+        WHERE {column} IS NOT NULL {where}
+        ORDER BY {column} <=> %s::vector
+        LIMIT %s
+    """
+
+    def search(conn, embedding: list, k: int) -> List[str]:
+        return [row[0] for row in conn.execute(sql, (embedding, k)).fetchall()]
+
+    return search
+
+
+def storage_search(mode: str, where: str = "", table: str = "messages", rerank_factor: Optional[int] = None,
+                   dimensions: Optional[int] = None) -> SearchFn:
+    """
+    Search function for one of the vector_index storage modes (float32, halfvec, binary / matryoshka + re-rank)
+
+    Like the retrievers, shortlist modes run with ef_search raised to at least
+    the shortlist size, scoped to a transaction per query.
+    """
+    from vector_index import ensure_shortlist_ef_search, vector_search_sql
+
+    def search(conn, embedding: list, k: int) -> List[str]:
+        sql, params = vector_search_sql("id", table, where, embedding, k, mode=mode,
+                                        rerank_factor=rerank_factor, dimensions=dimensions)
+        with conn.transaction():
+            ensure_shortlist_ef_search(conn, k, mode, rerank_factor)
+            return [str(row[0]) for row in conn.execute(sql, params).fetchall()]
+
+    return search
+
+
+def routed_search(where: str = "", top_n: int = 50, level: Optional[str] = None) -> SearchFn:
+    """Two-stage search through the thread(-day) centroid index (thread_centroids.routed_search_sql)"""
+    from thread_centroids import routed_search_sql
+
+    def search(conn, embedding: list, k: int) -> List[str]:
+        sql, params = routed_search_sql("id", where, embedding, k, top_n, level)
+        return [str(row[0]) for row in conn.execute(sql, params).fetchall()]
+
+    return search
+
+
+def exact_top_k(conn, queries: List[list], k: int, where: str = "", table: str = "messages", column: str = "embedding") -> List[List[str]]:
+    """Ground truth by brute force: index scans disabled so Postgres sequentially scans and sorts"""
+    search = hnsw_search(where, table, column)
+    results = []
+    with conn.transaction():
+        conn.execute("SET LOCAL enable_indexscan = off")
+        conn.execute("SET LOCAL enable_bitmapscan = off")
+        for embedding in queries:
+            results.append(search(conn, embedding, k))
+    return results
+
+
+def measure(conn, queries: List[list], exact: List[List[str]], k: int, search: SearchFn, warmup: int = 3) -> dict:
+    """
+    Run `search` for every query and compare to the exact results
+
+    Returns:
+        Mean/min recall@k, short-result count and latency percentiles (client-side, ms)
+    """
+    for embedding in queries[:warmup]:
+        search(conn, embedding, k)
+
+    recalls, latencies, short_results = [], [], 0
+    for embedding, truth in zip(queries, exact):
+        start = time.perf_counter()
+        ids = search(conn, embedding, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(recall_at_k(ids, truth))
+        if len(ids) < len(truth):
+            short_results += 1  # Filtered HNSW scans can run out of candidates
+
+    return {
+        "queries": len(queries),
+        "recall_mean": round(float(np.mean(recalls)), 4) if recalls else 0.0,
+        "recall_min": round(float(np.min(recalls)), 4) if recalls else 0.0,
+        "short_results": short_results,
+        "latency_p50_ms": round(percentile(latencies, 50), 2),
+        "latency_p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def set_ef_search(conn, ef_search: int, iterative_scan: Optional[str] = None):
+    conn.execute(f"SET hnsw.ef_search = {int(ef_search)}")
+    if iterative_scan:
+        # pgvector >= 0.8 keeps scanning when filters discard candidates
+        conn.execute(f"SET hnsw.iterative_scan = {iterative_scan}")
+
+
+def recommend(results: List[dict], target_recall: float) -> Optional[dict]:
+    """
+    Cheapest configuration meeting the target recall under every benchmarked filter
+
+    Configurations are grouped by (index params, ef_search); a group qualifies
+    when its worst mean recall across filters reaches the target, and the
+    qualifying group with the lowest worst-case p99 latency wins.
+    """
+    groups: Dict[tuple, List[dict]] = {}
+    for result in results:
+        key = (result.get("m"), result.get("ef_construction"), result["ef_search"])
+        groups.setdefault(key, []).append(result)
+
+    best = None
+    for (m, ef_construction, ef_search), group in groups.items():
+        worst_recall = min(r["recall_mean"] for r in group)
+        worst_p99 = max(r["latency_p99_ms"] for r in group)
+        if worst_recall < target_recall:
+            continue
+        candidate = {
+            "m": m,
+            "ef_construction": ef_construction,
+            "ef_search": ef_search,
+            "worst_recall_mean": worst_recall,
+            "worst_latency_p99_ms": worst_p99,
+        }
+        if best is None or (worst_p99, ef_search) < (best["worst_latency_p99_ms"], best["ef_search"]):
+            best = candidate
+    return best
+
+
+def get_connection_string() -> str:
+    return os.getenv("DATABASE_URL")
@@ -0,0 +1,314 @@
+"""
+Chat Job Service for Matt-GPT
+Runs long chat turns asynchronously on an in-process worker pool backed by the chat_jobs table
+"""
+
+import asyncio
+import os
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import func, update
+
+from database import engine, get_session
+from models import ChatJob
+from admission_control import AdmissionRejected, retry_admission
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"succeeded", "failed"}
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class ChatJobManager:
+    """
+    In-process worker pool for chat jobs.
+
+    Job state lives in the chat_jobs table so any worker can answer status
+    polls; the user's API key is only ever held in memory for the queued job.
+    Jobs queued in a worker that shuts down are marked failed. The owning
+    worker renews heartbeat_at on its queued and running jobs every
+    heartbeat_seconds; jobs whose heartbeat is older than lease_seconds belong
+    to a worker that died without shutting down and are failed by whichever
+    worker reclaims next (at startup and on every heartbeat). They can't be
+    re-run, since the API key they need was never stored. A job that isn't
+    admitted to the pipeline within admission_seconds fails with the last
+    rejection instead of waiting for a slot indefinitely.
+    """
+
+    def __init__(
+        self,
+        processor: Callable[[object, dict], Awaitable[dict]],
+        workers: int = 2,
+        max_pending: int = 100,
+        heartbeat_seconds: float = 15.0,
+        lease_seconds: float = 90.0,
+        admission_seconds: float = 600.0,
+    ):
+        self.processor = processor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self.admission_seconds = admission_seconds
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._events: Dict[uuid.UUID, asyncio.Event] = {}
+        self._owned: Set[uuid.UUID] = set()
+
+        # Metrics
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+        self._rejected = 0
+        self._reclaimed = 0
+        self._queue_wait_ms_total = 0.0
+        self._run_ms_total = 0.0
+
+        logger.info(f"Chat job manager initialized: workers={workers}, max_pending={max_pending}")
+
+    @classmethod
+    def from_env(cls, processor) -> "ChatJobManager":
+        """Build a manager from CHAT_JOB_* environment variables"""
+        return cls(
+            processor,
+            workers=int(os.getenv("CHAT_JOB_WORKERS", "2")),
+            max_pending=int(os.getenv("CHAT_JOB_MAX_PENDING", "100")),
+            heartbeat_seconds=float(os.getenv("CHAT_JOB_HEARTBEAT_SECONDS", "15")),
+            lease_seconds=float(os.getenv("CHAT_JOB_LEASE_SECONDS", "90")),
+            admission_seconds=float(os.getenv("CHAT_JOB_ADMISSION_SECONDS", "600")),
+        )
+
+    async def start(self):
+        """Reclaim jobs abandoned by dead workers, then start the worker tasks on the running event loop"""
+        try:
+            await asyncio.to_thread(self.reclaim_stale)
+        except Exception as e:
+            logger.error(f"Failed to reclaim stale chat jobs: {e}")
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        logger.info(f"Started {self.workers} chat job workers")
+
+    async def stop(self):
+        """Cancel workers and fail any jobs still queued in this process"""
+        tasks = self._tasks + ([self._heartbeat_task] if self._heartbeat_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._heartbeat_task = None
+
+        abandoned = 0
+        while self._queue is not None and not self._queue.empty():
+            job_id, _, _, _ = self._queue.get_nowait()
+            await self._finish(job_id, "failed", error_details="Server shut down before the job ran")
+            abandoned += 1
+        if abandoned:
+            logger.warning(f"Marked {abandoned} queued chat jobs as failed on shutdown")
+
+    async def submit(self, request, client_info: dict) -> ChatJob:
+        """
+        Persist a new job and queue it for execution
+
+        Raises:
+            AdmissionRejected: if the pending queue is full
+        """
+        if self._queue is None or self._queue.full():
+            self._rejected += 1
+            raise AdmissionRejected(429, "Too many pending chat jobs", retry_after=30)
+
+        job = ChatJob(
+            conversation_id=request.conversation_id,
+            request=request.model_dump(mode="json", exclude={"openrouter_api_key"}),
+            heartbeat_at=datetime.utcnow(),
+        )
+        job = await asyncio.to_thread(self._insert, job)
+        if self._queue.full():
+            # Filled up by other submissions while the insert ran
+            self._rejected += 1
+            await self._finish(job.id, "failed", error_details="Too many pending chat jobs")
+            raise AdmissionRejected(429, "Too many pending chat jobs", retry_after=30)
+
+        self._events[job.id] = asyncio.Event()
+        self._owned.add(job.id)
+        self._queue.put_nowait((job.id, request, client_info, time.monotonic()))
+        self._submitted += 1
+        logger.info(f"Queued chat job {job.id} ({self._queue.qsize()} pending)")
+        return job
+
+    def _insert(self, job: ChatJob) -> ChatJob:
+        with get_session() as session:
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+            return job
+
+    def reclaim_stale(self) -> int:
+        """Fail queued/running jobs whose owning worker stopped renewing their heartbeat"""
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self.lease_seconds)
+        with engine.begin() as conn:
+            reclaimed = conn.execute(
+                update(ChatJob.__table__)
+                .where(ChatJob.status.in_(ACTIVE_STATUSES))
+                # Jobs queued before heartbeats existed fall back to their creation time
+                .where(func.coalesce(ChatJob.heartbeat_at, ChatJob.created_at) < cutoff)
+                .values(status="failed", error_details="Worker stopped before the job finished", completed_at=now)
+            ).rowcount
+        if reclaimed:
+            self._reclaimed += reclaimed
+            logger.warning(f"Reclaimed {reclaimed} chat jobs abandoned by a dead worker")
+        return reclaimed
+
+    def _renew_leases(self, job_ids: Set[uuid.UUID]):
+        with engine.begin() as conn:
+            conn.execute(
+                update(ChatJob.__table__)
+                .where(ChatJob.id.in_(job_ids))
+                .where(ChatJob.status.in_(ACTIVE_STATUSES))
+                .values(heartbeat_at=datetime.utcnow())
+            )
+
+    async def _heartbeat(self):
+        """Renew this worker's job leases and reclaim other workers' expired ones"""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                if self._owned:
+                    await asyncio.to_thread(self._renew_leases, set(self._owned))
+                await asyncio.to_thread(self.reclaim_stale)
+            except Exception as e:
+                logger.error(f"Chat job heartbeat failed: {e}")
+
+    def get(self, job_id: uuid.UUID) -> Optional[ChatJob]:
+        """Load a job's current state"""
+        with get_session() as session:
+            return session.get(ChatJob, job_id)
+
+    async def wait(self, job_id: uuid.UUID, timeout: float) -> Optional[ChatJob]:
+        """
+        Long-poll until the job reaches a terminal state or the timeout expires
+
+        Jobs owned by this worker are awaited via an in-memory event; jobs owned
+        by another gunicorn worker are polled from the database once a second.
+        """
+        job = await asyncio.to_thread(self.get, job_id)
+        if job is None or job.status in TERMINAL_STATUSES or timeout <= 0:
+            return job
+
+        event = self._events.get(job_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await asyncio.to_thread(self.get, job_id)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None or job.status in TERMINAL_STATUSES:
+                break
+        return job
+
+    async def _worker(self, worker_id: int):
+        """Pull jobs off the queue and run them through the chat pipeline"""
+        while True:
+            job_id, request, client_info, queued_at = await self._queue.get()
+            try:
+                self._queue_wait_ms_total += (time.monotonic() - queued_at) * 1000
+                await self._run_job(job_id, request, client_info)
+            except asyncio.CancelledError:
+                await self._finish(job_id, "failed", error_details="Server shut down while the job was running")
+                raise
+            except Exception as e:
+                logger.error(f"Chat job worker {worker_id} crashed on job {job_id}: {e}", exc_info=True)
+                await self._finish(job_id, "failed", error_details=str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: uuid.UUID, request, client_info: dict):
+        """Execute a single job, retrying while the pipeline is saturated (up to admission_seconds)"""
+        now = datetime.utcnow()
+        await asyncio.to_thread(self._update, job_id, status="running", started_at=now, heartbeat_at=now)
+        start = time.monotonic()
+
+        try:
+            # Jobs are already asynchronous - back off instead of failing, within limits
+            result = await retry_admission(
+                lambda: self.processor(request, client_info), self.admission_seconds, label=f"Chat job {job_id}"
+            )
+        except AdmissionRejected as e:
+            await self._finish(job_id, "failed", error_details=(
+                f"Not admitted within {self.admission_seconds:.0f}s ({e.status_code}: {e.reason}); "
+                f"retry after {e.retry_after}s"
+            ))
+            return
+        except HTTPException as e:
+            await self._finish(job_id, "failed", error_details=str(e.detail))
+            return
+
+        self._run_ms_total += (time.monotonic() - start) * 1000
+        status = "succeeded" if result.get("ok", True) else "failed"
+        await self._finish(job_id, status, result=result, error_details=result.get("error_details"))
+
+    def _update(self, job_id: uuid.UUID, **fields):
+        """Write job fields to the database"""
+        with get_session() as session:
+            job = session.get(ChatJob, job_id)
+            if job is None:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            session.add(job)
+            session.commit()
+
+    async def _finish(self, job_id: uuid.UUID, status: str, result: Optional[dict] = None, error_details: Optional[str] = None):
+        """Record a terminal state and wake any long-polling clients"""
+        self._owned.discard(job_id)
+        try:
+            await asyncio.to_thread(
+                self._update,
+                job_id,
+                status=status,
+                result=result,
+                error_details=error_details,
+                completed_at=datetime.utcnow(),
+            )
+        except Exception as e:
+            logger.error(f"Failed to record result for chat job {job_id}: {e}")
+
+        if status == "succeeded":
+            self._succeeded += 1
+        else:
+            self._failed += 1
+
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+        logger.info(f"Chat job {job_id} finished with status {status}")
+
+    def get_stats(self) -> dict:
+        """Snapshot of pending jobs and outcome counters"""
+        completed = self._succeeded + self._failed
+        return {
+            "workers": self.workers,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "max_pending": self.max_pending,
+            "submitted": self._submitted,
+            "succeeded": self._succeeded,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "reclaimed": self._reclaimed,
+            "avg_queue_wait_ms": self._queue_wait_ms_total / completed if completed else 0.0,
+            "avg_run_ms": self._run_ms_total / completed if completed else 0.0,
+        }
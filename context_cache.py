@@ -0,0 +1,231 @@
+"""
+Conversation Context Cache for Matt-GPT
+Reuses the previous turn's retrieved passages when a follow-up question is similar enough
+"""
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+
+from analytics_storage import hit_days
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedConversationContext:
+    """Retrieval state kept from a conversation's previous turn"""
+    query_embedding: np.ndarray
+    passages: List[str]
+    passage_refs: Optional[dict] = None
+
+
+THREAD_HEADER_PREFIXES = ("=== Thread ", "=== Matt-GPT Conversation ")
+
+
+def thread_block_header(passage: str) -> Optional[str]:
+    """Return the '=== Thread X - date ===' header a passage starts with, if any"""
+    first_line = passage.strip().split("\n", 1)[0]
+    if first_line.startswith(THREAD_HEADER_PREFIXES) and first_line.endswith(" ==="):
+        return first_line
+    return None
+
+
+def is_personality_passage(passage: str) -> bool:
+    """Personality docs are single passages starting with '=== Title ==='"""
+    return passage.startswith("=== ") and " ===" in passage and thread_block_header(passage) is None
+
+
+def split_passage_blocks(passages: List[str]) -> List[Tuple[Optional[str], List[str]]]:
+    """
+    Group line-based message passages into thread-day blocks
+
+    Message retrieval returns one list item per line: a '\\n=== header ==='
+    line, the message lines, then a blank separator. Personality docs are
+    returned as their own single-item blocks with no header. Context filtering
+    may also return a whole block as one multi-line item.
+
+    Returns:
+        List of (header or None, passage items) in original order
+    """
+    blocks = []
+    current_header = None
+    current_items = []
+
+    for passage in passages:
+        if is_personality_passage(passage):
+            if current_items:
+                blocks.append((current_header, current_items))
+                current_header, current_items = None, []
+            blocks.append((None, [passage]))
+            continue
+
+        header = thread_block_header(passage)
+        if header is not None:
+            if current_items:
+                blocks.append((current_header, current_items))
+            current_header = header
+            current_items = [passage]
+        else:
+            current_items.append(passage)
+
+    if current_items:
+        blocks.append((current_header, current_items))
+
+    return blocks
+
+
+def hit_block_headers(hit: dict) -> Set[str]:
+    """Headers of the blocks a passage-ref hit can have been rendered under (either thread display form)"""
+    thread_id = hit.get("thread_id")
+    if not thread_id:
+        return set()
+    headers = set()
+    for day in hit_days(hit):
+        headers.add(f"=== Thread {thread_id} - {day.isoformat()} ===")
+        headers.add(f"=== Matt-GPT Conversation {thread_id[-5:]} - {day.isoformat()} ===")
+    return headers
+
+
+def drop_conversation_passages(passages: List[str], conversation_id: Optional[str],
+                               passage_refs: Optional[dict] = None) -> List[str]:
+    """
+    Remove thread-day blocks from the current Matt-GPT conversation itself.
+    Those messages are already in the prompt via the conversation history.
+
+    With passage refs, only the blocks of the conversation's own hits are
+    dropped (matched on thread_id and day), so other conversations whose ids
+    share the 5-character display suffix are kept unless they were rendered
+    into the same block. Without refs the display suffix is all there is.
+    """
+    if not conversation_id:
+        return passages
+
+    conversation_id = str(conversation_id)
+    own_prefix = f"=== Matt-GPT Conversation {conversation_id[-5:]} - "
+    own_headers = None
+    if passage_refs is not None:
+        own_headers = set()
+        for hit in passage_refs.get("messages", []):
+            if hit.get("thread_id") == conversation_id:
+                own_headers |= hit_block_headers(hit)
+
+    kept = []
+    dropped = 0
+    for header, items in split_passage_blocks(passages):
+        own = header in own_headers if own_headers is not None else bool(header and header.startswith(own_prefix))
+        if own:
+            dropped += 1
+            continue
+        kept.extend(items)
+
+    if dropped:
+        logger.info(f"Dropped {dropped} retrieved blocks already represented in conversation history")
+    return kept
+
+
+def merge_passages(fresh: List[str], cached: List[str], max_blocks: Optional[int] = None) -> List[str]:
+    """
+    Union of freshly retrieved and cached passages, fresh first
+
+    Thread-day blocks are deduplicated by header and capped at max_blocks, so
+    the cached blocks are the ones left out when the cap is reached.
+    Personality docs are taken from the fresh retrieval only, so they track
+    the current question, and don't count towards the cap.
+    """
+    merged = []
+    seen_headers = set()
+    reused = 0
+
+    for source, blocks in (("fresh", split_passage_blocks(fresh)), ("cached", split_passage_blocks(cached))):
+        for header, items in blocks:
+            if header is None:
+                if source == "fresh":
+                    merged.extend(items)
+                continue
+            if header in seen_headers or (max_blocks is not None and len(seen_headers) >= max_blocks):
+                continue
+            seen_headers.add(header)
+            reused += source == "cached"
+            merged.extend(items)
+
+    logger.debug(f"Merged context: {len(seen_headers) - reused} fresh + {reused} cached thread-day blocks")
+    return merged
+
+
+class ConversationContextCache:
+    """Per-worker LRU of the last turn's query embedding and passages per conversation"""
+
+    def __init__(self, similarity_threshold: float = 0.85, max_conversations: int = 500):
+        self.similarity_threshold = similarity_threshold
+        self.max_conversations = max_conversations
+        self._entries: "OrderedDict[str, CachedConversationContext]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.reused = 0
+        self.not_similar = 0
+        self.misses = 0
+
+        logger.info(f"Conversation context cache initialized: threshold={similarity_threshold}, max_conversations={max_conversations}")
+
+    @classmethod
+    def from_env(cls) -> "ConversationContextCache":
+        """Build a cache from CONTEXT_REUSE_* environment variables"""
+        return cls(
+            similarity_threshold=float(os.getenv("CONTEXT_REUSE_SIMILARITY", "0.85")),
+            max_conversations=int(os.getenv("CONTEXT_REUSE_CACHE_SIZE", "500")),
+        )
+
+    def lookup(self, conversation_id: str, query_embedding: list) -> Optional[CachedConversationContext]:
+        """Return the cached context if the new query is similar enough to the previous one"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                self._entries.move_to_end(conversation_id)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        denominator = float(np.linalg.norm(query) * np.linalg.norm(entry.query_embedding)) or 1.0
+        similarity = float(np.dot(query, entry.query_embedding)) / denominator
+
+        if similarity < self.similarity_threshold:
+            self.not_similar += 1
+            logger.info(f"Follow-up similarity {similarity:.3f} below {self.similarity_threshold} - full retrieval")
+            return None
+
+        self.reused += 1
+        logger.info(f"Follow-up similarity {similarity:.3f} - reusing previous turn's context")
+        return entry
+
+    def store(self, conversation_id: str, query_embedding: list, passages: List[str], passage_refs: Optional[dict] = None):
+        """Remember this turn's retrieval for the next turn"""
+        entry = CachedConversationContext(
+            query_embedding=np.asarray(query_embedding, dtype=np.float32),
+            passages=list(passages),
+            passage_refs=passage_refs,
+        )
+        with self._lock:
+            self._entries[conversation_id] = entry
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        lookups = self.reused + self.not_similar + self.misses
+        return {
+            "conversations_cached": len(self._entries),
+            "reused": self.reused,
+            "not_similar": self.not_similar,
+            "misses": self.misses,
+            "reuse_rate": self.reused / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,217 @@
+"""
+Context Windows Service for Matt-GPT
+Hit-centred, token-capped conversation windows around retrieved messages
+"""
+
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from conversation_history import estimate_tokens
+from retrieval_options import RetrievalOptions
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# messages columns loaded for windowing; everything after id is format_context_messages row shape
+WINDOW_COLUMNS = "id, message_text, timestamp, thread_id, meta_data, source, from_matt_gpt"
+# Rendering overhead of one '=== Thread X - date ===' group and of each 'Sender: ' prefix
+WINDOW_HEADER_TOKENS = 16
+MESSAGE_PREFIX_TOKENS = 3
+
+
+@dataclass
+class ContextWindow:
+    """Consecutive messages of one thread around one or more hits"""
+    thread_id: str
+    rows: List[tuple] = field(default_factory=list)  # WINDOW_COLUMNS order, by timestamp
+    hit_ids: List[str] = field(default_factory=list)
+
+    @property
+    def start(self) -> datetime:
+        return self.rows[0][2]
+
+    @property
+    def end(self) -> datetime:
+        return self.rows[-1][2]
+
+    @property
+    def context_rows(self) -> List[tuple]:
+        """Rows in format_context_messages shape"""
+        return [row[1:] for row in self.rows]
+
+    @property
+    def token_count(self) -> int:
+        return WINDOW_HEADER_TOKENS + sum(message_cost(row[1]) for row in self.rows)
+
+
+def windowing_enabled(options: RetrievalOptions) -> bool:
+    """False means hits expand to their whole thread-day (context_messages and context_minutes both 0)"""
+    return options.context_messages > 0 or options.context_minutes > 0
+
+
+def message_cost(text: Optional[str]) -> int:
+    return estimate_tokens(text or "") + MESSAGE_PREFIX_TOKENS
+
+
+def _fetch_neighbours(cur, thread_id: str, message_id: str, timestamp: datetime,
+                      options: RetrievalOptions) -> List[tuple]:
+    """The hit plus up to context_messages / context_minutes of its thread on either side"""
+    # No single message costs less than a prefix and one token, so the budget also bounds the row count
+    row_cap = max(1, options.context_max_tokens // (MESSAGE_PREFIX_TOKENS + 1))
+    side_limit = min(options.context_messages, row_cap) if options.context_messages > 0 else row_cap
+
+    before, after = "", ""
+    before_params, after_params = (), ()
+    if options.context_minutes > 0:
+        radius = timedelta(minutes=options.context_minutes)
+        before, before_params = "AND timestamp >= %s", (timestamp - radius,)
+        after, after_params = "AND timestamp <= %s", (timestamp + radius,)
+
+    cur.execute(f"""
+        (SELECT {WINDOW_COLUMNS} FROM messages
+         WHERE thread_id = %s AND (timestamp, id) < (%s, %s::uuid) {before}
+         ORDER BY timestamp DESC, id DESC
+         LIMIT %s)
+        UNION ALL
+        (SELECT {WINDOW_COLUMNS} FROM messages
+         WHERE thread_id = %s AND (timestamp, id) >= (%s, %s::uuid) {after}
+         ORDER BY timestamp, id
+         LIMIT %s)
+    """, (
+        thread_id, timestamp, message_id, *before_params, side_limit,
+        thread_id, timestamp, message_id, *after_params, side_limit + 1,  # + the hit itself
+    ))
+    return cur.fetchall()
+
+
+def grow_window(rows: List[tuple], anchor: int, options: RetrievalOptions) -> Tuple[int, int]:
+    """
+    Inclusive (start, end) indexes of the window around rows[anchor]
+
+    Grows alternately backwards and forwards while the next message is within
+    context_messages positions / context_minutes of the hit (0 = unbounded) and
+    the window stays within context_max_tokens. The hit itself is always kept.
+    """
+    costs = [message_cost(row[1]) for row in rows]
+    hit_time = rows[anchor][2]
+    radius = timedelta(minutes=options.context_minutes) if options.context_minutes > 0 else None
+
+    def allowed(index: int) -> bool:
+        if not 0 <= index < len(rows):
+            return False
+        if options.context_messages > 0 and abs(index - anchor) > options.context_messages:
+            return False
+        return radius is None or abs(rows[index][2] - hit_time) <= radius
+
+    start = end = anchor
+    tokens = WINDOW_HEADER_TOKENS + costs[anchor]
+    grow_back = True
+    while True:
+        can_back = allowed(start - 1) and tokens + costs[start - 1] <= options.context_max_tokens
+        can_forward = allowed(end + 1) and tokens + costs[end + 1] <= options.context_max_tokens
+        if not can_back and not can_forward:
+            break
+        if can_back and (grow_back or not can_forward):
+            start -= 1
+            tokens += costs[start]
+        else:
+            end += 1
+            tokens += costs[end]
+        grow_back = not grow_back
+    return start, end
+
+
+def merge_windows(thread_id: str, rows: List[tuple], spans: List[Tuple[int, int, str]]) -> List[ContextWindow]:
+    """Union overlapping or touching (start, end, hit_id) spans over one thread's sorted rows"""
+    windows: List[ContextWindow] = []
+    last_end = None
+    for start, end, hit_id in sorted(spans):
+        if windows and start <= last_end + 1:
+            if end > last_end:
+                windows[-1].rows.extend(rows[last_end + 1:end + 1])
+                last_end = end
+            windows[-1].hit_ids.append(hit_id)
+            continue
+        windows.append(ContextWindow(thread_id=thread_id, rows=list(rows[start:end + 1]), hit_ids=[hit_id]))
+        last_end = end
+    return windows
+
+
+def build_hit_windows(cur, hits: Iterable[Tuple[str, str, datetime]], options: RetrievalOptions) -> List[ContextWindow]:
+    """
+    Context windows for (message_id, thread_id, timestamp) hits
+
+    Each hit gets its own window (see grow_window); windows of the same
+    thread that overlap or touch are merged, so the token cap applies per hit
+    and a merged window is at most the sum of its hits' budgets. Hits without
+    a thread have no context and are skipped.
+    """
+    by_thread: Dict[str, List[Tuple[str, datetime]]] = {}
+    for message_id, thread_id, timestamp in hits:
+        if thread_id:
+            by_thread.setdefault(thread_id, []).append((str(message_id), timestamp))
+
+    windows: List[ContextWindow] = []
+    for thread_id, thread_hits in by_thread.items():
+        rows_by_id = {}
+        for message_id, timestamp in thread_hits:
+            for row in _fetch_neighbours(cur, thread_id, message_id, timestamp, options):
+                rows_by_id[str(row[0])] = row
+        rows = sorted(rows_by_id.values(), key=lambda row: (row[2], row[0]))
+        position = {str(row[0]): i for i, row in enumerate(rows)}
+
+        spans = []
+        for message_id, _ in thread_hits:
+            if message_id in position:  # Missing if deleted since the search
+                start, end = grow_window(rows, position[message_id], options)
+                spans.append((start, end, message_id))
+        windows.extend(merge_windows(thread_id, rows, spans))
+
+    logger.debug(f"Built {len(windows)} context windows for {sum(len(h) for h in by_thread.values())} hits "
+                 f"in {len(by_thread)} threads")
+    return windows
+
+
+def window_bounds(windows: List[ContextWindow]) -> Dict[str, Tuple[datetime, datetime]]:
+    """Hit message id -> (start, end) of the window it was rendered in"""
+    return {hit_id: (window.start, window.end) for window in windows for hit_id in window.hit_ids}
+
+
+def window_ref(hit: dict, bounds: Dict[str, Tuple[datetime, datetime]]) -> dict:
+    """Add the rendered window's start/end to a passage-ref hit so analytics can re-render it exactly"""
+    if hit["message_id"] in bounds:
+        start, end = bounds[hit["message_id"]]
+        hit.update(start=start.isoformat(), end=end.isoformat())
+    return hit
+
+
+def fetch_window_messages(cur, windows: Iterable[Tuple[str, datetime, datetime]]) -> List[tuple]:
+    """Messages of each (thread_id, start, end) window in format_context_messages row shape"""
+    all_context_messages = []
+    for thread_id, start, end in windows:
+        cur.execute(f"""
+            SELECT {WINDOW_COLUMNS} FROM messages
+            WHERE thread_id = %s AND timestamp BETWEEN %s AND %s
+            ORDER BY timestamp, id
+        """, (thread_id, start, end))
+        all_context_messages.extend(row[1:] for row in cur.fetchall())
+    return all_context_messages
+
+
+def passage_token_counts(passages: List[str]) -> List[int]:
+    """
+    Estimated tokens of each conversation passage in retrieved context lines
+
+    A passage is one '\\n=== Thread X - date ===' group of
+    format_context_messages lines (or one chunk); personality docs, which
+    start with '=== ' at position 0, are not counted.
+    """
+    counts: List[int] = []
+    for line in passages:
+        if line.startswith("\n=== "):
+            counts.append(estimate_tokens(line))
+        elif counts and not line.startswith("=== "):
+            counts[-1] += estimate_tokens(line)
+    return counts
@@ -4,8 +4,10 @@ Handles retrieval and formatting of conversation history across API requests
 """
 
 from sqlmodel import Session, select
-from typing import List, Optional
+from sqlalchemy import tuple_, func
+from typing import List, Optional, Tuple
 from datetime import datetime
+import base64
 import uuid
 import logging
 from pydantic import BaseModel
@@ -24,6 +26,59 @@ class ChatMessage(BaseModel):
     query_id: uuid.UUID
 
 
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def truncate_middle(text: str, max_chars: int) -> str:
+    """Keep the start and end of a long text, dropping the middle"""
+    if len(text) <= max_chars:
+        return text
+    half = max(1, (max_chars - 20) // 2)
+    return f"{text[:half]} ...[truncated]... {text[-half:]}"
+
+
+def encode_cursor(created_at: datetime, query_id: uuid.UUID) -> str:
+    """Encode a (created_at, id) keyset position as an opaque cursor string"""
+    raw = f"{created_at.isoformat()}|{query_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """
+    Decode a cursor produced by encode_cursor
+    
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at_str, query_id_str = raw.split("|", 1)
+        return datetime.fromisoformat(created_at_str), uuid.UUID(query_id_str)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def logs_to_messages(rows) -> List[ChatMessage]:
+    """Expand (id, query_text, response_text, created_at) rows into user/assistant messages"""
+    history = []
+    for query_id, query_text, response_text, created_at in rows:
+        history.append(ChatMessage(
+            role="user",
+            content=query_text,
+            timestamp=created_at,
+            query_id=query_id
+        ))
+        history.append(ChatMessage(
+            role="assistant",
+            content=response_text,
+            timestamp=created_at,
+            query_id=query_id
+        ))
+    return history
+
+
 class ConversationHistoryService:
     """Service for managing conversation history and context"""
     
@@ -43,8 +98,9 @@ class ConversationHistoryService:
         logger.debug(f"Retrieving conversation history for {conversation_id}")
         
         # Query all logs for this conversation, ordered by creation time
+        # (message columns only - context_used can be large)
         query = (
-            select(QueryLog)
+            select(QueryLog.id, QueryLog.query_text, QueryLog.response_text, QueryLog.created_at)
             .where(QueryLog.conversation_id == conversation_id)
             .order_by(QueryLog.created_at)
         )
@@ -52,52 +108,163 @@ class ConversationHistoryService:
         logs = self.session.exec(query).all()
         logger.info(f"Found {len(logs)} query logs for conversation {conversation_id}")
         
-        history = []
-        for log in logs:
-            # Add user message
-            history.append(ChatMessage(
-                role="user",
-                content=log.query_text,
-                timestamp=log.created_at,
-                query_id=log.id
-            ))
-            
-            # Add assistant response
-            history.append(ChatMessage(
-                role="assistant", 
-                content=log.response_text,
-                timestamp=log.created_at,
-                query_id=log.id
-            ))
+        history = logs_to_messages(logs)
         
         logger.debug(f"Formatted {len(history)} messages from {len(logs)} query logs")
         return history
     
-    def format_history_for_llm(self, history: List[ChatMessage], max_messages: int = 10) -> str:
+    def get_recent_window(self, conversation_id: uuid.UUID, max_messages: int = 10) -> List[ChatMessage]:
+        """
+        Retrieve only the most recent messages of a conversation
+        
+        Doubles as the existence check: an empty result means the conversation
+        doesn't exist. Uses ORDER BY ... DESC LIMIT on the
+        (conversation_id, created_at) index, so cost doesn't grow with length.
+        
+        Args:
+            conversation_id: UUID of the conversation
+            max_messages: Maximum number of messages (two per exchange)
+            
+        Returns:
+            List of ChatMessage objects in chronological order
+        """
+        query = (
+            select(QueryLog.id, QueryLog.query_text, QueryLog.response_text, QueryLog.created_at)
+            .where(QueryLog.conversation_id == conversation_id)
+            .order_by(QueryLog.created_at.desc())
+            .limit(max(1, max_messages // 2))
+        )
+        
+        rows = list(reversed(self.session.exec(query).all()))
+        logger.debug(f"Loaded {len(rows)} recent query logs for conversation {conversation_id}")
+        return logs_to_messages(rows)[-max_messages:]
+    
+    def get_latest_query_id(self, conversation_id: uuid.UUID) -> Optional[uuid.UUID]:
+        """Return the id of the conversation's most recent QueryLog, or None"""
+        query = (
+            select(QueryLog.id)
+            .where(QueryLog.conversation_id == conversation_id)
+            .order_by(QueryLog.created_at.desc())
+            .limit(1)
+        )
+        return self.session.exec(query).first()
+    
+    def get_conversation_page(
+        self,
+        conversation_id: uuid.UUID,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        order: str = "asc"
+    ) -> Tuple[List[ChatMessage], Optional[str]]:
+        """
+        Fetch one page of a conversation using keyset pagination
+        
+        Only the columns needed for messages are selected, and the
+        (conversation_id, created_at) index makes each page cost the same
+        regardless of conversation length.
+        
+        Args:
+            conversation_id: UUID of the conversation
+            limit: Maximum number of exchanges (query logs) in the page
+            cursor: Cursor returned with the previous page, or None for the first page
+            order: "asc" for oldest-first, "desc" for newest-first paging
+            
+        Returns:
+            Tuple of (messages in chronological order, next_cursor or None when exhausted)
+        """
+        descending = order == "desc"
+        
+        query = (
+            select(QueryLog.id, QueryLog.query_text, QueryLog.response_text, QueryLog.created_at)
+            .where(QueryLog.conversation_id == conversation_id)
+        )
+        
+        if cursor:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+            position = tuple_(QueryLog.created_at, QueryLog.id)
+            if descending:
+                query = query.where(position < tuple_(cursor_created_at, cursor_id))
+            else:
+                query = query.where(position > tuple_(cursor_created_at, cursor_id))
+        
+        if descending:
+            query = query.order_by(QueryLog.created_at.desc(), QueryLog.id.desc())
+        else:
+            query = query.order_by(QueryLog.created_at, QueryLog.id)
+        
+        # Fetch one extra row to know whether another page exists
+        rows = self.session.exec(query.limit(limit + 1)).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        next_cursor = None
+        if has_more and rows:
+            last_id, _, _, last_created_at = rows[-1]
+            next_cursor = encode_cursor(last_created_at, last_id)
+        
+        if descending:
+            rows = list(reversed(rows))
+        
+        logger.debug(f"Fetched page of {len(rows)} query logs for conversation {conversation_id} (has_more={has_more})")
+        return logs_to_messages(rows), next_cursor
+    
+    def format_history_for_llm(
+        self,
+        history: List[ChatMessage],
+        max_messages: int = 10,
+        summary: str = "",
+        token_budget: Optional[int] = None
+    ) -> str:
         """
         Format conversation history for inclusion in LLM context
         
         Args:
             history: List of ChatMessage objects
             max_messages: Maximum number of recent messages to include
+            summary: Rolling summary of earlier turns that are no longer in the window
+            token_budget: Approximate token cap for the whole section; long messages are
+                trimmed and the oldest messages dropped to stay under it
             
         Returns:
             Formatted string suitable for LLM context
         """
-        if not history:
+        if not history and not summary:
             return ""
         
         # Take the most recent messages to stay within context limits
         recent_history = history[-max_messages:] if len(history) > max_messages else history
         
+        summary_section = ""
+        if summary:
+            if token_budget:
+                # The summary may use at most a quarter of the budget
+                summary = truncate_middle(summary, token_budget)
+            summary_section = f"[Summary of earlier conversation]\n{summary}\n\n[Recent messages]\n"
+        
         formatted_messages = []
-        for msg in recent_history:
-            timestamp_str = msg.timestamp.strftime("%Y-%m-%d %H:%M")
-            formatted_messages.append(f"[{timestamp_str}] {msg.role}: {msg.content}")
+        if token_budget:
+            remaining_chars = max(0, token_budget * 4 - len(summary_section))
+            # No single message may take more than half of what's left, so one
+            # pasted transcript can't crowd out the rest of the window
+            per_message_chars = max(200, remaining_chars // 2)
+            
+            # Fill newest-first so the latest turns always make it in
+            for msg in reversed(recent_history):
+                timestamp_str = msg.timestamp.strftime("%Y-%m-%d %H:%M")
+                line = f"[{timestamp_str}] {msg.role}: {truncate_middle(msg.content, per_message_chars)}"
+                if len(line) > remaining_chars:
+                    break
+                formatted_messages.append(line)
+                remaining_chars -= len(line) + 1
+            formatted_messages.reverse()
+        else:
+            for msg in recent_history:
+                timestamp_str = msg.timestamp.strftime("%Y-%m-%d %H:%M")
+                formatted_messages.append(f"[{timestamp_str}] {msg.role}: {msg.content}")
         
-        context_str = "\n".join(formatted_messages)
+        context_str = summary_section + "\n".join(formatted_messages)
         
-        logger.debug(f"Formatted {len(recent_history)} messages for LLM context ({len(context_str)} chars)")
+        logger.debug(f"Formatted {len(formatted_messages)} messages for LLM context ({len(context_str)} chars, ~{estimate_tokens(context_str)} tokens)")
         
         return context_str
     
@@ -133,15 +300,19 @@ class ConversationHistoryService:
         Returns:
             Dictionary with conversation metadata
         """
-        query = (
-            select(QueryLog)
-            .where(QueryLog.conversation_id == conversation_id)
-            .order_by(QueryLog.created_at)
-        )
+        # Aggregate in SQL instead of loading every row (with its response and
+        # context payloads) into Python
+        stats_query = select(
+            func.count(QueryLog.id),
+            func.min(QueryLog.created_at),
+            func.max(QueryLog.created_at),
+            func.coalesce(func.sum(QueryLog.tokens_used), 0),
+            func.avg(QueryLog.latency_ms),
+        ).where(QueryLog.conversation_id == conversation_id)
         
-        logs = self.session.exec(query).all()
+        message_count, first_message_at, last_message_at, total_tokens, avg_latency_ms = self.session.exec(stats_query).one()
         
-        if not logs:
+        if not message_count:
             return {
                 "exists": False,
                 "message_count": 0,
@@ -150,14 +321,20 @@ class ConversationHistoryService:
                 "total_tokens": 0
             }
         
+        models_query = (
+            select(QueryLog.model_used)
+            .where(QueryLog.conversation_id == conversation_id)
+            .distinct()
+        )
+        
         summary = {
             "exists": True,
-            "message_count": len(logs),
-            "first_message_at": logs[0].created_at,
-            "last_message_at": logs[-1].created_at,
-            "total_tokens": sum(log.tokens_used for log in logs if log.tokens_used),
-            "models_used": list(set(log.model_used for log in logs)),
-            "avg_latency_ms": sum(log.latency_ms for log in logs) / len(logs)
+            "message_count": message_count,
+            "first_message_at": first_message_at,
+            "last_message_at": last_message_at,
+            "total_tokens": int(total_tokens),
+            "models_used": list(self.session.exec(models_query).all()),
+            "avg_latency_ms": float(avg_latency_ms)
         }
         
         logger.debug(f"Conversation {conversation_id} summary: {summary['message_count']} messages")
@@ -0,0 +1,131 @@
+"""
+Conversation State Store for Matt-GPT
+Caches the recent history window per conversation so continuing turns don't reload whole conversations
+"""
+
+import os
+import threading
+import uuid
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+
+from conversation_history import ConversationHistoryService, ChatMessage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class ConversationStateStore:
+    """
+    Write-through per-worker LRU of recent conversation windows.
+
+    A window is the last `window_messages` messages of a conversation. Cached
+    windows are updated as soon as a turn completes, which is before its
+    QueryLog row is written in the background. Because gunicorn workers don't
+    share memory, every cache hit is validated with an index-only probe of the
+    conversation's latest QueryLog id; if another worker has served a newer
+    turn, the window is reloaded with a single windowed query.
+    """
+
+    def __init__(self, window_messages: int = 10, max_conversations: int = 1000):
+        self.window_messages = window_messages
+        self.max_conversations = max_conversations
+        self._windows: "OrderedDict[uuid.UUID, List[ChatMessage]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        logger.info(f"Conversation state store initialized: window={window_messages}, max_conversations={max_conversations}")
+
+    @classmethod
+    def from_env(cls, window_messages: int = 10) -> "ConversationStateStore":
+        """Build a store sized from CONVERSATION_CACHE_SIZE"""
+        return cls(
+            window_messages=window_messages,
+            max_conversations=int(os.getenv("CONVERSATION_CACHE_SIZE", "1000")),
+        )
+
+    def get_window(self, history_service: ConversationHistoryService, conversation_id: uuid.UUID) -> Optional[List[ChatMessage]]:
+        """
+        Get the recent message window for a conversation
+
+        Returns:
+            List of ChatMessage objects (chronological), or None if the conversation doesn't exist
+        """
+        with self._lock:
+            cached = self._windows.get(conversation_id)
+            if cached is not None:
+                self._windows.move_to_end(conversation_id)
+                cached = list(cached)
+
+        if cached is not None:
+            latest_id = history_service.get_latest_query_id(conversation_id)
+            cached_ids = {msg.query_id for msg in cached}
+            # latest_id is None when the first turn's log is still being written
+            if latest_id is None or latest_id in cached_ids:
+                self.hits += 1
+                logger.debug(f"Conversation window cache hit for {conversation_id}")
+                return cached
+            self.stale += 1
+            logger.debug(f"Conversation window for {conversation_id} is stale (turn served by another worker)")
+        else:
+            self.misses += 1
+
+        window = history_service.get_recent_window(conversation_id, max_messages=self.window_messages)
+        if not window:
+            return None
+
+        self._store(conversation_id, window)
+        return window
+
+    def record_turn(
+        self,
+        conversation_id: uuid.UUID,
+        query_id: uuid.UUID,
+        user_message: str,
+        response_text: str,
+        timestamp: Optional[datetime] = None,
+        previous_window: Optional[List[ChatMessage]] = None,
+    ):
+        """Write-through update with a completed turn"""
+        timestamp = timestamp or datetime.utcnow()
+        exchange = [
+            ChatMessage(role="user", content=user_message, timestamp=timestamp, query_id=query_id),
+            ChatMessage(role="assistant", content=response_text, timestamp=timestamp, query_id=query_id),
+        ]
+
+        with self._lock:
+            base = self._windows.get(conversation_id)
+            if base is None:
+                base = previous_window or []
+            window = (list(base) + exchange)[-self.window_messages:]
+            self._windows[conversation_id] = window
+            self._windows.move_to_end(conversation_id)
+            self._evict()
+
+    def _store(self, conversation_id: uuid.UUID, window: List[ChatMessage]):
+        with self._lock:
+            self._windows[conversation_id] = list(window)
+            self._windows.move_to_end(conversation_id)
+            self._evict()
+
+    def _evict(self):
+        while len(self._windows) > self.max_conversations:
+            self._windows.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        """Snapshot of cache size and hit rates"""
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "conversations_cached": len(self._windows),
+            "max_conversations": self.max_conversations,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,155 @@
+"""
+Conversation Summary Service for Matt-GPT
+Folds turns that fall out of the verbatim history window into a rolling per-conversation summary
+"""
+
+import asyncio
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from database import get_session
+from models import ConversationSummary, QueryLog
+from conversation_history import truncate_middle
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cheap model used for folding old turns into the summary
+DEFAULT_SUMMARY_MODEL = "anthropic/claude-3.5-haiku"
+
+# Turns folded per summarization call, and per-message cap inside the fold prompt
+FOLD_BATCH_TURNS = 20
+FOLD_MESSAGE_CHARS = 2000
+SUMMARY_MAX_CHARS = 3000
+
+
+class ConversationSummarizer:
+    """Maintains rolling summaries of conversation turns outside the history window"""
+
+    def __init__(self, window_messages: int = 10, model: Optional[str] = None):
+        self.window_messages = window_messages
+        self.model = model or os.getenv("CONVERSATION_SUMMARY_MODEL", DEFAULT_SUMMARY_MODEL)
+        self._client = None
+        logger.info(f"Conversation summarizer initialized with model {self.model}")
+
+    def _get_client(self):
+        """Get system OpenRouter client - summaries are paid by Matt-GPT, not the user"""
+        if self._client is None:
+            from llm_client import OpenRouterClient
+            system_key = os.getenv("OPENROUTER_API_KEY")
+            if not system_key:
+                raise ValueError("System OPENROUTER_API_KEY required for conversation summaries")
+            self._client = OpenRouterClient(api_key=system_key)
+        return self._client
+
+    def get_summary(self, session: Session, conversation_id: uuid.UUID) -> str:
+        """Return the stored summary for a conversation, or an empty string"""
+        record = session.get(ConversationSummary, conversation_id)
+        return record.summary if record else ""
+
+    def _get_unsummarized_turns(self, session: Session, conversation_id: uuid.UUID, summarized_through: Optional[datetime]) -> list:
+        """Rows that have left the verbatim window but aren't in the summary yet"""
+        window_turns = max(1, self.window_messages // 2)
+
+        # Newest row outside the window marks the upper bound of what to fold
+        boundary_query = (
+            select(QueryLog.created_at)
+            .where(QueryLog.conversation_id == conversation_id)
+            .order_by(QueryLog.created_at.desc())
+            .offset(window_turns)
+            .limit(1)
+        )
+        boundary = session.exec(boundary_query).first()
+        if boundary is None:
+            return []
+
+        query = (
+            select(QueryLog.query_text, QueryLog.response_text, QueryLog.created_at)
+            .where(QueryLog.conversation_id == conversation_id)
+            .where(QueryLog.created_at <= boundary)
+        )
+        if summarized_through is not None:
+            query = query.where(QueryLog.created_at > summarized_through)
+
+        query = query.order_by(QueryLog.created_at).limit(FOLD_BATCH_TURNS)
+        return session.exec(query).all()
+
+    def _fold(self, previous_summary: str, turns: list) -> str:
+        """Ask the summary model to merge new turns into the existing summary"""
+        exchanges = []
+        for query_text, response_text, created_at in turns:
+            timestamp_str = created_at.strftime("%Y-%m-%d %H:%M")
+            exchanges.append(
+                f"[{timestamp_str}] user: {truncate_middle(query_text, FOLD_MESSAGE_CHARS)}\n"
+                f"[{timestamp_str}] assistant: {truncate_middle(response_text, FOLD_MESSAGE_CHARS)}"
+            )
+
+        prompt = f"""You maintain a running summary of a conversation between a user and Matt (the assistant).
+
+Update the summary so it also covers the new exchanges below. Keep facts the user shared, decisions, open questions, commitments Matt made and the overall tone. Drop small talk. Write in compact third person prose, at most {SUMMARY_MAX_CHARS // 5} words.
+
+CURRENT SUMMARY:
+{previous_summary or "(none yet)"}
+
+NEW EXCHANGES:
+{chr(10).join(exchanges)}
+
+Return ONLY the updated summary."""
+
+        client = self._get_client()
+        response = client.chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model,
+            temperature=0.2
+        )
+        return response.choices[0].message.content.strip()[:SUMMARY_MAX_CHARS]
+
+    def update_summary(self, conversation_id: uuid.UUID):
+        """Fold any turns that fell out of the window into the stored summary"""
+        with get_session() as session:
+            record = session.get(ConversationSummary, conversation_id)
+            summarized_through = record.summarized_through if record else None
+            previous_summary = record.summary if record else ""
+
+            turns = self._get_unsummarized_turns(session, conversation_id, summarized_through)
+            if not turns:
+                logger.debug(f"No turns to summarize for conversation {conversation_id}")
+                return
+
+        logger.info(f"Folding {len(turns)} turns into summary for conversation {conversation_id}")
+        new_summary = self._fold(previous_summary, turns)
+
+        with get_session() as session:
+            record = session.get(ConversationSummary, conversation_id)
+            if record is None:
+                record = ConversationSummary(conversation_id=conversation_id)
+            elif record.summarized_through != summarized_through:
+                # Another worker folded these turns first - keep its result
+                logger.info(f"Summary for conversation {conversation_id} was updated concurrently, skipping")
+                return
+
+            record.summary = new_summary
+            record.summarized_through = turns[-1][2]
+            turns_summarized = (record.turns_summarized or 0) + len(turns)
+            record.turns_summarized = turns_summarized
+            record.model_used = self.model
+            record.updated_at = datetime.utcnow()
+            session.add(record)
+            session.commit()
+
+        logger.info(f"Conversation {conversation_id} summary now covers {turns_summarized} turns")
+
+
+# Background task for summarization
+async def update_conversation_summary(summarizer: ConversationSummarizer, conversation_id: uuid.UUID):
+    """Update the rolling summary after a turn without blocking the response"""
+    try:
+        await asyncio.to_thread(summarizer.update_summary, conversation_id)
+    except Exception as e:
+        logger.error(f"Failed to update conversation summary for {conversation_id}: {e}")
+        # Don't raise - the verbatim window still works without a summary
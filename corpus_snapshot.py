@@ -0,0 +1,227 @@
+"""
+Corpus Snapshot Service for Matt-GPT
+Exports the messages corpus to memory-mappable columnar files for fast worker startup
+"""
+
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Snapshot root directory; CURRENT inside it names the active snapshot
+VECTOR_ENGINE_SNAPSHOT_DIR = os.getenv("VECTOR_ENGINE_SNAPSHOT_DIR", "snapshots/messages")
+
+SNAPSHOT_FORMAT_VERSION = 1
+EMBEDDING_DIMENSIONS = 1536
+EXPORT_BATCH_ROWS = 5000
+SNAPSHOTS_TO_KEEP = 2
+
+# Column name -> numpy dtype; every column is one .npy file of length `rows`
+COLUMNS: Dict[str, str] = {
+    "embeddings": "float16",      # (rows, 1536) L2-normalized
+    "ids": "U36",                 # Message UUIDs
+    "thread_codes": "int32",      # Index into manifest["threads"]
+    "timestamps": "datetime64[us]",
+    "thread_days": "datetime64[D]",
+    "source_codes": "int16",      # Index into manifest["sources"]
+    "sent": "bool",
+    "lengths": "int32",           # LENGTH(message_text)
+}
+
+
+class CorpusSnapshot:
+    """
+    Read-only, memory-mapped view of an exported snapshot
+
+    Arrays are opened with mmap_mode='r', so every gunicorn worker on a host
+    shares one page-cache copy and opening costs no more than reading the
+    manifest. Small lookup tables (thread ids, sources) live in the manifest.
+    """
+
+    def __init__(self, path: Path, manifest: dict, arrays: Dict[str, np.ndarray]):
+        self.path = path
+        self.manifest = manifest
+        self.rows: int = manifest["rows"]
+        self.watermark: Optional[datetime] = (
+            datetime.fromisoformat(manifest["watermark"]) if manifest.get("watermark") else None
+        )
+        self.threads: List[Optional[str]] = manifest["threads"]
+        self.sources: List[Optional[str]] = manifest["sources"]
+        self.embeddings = arrays["embeddings"]
+        self.ids = arrays["ids"]
+        self.thread_codes = arrays["thread_codes"]
+        self.timestamps = arrays["timestamps"]
+        self.thread_days = arrays["thread_days"]
+        self.source_codes = arrays["source_codes"]
+        self.sent = arrays["sent"]
+        self.lengths = arrays["lengths"]
+
+    @classmethod
+    def open(cls, path) -> "CorpusSnapshot":
+        path = Path(path)
+        manifest = json.loads((path / "manifest.json").read_text())
+        if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {manifest.get('format_version')} in {path}")
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+        for name, array in arrays.items():
+            if len(array) != manifest["rows"]:
+                raise ValueError(f"Snapshot column {name} has {len(array)} rows, manifest says {manifest['rows']}")
+        return cls(path, manifest, arrays)
+
+    def source_code(self, source: Optional[str]) -> int:
+        """Snapshot code for a source name (-1 when the snapshot has none)"""
+        try:
+            return self.sources.index(source)
+        except ValueError:
+            return -1
+
+    def row(self, index: int) -> Tuple[str, Optional[str], datetime]:
+        """(message_id, thread_id, timestamp) for one row"""
+        return (
+            str(self.ids[index]),
+            self.threads[int(self.thread_codes[index])],
+            self.timestamps[index].astype("datetime64[us]").item(),
+        )
+
+    def get_stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "rows": self.rows,
+            "watermark": self.watermark,
+            "created_at": self.manifest.get("created_at"),
+            "embeddings_mb": round(self.embeddings.nbytes / 1024 / 1024, 1),
+        }
+
+
+def current_snapshot_path(root=VECTOR_ENGINE_SNAPSHOT_DIR) -> Optional[Path]:
+    """Directory of the active snapshot, or None if nothing has been exported"""
+    pointer = Path(root) / "CURRENT"
+    if not pointer.exists():
+        return None
+    path = Path(root) / pointer.read_text().strip()
+    return path if (path / "manifest.json").exists() else None
+
+
+def open_current_snapshot(root=VECTOR_ENGINE_SNAPSHOT_DIR) -> Optional[CorpusSnapshot]:
+    path = current_snapshot_path(root)
+    return CorpusSnapshot.open(path) if path else None
+
+
+def export_snapshot(conn_string: Optional[str] = None, root=VECTOR_ENGINE_SNAPSHOT_DIR) -> Path:
+    """
+    Stream every embedded message out of Postgres into a new snapshot directory
+
+    Reads inside one REPEATABLE READ transaction so the row count, the data
+    and the watermark agree. Columns are written straight into .npy memmaps,
+    so the exporter never holds the corpus as Python lists. The CURRENT
+    pointer is swapped atomically once every file is complete; workers that
+    already mapped the previous snapshot keep using it until they restart.
+
+    Returns:
+        Path of the new snapshot directory
+    """
+    import psycopg
+    from pgvector.psycopg import register_vector
+
+    conn_string = conn_string or os.getenv("DATABASE_URL")
+    root = Path(root)
+    name = f"snapshot-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
+    path = root / name
+    path.mkdir(parents=True, exist_ok=False)
+    start = time.time()
+
+    threads: Dict[Optional[str], int] = {}
+    sources: Dict[Optional[str], int] = {}
+    watermark: Optional[datetime] = None
+
+    with psycopg.connect(conn_string) as conn:
+        register_vector(conn)
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        rows = conn.execute("SELECT COUNT(*) FROM messages WHERE embedding IS NOT NULL").fetchone()[0]
+
+        arrays = {}
+        for column, dtype in COLUMNS.items():
+            shape = (rows, EMBEDDING_DIMENSIONS) if column == "embeddings" else (rows,)
+            arrays[column] = np.lib.format.open_memmap(path / f"{column}.npy", mode="w+", dtype=dtype, shape=shape)
+
+        offset = 0
+        with conn.cursor(name="corpus_snapshot_export") as cur:
+            cur.execute("""
+                SELECT id, thread_id, timestamp, source, sent, LENGTH(message_text), created_at, embedding
+                FROM messages
+                WHERE embedding IS NOT NULL
+                ORDER BY created_at
+            """)
+            while True:
+                batch = cur.fetchmany(EXPORT_BATCH_ROWS)
+                if not batch:
+                    break
+                end = offset + len(batch)
+
+                vectors = np.asarray([row[7] for row in batch], dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors /= np.where(norms == 0, 1.0, norms)
+                arrays["embeddings"][offset:end] = vectors.astype(np.float16)
+
+                for i, (message_id, thread_id, timestamp, source, sent, length, created_at, _) in enumerate(batch, offset):
+                    arrays["ids"][i] = str(message_id)
+                    arrays["thread_codes"][i] = threads.setdefault(thread_id, len(threads))
+                    arrays["timestamps"][i] = np.datetime64(timestamp, "us")
+                    arrays["thread_days"][i] = np.datetime64(timestamp.date(), "D")
+                    arrays["source_codes"][i] = sources.setdefault(source, len(sources))
+                    arrays["sent"][i] = bool(sent)
+                    arrays["lengths"][i] = length
+                    if watermark is None or created_at > watermark:
+                        watermark = created_at
+                offset = end
+                logger.info(f"Exported {offset}/{rows} messages")
+
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": datetime.utcnow().isoformat(),
+        "rows": offset,
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "watermark": watermark.isoformat() if watermark else None,
+        "columns": COLUMNS,
+        "threads": list(threads),
+        "sources": list(sources),
+    }
+    (path / "manifest.json").write_text(json.dumps(manifest, indent=2))
+
+    # Atomic pointer swap
+    pointer_tmp = root / "CURRENT.tmp"
+    pointer_tmp.write_text(name)
+    os.replace(pointer_tmp, root / "CURRENT")
+
+    logger.info(f"Snapshot {name}: {offset} messages, watermark {watermark}, {time.time() - start:.1f}s")
+    prune_snapshots(root)
+    return path
+
+
+def prune_snapshots(root=VECTOR_ENGINE_SNAPSHOT_DIR, keep: int = SNAPSHOTS_TO_KEEP) -> List[Path]:
+    """Delete all but the newest `keep` snapshots (never the CURRENT one)"""
+    import shutil
+
+    root = Path(root)
+    current = current_snapshot_path(root)
+    snapshots = sorted(root.glob("snapshot-*"), reverse=True)
+    removed = []
+    for path in snapshots[keep:]:
+        if current is not None and path.resolve() == current.resolve():
+            continue
+        shutil.rmtree(path)
+        removed.append(path)
+        logger.info(f"Removed old snapshot {path}")
+    return removed
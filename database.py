@@ -1,5 +1,4 @@
 from sqlmodel import create_engine, Session, SQLModel
-from sqlalchemy import text
 from contextlib import contextmanager
 import os
 import logging
@@ -31,36 +30,16 @@ logger.info("Database engine created with connection pooling (size=20)")
 
 
 def init_db():
-    """Initialize database with pgvector extension"""
-    logger.info("Initializing database...")
+    """
+    Bring the database schema up to date via the versioned migration runner.
+    The API itself only verifies the schema version (see migrations.verify_schema_version).
+    """
+    from migrations import apply_migrations
     
+    logger.info("Initializing database...")
     try:
-        with engine.connect() as conn:
-            logger.info("Creating pgvector extension...")
-            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-            conn.commit()
-            logger.info("pgvector extension created successfully")
-        
-        logger.info("Creating database tables...")
-        SQLModel.metadata.create_all(engine)
-        logger.info("Database tables created successfully")
-        
-        # Create HNSW indexes for optimal vector performance
-        logger.info("Creating HNSW vector indexes...")
-        with engine.connect() as conn:
-            conn.execute(text("""
-                CREATE INDEX IF NOT EXISTS messages_embedding_idx
-                ON messages USING hnsw (embedding vector_cosine_ops);
-            """))
-            
-            conn.execute(text("""
-                CREATE INDEX IF NOT EXISTS personality_docs_embedding_idx
-                ON personality_docs USING hnsw (embedding vector_cosine_ops);
-            """))
-            
-            conn.commit()
-            logger.info("HNSW vector indexes created successfully")
-        
+        applied = apply_migrations()
+        logger.info(f"Database initialized ({len(applied)} migrations applied)")
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         raise
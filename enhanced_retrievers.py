@@ -13,9 +13,20 @@ from concurrent.futures import ThreadPoolExecutor
 import hashlib
 
 from llm_client import OpenRouterClient
-from retrievers import PostgreSQLVectorRetriever
+from retrievers import PostgreSQLVectorRetriever, format_context_messages, search_messages
 from models import RagAnalytics
-from database import get_session
+from vector_index import apply_search_settings, ensure_shortlist_ef_search, vector_search_sql
+from vector_engine import get_vector_engine
+from retrieval_options import DEFAULT_RETRIEVAL_OPTIONS, UNIT_CHUNKS, RetrievalOptions
+from message_chunks import chunk_passages, load_chunks, search_chunks
+from context_windows import build_hit_windows, passage_token_counts, window_bounds, window_ref, windowing_enabled
+from mmr import candidate_embeddings, diversify
+from thread_day_cache import render_thread_days
+from telemetry import record_telemetry
+from analytics_storage import (
+    RAG_ANALYTICS_STORAGE, STORAGE_FULL, STORAGE_REFS,
+    compress_payload, filtered_passage_keys, should_capture_full
+)
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +62,12 @@ class EnhancedRagMetrics:
     # Quality metrics
     context_relevance_score: Optional[float] = None
     fallback_used: bool = False
+    
+    # Message ids / thread-days / doc ids behind raw_retrieved_context
+    passage_refs: Optional[Dict] = None
+    
+    # Follow-up turn: only a small delta was retrieved and merged with the conversation's cached passages
+    context_reused: bool = False
 
 
 class EnhancedRAGRetriever:
@@ -166,7 +183,8 @@ Example messages:"""
     def multi_query_retrieval(
         self, 
         expanded_queries: List[str], 
-        messages_per_query: int = 10
+        messages_per_query: int = 10,
+        options: RetrievalOptions = DEFAULT_RETRIEVAL_OPTIONS
     ) -> Tuple[List[str], float, Dict]:
         """
         Retrieve context using multiple query variations with deduplication.
@@ -178,7 +196,7 @@ Example messages:"""
         
         logger.info(f"Multi-query retrieval with {len(expanded_queries)} queries")
         
-        all_message_ids = set()
+        message_scores = {}  # Best similarity score per unique message ID
         retrieval_stats = {
             'total_queries': len(expanded_queries),
             'messages_per_query': messages_per_query,
@@ -195,7 +213,7 @@ Example messages:"""
                 for i, query in enumerate(expanded_queries):
                     logger.debug(f"Submitting retrieval for query {i+1}: {query[:50]}...")
                     # Submit each query for parallel processing
-                    future = executor.submit(self._retrieve_single_query, query, messages_per_query)
+                    future = executor.submit(self._retrieve_single_query, query, messages_per_query, options)
                     future_to_query[future] = query
                 
                 # Collect results as they complete
@@ -204,25 +222,31 @@ Example messages:"""
                         query = future_to_query[future]
                         message_ids = future.result()
                         retrieval_stats['total_raw_retrievals'] += len(message_ids)
-                        all_message_ids.update(message_ids)
+                        for message_id, score in message_ids:
+                            message_scores[message_id] = max(score, message_scores.get(message_id, score))
                         logger.debug(f"Query '{query[:30]}...' returned {len(message_ids)} messages")
                     except Exception as e:
                         logger.warning(f"Failed to retrieve for query '{future_to_query[future]}': {e}")
             
             # Update stats after deduplication
-            retrieval_stats['unique_messages'] = len(all_message_ids)
+            retrieval_stats['unique_messages'] = len(message_scores)
             
             # DEBUG: Log the exact message IDs that were found
-            message_id_list = list(all_message_ids)
+            message_id_list = list(message_scores)
             logger.info(f"DEBUG: Found {len(message_id_list)} unique message IDs:")
             for i, msg_id in enumerate(sorted(message_id_list)[:20], 1):  # Show first 20 IDs
                 logger.info(f"  {i}. {msg_id}")
             if len(message_id_list) > 20:
                 logger.info(f"  ... and {len(message_id_list) - 20} more message IDs")
             
-            # Now rebuild thread contexts for all unique messages
-            logger.debug(f"Rebuilding thread contexts for {len(all_message_ids)} unique messages")
-            context_passages = self._rebuild_thread_contexts(list(all_message_ids))
+            if options.unit == UNIT_CHUNKS:
+                # IDs are message_chunks ids; their text is already the passage
+                context_passages, hits = self._load_chunk_contexts(message_scores)
+            else:
+                # Now rebuild thread contexts for all unique messages
+                logger.debug(f"Rebuilding thread contexts for {len(message_scores)} unique messages")
+                context_passages, hits = self._rebuild_thread_contexts(message_scores, options, limit=self.k)
+            retrieval_stats['passage_refs'] = {"messages": hits, "personality_docs": []}
             
             # Count unique threads
             thread_ids = set()
@@ -247,66 +271,99 @@ Example messages:"""
             retrieval_time = (time.time() - start_time) * 1000
             return [], retrieval_time, retrieval_stats
     
-    def _retrieve_single_query(self, query: str, limit: int) -> List[str]:
-        """Retrieve message IDs for a single query"""
+    def _retrieve_single_query(self, query: str, limit: int, options: RetrievalOptions = DEFAULT_RETRIEVAL_OPTIONS) -> List[Tuple[str, float]]:
+        """Retrieve (message ID, similarity score) pairs for a single query, in (fused) rank order"""
         try:
             # Generate embedding for the query
             client = self._get_system_client()
             embedding = client.generate_embedding(query)
             logger.debug(f"Generated embedding for query: '{query[:50]}...'")
-            
-            # Use the base retriever's database connection logic
-            import psycopg
-            from pgvector.psycopg import register_vector
-            
-            with psycopg.connect(self.conn_string) as conn:
-                register_vector(conn)
-                
-                # Get the most relevant message IDs (not full context yet)
-                # FILTER: Only include matt-gpt conversation sources for debugging
-                relevant_query = """
-                SELECT id
-                FROM messages
-                WHERE embedding IS NOT NULL 
-                AND LENGTH(message_text) > 20
-                AND source = 'matt-gpt conversation'
-                ORDER BY embedding <=> %s::vector
-                LIMIT %s
-                """
+
+            # FILTER: Only include matt-gpt conversation sources for debugging
+            where = "AND LENGTH(message_text) > 20 AND source = 'matt-gpt conversation'"
+            engine_filters = {"min_length": 20, "source": "matt-gpt conversation"}
+
+            if options.unit == UNIT_CHUNKS:
+                import psycopg
+                from pgvector.psycopg import register_vector
+
+                with psycopg.connect(self.conn_string) as conn:
+                    register_vector(conn)
+                    apply_search_settings(conn)
+                    with conn.cursor() as cur:
+                        rows = search_chunks(cur, embedding, limit, "AND source = 'matt-gpt conversation'")
+                return [(str(row[0]), 1.0 - float(row[-1])) for row in rows]
+
+            if get_vector_engine() is not None and not options.hybrid:
+                # In-process vector search needs no database connection
+                results = search_messages(None, embedding, limit, where, engine_filters, options=options)
+            else:
+                # Use the base retriever's database connection logic
+                import psycopg
+                from pgvector.psycopg import register_vector
                 
-                with conn.cursor() as cur:
-                    cur.execute(relevant_query, (embedding, limit))
-                    results = cur.fetchall()
-                    message_ids = [str(row[0]) for row in results]  # Return message IDs as strings
-                    logger.debug(f"Query '{query[:30]}...' retrieved {len(message_ids)} message IDs")
-                    return message_ids
+                with psycopg.connect(self.conn_string) as conn:
+                    register_vector(conn)
+                    apply_search_settings(conn)
+                    
+                    # Get the most relevant message IDs (not full context yet)
+                    with conn.cursor() as cur:
+                        results = search_messages(cur, embedding, limit, where, engine_filters,
+                                                  query_text=query, options=options)
+
+            message_ids = [(str(row[0]), 1.0 - float(row[-1])) for row in results]  # Message IDs as strings with scores
+            logger.debug(f"Query '{query[:30]}...' retrieved {len(message_ids)} message IDs")
+            return message_ids
                     
         except Exception as e:
             logger.error(f"Single query retrieval failed for '{query[:50]}...': {e}")
             return []
     
-    def _rebuild_thread_contexts(self, message_ids: List[str]) -> List[str]:
-        """Rebuild full thread contexts for the given message IDs"""
-        if not message_ids:
-            logger.warning("No message IDs provided to rebuild thread contexts")
-            return []
+    def _rebuild_thread_contexts(
+        self, message_scores: Dict[str, float], options: RetrievalOptions = DEFAULT_RETRIEVAL_OPTIONS,
+        limit: Optional[int] = None
+    ) -> Tuple[List[str], List[Dict]]:
+        """
+        Rebuild thread contexts for the given message IDs
+        
+        Args:
+            message_scores: Best similarity score per message ID
+            options: context window and MMR settings (whole thread-days when windowing is off)
+            limit: with options.mmr, keep only this many messages, chosen by maximal
+                marginal relevance from the best-scoring options.mmr_pool_size
             
+        Returns:
+            Tuple of (formatted context lines, hit references with message id, thread-day, window and score)
+        """
+        if not message_scores:
+            logger.warning("No message IDs provided to rebuild thread contexts")
+            return [], []
+        
+        message_ids = list(message_scores.keys())
         logger.debug(f"Rebuilding thread contexts for {len(message_ids)} message IDs")
         try:
             import psycopg
             from pgvector.psycopg import register_vector
-            from collections import defaultdict
             
             with psycopg.connect(self.conn_string) as conn:
                 register_vector(conn)
                 
                 with conn.cursor() as cur:
-                    # Get thread_id and date for each message
-                    thread_dates = set()
+                    if options.mmr and limit and len(message_ids) > limit:
+                        # Expanded queries tend to hit the same threads; spread the union before fetching context
+                        pool = sorted(message_scores.items(), key=lambda item: item[1], reverse=True)
+                        pool = pool[:max(limit, options.mmr_pool_size)]
+                        embeddings = candidate_embeddings(cur, [message_id for message_id, _ in pool])
+                        message_ids = diversify(pool, embeddings, limit, options.mmr_lambda)
+                        logger.debug(f"MMR kept {len(message_ids)} of {len(message_scores)} unique message IDs")
+                        if not message_ids:
+                            return [], []
+                    
+                    # Get thread_id and timestamp for each message
                     id_placeholders = ','.join(['%s'] * len(message_ids))
                     
                     thread_query = f"""
-                    SELECT DISTINCT thread_id, DATE(timestamp) as date
+                    SELECT id::text, thread_id, timestamp
                     FROM messages
                     WHERE id::text IN ({id_placeholders})
                     AND thread_id IS NOT NULL
@@ -314,92 +371,55 @@ Example messages:"""
                     
                     cur.execute(thread_query, message_ids)
                     thread_results = cur.fetchall()
-                    for thread_id, date in thread_results:
-                        thread_dates.add((thread_id, date))
-                    
-                    logger.debug(f"Found {len(thread_dates)} unique thread/date combinations from {len(message_ids)} message IDs")
-                    
-                    # Now get ALL messages from those thread/date combinations
-                    all_context_messages = []
-                    for thread_id, date in thread_dates:
-                        context_query = """
-                        SELECT message_text, timestamp, thread_id, meta_data, source, from_matt_gpt
-                        FROM messages
-                        WHERE thread_id = %s 
-                        AND DATE(timestamp) = %s
-                        ORDER BY timestamp
-                        """
-                        cur.execute(context_query, (thread_id, date))
-                        thread_messages = cur.fetchall()
-                        all_context_messages.extend(thread_messages)
-                        logger.debug(f"Retrieved {len(thread_messages)} messages from thread {thread_id} on {date}")
                     
-                    logger.debug(f"Total context messages retrieved: {len(all_context_messages)}")
-            
-            # Format messages using the same logic as the base retriever
-            return self._format_messages_as_context(all_context_messages)
+                    bounds = {}
+                    if windowing_enabled(options):
+                        # Hit-centred windows depend on the query, so they bypass the thread-day cache
+                        windows = build_hit_windows(cur, thread_results, options)
+                        bounds = window_bounds(windows)
+                        all_context_messages = [row for window in windows for row in window.context_rows]
+                        context_lines = self._format_messages_as_context(all_context_messages)
+                        logger.debug(f"Built {len(windows)} context windows with {len(all_context_messages)} messages "
+                                     f"from {len(message_ids)} message IDs")
+                    else:
+                        # Get ALL messages from the hits' thread/date combinations (rendered blocks are cached)
+                        thread_dates = {(thread_id, timestamp.date()) for _, thread_id, timestamp in thread_results}
+                        logger.debug(f"Found {len(thread_dates)} unique thread/date combinations from {len(message_ids)} message IDs")
+                        context_lines = render_thread_days(cur, thread_dates)
+            
+            hits = [
+                window_ref({
+                    "message_id": message_id,
+                    "thread_id": thread_id,
+                    "day": timestamp.date().isoformat(),
+                    "score": round(message_scores.get(message_id, 0.0), 4)
+                }, bounds)
+                for message_id, thread_id, timestamp in thread_results
+            ]
+            
+            return context_lines, hits
             
         except Exception as e:
             logger.error(f"Thread context rebuild failed: {e}")
-            return []
+            return [], []
+    
+    def _load_chunk_contexts(self, chunk_scores: Dict[str, float]) -> Tuple[List[str], List[Dict]]:
+        """Chunk passages and hit references for the given message_chunks IDs, best first"""
+        if not chunk_scores:
+            return [], []
+        try:
+            import psycopg
+            
+            with psycopg.connect(self.conn_string) as conn:
+                with conn.cursor() as cur:
+                    return chunk_passages(load_chunks(cur, chunk_scores))
+        except Exception as e:
+            logger.error(f"Chunk context load failed: {e}")
+            return [], []
     
     def _format_messages_as_context(self, all_context_messages: List[Tuple]) -> List[str]:
         """Format messages with the same logic as base retriever"""
-        
-        # Helper function to filter names for family only (copied from base retriever)
-        def filter_sender_name(display_name: str, phone_number: str = "") -> str:
-            """Filter sender names to only show family members, others become 'Someone:'"""
-            if not display_name:
-                display_name = phone_number
-            
-            # Replace Sisterr<3 with Danielle Brooks
-            if display_name == "Sisterr<3":
-                display_name = "Danielle Brooks"
-            
-            # Family names to keep
-            family_names = {"Natalie Brooks", "Sarah Brooks", "Mom", "Dad", "Danielle Brooks"}
-            
-            if display_name in family_names:
-                return display_name
-            else:
-                return "Someone"
-        
-        # Group and format messages by thread, date, and source type
-        from collections import defaultdict
-        grouped_messages = defaultdict(list)
-        
-        for text, timestamp, thread_id, meta_data, source, from_matt_gpt in all_context_messages:
-            date_str = timestamp.date().strftime("%Y-%m-%d")
-            
-            # Determine sender name based on message source
-            if source == "matt-gpt conversation":
-                # Matt-GPT conversation message
-                if from_matt_gpt:
-                    sender_name = "Matt"
-                else:
-                    sender_name = "User"
-                key = f"Matt-GPT Conversation {thread_id[-5:]} - {date_str}"
-            else:
-                # Text/Slack message
-                if meta_data and isinstance(meta_data, dict):
-                    display_name = meta_data.get('display_name', '')
-                    sender_name = filter_sender_name(display_name)
-                else:
-                    sender_name = "Unknown"
-                key = f"Thread {thread_id} - {date_str}"
-            
-            grouped_messages[key].append((timestamp, text, sender_name, source))
-
-        # Format chronologically with thread/date headers
-        formatted = []
-        for thread_date, messages in sorted(grouped_messages.items()):
-            formatted.append(f"\n=== {thread_date} ===")
-            for timestamp, text, sender_name, source in sorted(messages):
-                formatted.append(f"{sender_name}: {text}")
-            formatted.append("")  # Add blank line between groups
-
-        logger.debug(f"Formatted {len(formatted)} message contexts in {len(grouped_messages)} thread/date groups")
-        return formatted
+        return format_context_messages(all_context_messages)
     
     def filter_relevant_context(
         self, 
@@ -494,10 +514,14 @@ INSTRUCTIONS:
             filtering_time = (time.time() - start_time) * 1000
             return all_context, filtering_time, None
     
-    def enhanced_retrieve(self, query: str, query_id: str) -> Tuple[List[str], EnhancedRagMetrics]:
+    def enhanced_retrieve(self, query: str, query_id: str, retrieval_options: Optional[RetrievalOptions] = None, message_limit: Optional[int] = None) -> Tuple[List[str], EnhancedRagMetrics]:
         """
         Main enhanced RAG pipeline with query expansion, multi-retrieval, and context filtering.
         
+        Args:
+            message_limit: search only the original query for this many hits, without
+                           expansion (the delta of a context reuse turn); still filtered
+        
         Returns:
             Tuple of (final_filtered_context, detailed_metrics)
         """
@@ -510,7 +534,11 @@ INSTRUCTIONS:
         try:
             # Phase 1: Query Expansion
             logger.info("PHASE 1: Query Expansion")
-            expanded_queries, expansion_time = self.expand_query(query)
+            if message_limit is None:
+                expanded_queries, expansion_time = self.expand_query(query)
+            else:
+                logger.info(f"Skipping expansion for a {message_limit}-hit delta search")
+                expanded_queries, expansion_time = [], 0.0
             all_queries = [query] + expanded_queries  # Include original query
             logger.info(f"Generated {len(expanded_queries)} expanded queries in {expansion_time:.1f}ms:")
             for i, eq in enumerate(expanded_queries, 1):
@@ -520,7 +548,7 @@ INSTRUCTIONS:
             logger.info("PHASE 2: Multi-Query Retrieval")
             logger.info(f"Searching with {len(all_queries)} queries ({len(expanded_queries)} expanded + 1 original)")
             raw_context, retrieval_time, retrieval_stats = self.multi_query_retrieval(
-                all_queries, messages_per_query=10
+                all_queries, messages_per_query=message_limit or 10, options=retrieval_options or DEFAULT_RETRIEVAL_OPTIONS
             )
             logger.info(f"Multi-query retrieval stats:")
             logger.info(f"  • Raw retrievals: {retrieval_stats['total_raw_retrievals']}")
@@ -564,7 +592,8 @@ INSTRUCTIONS:
                 raw_retrieved_context=raw_context,
                 filtered_context=filtered_context,
                 context_relevance_score=relevance_score,
-                fallback_used=False
+                fallback_used=False,
+                passage_refs=retrieval_stats.get('passage_refs')
             )
             
             logger.info("=" * 60)
@@ -582,7 +611,7 @@ INSTRUCTIONS:
             # Fallback to basic retrieval
             logger.warning("Falling back to basic RAG retrieval")
             try:
-                basic_result = self.base_retriever(query)
+                basic_result = self.base_retriever(query, retrieval_options=retrieval_options)
                 basic_context = basic_result.passages
                 
                 fallback_time = (time.time() - pipeline_start) * 1000
@@ -603,7 +632,8 @@ INSTRUCTIONS:
                     filtering_ratio=1.0,
                     raw_retrieved_context=basic_context,
                     filtered_context=basic_context,
-                    fallback_used=True
+                    fallback_used=True,
+                    passage_refs=basic_result.passage_refs
                 )
                 
                 logger.info(f"Fallback RAG completed in {fallback_time:.2f}ms")
@@ -630,32 +660,54 @@ INSTRUCTIONS:
                 )
     
     def save_analytics(self, query_id: str, metrics: EnhancedRagMetrics):
-        """Save detailed analytics to database for analysis and optimization"""
+        """Queue detailed analytics for batched insertion (never blocks the request)"""
         try:
-            with get_session() as session:
-                analytics = RagAnalytics(
-                    query_id=query_id,
-                    original_query=metrics.original_query,
-                    expanded_queries=metrics.expanded_queries,
-                    total_messages_retrieved=metrics.total_messages_retrieved,
-                    unique_messages_after_dedup=metrics.unique_messages_after_dedup,
-                    threads_reconstructed=metrics.threads_reconstructed,
-                    messages_before_filtering=metrics.messages_before_filtering,
-                    messages_after_filtering=metrics.messages_after_filtering,
-                    filtering_ratio=metrics.filtering_ratio,
-                    raw_retrieved_context=metrics.raw_retrieved_context,
-                    filtered_context=metrics.filtered_context,
-                    query_expansion_ms=metrics.query_expansion_ms,
-                    retrieval_ms=metrics.retrieval_ms,
-                    filtering_ms=metrics.filtering_ms,
-                    total_rag_ms=metrics.total_rag_ms,
-                    context_relevance_score=metrics.context_relevance_score,
-                    fallback_used=metrics.fallback_used
-                )
-                
-                session.add(analytics)
-                session.commit()
-                logger.info(f"RAG analytics saved for query_id: {query_id}")
+            storage_mode = RAG_ANALYTICS_STORAGE
+            if metrics.passage_refs is None:
+                # Nothing to reference (e.g. retrieval failed) - keep whatever text there is
+                storage_mode = STORAGE_FULL
+            
+            raw_context = metrics.raw_retrieved_context
+            filtered_context = metrics.filtered_context
+            context_blob, blob_codec = None, None
+            
+            if storage_mode == STORAGE_REFS:
+                # Passage text is re-rendered on demand; only a sample keeps a compressed copy
+                if should_capture_full():
+                    context_blob, blob_codec = compress_payload({"raw": raw_context, "filtered": filtered_context})
+                raw_context, filtered_context = [], []
+            
+            analytics = RagAnalytics(
+                query_id=query_id,
+                original_query=metrics.original_query,
+                expanded_queries=metrics.expanded_queries,
+                total_messages_retrieved=metrics.total_messages_retrieved,
+                unique_messages_after_dedup=metrics.unique_messages_after_dedup,
+                threads_reconstructed=metrics.threads_reconstructed,
+                messages_before_filtering=metrics.messages_before_filtering,
+                messages_after_filtering=metrics.messages_after_filtering,
+                filtering_ratio=metrics.filtering_ratio,
+                raw_retrieved_context=raw_context,
+                filtered_context=filtered_context,
+                storage_mode=storage_mode,
+                passage_refs=metrics.passage_refs,
+                passage_tokens=passage_token_counts(metrics.raw_retrieved_context),
+                filtered_passage_keys=filtered_passage_keys(
+                    metrics.raw_retrieved_context, metrics.filtered_context
+                ),
+                context_blob=context_blob,
+                blob_codec=blob_codec,
+                query_expansion_ms=metrics.query_expansion_ms,
+                retrieval_ms=metrics.retrieval_ms,
+                filtering_ms=metrics.filtering_ms,
+                total_rag_ms=metrics.total_rag_ms,
+                context_relevance_score=metrics.context_relevance_score,
+                fallback_used=metrics.fallback_used,
+                context_reused=metrics.context_reused
+            )
+            
+            record_telemetry(analytics)
+            logger.info(f"RAG analytics queued for query_id: {query_id} (storage: {storage_mode})")
                 
         except Exception as e:
             logger.error(f"Failed to save RAG analytics: {e}")
@@ -679,26 +731,24 @@ INSTRUCTIONS:
             
             with psycopg.connect(self.conn_string) as conn:
                 register_vector(conn)
+                apply_search_settings(conn)
                 
                 # Query only personality documents
-                personality_query = """
-                SELECT message_text, timestamp, thread_id, meta_data, source
-                FROM messages
-                WHERE source = 'personality_docs'
-                AND embedding IS NOT NULL
-                ORDER BY embedding <=> %s::vector
-                LIMIT 20
-                """
+                personality_query, params = vector_search_sql(
+                    "message_text, timestamp, thread_id, meta_data, source", "messages",
+                    "AND source = 'personality_docs'", embedding, 20
+                )
                 
                 with conn.cursor() as cur:
-                    cur.execute(personality_query, (embedding,))
+                    ensure_shortlist_ef_search(cur, 20)
+                    cur.execute(personality_query, params)
                     results = cur.fetchall()
                     
                     logger.info(f"Found {len(results)} personality documents")
                     
                     # Format as context passages
                     personality_docs = []
-                    for text, timestamp, thread_id, meta_data, source in results:
+                    for text, timestamp, thread_id, meta_data, source, _ in results:
                         # Format similar to regular context but mark as personality doc
                         formatted_doc = f"=== Personality Document ===\n{text}"
                         personality_docs.append(formatted_doc)
@@ -18,6 +18,9 @@ load_dotenv()
 class MattGPTResponseGeneratorV2:
     def __init__(self):
         self.api_url = "http://127.0.0.1:9005/chat"
+        self.batch_api_url = "http://127.0.0.1:9005/chat/batch"
+        self.batch_size = 10  # Items per /chat/batch call (server caps at CHAT_BATCH_MAX_ITEMS)
+        self.candidates_per_message = 3
         self.bearer_token = os.getenv('MATT_GPT_BEARER_TOKEN')
         self.openrouter_api_key = os.getenv('OPENROUTER_API_KEY')
         
@@ -37,18 +40,13 @@ class MattGPTResponseGeneratorV2:
             formatted_history += f"Message {i} - {role} ({participant}):\n{content}\n\n"
         return formatted_history
     
-    def get_matt_gpt_response(self, conversation_history: List[Dict], current_assistant_message: str) -> str:
-        """Get a response from Matt-GPT with structured conversation history."""
-        headers = {
-            'Authorization': f'Bearer {self.bearer_token}',
-            'Content-Type': 'application/json'
-        }
-        
+    def build_prompt(self, conversation_history: List[Dict], current_assistant_message: str) -> str:
+        """Build the Matt-GPT prompt with structured conversation history."""
         # Format conversation history in a more structured way
         history_context = self.format_conversation_as_structured_history(conversation_history)
         
         # Create a prompt that emphasizes the conversational flow
-        prompt = f"""You are responding as Matt in an ongoing conversation. Here is the conversation history:
+        return f"""You are responding as Matt in an ongoing conversation. Here is the conversation history:
 
 {history_context}
 
@@ -62,9 +60,16 @@ Please respond as Matt would, taking into account:
 4. Matt's conversational style and personality
 
 Your response should feel like a natural continuation of Matt's participation in this specific conversation."""
+    
+    def get_matt_gpt_response(self, conversation_history: List[Dict], current_assistant_message: str) -> str:
+        """Get a response from Matt-GPT with structured conversation history."""
+        headers = {
+            'Authorization': f'Bearer {self.bearer_token}',
+            'Content-Type': 'application/json'
+        }
         
         payload = {
-            'message': prompt,
+            'message': self.build_prompt(conversation_history, current_assistant_message),
             'openrouter_api_key': self.openrouter_api_key,
             'other_conversation_context': False
         }
@@ -80,6 +85,46 @@ Your response should feel like a natural continuation of Matt's participation in
             print(f"Unexpected error: {e}")
             return f"Error: {str(e)}"
     
+    def get_matt_gpt_responses_batch(self, prompts: List[str]) -> List[List[str]]:
+        """Get candidate responses for many independent prompts with a single /chat/batch call."""
+        headers = {
+            'Authorization': f'Bearer {self.bearer_token}',
+            'Content-Type': 'application/json'
+        }
+        
+        payload = {
+            'items': [
+                {
+                    'message': prompt,
+                    'other_conversation_context': False,
+                    'n_candidates': self.candidates_per_message
+                }
+                for prompt in prompts
+            ],
+            'openrouter_api_key': self.openrouter_api_key
+        }
+        
+        try:
+            response = requests.post(self.batch_api_url, headers=headers, json=payload)
+            response.raise_for_status()
+            responses = []
+            for item in response.json()['results']:
+                result = item.get('result')
+                if result:
+                    candidates = result.get('candidates') or [result.get('response', 'Error: No response generated')]
+                else:
+                    candidates = [f"Error: {item.get('error_details')}"]
+                # Pad so every message always gets the expected number of columns
+                candidates += [candidates[-1]] * (self.candidates_per_message - len(candidates))
+                responses.append(candidates)
+            return responses
+        except requests.exceptions.RequestException as e:
+            print(f"Error calling Matt-GPT batch API: {e}")
+            return [[f"Error: API call failed - {str(e)}"] * self.candidates_per_message] * len(prompts)
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            return [[f"Error: {str(e)}"] * self.candidates_per_message] * len(prompts)
+    
     def process_csv(self, input_file: str, output_file: str):
         """Process the CSV file and generate Matt-GPT responses with structured conversation history."""
         print(f"Reading {input_file}...")
@@ -98,11 +143,13 @@ Your response should feel like a natural continuation of Matt's participation in
         
         print(f"Found {len(matt_user_messages)} Matt user messages to process...")
         
+        # Build every (message, candidate) work item up front
+        work_items = []
         total_matt_messages = len(matt_user_messages)
         for idx, matt_message in matt_user_messages.iterrows():
             message_id = matt_message['message_id']
             current_position = list(matt_user_messages.index).index(idx) + 1
-            print(f"Processing message {message_id} ({current_position}/{total_matt_messages})...")
+            print(f"Preparing message {message_id} ({current_position}/{total_matt_messages})...")
             print(f"  Original Matt response: {matt_message['content'][:100]}...")
             
             # Get all conversation history up to (but not including) this Matt message
@@ -116,25 +163,28 @@ Your response should feel like a natural continuation of Matt's participation in
                 
                 # Convert to list of dicts for structured formatting
                 history_records = conversation_history.to_dict('records')
-                assistant_prompt = previous_assistant_msg['content']
+                prompt = self.build_prompt(history_records, previous_assistant_msg['content'])
                 
-                # Generate 3 Matt-GPT responses
-                for i in range(1, 4):
-                    print(f"  Generating v2 response {i}/3...")
-                    start_time = time.time()
-                    response = self.get_matt_gpt_response(history_records, assistant_prompt)
-                    elapsed = time.time() - start_time
-                    print(f"    V2 Response {i} generated in {elapsed:.1f}s: {response[:100]}...")
-                    
-                    # Update the dataframe
-                    df.loc[df['message_id'] == message_id, f'matt_gpt_v2_response_{i}'] = response
-                    
-                    # Small delay to avoid overwhelming the API
-                    time.sleep(1)
-                print(f"  Completed message {message_id}\n")
+                # 3 Matt-GPT candidates per message, generated in one pipeline pass
+                work_items.append((message_id, prompt))
             else:
                 print(f"  Skipping message {message_id} - no previous assistant message found")
         
+        # Generate all responses in server-side parallel batches
+        print(f"Generating v2 responses for {len(work_items)} messages in batches of {self.batch_size}...")
+        for batch_start in range(0, len(work_items), self.batch_size):
+            batch = work_items[batch_start:batch_start + self.batch_size]
+            start_time = time.time()
+            responses = self.get_matt_gpt_responses_batch([prompt for _, prompt in batch])
+            elapsed = time.time() - start_time
+            print(f"  Batch {batch_start // self.batch_size + 1}: {len(batch)} messages generated in {elapsed:.1f}s")
+            
+            for (message_id, _), candidates in zip(batch, responses):
+                for i, response in enumerate(candidates[:self.candidates_per_message], 1):
+                    print(f"    Message {message_id} v2 response {i}: {response[:100]}...")
+                    # Update the dataframe
+                    df.loc[df['message_id'] == message_id, f'matt_gpt_v2_response_{i}'] = response
+        
         # Save the enhanced CSV
         print(f"Saving results to {output_file}...")
         df.to_csv(output_file, index=False)
@@ -0,0 +1,113 @@
+"""
+Hybrid Search Service for Matt-GPT
+Full-text + vector retrieval in one round-trip, merged with reciprocal rank fusion
+"""
+
+import logging
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+from retrieval_options import RetrievalOptions
+from vector_index import vector_search_sql
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LEG_VECTOR = "vector"
+LEG_LEXICAL = "lexical"
+# Text search configuration used by the messages.message_tsv trigger (migration 6)
+TEXT_SEARCH_CONFIG = "english"
+
+
+def lexical_search_sql(columns: str, table: str, where: str, query_text: str, embedding: list, limit: int) -> Tuple[str, tuple]:
+    """
+    Full-text search ranked by ts_rank_cd, GIN-indexed via message_tsv
+
+    Returns the same columns as vector_search_sql, including the cosine
+    `distance` (computed only for the `limit` matched rows) so fused results
+    keep a comparable similarity score.
+    """
+    sql = f"""
+    SELECT {columns}, (embedding <=> %s::vector) as distance, lexical_rank
+    FROM (
+        SELECT {columns}, embedding, ts_rank_cd(message_tsv, text_query) AS lexical_rank
+        FROM {table}, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %s) text_query
+        WHERE message_tsv @@ text_query {where}
+        ORDER BY lexical_rank DESC
+        LIMIT %s
+    ) matches
+    """
+    return sql, (embedding, query_text, limit)
+
+
+def hybrid_search_sql(columns: str, table: str, where: str, embedding: list, query_text: str, limit: int,
+                      candidate_limit: Optional[int] = None,
+                      vector_query: Optional[Tuple[str, tuple]] = None) -> Tuple[str, tuple]:
+    """
+    Both legs as one statement; rows are (leg, rank, *columns, distance)
+
+    Each leg returns up to `candidate_limit` (default 2 * limit) ranked
+    candidates; fuse_rows() merges them into the final top `limit`.
+    `vector_query` replaces the default vector leg (e.g. a routed search)
+    and must already be limited to candidate_limit.
+    """
+    candidate_limit = candidate_limit or limit * 2
+    vector_sql, vector_params = vector_query or vector_search_sql(columns, table, where, embedding, candidate_limit)
+    lexical_sql, lexical_params = lexical_search_sql(columns, table, where, query_text, embedding, candidate_limit)
+    sql = f"""
+    SELECT '{LEG_VECTOR}' AS leg, ROW_NUMBER() OVER (ORDER BY distance) AS rank, vector_leg.*
+    FROM ({vector_sql}) vector_leg
+    UNION ALL
+    SELECT '{LEG_LEXICAL}' AS leg, ROW_NUMBER() OVER (ORDER BY lexical_rank DESC) AS rank, {_prefixed(columns, 'lexical_leg')}, lexical_leg.distance
+    FROM ({lexical_sql}) lexical_leg
+    """
+    return sql, vector_params + lexical_params
+
+
+def _prefixed(columns: str, alias: str) -> str:
+    return ", ".join(f"{alias}.{column.strip()}" for column in columns.split(","))
+
+
+def reciprocal_rank_fusion(ranked_lists: Dict[str, Sequence[Hashable]], weights: Dict[str, float], k: int = 60) -> List[Tuple[Hashable, float]]:
+    """
+    score(d) = sum over lists of weight / (k + rank of d in that list), ranks starting at 1
+
+    Returns:
+        (key, fused score) pairs, best first
+    """
+    scores: Dict[Hashable, float] = {}
+    for leg, keys in ranked_lists.items():
+        weight = weights.get(leg, 0.0)
+        if weight <= 0:
+            continue
+        for rank, key in enumerate(keys, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def fuse_rows(rows: List[tuple], options: RetrievalOptions, limit: int) -> List[tuple]:
+    """
+    Merge (leg, rank, id, ..., distance) rows from hybrid_search_sql
+
+    Returns:
+        (id, ..., distance) rows - the shape vector_search_sql produces - in fused order
+    """
+    ranked: Dict[str, List] = {LEG_VECTOR: [], LEG_LEXICAL: []}
+    by_id: Dict = {}
+    for leg, rank, *row in sorted(rows, key=lambda r: (r[0], r[1])):
+        ranked[leg].append(row[0])
+        by_id.setdefault(row[0], tuple(row))
+
+    fused = reciprocal_rank_fusion(
+        ranked,
+        {LEG_VECTOR: options.vector_weight, LEG_LEXICAL: options.lexical_weight},
+        options.rrf_k
+    )
+    lexical_only = len(set(ranked[LEG_LEXICAL]) - set(ranked[LEG_VECTOR]))
+    logger.debug(f"Fused {len(ranked[LEG_VECTOR])} vector + {len(ranked[LEG_LEXICAL])} lexical candidates "
+                 f"({lexical_only} only found by full-text)")
+    return [by_id[key] for key, _ in fused[:limit]]
+
+
+def tag_rows(leg: str, rows: List[tuple]) -> List[tuple]:
+    """Leg-tag an already ranked result list (e.g. from the in-process vector engine) for fuse_rows()"""
+    return [(leg, rank) + tuple(row) for rank, row in enumerate(rows, start=1)]
@@ -2,6 +2,7 @@ from openai import OpenAI
 import os
 import logging
 import hashlib
+import threading
 from typing import Optional
 from dotenv import load_dotenv
 
@@ -11,7 +12,10 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 # Simple in-memory cache for embeddings to avoid API calls
+# Shared by every request in the worker, so batch items reuse each other's embeddings
 _embedding_cache = {}
+_embedding_cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "100"))
+_embedding_cache_lock = threading.Lock()  # Batch items look up and evict from several threads
 
 
 def get_current_trace():
@@ -100,9 +104,11 @@ class OpenRouterClient:
         cache_key = hashlib.md5(text.encode('utf-8')).hexdigest()
         
         # Check cache first
-        if cache_key in _embedding_cache:
+        with _embedding_cache_lock:
+            cached = _embedding_cache.get(cache_key)
+        if cached is not None:
             logger.debug(f"Using cached embedding for text: {text[:50]}...")
-            return _embedding_cache[cache_key]
+            return cached
         
         logger.debug(f"Generating new embedding for text: {text[:50]}...")
         
@@ -128,16 +134,17 @@ class OpenRouterClient:
                 trace.log_embedding_generation(text, embedding, api_key_prefix)
             
             # Cache the result
-            _embedding_cache[cache_key] = embedding
+            with _embedding_cache_lock:
+                _embedding_cache[cache_key] = embedding
+                
+                # Basic cache size management
+                if len(_embedding_cache) > _embedding_cache_size:
+                    keys_to_remove = list(_embedding_cache.keys())[:_embedding_cache_size // 2]
+                    for key in keys_to_remove:
+                        _embedding_cache.pop(key, None)
+                    logger.debug("Cleaned embedding cache")
             logger.debug(f"Embedding generated and cached, dimensions: {len(embedding)}")
             
-            # Basic cache size management
-            if len(_embedding_cache) > 100:
-                keys_to_remove = list(_embedding_cache.keys())[:50]
-                for key in keys_to_remove:
-                    del _embedding_cache[key]
-                logger.debug("Cleaned embedding cache")
-            
             return embedding
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
@@ -11,16 +11,40 @@ import os
 import asyncio
 from datetime import datetime
 
-from database import init_db, get_session
-from models import QueryLog, Message
-from matt_gpt import setup_dspy
+from sqlmodel import select
+from database import get_session
+from migrations import verify_schema_version
+from models import QueryLog, Message, AnalyticsHourlyRollup
+from matt_gpt import setup_dspy, SharedRetrievalCache
 from conversation_history import ConversationHistoryService, ChatMessage
+from conversation_state import ConversationStateStore
+from conversation_summaries import ConversationSummarizer, update_conversation_summary
 from llm_client import OpenRouterClient
+from admission_control import AdmissionController, AdmissionRejected, LANES, LANE_INTERACTIVE, LANE_BATCH, retry_admission
+from chat_jobs import ChatJobManager
+from telemetry import telemetry_writer
+from analytics_storage import build_query_context_log
+from retrieval_options import DEFAULT_RETRIEVAL_OPTIONS, RETRIEVAL_UNITS, RetrievalOptions
+from message_chunks import MESSAGE_CHUNKS_ENABLED, rechunk_thread_now
+from thread_centroids import THREAD_CENTROIDS_ENABLED, refresh_thread_day
+from vector_engine import VECTOR_ENGINE, load_vector_engine, get_vector_engine
+from retrieval_cache import get_retrieval_cache
+from thread_day_cache import get_thread_day_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Conversation history settings
+HISTORY_MODES = ("full", "delta")
+HISTORY_WINDOW_MESSAGES = 10  # Recent messages included verbatim in the prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))  # Cap for summary + recent window
+CONVERSATION_SUMMARIES_ENABLED = os.getenv("CONVERSATION_SUMMARIES_ENABLED", "true").lower() == "true"
+
+# Pipeline run timeouts: synchronous /chat turns vs async jobs (0 = no limit)
+CHAT_TIMEOUT_SECONDS = 60.0
+CHAT_JOB_TIMEOUT_SECONDS = float(os.getenv("CHAT_JOB_TIMEOUT_SECONDS", "900"))
+
 # Authentication setup
 security = HTTPBearer()
 
@@ -52,14 +76,29 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting Matt-GPT API server...")
     
-    logger.info("Initializing database...")
-    init_db()
+    logger.info("Verifying database schema version...")
+    verify_schema_version()
+    logger.info("Starting telemetry writer...")
+    telemetry_writer.start()
     logger.info("Setting up MattGPT DSPy system...")
     app.state.matt_gpt = setup_dspy()
+    if VECTOR_ENGINE == "inprocess":
+        logger.info("Loading in-process vector engine...")
+        await asyncio.to_thread(load_vector_engine)
+    logger.info("Configuring admission control...")
+    app.state.admission = AdmissionController.from_env()
+    app.state.conversation_store = ConversationStateStore.from_env(window_messages=HISTORY_WINDOW_MESSAGES)
+    app.state.summarizer = ConversationSummarizer(window_messages=HISTORY_WINDOW_MESSAGES)
+    logger.info("Starting chat job workers...")
+    app.state.chat_jobs = ChatJobManager.from_env(run_chat_job)
+    await app.state.chat_jobs.start()
     logger.info("Matt-GPT API startup complete")
     yield
     # Shutdown
     logger.info("Shutting down Matt-GPT API...")
+    await app.state.chat_jobs.stop()
+    # Drain buffered RagAnalytics rows last, after jobs have logged theirs
+    await asyncio.to_thread(telemetry_writer.stop)
 
 
 app = FastAPI(
@@ -90,6 +129,20 @@ app.add_middleware(
 
 
 # Request/Response models
+class RetrievalSettings(BaseModel):
+    """Per-request retrieval overrides; unset fields use the server defaults (RETRIEVAL_* env vars)"""
+    vector_weight: Optional[float] = None  # Reciprocal rank fusion weight of the embedding search
+    lexical_weight: Optional[float] = None  # Weight of the full-text search (0 = vector only)
+    rrf_k: Optional[int] = None  # RRF rank offset; larger values flatten the rank weighting
+    unit: Optional[str] = None  # "messages" (hits expanded to thread-days) or "chunks" (precomputed windows)
+    route_top_n: Optional[int] = None  # > 0: search only the messages of the N nearest thread(-day) centroids
+    context_messages: Optional[int] = None  # ±N messages of context around each hit (0 = unbounded)
+    context_minutes: Optional[int] = None  # ±T minutes of context around each hit (0 = unbounded)
+    context_max_tokens: Optional[int] = None  # Token cap of each hit's context window
+    mmr_lambda: Optional[float] = None  # Relevance vs diversity of message hits (1.0 = relevance only)
+    mmr_pool_size: Optional[int] = None  # Candidates MMR chooses the hits from
+
+
 class ChatRequest(BaseModel):
     message: str
     openrouter_api_key: str  # User must provide their own API key
@@ -97,18 +150,74 @@ class ChatRequest(BaseModel):
     context: Optional[dict] = {}
     model: Optional[str] = "anthropic/claude-sonnet-4"
     other_conversation_context: Optional[bool] = True  # NEW: Include past conversations in RAG (default: True)
+    priority: Optional[str] = LANE_INTERACTIVE  # Admission lane: "interactive" or "batch" (eval/offline clients)
+    n_candidates: Optional[int] = 1  # Alternative replies generated from a single retrieval/prompt pass
+    history_mode: Optional[str] = "full"  # "full": whole conversation in response.history, "delta": only the new exchange
+    retrieval: Optional[RetrievalSettings] = None  # Retrieval tuning overrides
 
 
 class ChatResponse(BaseModel):
     response: str
+    candidates: Optional[List[str]] = None  # All generated replies when n_candidates > 1 (response is the first)
     conversation_id: uuid.UUID  # NEW: Always returned for conversation continuity
     query_id: str
-    history: List[ChatMessage]  # NEW: Complete conversation history
+    history: List[ChatMessage]  # NEW: Complete conversation history (only the new exchange in delta mode)
     ok: bool = True
     error_details: Optional[str] = None
     tokens_used: Optional[int] = None
     latency_ms: float
     context_items_used: int
+    context_reused: bool = False  # Follow-up answered from this conversation's earlier context plus a small new search
+
+
+class ConversationMessagesResponse(BaseModel):
+    conversation_id: uuid.UUID
+    messages: List[ChatMessage]  # Chronological order within the page
+    next_cursor: Optional[str] = None  # Pass as ?cursor= to fetch the next page
+    has_more: bool
+
+
+class ChatJobResponse(BaseModel):
+    job_id: uuid.UUID
+    status: str  # "queued", "running", "succeeded" or "failed"
+    conversation_id: Optional[uuid.UUID] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    result: Optional[ChatResponse] = None
+    error_details: Optional[str] = None
+
+
+class BatchChatItem(BaseModel):
+    message: str
+    conversation_id: Optional[uuid.UUID] = None
+    context: Optional[dict] = {}
+    model: Optional[str] = "anthropic/claude-sonnet-4"
+    other_conversation_context: Optional[bool] = True
+    n_candidates: Optional[int] = 1
+    retrieval: Optional[RetrievalSettings] = None
+
+
+class ChatBatchRequest(BaseModel):
+    items: List[BatchChatItem]
+    openrouter_api_key: str  # Shared by every item in the batch
+    max_parallel: Optional[int] = None  # Capped by CHAT_BATCH_MAX_PARALLEL
+
+
+class ChatBatchItemResult(BaseModel):
+    index: int
+    ok: bool
+    result: Optional[ChatResponse] = None
+    error_details: Optional[str] = None
+    status_code: Optional[int] = None  # 429/503 when the item was never admitted to the pipeline
+    retry_after: Optional[int] = None  # Last Retry-After seen for such an item
+    latency_ms: float
+
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchItemResult]  # Same order as the request items
+    total_latency_ms: float
+    retrieval_cache_hits: int
 
 
 # Dependency for getting client info
@@ -119,6 +228,34 @@ def get_client_info(request: Request):
     }
 
 
+async def run_admitted(lane: str, func, timeout: Optional[float] = CHAT_TIMEOUT_SECONDS):
+    """
+    Run a blocking pipeline function in the thread pool under admission control.
+
+    The slot is held until the worker thread actually finishes, even if the
+    caller gives up on timeout, so the slot count reflects real thread usage.
+    A timeout of None waits for the run however long it takes.
+    """
+    admission: AdmissionController = app.state.admission
+    wait_ms = await admission.acquire(lane)
+    if wait_ms:
+        logger.info(f"Admitted to {lane} lane after waiting {wait_ms:.0f}ms")
+
+    start = time.monotonic()
+    task = asyncio.ensure_future(asyncio.to_thread(func))
+    task.add_done_callback(lambda _: admission.release((time.monotonic() - start) * 1000))
+    return await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+
+
+def admission_http_error(e: AdmissionRejected) -> HTTPException:
+    """Translate an admission rejection into a fast 429/503 response"""
+    return HTTPException(
+        status_code=e.status_code,
+        detail=e.reason,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
 # Background task for logging
 async def log_query(
     query_id: str,
@@ -130,23 +267,33 @@ async def log_query(
     latency_ms: float,
     client_info: dict
 ):
-    """Log query asynchronously to not block response"""
-    with get_session() as session:
-        log_entry = QueryLog(
-            id=uuid.UUID(query_id),  # Convert string to UUID
-            conversation_id=conversation_id,  # NEW: Store conversation ID
-            query_text=query_text,
-            response_text=response_text,
-            model_used=model,
-            context_used=context_used,
-            tokens_used=len(response_text.split()),  # Rough estimate
-            latency_ms=latency_ms,
-            ip_address=client_info.get("ip"),
-            user_agent=client_info.get("user_agent"),
-            meta_data={"version": "1.0.0"}
-        )
-        session.add(log_entry)
-        session.commit()
+    """
+    Log query asynchronously to not block response
+    
+    Written through rather than via the buffered telemetry writer: the next
+    turn's continuation check and summary fold read query_logs, possibly from
+    another worker, as soon as the client has this response.
+    """
+    log_entry = QueryLog(
+        id=uuid.UUID(query_id),  # Convert string to UUID
+        conversation_id=conversation_id,  # NEW: Store conversation ID
+        query_text=query_text,
+        response_text=response_text,
+        model_used=model,
+        context_used=context_used,
+        tokens_used=len(response_text.split()),  # Rough estimate
+        latency_ms=latency_ms,
+        ip_address=client_info.get("ip"),
+        user_agent=client_info.get("user_agent"),
+        meta_data={"version": "1.0.0"}
+    )
+    
+    def write_log():
+        with get_session() as session:
+            session.add(log_entry)
+            session.commit()
+    
+    await asyncio.to_thread(write_log)
 
 
 # Helper function to save conversation messages to the Message table
@@ -167,35 +314,53 @@ async def save_conversation_message(
             logger.error("System OPENROUTER_API_KEY not available for embedding generation")
             return
             
+        # Embedding, insert and re-chunking block - keep them off the event loop
         embedding_client = OpenRouterClient(api_key=system_api_key)
-        embedding = embedding_client.generate_embedding(message_text)
+        embedding = await asyncio.to_thread(embedding_client.generate_embedding, message_text)
         logger.info("Embedding generated successfully")
         
-        with get_session() as session:
-            message = Message(
-                source="matt-gpt conversation",
-                thread_id=str(conversation_id),  # Use conversation_id as thread_id
-                message_text=message_text,
-                timestamp=datetime.utcnow(),
-                sent=sent,  # True for Matt's responses, False for user messages
-                from_matt_gpt=from_matt_gpt,
-                embedding=embedding,
-                meta_data={
-                    "conversation_id": str(conversation_id),
-                    "query_id": query_id,
-                    "message_type": "assistant" if from_matt_gpt else "user"
-                }
-            )
-            session.add(message)
-            session.commit()
-            logger.info(f"Successfully saved {'assistant' if from_matt_gpt else 'user'} message to Message table")
+        timestamp = datetime.utcnow()
+        
+        def write_message():
+            with get_session() as session:
+                message = Message(
+                    source="matt-gpt conversation",
+                    thread_id=str(conversation_id),  # Use conversation_id as thread_id
+                    message_text=message_text,
+                    timestamp=timestamp,
+                    sent=sent,  # True for Matt's responses, False for user messages
+                    from_matt_gpt=from_matt_gpt,
+                    embedding=embedding,
+                    meta_data={
+                        "conversation_id": str(conversation_id),
+                        "query_id": query_id,
+                        "message_type": "assistant" if from_matt_gpt else "user"
+                    }
+                )
+                session.add(message)
+                session.commit()
+        
+        await asyncio.to_thread(write_message)
+        logger.info(f"Successfully saved {'assistant' if from_matt_gpt else 'user'} message to Message table")
+        # Other workers see it on their next retrieval cache sync
+        get_retrieval_cache().note_message(str(conversation_id), timestamp)
+        
+        if THREAD_CENTROIDS_ENABLED:
+            # Routed search can find this conversation without waiting for the next centroid refresh
+            counts = await asyncio.to_thread(refresh_thread_day, str(conversation_id), timestamp.date())
+            logger.info(f"Refreshed centroids of conversation {conversation_id}: {counts}")
+        
+        if MESSAGE_CHUNKS_ENABLED and from_matt_gpt:
+            # The exchange is complete - refresh this conversation's chunk windows
+            counts = await asyncio.to_thread(rechunk_thread_now, str(conversation_id))
+            logger.info(f"Re-chunked conversation {conversation_id}: {counts}")
     
     except Exception as e:
         logger.error(f"Failed to save conversation message: {e}", exc_info=True)
         # Don't raise - this is a background operation that shouldn't break the main flow
 
 
-def run_with_logging(matt_gpt, question, api_key, conversation_history="", query_id=None, other_conversation_context=True):
+def run_with_logging(matt_gpt, question, api_key, conversation_history="", query_id=None, other_conversation_context=True, retrieval_cache=None, n_candidates=1, conversation_id=None, retrieval_options=None):
     """Wrapper to add console logging to matt_gpt processing"""
     
     # === REQUEST LOGGING ===
@@ -206,6 +371,8 @@ def run_with_logging(matt_gpt, question, api_key, conversation_history="", query
     logger.info(f"API KEY (truncated): {api_key[:20]}...")
     logger.info(f"MODEL: anthropic/claude-sonnet-4")
     logger.info(f"OTHER CONVERSATION CONTEXT: {other_conversation_context}")
+    if n_candidates > 1:
+        logger.info(f"CANDIDATES REQUESTED: {n_candidates}")
     if conversation_history:
         logger.info(f"CONVERSATION HISTORY: {len(conversation_history)} characters")
     logger.info("=" * 80)
@@ -217,11 +384,18 @@ def run_with_logging(matt_gpt, question, api_key, conversation_history="", query
             user_openrouter_key=api_key,
             conversation_history=conversation_history,
             query_id=query_id,
-            other_conversation_context=other_conversation_context
+            other_conversation_context=other_conversation_context,
+            retrieval_cache=retrieval_cache,
+            n_candidates=n_candidates,
+            conversation_id=conversation_id,
+            retrieval_options=retrieval_options
         )
         
         response_text = result.response
+        candidates = result.candidates
         context_used = result.context_used
+        context_refs = result.context_refs
+        context_reused = result.context_reused
         
         # === RESPONSE LOGGING ===
         logger.info("=" * 80)
@@ -235,7 +409,10 @@ def run_with_logging(matt_gpt, question, api_key, conversation_history="", query
         # Return result object
         return type('Result', (), {
             'response': response_text,
-            'context_used': context_used
+            'candidates': candidates,
+            'context_used': context_used,
+            'context_refs': context_refs,
+            'context_reused': context_reused
         })()
         
     except Exception as e:
@@ -247,6 +424,80 @@ def run_with_logging(matt_gpt, question, api_key, conversation_history="", query
         raise
 
 
+def validate_chat_request(request: ChatRequest):
+    """Validate request fields that the pipeline depends on"""
+    # Validate user's OpenRouter API key format
+    if not request.openrouter_api_key.startswith('sk-or-v1-'):
+        logger.warning("Invalid OpenRouter API key format provided")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid OpenRouter API key format. Must start with 'sk-or-v1-'"
+        )
+    
+    if request.priority not in LANES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid priority '{request.priority}'. Must be one of: {', '.join(LANES)}"
+        )
+    
+    if request.history_mode not in HISTORY_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid history_mode '{request.history_mode}'. Must be one of: {', '.join(HISTORY_MODES)}"
+        )
+    
+    max_candidates = int(os.getenv("CHAT_MAX_CANDIDATES", "5"))
+    if not 1 <= request.n_candidates <= max_candidates:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"n_candidates must be between 1 and {max_candidates}"
+        )
+    
+    options = get_retrieval_options(request)
+    if options.vector_weight < 0 or options.lexical_weight < 0 or options.vector_weight + options.lexical_weight == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="retrieval weights must be non-negative and not both 0"
+        )
+    if options.rrf_k < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="retrieval.rrf_k must be at least 1"
+        )
+    if not 0 <= options.route_top_n <= 1000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="retrieval.route_top_n must be between 0 and 1000"
+        )
+    if not 0 <= options.context_messages <= 200 or not 0 <= options.context_minutes <= 1440:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="retrieval.context_messages must be between 0 and 200 and retrieval.context_minutes between 0 and 1440"
+        )
+    if not 50 <= options.context_max_tokens <= 8000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="retrieval.context_max_tokens must be between 50 and 8000"
+        )
+    if not 0.0 <= options.mmr_lambda <= 1.0 or not 1 <= options.mmr_pool_size <= 200:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="retrieval.mmr_lambda must be between 0 and 1 and retrieval.mmr_pool_size between 1 and 200"
+        )
+    if options.unit not in RETRIEVAL_UNITS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid retrieval.unit '{options.unit}'. Must be one of: {', '.join(RETRIEVAL_UNITS)}"
+        )
+
+
+def get_retrieval_options(request: ChatRequest) -> RetrievalOptions:
+    """Server defaults with the request's retrieval overrides applied"""
+    if request.retrieval is None:
+        return DEFAULT_RETRIEVAL_OPTIONS
+    return DEFAULT_RETRIEVAL_OPTIONS.with_overrides(request.retrieval.model_dump(exclude_none=True))
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(
     request: ChatRequest,
@@ -266,13 +517,34 @@ async def chat_endpoint(
     logger.info(f"Authenticated chat request from {client_info.get('ip', 'unknown')}")
     logger.debug(f"Message: {request.message[:50]}...")
     
-    # Validate user's OpenRouter API key format
-    if not request.openrouter_api_key.startswith('sk-or-v1-'):
-        logger.warning("Invalid OpenRouter API key format provided")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid OpenRouter API key format. Must start with 'sk-or-v1-'"
-        )
+    validate_chat_request(request)
+    
+    try:
+        return await process_chat(request, client_info, background_tasks.add_task)
+    except AdmissionRejected as e:
+        # Shed load immediately - nothing has been generated or logged yet
+        raise admission_http_error(e)
+
+
+async def process_chat(request: ChatRequest, client_info: dict, schedule_task, retrieval_cache: Optional[SharedRetrievalCache] = None,
+                       timeout: Optional[float] = CHAT_TIMEOUT_SECONDS) -> ChatResponse:
+    """
+    Run one chat turn through the full pipeline
+    
+    Args:
+        request: Validated chat request
+        client_info: Client IP / user agent for logging
+        schedule_task: Callable(func, **kwargs) used to defer logging and message persistence
+        retrieval_cache: Optional context memo shared with other items of the same batch
+        timeout: Seconds the pipeline run may take once admitted (None = no limit)
+        
+    Returns:
+        ChatResponse for the turn
+        
+    Raises:
+        HTTPException: if the conversation to continue does not exist
+        AdmissionRejected: if no pipeline slot could be acquired
+    """
     
     start_time = time.time()
     query_id = str(uuid.uuid4())
@@ -291,6 +563,7 @@ async def chat_endpoint(
     
     # Retrieve conversation history and handle conversation logic
     history = []  # Initialize history for all code paths
+    window = []
     history_for_llm = ""
     
     with get_session() as session:
@@ -299,16 +572,32 @@ async def chat_endpoint(
         # Get conversation history if continuing conversation
         if request.conversation_id:
             logger.info(f"Retrieving history for conversation {request.conversation_id}")
-            # Validate conversation exists
-            if not history_service.conversation_exists(request.conversation_id):
+            # Existence check and recent window in one lookup (cached per worker)
+            window = app.state.conversation_store.get_window(history_service, request.conversation_id)
+            if window is None:
                 logger.warning(f"Conversation {request.conversation_id} not found")
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Conversation {request.conversation_id} not found"
                 )
             
-            history = history_service.get_conversation_history(request.conversation_id)
-            history_for_llm = history_service.format_history_for_llm(history)
+            if request.history_mode == "delta":
+                history = window
+            else:
+                # Full mode still returns the whole conversation to the client;
+                # the cached window may include turns whose logs are still being written
+                history = history_service.get_conversation_history(request.conversation_id)
+                logged_ids = {msg.query_id for msg in history}
+                history += [msg for msg in window if msg.query_id not in logged_ids]
+            summary = ""
+            if CONVERSATION_SUMMARIES_ENABLED:
+                summary = app.state.summarizer.get_summary(session, request.conversation_id)
+            history_for_llm = history_service.format_history_for_llm(
+                window,
+                max_messages=HISTORY_WINDOW_MESSAGES,
+                summary=summary,
+                token_budget=HISTORY_TOKEN_BUDGET
+            )
             logger.info(f"Retrieved {len(history)} messages from conversation history")
         else:
             logger.info(f"Starting new conversation with ID {conversation_id}")
@@ -322,17 +611,21 @@ async def chat_endpoint(
                 request.openrouter_api_key,
                 history_for_llm,
                 query_id,
-                request.other_conversation_context
+                request.other_conversation_context,
+                retrieval_cache,
+                request.n_candidates,
+                str(conversation_id),
+                get_retrieval_options(request)
             )
         
-        # Run in thread pool with timeout
-        result = await asyncio.wait_for(
-            asyncio.to_thread(run_matt_gpt_with_logging),
-            timeout=60.0
-        )
+        # Run in thread pool with timeout, once admitted to a pipeline slot
+        result = await run_admitted(request.priority, run_matt_gpt_with_logging, timeout=timeout)
         
         response_text = result.response
+        candidates = result.candidates if request.n_candidates > 1 else None
         context_used = result.context_used
+        context_refs = result.context_refs
+        context_reused = result.context_reused
         
         # Log successful response
         logger.info(f"Response generated successfully")
@@ -343,11 +636,18 @@ async def chat_endpoint(
         error_details = None
         is_error = False
         
+    except AdmissionRejected:
+        # Shed load immediately - nothing has been generated or logged yet
+        raise
+        
     except asyncio.TimeoutError:
-        logger.error("MattGPT generation timed out after 60 seconds")
+        logger.error(f"MattGPT generation timed out after {timeout:.0f} seconds")
         response_text = "Sorry, the request timed out. The system is experiencing slow response times."
-        error_details = "Request timeout (60s)"
+        error_details = f"Request timeout ({timeout:.0f}s)"
+        candidates = None
         context_used = []
+        context_refs = None
+        context_reused = False
         is_error = True
         
     except Exception as e:
@@ -357,7 +657,10 @@ async def chat_endpoint(
         
         response_text = f"Sorry, I encountered an error processing your message."
         error_details = str(e)
+        candidates = None
         context_used = []
+        context_refs = None
+        context_reused = False
         is_error = True
     
     latency_ms = (time.time() - start_time) * 1000
@@ -379,33 +682,55 @@ async def chat_endpoint(
                 query_id=uuid.UUID(query_id)
             )
         ]
-        full_history = history + current_exchange
-        logger.info(f"Built full conversation history with {len(full_history)} messages")
+        app.state.conversation_store.record_turn(
+            conversation_id,
+            uuid.UUID(query_id),
+            request.message,
+            response_text,
+            previous_window=window
+        )
+        
+        if request.history_mode == "delta":
+            # Client already has earlier turns - return only the new exchange
+            full_history = current_exchange
+        else:
+            full_history = history + current_exchange
+        logger.info(f"Built {request.history_mode} conversation history with {len(full_history)} messages")
     except Exception as e:
         logger.error(f"Error building conversation history: {e}")
         # Fallback to empty history
         full_history = []
     
     # Schedule background logging with conversation_id
-    background_tasks.add_task(
+    schedule_task(
         log_query,
         query_id=query_id,
         conversation_id=conversation_id,  # NEW: Include conversation ID
         query_text=request.message,
         response_text=response_text,
         model=request.model,
-        context_used={
-            "passages": context_used[:10] if 'context_used' in locals() else [],
-            "used_user_key": bool(request.openrouter_api_key),
-            "context_count": len(context_used) if 'context_used' in locals() else 0,
-            "conversation_history_length": len(history_for_llm) if history_for_llm else 0
-        },
+        context_used=build_query_context_log(
+            context_used if 'context_used' in locals() else [],
+            context_refs if 'context_refs' in locals() else None,
+            used_user_key=bool(request.openrouter_api_key),
+            context_count=len(context_used) if 'context_used' in locals() else 0,
+            conversation_history_length=len(history_for_llm) if history_for_llm else 0,
+            context_reused=context_reused if 'context_reused' in locals() else False
+        ),
         latency_ms=latency_ms,
         client_info=client_info
     )
     
+    # Fold turns that just left the verbatim window into the rolling summary
+    if CONVERSATION_SUMMARIES_ENABLED and len(window) + 2 > HISTORY_WINDOW_MESSAGES:
+        schedule_task(
+            update_conversation_summary,
+            summarizer=app.state.summarizer,
+            conversation_id=conversation_id
+        )
+    
     # NEW: Schedule background tasks to save conversation messages to Message table for RAG
-    background_tasks.add_task(
+    schedule_task(
         save_conversation_message,
         message_text=request.message,
         conversation_id=conversation_id,
@@ -414,7 +739,7 @@ async def chat_endpoint(
         sent=False  # User sent it to Matt-GPT
     )
     
-    background_tasks.add_task(
+    schedule_task(
         save_conversation_message,
         message_text=response_text,
         conversation_id=conversation_id,
@@ -439,13 +764,225 @@ async def chat_endpoint(
     
     return ChatResponse(
         response=response_text,
+        candidates=candidates,
         conversation_id=conversation_id,
         query_id=query_id,
         history=full_history,
         ok=not is_error,
         error_details=error_details,
         latency_ms=latency_ms,
-        context_items_used=len(context_used) if 'context_used' in locals() else 0
+        context_items_used=len(context_used) if 'context_used' in locals() else 0,
+        context_reused=context_reused if 'context_reused' in locals() else False
+    )
+
+
+async def run_chat_job(request: ChatRequest, client_info: dict) -> dict:
+    """Chat job processor: run the pipeline, then the deferred logging/persistence tasks"""
+    deferred = []
+    response = await process_chat(
+        request,
+        client_info,
+        lambda func, **kwargs: deferred.append((func, kwargs)),
+        timeout=CHAT_JOB_TIMEOUT_SECONDS or None
+    )
+    for func, kwargs in deferred:
+        try:
+            await func(**kwargs)
+        except Exception as e:
+            logger.error(f"Deferred task {func.__name__} failed for chat job: {e}")
+    return response.model_dump(mode="json")
+
+
+def job_to_response(job) -> ChatJobResponse:
+    """Convert a ChatJob row into its API representation"""
+    return ChatJobResponse(
+        job_id=job.id,
+        status=job.status,
+        conversation_id=job.conversation_id,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        completed_at=job.completed_at,
+        result=ChatResponse(**job.result) if job.result else None,
+        error_details=job.error_details
+    )
+
+
+@app.post("/chat/jobs", response_model=ChatJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_chat_job(
+    request: ChatRequest,
+    client_info: dict = Depends(get_client_info),
+    token: str = Depends(verify_bearer_token)
+):
+    """Submit a chat turn for asynchronous processing and return its job id immediately"""
+    logger.info(f"Chat job submitted from {client_info.get('ip', 'unknown')}")
+    validate_chat_request(request)
+    if "priority" not in request.model_fields_set:
+        # Jobs are already asynchronous - don't compete with /chat callers unless asked to
+        request.priority = LANE_BATCH
+    
+    try:
+        job = await app.state.chat_jobs.submit(request, client_info)
+    except AdmissionRejected as e:
+        raise admission_http_error(e)
+    
+    return job_to_response(job)
+
+
+@app.get("/chat/jobs/{job_id}", response_model=ChatJobResponse)
+async def get_chat_job(
+    job_id: uuid.UUID,
+    wait: float = 0.0,
+    token: str = Depends(verify_bearer_token)
+):
+    """Get a chat job's status and result, optionally long-polling up to `wait` seconds (max 30)"""
+    job = await app.state.chat_jobs.wait(job_id, timeout=min(max(wait, 0.0), 30.0))
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Chat job {job_id} not found"
+        )
+    return job_to_response(job)
+
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch_endpoint(
+    request: ChatBatchRequest,
+    background_tasks: BackgroundTasks,
+    client_info: dict = Depends(get_client_info),
+    token: str = Depends(verify_bearer_token)
+):
+    """Run many independent chat items with bounded parallelism and shared retrieval"""
+    max_items = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "50"))
+    max_parallel = int(os.getenv("CHAT_BATCH_MAX_PARALLEL", "4"))
+    admission_seconds = float(os.getenv("CHAT_BATCH_ADMISSION_SECONDS", "300"))
+    
+    if not request.items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch must contain at least one item"
+        )
+    if len(request.items) > max_items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch too large: {len(request.items)} items (max {max_items})"
+        )
+    
+    if request.max_parallel:
+        max_parallel = max(1, min(request.max_parallel, max_parallel))
+    
+    logger.info(f"Batch chat request with {len(request.items)} items (parallelism {max_parallel}) from {client_info.get('ip', 'unknown')}")
+    
+    chat_requests = [
+        ChatRequest(
+            message=item.message,
+            openrouter_api_key=request.openrouter_api_key,
+            conversation_id=item.conversation_id,
+            context=item.context,
+            model=item.model,
+            other_conversation_context=item.other_conversation_context,
+            n_candidates=item.n_candidates,
+            retrieval=item.retrieval,
+            priority=LANE_BATCH
+        )
+        for item in request.items
+    ]
+    for chat_request in chat_requests:
+        validate_chat_request(chat_request)
+    
+    batch_start = time.time()
+    semaphore = asyncio.Semaphore(max_parallel)
+    retrieval_cache = SharedRetrievalCache()
+    
+    async def run_item(index: int, chat_request: ChatRequest) -> ChatBatchItemResult:
+        async with semaphore:
+            item_start = time.time()
+            try:
+                # Batch clients are willing to wait, up to CHAT_BATCH_ADMISSION_SECONDS per item
+                response = await retry_admission(
+                    lambda: process_chat(
+                        chat_request,
+                        client_info,
+                        background_tasks.add_task,
+                        retrieval_cache=retrieval_cache
+                    ),
+                    admission_seconds,
+                    label=f"Batch item {index}"
+                )
+                return ChatBatchItemResult(
+                    index=index,
+                    ok=response.ok,
+                    result=response,
+                    error_details=response.error_details,
+                    latency_ms=(time.time() - item_start) * 1000
+                )
+            except AdmissionRejected as e:
+                return ChatBatchItemResult(
+                    index=index,
+                    ok=False,
+                    error_details=e.reason,
+                    status_code=e.status_code,
+                    retry_after=e.retry_after,
+                    latency_ms=(time.time() - item_start) * 1000
+                )
+            except HTTPException as e:
+                return ChatBatchItemResult(
+                    index=index,
+                    ok=False,
+                    error_details=str(e.detail),
+                    latency_ms=(time.time() - item_start) * 1000
+                )
+    
+    results = await asyncio.gather(*(run_item(i, r) for i, r in enumerate(chat_requests)))
+    
+    total_latency_ms = (time.time() - batch_start) * 1000
+    logger.info(f"Batch of {len(results)} items completed in {total_latency_ms:.2f}ms ({retrieval_cache.hits} shared retrievals)")
+    
+    return ChatBatchResponse(
+        results=list(results),
+        total_latency_ms=total_latency_ms,
+        retrieval_cache_hits=retrieval_cache.hits
+    )
+
+
+@app.get("/conversations/{conversation_id}/messages", response_model=ConversationMessagesResponse)
+async def get_conversation_messages(
+    conversation_id: uuid.UUID,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    order: str = "asc",
+    token: str = Depends(verify_bearer_token)
+):
+    """Page through a conversation's messages with an opaque cursor"""
+    if order not in ("asc", "desc"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="order must be 'asc' or 'desc'"
+        )
+    limit = max(1, min(limit, 100))
+    
+    with get_session() as session:
+        history_service = ConversationHistoryService(session)
+        try:
+            messages, next_cursor = history_service.get_conversation_page(
+                conversation_id, limit=limit, cursor=cursor, order=order
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    
+    if not messages and not cursor:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Conversation {conversation_id} not found"
+        )
+    
+    return ConversationMessagesResponse(
+        conversation_id=conversation_id,
+        messages=messages,
+        next_cursor=next_cursor,
+        has_more=next_cursor is not None
     )
 
 
@@ -456,6 +993,46 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
 
+@app.get("/metrics")
+async def metrics_endpoint(token: str = Depends(verify_bearer_token)):
+    """Per-worker load metrics for sizing gunicorn workers and instances"""
+    return {
+        "timestamp": datetime.utcnow(),
+        "admission": app.state.admission.get_stats(),
+        "chat_jobs": app.state.chat_jobs.get_stats(),
+        "conversation_store": app.state.conversation_store.get_stats(),
+        "context_reuse": app.state.matt_gpt.context_cache.get_stats(),
+        "telemetry": telemetry_writer.get_stats(),
+        "retrieval_cache": get_retrieval_cache().get_stats(),
+        "thread_day_cache": get_thread_day_cache().get_stats(),
+        "vector_engine": get_vector_engine().get_stats() if get_vector_engine() else None
+    }
+
+
+@app.get("/metrics/hourly", response_model=List[AnalyticsHourlyRollup])
+async def hourly_metrics_endpoint(
+    hours: int = 24,
+    token: str = Depends(verify_bearer_token)
+):
+    """Hourly request, token, latency and fallback rollups (newest first) for dashboards"""
+    if not 1 <= hours <= 24 * 90:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="hours must be between 1 and 2160"
+        )
+    
+    def load_rollups():
+        with get_session() as session:
+            query = (
+                select(AnalyticsHourlyRollup)
+                .order_by(AnalyticsHourlyRollup.bucket_start.desc())
+                .limit(hours)
+            )
+            return session.exec(query).all()
+    
+    return await asyncio.to_thread(load_rollups)
+
+
 
 
 if __name__ == "__main__":
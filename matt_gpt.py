@@ -1,14 +1,30 @@
 import dspy
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import os
 import logging
+import threading
+import contextvars
+from datetime import datetime
 from dotenv import load_dotenv
 
+from context_cache import (
+    ConversationContextCache, merge_passages, drop_conversation_passages, split_passage_blocks, hit_block_headers,
+)
+from analytics_storage import merge_passage_refs, drop_thread_refs
+from retrieval_options import DEFAULT_RETRIEVAL_OPTIONS, RetrievalOptions
+from retrieval_cache import KEY_EMBEDDING, get_retrieval_cache
+
 load_dotenv()
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Message hits fetched on top of reused context for a similar follow-up (vs 15 for a full search)
+CONTEXT_REUSE_DELTA_LIMIT = int(os.getenv("CONTEXT_REUSE_DELTA_LIMIT", "5"))
+# Thread-day blocks kept when merging that search with the reused context (fresh blocks first)
+CONTEXT_REUSE_MAX_BLOCKS = int(os.getenv("CONTEXT_REUSE_MAX_BLOCKS", "15"))
+
 
 class MattResponse(dspy.Signature):
     """Generate a response as Matt would, based on his history, personality, and conversation context."""
@@ -27,32 +43,99 @@ class MattResponse(dspy.Signature):
     )
 
 
+class SharedRetrievalCache:
+    """
+    Single-flight memo of retrieved context shared by the items of one batch.
+    Concurrent callers with the same key wait for the first caller's result
+    instead of repeating retrieval.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            future = self._entries.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._entries[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if is_owner:
+            try:
+                future.set_result(compute())
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            logger.info("Reusing context retrieved for an identical batch item")
+
+        return future.result()
+
+
 class MattGPT(dspy.Module):
     def __init__(self, retriever):
         super().__init__()
         self.retrieve = retriever
         # Check if this is an enhanced RAG retriever
         self.is_enhanced_rag = hasattr(retriever, 'enhanced_retrieve')
+        self.context_cache = ConversationContextCache.from_env()
+        self.retrieval_cache = get_retrieval_cache()
         logger.info(f"MattGPT module initialized with {'enhanced' if self.is_enhanced_rag else 'standard'} retriever")
 
-    def forward(self, question: str, user_openrouter_key: Optional[str] = None, conversation_history: str = "", query_id: Optional[str] = None, other_conversation_context: bool = True):
-        logger.info(f"Processing question: {question[:100]}...")
-        if conversation_history:
-            logger.info(f"Including conversation history: {len(conversation_history)} characters")
+    def _question_embedding(self, question: str) -> Optional[list]:
+        """
+        The question's embedding from the embedding cache the retrievers share, so the
+        retrieval that follows doesn't pay for it again; None when it can't be computed
+        """
+        from llm_client import OpenRouterClient
+        try:
+            return OpenRouterClient(api_key=os.getenv("OPENROUTER_API_KEY")).generate_embedding(question)
+        except Exception as e:
+            logger.warning(f"Question embedding failed: {e}")
+            return None
+
+    def _retrieve_context(self, question: str, query_id: Optional[str], other_conversation_context: bool, retrieval_options: Optional[RetrievalOptions] = None, query_embedding: Optional[list] = None) -> Tuple[List[str], Optional[dict]]:
+        """
+        Retrieve context passages (messages and personality docs) for a question
         
-        # Retrieve relevant context using appropriate RAG system
-        logger.debug("Retrieving relevant context...")
-        logger.info(f"Other conversation context enabled: {other_conversation_context}")
+        Args:
+            query_embedding: the question's embedding if the caller already has it (embedding cache keys)
         
+        Returns:
+            Tuple of (passages, passage refs or None when the retriever doesn't report them)
+        """
+        refs = None
         if other_conversation_context:
+            cache_key = None
+            if self.retrieval_cache.enabled:
+                scope = "enhanced" if self.is_enhanced_rag else "standard"
+                if self.retrieval_cache.key_mode == KEY_EMBEDDING and query_embedding is None:
+                    query_embedding = self._question_embedding(question)  # None: falls back to the text key
+                cache_key = self.retrieval_cache.make_key(question, retrieval_options or DEFAULT_RETRIEVAL_OPTIONS, scope,
+                                                          embedding=query_embedding)
+                cached = self.retrieval_cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"Retrieval cache hit: reusing {len(cached.passages)} passages")
+                    return list(cached.passages), cached.passage_refs
+            computed_at = datetime.utcnow()
+            
             if self.is_enhanced_rag:
                 # Use enhanced RAG system
                 if not query_id:
                     import uuid
                     query_id = str(uuid.uuid4())
                 
-                context, rag_metrics = self.retrieve.enhanced_retrieve(question, query_id)
+                context, rag_metrics = self.retrieve.enhanced_retrieve(question, query_id, retrieval_options=retrieval_options)
+                refs = rag_metrics.passage_refs
                 logger.info(f"Enhanced RAG retrieved {len(context)} context passages")
+                if rag_metrics.fallback_used:
+                    cache_key = None  # Degraded result - retry the full pipeline next time
                 
                 # Save analytics in background
                 try:
@@ -61,9 +144,13 @@ class MattGPT(dspy.Module):
                     logger.warning(f"Failed to save RAG analytics: {e}")
             else:
                 # Use standard RAG system
-                context_result = self.retrieve(question)
+                context_result = self.retrieve(question, retrieval_options=retrieval_options)
                 context = context_result.passages
+                refs = context_result.passage_refs
                 logger.info(f"Standard RAG retrieved {len(context)} context passages")
+            
+            if cache_key is not None and context:
+                self.retrieval_cache.put(cache_key, context, refs, computed_at)
         else:
             # Skip conversation retrieval - only use personality docs from retriever
             logger.info("Skipping conversation context retrieval - personality-only mode")
@@ -77,7 +164,97 @@ class MattGPT(dspy.Module):
                 all_context = context_result.passages
                 # Filter to only personality docs
                 context = [item for item in all_context if item.startswith("=== ") and " ===" in item]
+                refs = {"messages": [], "personality_docs": context_result.passage_refs["personality_docs"]}
                 logger.info(f"Standard RAG personality-only filtered {len(context)} personality docs from {len(all_context)} total")
+        
+        return context, refs
+
+    def _retrieve_shared(self, question: str, query_id: Optional[str], other_conversation_context: bool, retrieval_options: Optional[RetrievalOptions] = None, retrieval_cache: Optional[SharedRetrievalCache] = None, query_embedding: Optional[list] = None) -> Tuple[List[str], Optional[dict]]:
+        """_retrieve_context, shared with other items of the same batch asking the same question"""
+        if retrieval_cache is None:
+            return self._retrieve_context(question, query_id, other_conversation_context, retrieval_options, query_embedding)
+        # Only the conversation-independent retrieval is shared; reuse and filtering stay per conversation
+        return retrieval_cache.get_or_compute(
+            (question, other_conversation_context, retrieval_options),
+            lambda: self._retrieve_context(question, query_id, other_conversation_context, retrieval_options, query_embedding)
+        )
+
+    def _retrieve_with_reuse(self, question: str, query_id: Optional[str], conversation_id: Optional[str], retrieval_options: Optional[RetrievalOptions] = None, retrieval_cache: Optional[SharedRetrievalCache] = None) -> Tuple[List[str], Optional[dict], bool]:
+        """
+        Retrieve context for a conversation turn, reusing the last full
+        retrieval's passages when the follow-up is similar enough to its
+        question and only retrieving the difference
+
+        Only full retrievals are stored, together with their own question's
+        embedding, so the merged context of a reuse turn is never reused again:
+        it can't snowball across follow-ups, and each follow-up is compared with
+        the question its passages were actually retrieved for.
+
+        Returns:
+            Tuple of (passages, passage refs, whether cached context was reused)
+        """
+        if not conversation_id:
+            return (*self._retrieve_shared(question, query_id, True, retrieval_options, retrieval_cache), False)
+        
+        query_embedding = self._question_embedding(question)
+        if query_embedding is None:
+            return (*self._retrieve_shared(question, query_id, True, retrieval_options, retrieval_cache), False)
+        
+        cached = self.context_cache.lookup(conversation_id, query_embedding)
+        if cached is None:
+            context, refs = self._retrieve_shared(question, query_id, True, retrieval_options, retrieval_cache, query_embedding)
+            self.context_cache.store(conversation_id, query_embedding, context, refs)
+            return context, refs, False
+        
+        # Small single-query search for anything the cached passages don't cover
+        if self.is_enhanced_rag:
+            # Filtered like the cached passages it is merged with, just without query expansion
+            if not query_id:
+                import uuid
+                query_id = str(uuid.uuid4())
+            fresh, rag_metrics = self.retrieve.enhanced_retrieve(
+                question, query_id, retrieval_options=retrieval_options, message_limit=CONTEXT_REUSE_DELTA_LIMIT
+            )
+            fresh_refs = rag_metrics.passage_refs
+            rag_metrics.context_reused = True
+            try:
+                self.retrieve.save_analytics(query_id, rag_metrics)
+            except Exception as e:
+                logger.warning(f"Failed to save RAG analytics: {e}")
+        else:
+            fresh_result = self.retrieve.forward(question, message_limit=CONTEXT_REUSE_DELTA_LIMIT, retrieval_options=retrieval_options)
+            fresh, fresh_refs = fresh_result.passages, fresh_result.passage_refs
+        context = merge_passages(fresh, cached.passages, max_blocks=CONTEXT_REUSE_MAX_BLOCKS)
+        refs = None
+        if cached.passage_refs is not None and fresh_refs is not None:
+            kept_headers = {header for header, _ in split_passage_blocks(context) if header}
+            refs = merge_passage_refs(
+                fresh_refs,
+                # Personality docs come from the fresh retrieval; cached hits only if their block was kept
+                {"messages": [hit for hit in cached.passage_refs["messages"] if hit_block_headers(hit) & kept_headers]}
+            )
+        logger.info(f"Reused context: {len(fresh)} fresh + {len(cached.passages)} cached -> {len(context)} passages")
+        return context, refs, True
+
+    def forward(self, question: str, user_openrouter_key: Optional[str] = None, conversation_history: str = "", query_id: Optional[str] = None, other_conversation_context: bool = True, retrieval_cache: Optional[SharedRetrievalCache] = None, n_candidates: int = 1, conversation_id: Optional[str] = None, retrieval_options: Optional[RetrievalOptions] = None):
+        logger.info(f"Processing question: {question[:100]}...")
+        if conversation_history:
+            logger.info(f"Including conversation history: {len(conversation_history)} characters")
+        
+        # Retrieve relevant context using appropriate RAG system
+        logger.debug("Retrieving relevant context...")
+        logger.info(f"Other conversation context enabled: {other_conversation_context}")
+        
+        context_reused = False
+        if other_conversation_context:
+            context, context_refs, context_reused = self._retrieve_with_reuse(question, query_id, conversation_id, retrieval_options, retrieval_cache)
+        else:
+            context, context_refs = self._retrieve_shared(question, query_id, other_conversation_context, retrieval_options, retrieval_cache)
+        
+        # This conversation's own messages are already in the history section
+        context = drop_conversation_passages(context, conversation_id, context_refs)
+        if context_refs is not None:
+            context_refs = drop_thread_refs(context_refs, conversation_id)
 
         # === RAG RESULTS LOGGING ===
         logger.info("=" * 60)
@@ -236,17 +413,30 @@ class MattGPT(dspy.Module):
 
                 logger.debug("Calling chat_completion...")
                 messages = [{"role": "user", "content": prompt}]
-                response = user_client.chat_completion(messages=messages)
+                if n_candidates > 1:
+                    # Same prompt, concurrent completions - retrieval and prompt assembly happen once
+                    logger.info(f"Generating {n_candidates} candidate responses concurrently")
+                    with ThreadPoolExecutor(max_workers=n_candidates) as executor:
+                        responses = list(executor.map(
+                            lambda _: user_client.chat_completion(messages=messages),
+                            range(n_candidates)
+                        ))
+                else:
+                    responses = [user_client.chat_completion(messages=messages)]
                 logger.debug("chat_completion returned successfully")
                 
-                response_text = response.choices[0].message.content
+                candidates = [r.choices[0].message.content for r in responses]
+                response_text = candidates[0]
                 logger.debug(f"Response text extracted: {response_text[:50]}...")
 
                 # === PROMPT OUTPUT LOGGING ===
                 logger.info("=" * 60)
                 logger.info("RAW PROMPT OUTPUT (User OpenRouter Key):")
                 logger.info("=" * 60)
-                logger.info(f"FULL RESPONSE:\n{response_text}")
+                for i, candidate in enumerate(candidates, 1):
+                    if len(candidates) > 1:
+                        logger.info(f"CANDIDATE {i}/{len(candidates)}:")
+                    logger.info(f"FULL RESPONSE:\n{candidate}")
                 logger.info("=" * 60)
                 
                 # Create mock DSPy prediction object
@@ -282,24 +472,44 @@ class MattGPT(dspy.Module):
             logger.info("=" * 60)
             
             generate = dspy.ChainOfThought(MattResponse)
-            prediction = generate(
-                conversation_history=conversation_history,
-                context=structured_context,
-                question=question
-            )
+            inputs = {
+                "conversation_history": conversation_history,
+                "context": structured_context,
+                "question": question,
+            }
+            if n_candidates > 1:
+                # Same prompt and LM settings for every candidate, generated concurrently; only the
+                # rollout_id differs, so each candidate bypasses the DSPy cache entry of the others
+                logger.info(f"Generating {n_candidates} candidate responses concurrently")
+                with ThreadPoolExecutor(max_workers=n_candidates) as executor:
+                    futures = [
+                        executor.submit(contextvars.copy_context().run, generate, **inputs, config={"rollout_id": rollout_id})
+                        for rollout_id in range(n_candidates)
+                    ]
+                    predictions = [future.result() for future in futures]
+            else:
+                predictions = [generate(**inputs)]
+            prediction = predictions[0]
+            candidates = [p.response for p in predictions]
             
             # === PROMPT OUTPUT LOGGING (Environment Key) ===
             logger.info("=" * 60)
             logger.info("RAW PROMPT OUTPUT (Environment OpenRouter Key):")
             logger.info("=" * 60)
-            logger.info(f"FULL RESPONSE:\n{prediction.response}")
+            for i, candidate in enumerate(candidates, 1):
+                if len(candidates) > 1:
+                    logger.info(f"CANDIDATE {i}/{len(candidates)}:")
+                logger.info(f"FULL RESPONSE:\n{candidate}")
             logger.info("=" * 60)
             
             logger.info("Response generated successfully with environment key")
 
         return dspy.Prediction(
             response=prediction.response,
-            context_used=context
+            candidates=candidates,
+            context_used=context,
+            context_refs=context_refs,
+            context_reused=context_reused
         )
 
 
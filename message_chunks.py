@@ -0,0 +1,284 @@
+"""
+Message Chunks Service for Matt-GPT
+Precomputed, token-bounded conversation windows around Matt's messages as a retrieval unit
+"""
+
+import os
+import uuid
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from conversation_history import estimate_tokens, truncate_middle
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Build and incrementally maintain message_chunks (needs migrations 8 and 9)
+MESSAGE_CHUNKS_ENABLED = os.getenv("MESSAGE_CHUNKS_ENABLED", "false").lower() == "true"
+# Token budget of one rendered window, including its thread header
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "320"))
+# A window never spans a silence longer than this - it would join two separate conversations
+CHUNK_MAX_GAP = timedelta(hours=float(os.getenv("CHUNK_MAX_GAP_HOURS", "6")))
+# A single message is cut to this share of the budget so the window keeps some context
+CHUNK_MAX_MESSAGE_SHARE = 0.5
+
+# messages columns loaded for chunking, in this order
+CHUNK_SOURCE_COLUMNS = "id, message_text, timestamp, thread_id, meta_data, source, from_matt_gpt, sent, created_at"
+
+
+@dataclass
+class ChunkWindow:
+    """One window of consecutive thread messages centred on an anchor message"""
+    anchor_index: int
+    start: int
+    end: int  # Inclusive
+    rows: List[tuple] = field(default_factory=list)
+    text: str = ""
+    token_count: int = 0
+
+    @property
+    def content_hash(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+
+
+def render_rows(rows: List[tuple], max_tokens: int = CHUNK_MAX_TOKENS) -> str:
+    """
+    Render chunk source rows exactly like retrieved thread-days
+
+    The result starts with the '\\n=== Thread X - date ===' header, so it is
+    never mistaken for a personality doc ('=== Title ===' at position 0).
+    """
+    from retrievers import format_context_messages
+
+    max_chars = max_tokens * 4 * CHUNK_MAX_MESSAGE_SHARE
+    context_rows = [
+        (truncate_middle(text, int(max_chars)), timestamp, thread_id, meta_data, source, from_matt_gpt)
+        for _, text, timestamp, thread_id, meta_data, source, from_matt_gpt, _, _ in rows
+    ]
+    return "\n".join(format_context_messages(context_rows)).rstrip()
+
+
+def build_windows(rows: List[tuple], max_tokens: int = CHUNK_MAX_TOKENS) -> List[ChunkWindow]:
+    """
+    Split one thread (rows in CHUNK_SOURCE_COLUMNS order, by timestamp) into windows
+
+    Each of Matt's messages not already covered by the previous window
+    anchors a new one, which grows alternately backwards and forwards until
+    the token budget or a CHUNK_MAX_GAP silence stops it. Consecutive
+    windows therefore overlap on the context between Matt's messages.
+    """
+    max_chars = max_tokens * 4 * CHUNK_MAX_MESSAGE_SHARE
+    costs = [estimate_tokens(truncate_middle(row[1], int(max_chars))) + 3 for row in rows]  # + sender prefix
+    header_cost = 16
+
+    windows: List[ChunkWindow] = []
+    for anchor, row in enumerate(rows):
+        if not row[7]:  # sent - Matt's message
+            continue
+        if windows and windows[-1].start <= anchor <= windows[-1].end:
+            continue
+
+        start = end = anchor
+        tokens = header_cost + costs[anchor]
+        grow_back = True
+        while True:
+            can_back = start > 0 and rows[start][2] - rows[start - 1][2] <= CHUNK_MAX_GAP \
+                and tokens + costs[start - 1] <= max_tokens
+            can_forward = end < len(rows) - 1 and rows[end + 1][2] - rows[end][2] <= CHUNK_MAX_GAP \
+                and tokens + costs[end + 1] <= max_tokens
+            if not can_back and not can_forward:
+                break
+            if can_back and (grow_back or not can_forward):
+                start -= 1
+                tokens += costs[start]
+            else:
+                end += 1
+                tokens += costs[end]
+            grow_back = not grow_back
+
+        window = ChunkWindow(anchor_index=anchor, start=start, end=end, rows=rows[start:end + 1])
+        window.text = render_rows(window.rows, max_tokens)
+        window.token_count = estimate_tokens(window.text)
+        windows.append(window)
+    return windows
+
+
+def rechunk_thread(cur, thread_id: str, embed=None) -> Dict[str, int]:
+    """
+    Rebuild one thread's chunks inside the caller's transaction
+
+    Chunks whose rendered text is unchanged keep their row and embedding, so
+    appending messages to a thread only embeds the windows that changed.
+
+    Args:
+        cur: psycopg cursor (pgvector registered)
+        embed: text -> embedding callable (default OpenRouterClient.generate_embedding)
+
+    Returns:
+        Counts of kept, added and deleted chunks
+    """
+    if embed is None:
+        from llm_client import OpenRouterClient
+        embed = OpenRouterClient().generate_embedding
+
+    # Serializes the API's ingest hook and the batch updater on the same thread
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"message_chunks:{thread_id}",))
+    cur.execute(f"""
+        SELECT {CHUNK_SOURCE_COLUMNS}
+        FROM messages
+        WHERE thread_id = %s
+        ORDER BY timestamp, id
+    """, (thread_id,))
+    rows = cur.fetchall()
+    windows = build_windows(rows)
+
+    cur.execute("SELECT id, content_hash FROM message_chunks WHERE thread_id = %s", (thread_id,))
+    existing = {content_hash: chunk_id for chunk_id, content_hash in cur.fetchall()}
+
+    wanted = {window.content_hash: window for window in windows}
+    stale_ids = [chunk_id for content_hash, chunk_id in existing.items() if content_hash not in wanted]
+    if stale_ids:
+        cur.execute("DELETE FROM message_chunks WHERE id = ANY(%s)", (stale_ids,))
+
+    added = 0
+    for content_hash, window in wanted.items():
+        if content_hash in existing:
+            continue
+        anchor = rows[window.anchor_index]
+        cur.execute("""
+            INSERT INTO message_chunks (id, thread_id, source, anchor_message_id, message_ids, start_time, end_time,
+                                        message_count, token_count, content_hash, text, embedding, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (thread_id, anchor_message_id) DO UPDATE SET
+                message_ids = EXCLUDED.message_ids, start_time = EXCLUDED.start_time, end_time = EXCLUDED.end_time,
+                message_count = EXCLUDED.message_count, token_count = EXCLUDED.token_count,
+                content_hash = EXCLUDED.content_hash, text = EXCLUDED.text, embedding = EXCLUDED.embedding,
+                created_at = EXCLUDED.created_at
+        """, (
+            uuid.uuid4(), thread_id, anchor[5], anchor[0], _json([str(row[0]) for row in window.rows]),
+            window.rows[0][2], window.rows[-1][2], len(window.rows), window.token_count,
+            content_hash, window.text, embed(window.text), datetime.utcnow(),
+        ))
+        added += 1
+
+    watermark = max((row[8] for row in rows), default=datetime.utcnow())
+    cur.execute("""
+        INSERT INTO message_chunk_threads (thread_id, source_watermark, chunk_count, chunked_at)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (thread_id) DO UPDATE SET
+            source_watermark = EXCLUDED.source_watermark,
+            chunk_count = EXCLUDED.chunk_count,
+            chunked_at = EXCLUDED.chunked_at
+    """, (thread_id, watermark, len(wanted), datetime.utcnow()))
+
+    counts = {"kept": len(wanted) - added, "added": added, "deleted": len(stale_ids)}
+    logger.debug(f"Re-chunked thread {thread_id}: {counts}")
+    return counts
+
+
+def _json(value: Any):
+    from psycopg.types.json import Json
+    return Json(value)
+
+
+def stale_threads(cur, limit: Optional[int] = None) -> List[str]:
+    """Threads with messages newer than their chunking watermark (or never chunked)"""
+    cur.execute(f"""
+        SELECT m.thread_id
+        FROM messages m
+        LEFT JOIN message_chunk_threads t ON t.thread_id = m.thread_id
+        WHERE m.thread_id IS NOT NULL
+        GROUP BY m.thread_id, t.source_watermark
+        HAVING t.source_watermark IS NULL OR MAX(m.created_at) > t.source_watermark
+        ORDER BY MAX(m.created_at)
+        {"LIMIT %s" if limit else ""}
+    """, (limit,) if limit else None)
+    return [row[0] for row in cur.fetchall()]
+
+
+def update_stale_chunks(conn_string: Optional[str] = None, limit: Optional[int] = None, embed=None) -> Dict[str, int]:
+    """Re-chunk every stale thread, one transaction per thread"""
+    import psycopg
+    from pgvector.psycopg import register_vector
+
+    conn_string = conn_string or os.getenv("DATABASE_URL")
+    totals = {"threads": 0, "kept": 0, "added": 0, "deleted": 0}
+    with psycopg.connect(conn_string) as conn:
+        register_vector(conn)
+        with conn.cursor() as cur:
+            threads = stale_threads(cur, limit)
+        conn.commit()
+        logger.info(f"{len(threads)} threads need (re-)chunking")
+
+        for thread_id in threads:
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    counts = rechunk_thread(cur, thread_id, embed=embed)
+            totals["threads"] += 1
+            for key, value in counts.items():
+                totals[key] += value
+            if totals["threads"] % 50 == 0:
+                logger.info(f"Chunked {totals['threads']}/{len(threads)} threads: {totals}")
+
+    logger.info(f"Chunk update complete: {totals}")
+    return totals
+
+
+def rechunk_thread_now(thread_id: str, conn_string: Optional[str] = None) -> Dict[str, int]:
+    """Re-chunk one thread in its own connection (ingest hook)"""
+    import psycopg
+    from pgvector.psycopg import register_vector
+
+    conn_string = conn_string or os.getenv("DATABASE_URL")
+    with psycopg.connect(conn_string) as conn:
+        register_vector(conn)
+        with conn.cursor() as cur:
+            return rechunk_thread(cur, thread_id)
+
+
+def search_chunks(cur, embedding: list, limit: int, where: str = "") -> List[tuple]:
+    """(id, thread_id, anchor_message_id, start_time, text, distance) rows, nearest first"""
+    from vector_index import STORAGE_FLOAT32, vector_search_sql
+
+    # message_chunks only carries the float32 column
+    sql, params = vector_search_sql(
+        "id, thread_id, anchor_message_id, start_time, text", "message_chunks", where, embedding, limit,
+        mode=STORAGE_FLOAT32
+    )
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def chunk_passages(rows: List[tuple]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Passages and passage-ref hits for search_chunks / load_chunks rows
+
+    Hits use the anchor message as message_id so they merge with message-mode
+    refs; chunk_id lets analytics re-render the exact window.
+    """
+    passages, hits = [], []
+    for chunk_id, thread_id, anchor_message_id, start_time, text, distance in rows:
+        passages.append(text)
+        hits.append({
+            "message_id": str(anchor_message_id),
+            "chunk_id": str(chunk_id),
+            "thread_id": thread_id,
+            "day": start_time.date().isoformat(),
+            "score": round(1.0 - float(distance), 4),
+        })
+    return passages, hits
+
+
+def load_chunks(cur, chunk_scores: Dict[str, float]) -> List[tuple]:
+    """Rows in search_chunks shape for known chunk ids, best score first (distance = 1 - score)"""
+    if not chunk_scores:
+        return []
+    cur.execute(
+        "SELECT id::text, thread_id, anchor_message_id, start_time, text FROM message_chunks WHERE id::text = ANY(%s)",
+        (list(chunk_scores),)
+    )
+    rows = [row + (1.0 - chunk_scores[row[0]],) for row in cur.fetchall()]
+    return sorted(rows, key=lambda row: row[-1])
@@ -0,0 +1,562 @@
+"""
+Schema Migration Service for Matt-GPT
+Versioned, lock-protected schema changes applied once, out of band, instead of on every worker boot
+"""
+
+import os
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Union
+
+from sqlalchemy import text
+
+from database import engine
+import models  # Tables created by later migrations
+from vector_index import (
+    EMBEDDING_TABLES, HNSW_INDEXES, MATRYOSHKA_DIMENSIONS, STORAGE_HALFVEC, STORAGE_MATRYOSHKA, derived_column,
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant shared by every process that migrates this database
+MIGRATION_LOCK_ID = 72_616_001
+
+Step = Union[str, Callable]
+
+
+@dataclass
+class Migration:
+    """
+    One schema version
+
+    Non-concurrent migrations run in a single transaction together with their
+    schema_migrations row. Concurrent migrations run each step in autocommit
+    mode (required by CREATE INDEX CONCURRENTLY) and are recorded afterwards,
+    so every step must be idempotent.
+    """
+    version: int
+    name: str
+    steps: List[Step]
+    concurrent: bool = False
+    # Indexes built by a concurrent migration; invalid leftovers from a failed build are dropped first
+    indexes: List[str] = field(default_factory=list)
+
+
+# Schema as it stood when the migration runner was introduced. Written out instead of
+# SQLModel.metadata.create_all so later model changes only ever reach a database through
+# their own migration; columns and indexes added since live in migrations 3 and 4.
+INITIAL_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS vector",
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id UUID NOT NULL,
+        source VARCHAR NOT NULL,
+        thread_id VARCHAR,
+        message_text VARCHAR NOT NULL,
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        sent BOOLEAN NOT NULL,
+        from_matt_gpt BOOLEAN NOT NULL,
+        embedding VECTOR(1536),
+        meta_data JSON,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_messages_from_matt_gpt ON messages (from_matt_gpt)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_sent ON messages (sent)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_source ON messages (source)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_thread_id ON messages (thread_id)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_timestamp ON messages (timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS personality_docs (
+        id UUID NOT NULL,
+        doc_type VARCHAR NOT NULL,
+        title VARCHAR NOT NULL,
+        content VARCHAR NOT NULL,
+        summary VARCHAR,
+        embedding VECTOR(1536),
+        meta_data JSON,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_personality_docs_doc_type ON personality_docs (doc_type)",
+    """
+    CREATE TABLE IF NOT EXISTS query_logs (
+        id UUID NOT NULL,
+        conversation_id UUID NOT NULL,
+        query_text VARCHAR NOT NULL,
+        response_text VARCHAR NOT NULL,
+        model_used VARCHAR NOT NULL,
+        context_used JSON,
+        tokens_used INTEGER NOT NULL,
+        latency_ms FLOAT NOT NULL,
+        ip_address VARCHAR,
+        user_agent VARCHAR,
+        meta_data JSON,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_query_logs_conversation_id ON query_logs (conversation_id)",
+    "CREATE INDEX IF NOT EXISTS ix_query_logs_created_at ON query_logs (created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS rag_analytics (
+        id UUID NOT NULL,
+        query_id UUID NOT NULL,
+        original_query VARCHAR NOT NULL,
+        expanded_queries JSON,
+        total_messages_retrieved INTEGER NOT NULL,
+        unique_messages_after_dedup INTEGER NOT NULL,
+        threads_reconstructed INTEGER NOT NULL,
+        messages_before_filtering INTEGER NOT NULL,
+        messages_after_filtering INTEGER NOT NULL,
+        filtering_ratio FLOAT NOT NULL,
+        raw_retrieved_context JSON,
+        filtered_context JSON,
+        query_expansion_ms FLOAT NOT NULL,
+        retrieval_ms FLOAT NOT NULL,
+        filtering_ms FLOAT NOT NULL,
+        total_rag_ms FLOAT NOT NULL,
+        context_relevance_score FLOAT,
+        fallback_used BOOLEAN NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_rag_analytics_created_at ON rag_analytics (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_rag_analytics_query_id ON rag_analytics (query_id)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_jobs (
+        id UUID NOT NULL,
+        status VARCHAR NOT NULL,
+        conversation_id UUID,
+        request JSON,
+        result JSON,
+        error_details VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        started_at TIMESTAMP WITHOUT TIME ZONE,
+        completed_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_chat_jobs_conversation_id ON chat_jobs (conversation_id)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_jobs_created_at ON chat_jobs (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_jobs_status ON chat_jobs (status)",
+    """
+    CREATE TABLE IF NOT EXISTS conversation_summaries (
+        conversation_id UUID NOT NULL,
+        summary VARCHAR NOT NULL,
+        summarized_through TIMESTAMP WITHOUT TIME ZONE,
+        turns_summarized INTEGER NOT NULL,
+        model_used VARCHAR,
+        updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (conversation_id)
+    )
+    """,
+]
+
+# Rows per committed UPDATE when filling messages.message_tsv for existing messages
+TSV_BACKFILL_BATCH_SIZE = int(os.getenv("TSV_BACKFILL_BATCH_SIZE", "5000"))
+
+
+def _backfill_message_tsv(conn):
+    """
+    Fill message_tsv for rows inserted before the trigger existed
+
+    Walks the primary key in batches on the autocommit connection, so every
+    batch commits on its own and only locks the rows it updates. Rows already
+    filled (by the trigger, or an interrupted earlier run) are skipped.
+    """
+    after = None
+    filled = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            text("SELECT id FROM messages WHERE (CAST(:after AS uuid) IS NULL OR id > :after) ORDER BY id LIMIT :limit"),
+            {"after": after, "limit": TSV_BACKFILL_BATCH_SIZE}
+        )]
+        if not ids:
+            break
+        filled += conn.execute(text("""
+            UPDATE messages SET message_tsv = to_tsvector('english', message_text)
+            WHERE id = ANY(:ids) AND message_tsv IS NULL
+        """), {"ids": ids}).rowcount
+        after = ids[-1]
+    logger.info(f"Backfilled message_tsv for {filled} messages")
+
+
+# Rows per committed UPDATE when filling derived embedding columns (embedding_half, ...) for existing rows
+DERIVED_BACKFILL_BATCH_SIZE = int(os.getenv("DERIVED_BACKFILL_BATCH_SIZE", "2000"))
+
+
+def _derived_column_steps(mode: str, dimensions: Optional[int] = None) -> List[Step]:
+    """
+    A vector_index storage mode's derived column on every embedding table, kept in
+    sync with `embedding` by a trigger. Nullable without a default: catalog-only.
+    """
+    column, column_type, expression = derived_column(mode, dimensions)
+    steps: List[Step] = [
+        f"""
+        CREATE OR REPLACE FUNCTION sync_{column}() RETURNS trigger AS $$
+        BEGIN
+            NEW.{column} := {expression.format(source="NEW.embedding")};
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+    ]
+    for table in EMBEDDING_TABLES:
+        steps += [
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}",
+            f"DROP TRIGGER IF EXISTS {table}_sync_{column} ON {table}",
+            f"""
+            CREATE TRIGGER {table}_sync_{column}
+            BEFORE INSERT OR UPDATE OF embedding ON {table}
+            FOR EACH ROW EXECUTE FUNCTION sync_{column}()
+            """,
+        ]
+    return steps
+
+
+def _backfill_derived_column(mode: str, dimensions: Optional[int] = None) -> Callable:
+    """
+    Step filling a derived column for rows embedded before its trigger existed
+
+    Same keyset walk as _backfill_message_tsv: each batch commits on its own
+    on the autocommit connection, and rows already filled are skipped.
+    """
+    column, _, expression = derived_column(mode, dimensions)
+
+    def backfill(conn):
+        for table in EMBEDDING_TABLES:
+            after = None
+            filled = 0
+            while True:
+                ids = [row[0] for row in conn.execute(
+                    text(f"SELECT id FROM {table} WHERE (CAST(:after AS uuid) IS NULL OR id > :after) ORDER BY id LIMIT :limit"),
+                    {"after": after, "limit": DERIVED_BACKFILL_BATCH_SIZE}
+                )]
+                if not ids:
+                    break
+                filled += conn.execute(text(f"""
+                    UPDATE {table} SET {column} = {expression.format(source="embedding")}
+                    WHERE id = ANY(:ids) AND embedding IS NOT NULL AND {column} IS NULL
+                """), {"ids": ids}).rowcount
+                after = ids[-1]
+            logger.info(f"Backfilled {column} for {filled} {table} rows")
+
+    return backfill
+
+
+def _hnsw_index_step(name: str) -> str:
+    table, column, opclass = HNSW_INDEXES[name]
+    return f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING hnsw ({column} {opclass})"
+
+
+COMPACT_EMBEDDING_INDEXES = [
+    "messages_embedding_half_idx", "personality_docs_embedding_half_idx",
+    "messages_embedding_bit_idx", "personality_docs_embedding_bit_idx",
+]
+MATRYOSHKA_EMBEDDING_INDEXES = ["messages_embedding_short_idx", "personality_docs_embedding_short_idx"]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "initial_schema", INITIAL_SCHEMA),
+    Migration(2, "hnsw_embedding_indexes", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_embedding_idx
+        ON messages USING hnsw (embedding vector_cosine_ops)
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS personality_docs_embedding_idx
+        ON personality_docs USING hnsw (embedding vector_cosine_ops)
+        """,
+    ], concurrent=True, indexes=["messages_embedding_idx", "personality_docs_embedding_idx"]),
+    Migration(3, "query_logs_conversation_created_at_index", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_query_logs_conversation_id_created_at
+        ON query_logs (conversation_id, created_at)
+        """,
+    ], concurrent=True, indexes=["ix_query_logs_conversation_id_created_at"]),
+    Migration(4, "rag_analytics_compact_storage", [
+        """
+        ALTER TABLE rag_analytics
+            ADD COLUMN IF NOT EXISTS storage_mode VARCHAR NOT NULL DEFAULT 'full',
+            ADD COLUMN IF NOT EXISTS passage_refs JSON,
+            ADD COLUMN IF NOT EXISTS filtered_passage_keys JSON,
+            ADD COLUMN IF NOT EXISTS context_blob BYTEA,
+            ADD COLUMN IF NOT EXISTS blob_codec VARCHAR
+        """,
+    ]),
+    Migration(5, "analytics_hourly_rollups", [
+        lambda conn: models.AnalyticsHourlyRollup.__table__.create(conn, checkfirst=True),
+    ]),
+    # Nullable column without a default: a catalog-only change, no table rewrite.
+    # The trigger fills it for new and edited messages; migration 7 backfills the rest.
+    Migration(6, "messages_full_text_column", [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS message_tsv tsvector",
+        """
+        CREATE OR REPLACE FUNCTION messages_message_tsv_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.message_tsv := to_tsvector('english', NEW.message_text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS messages_message_tsv_update ON messages",
+        """
+        CREATE TRIGGER messages_message_tsv_update
+        BEFORE INSERT OR UPDATE OF message_text ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_message_tsv_update()
+        """,
+    ]),
+    Migration(7, "messages_full_text_index", [
+        _backfill_message_tsv,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_message_tsv_idx
+        ON messages USING gin (message_tsv)
+        """,
+    ], concurrent=True, indexes=["messages_message_tsv_idx"]),
+    Migration(8, "message_chunks", [
+        lambda conn: models.MessageChunk.__table__.create(conn, checkfirst=True),
+        lambda conn: models.MessageChunkThread.__table__.create(conn, checkfirst=True),
+    ]),
+    Migration(9, "message_chunks_hnsw_index", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS message_chunks_embedding_idx
+        ON message_chunks USING hnsw (embedding vector_cosine_ops)
+        """,
+    ], concurrent=True, indexes=["message_chunks_embedding_idx"]),
+    Migration(10, "thread_centroids", [
+        lambda conn: models.ThreadDayCentroid.__table__.create(conn, checkfirst=True),
+        lambda conn: models.ThreadCentroid.__table__.create(conn, checkfirst=True),
+    ]),
+    Migration(11, "thread_centroid_indexes", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS thread_day_centroids_embedding_idx
+        ON thread_day_centroids USING hnsw (embedding_sum vector_cosine_ops)
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS thread_centroids_embedding_idx
+        ON thread_centroids USING hnsw (embedding_sum vector_cosine_ops)
+        """,
+        # Stage two of routed search, thread-day and hit-window context fetches
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_thread_id_timestamp
+        ON messages (thread_id, timestamp)
+        """,
+    ], concurrent=True, indexes=[
+        "thread_day_centroids_embedding_idx", "thread_centroids_embedding_idx", "ix_messages_thread_id_timestamp",
+    ]),
+    Migration(12, "passage_size_analytics", [
+        "ALTER TABLE rag_analytics ADD COLUMN IF NOT EXISTS passage_tokens JSON",
+        """
+        ALTER TABLE analytics_hourly_rollups
+            ADD COLUMN IF NOT EXISTS passage_count INTEGER,
+            ADD COLUMN IF NOT EXISTS passage_tokens_p50 FLOAT,
+            ADD COLUMN IF NOT EXISTS passage_tokens_p95 FLOAT,
+            ADD COLUMN IF NOT EXISTS passage_tokens_max INTEGER
+        """,
+    ]),
+    # created_at watermark polls: retrieval cache invalidation, vector engine and centroid syncs
+    Migration(13, "messages_created_at_index", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_created_at
+        ON messages (created_at)
+        """,
+    ], concurrent=True, indexes=["ix_messages_created_at"]),
+    # Keys of the rendered thread-day passage cache; one upsert per inserting statement, not per row
+    Migration(14, "thread_day_versions", [
+        lambda conn: models.ThreadDayVersion.__table__.create(conn, checkfirst=True),
+        """
+        CREATE OR REPLACE FUNCTION bump_thread_day_versions() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO thread_day_versions (thread_id, day, version)
+            SELECT thread_id, DATE(timestamp), 1 FROM new_messages
+            WHERE thread_id IS NOT NULL
+            GROUP BY thread_id, DATE(timestamp)
+            ON CONFLICT (thread_id, day) DO UPDATE SET version = thread_day_versions.version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS messages_bump_thread_day_versions ON messages",
+        """
+        CREATE TRIGGER messages_bump_thread_day_versions
+        AFTER INSERT ON messages
+        REFERENCING NEW TABLE AS new_messages
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_thread_day_versions()
+        """,
+    ]),
+    # Job leases: jobs whose owning worker died stop being renewed and are reclaimed
+    Migration(15, "chat_job_heartbeats", [
+        "ALTER TABLE chat_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP",
+    ]),
+    # halfvec copy of every embedding for VECTOR_STORAGE=halfvec|binary; the float32 column stays the source
+    Migration(16, "compact_embedding_columns", _derived_column_steps(STORAGE_HALFVEC)),
+    Migration(17, "compact_embedding_indexes", [
+        _backfill_derived_column(STORAGE_HALFVEC),
+        *[_hnsw_index_step(name) for name in COMPACT_EMBEDDING_INDEXES],
+    ], concurrent=True, indexes=COMPACT_EMBEDDING_INDEXES),
+    # Truncated, renormalized embeddings for VECTOR_STORAGE=matryoshka. The column type records the
+    # width searches use (vector_index.matryoshka_dimensions); a different width is a new migration
+    # dropping embedding_short and its indexes and re-running these steps with the new width.
+    Migration(18, "matryoshka_embedding_columns", _derived_column_steps(STORAGE_MATRYOSHKA, MATRYOSHKA_DIMENSIONS)),
+    Migration(19, "matryoshka_embedding_indexes", [
+        _backfill_derived_column(STORAGE_MATRYOSHKA, MATRYOSHKA_DIMENSIONS),
+        *[_hnsw_index_step(name) for name in MATRYOSHKA_EMBEDDING_INDEXES],
+    ], concurrent=True, indexes=MATRYOSHKA_EMBEDDING_INDEXES),
+    # Context reuse turns, so their answer quality can be compared with full retrievals
+    Migration(20, "rag_analytics_context_reused", [
+        "ALTER TABLE rag_analytics ADD COLUMN IF NOT EXISTS context_reused BOOLEAN NOT NULL DEFAULT false",
+    ]),
+]
+
+SCHEMA_VERSION = max(migration.version for migration in MIGRATIONS)
+
+
+class SchemaVersionError(RuntimeError):
+    """Raised at startup when the database is behind the code"""
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            duration_ms DOUBLE PRECISION
+        )
+    """))
+
+
+def get_schema_version(conn) -> int:
+    """Highest applied migration version (0 for a database that has never been migrated)"""
+    exists = conn.execute(text("SELECT to_regclass('public.schema_migrations')")).scalar()
+    if exists is None:
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+
+
+def get_applied_versions(conn) -> set:
+    exists = conn.execute(text("SELECT to_regclass('public.schema_migrations')")).scalar()
+    if exists is None:
+        return set()
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _run_step(conn, step: Step):
+    if callable(step):
+        step(conn)
+    else:
+        conn.execute(text(step))
+
+
+def _drop_invalid_indexes(conn, index_names: List[str]):
+    """Drop indexes left INVALID by an interrupted CREATE INDEX CONCURRENTLY"""
+    if not index_names:
+        return
+    invalid = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = ANY(:names)
+    """), {"names": index_names}).fetchall()
+    for (index_name,) in invalid:
+        logger.warning(f"Dropping invalid index {index_name} left by an interrupted build")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+
+
+def _apply(lock_conn, migration: Migration):
+    start = time.time()
+    logger.info(f"Applying migration {migration.version}: {migration.name}")
+
+    if migration.concurrent:
+        # Autocommit - each step is its own statement outside any transaction
+        _drop_invalid_indexes(lock_conn, migration.indexes)
+        for step in migration.steps:
+            _run_step(lock_conn, step)
+        duration_ms = (time.time() - start) * 1000
+        lock_conn.execute(
+            text("INSERT INTO schema_migrations (version, name, duration_ms) VALUES (:version, :name, :duration_ms)"),
+            {"version": migration.version, "name": migration.name, "duration_ms": duration_ms}
+        )
+    else:
+        with engine.begin() as conn:
+            for step in migration.steps:
+                _run_step(conn, step)
+            duration_ms = (time.time() - start) * 1000
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, duration_ms) VALUES (:version, :name, :duration_ms)"),
+                {"version": migration.version, "name": migration.name, "duration_ms": duration_ms}
+            )
+
+    logger.info(f"Migration {migration.version} applied in {duration_ms:.0f}ms")
+
+
+def apply_migrations(target: Optional[int] = None) -> List[int]:
+    """
+    Apply every pending migration up to `target` (default: latest)
+
+    Holds a session-level advisory lock for the whole run, so concurrent
+    callers (several release processes, a developer and CI) wait for each
+    other and then find nothing left to do.
+
+    Returns:
+        Versions that were applied by this call
+    """
+    target = target if target is not None else SCHEMA_VERSION
+    applied = []
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        logger.info("Waiting for migration lock...")
+        lock_conn.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+        try:
+            _ensure_migrations_table(lock_conn)
+            done = get_applied_versions(lock_conn)
+            pending = [m for m in MIGRATIONS if m.version not in done and m.version <= target]
+
+            if not pending:
+                logger.info(f"Schema is up to date (version {max(done) if done else 0})")
+            for migration in pending:
+                _apply(lock_conn, migration)
+                applied.append(migration.version)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+
+    return applied
+
+
+def migration_status() -> List[dict]:
+    """Applied/pending state of every known migration"""
+    with engine.connect() as conn:
+        done = get_applied_versions(conn)
+    return [
+        {"version": m.version, "name": m.name, "applied": m.version in done, "concurrent": m.concurrent}
+        for m in MIGRATIONS
+    ]
+
+
+def verify_schema_version():
+    """
+    Startup check: fail fast if the database hasn't been migrated to this code's version.
+    With AUTO_MIGRATE=true (local development) pending migrations are applied instead.
+    """
+    with engine.connect() as conn:
+        current = get_schema_version(conn)
+
+    if current >= SCHEMA_VERSION:
+        logger.info(f"Database schema version {current} (expected {SCHEMA_VERSION})")
+        return
+
+    if os.getenv("AUTO_MIGRATE", "false").lower() == "true":
+        logger.warning(f"Schema version {current} < {SCHEMA_VERSION}, applying migrations (AUTO_MIGRATE=true)")
+        apply_migrations()
+        return
+
+    raise SchemaVersionError(
+        f"Database schema version {current} is behind the required version {SCHEMA_VERSION}. "
+        f"Run 'python scripts/migrate.py upgrade' before starting the API."
+    )
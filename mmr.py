@@ -0,0 +1,100 @@
+"""
+MMR Service for Matt-GPT
+Maximal-marginal-relevance re-ranking of retrieved message hits
+"""
+
+import logging
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def fetch_message_embeddings(cur, message_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+    """
+    Embeddings of the given messages as float32 arrays
+
+    Fetched with psycopg's binary protocol, so pgvector hands back the raw
+    floats instead of formatting and re-parsing 1536 numbers per row.
+    """
+    message_ids = list(message_ids)
+    if not message_ids:
+        return {}
+    cur.execute(
+        "SELECT id::text, embedding FROM messages WHERE id = ANY(%s::uuid[]) AND embedding IS NOT NULL",
+        (message_ids,), binary=True
+    )
+    return {message_id: np.asarray(embedding, dtype=np.float32) for message_id, embedding in cur.fetchall()}
+
+
+def candidate_embeddings(cur, message_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+    """
+    Embeddings of MMR candidates, from the in-process vector engine when it is loaded
+
+    Only messages the engine hasn't synced yet are fetched from the database,
+    and only when there is a cursor (vector-only engine searches may run
+    without a connection); candidates left without an embedding are dropped
+    by diversify.
+    """
+    from vector_engine import get_vector_engine
+
+    message_ids = [str(message_id) for message_id in message_ids]
+    vector_engine = get_vector_engine()
+    if vector_engine is None:
+        return fetch_message_embeddings(cur, message_ids)
+
+    embeddings = vector_engine.get_embeddings(message_ids)
+    missing = [message_id for message_id in message_ids if message_id not in embeddings]
+    if missing and cur is not None:
+        embeddings.update(fetch_message_embeddings(cur, missing))
+    return embeddings
+
+
+def mmr_order(relevance: np.ndarray, embeddings: np.ndarray, k: int, mmr_lambda: float) -> List[int]:
+    """
+    Greedy MMR: indexes of up to k candidates, each maximising
+    mmr_lambda * relevance - (1 - mmr_lambda) * max cosine similarity to those already picked
+
+    Args:
+        relevance: (n,) similarity of each candidate to the query
+        embeddings: (n, d) candidate embeddings; all-zero rows count as unlike everything
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1.0, norms)
+    similarity = unit @ unit.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, n):
+        scores = np.where(available, mmr_lambda * relevance - (1.0 - mmr_lambda) * redundancy, -np.inf)
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        np.maximum(redundancy, similarity[pick], out=redundancy)
+    return selected
+
+
+def diversify(candidates: Sequence[Tuple[str, float]], embeddings: Dict[str, np.ndarray], k: int,
+              mmr_lambda: float) -> List[str]:
+    """
+    MMR-ordered ids of the k most useful (message_id, relevance) candidates
+
+    Candidates without an embedding (e.g. deleted since the search) are
+    dropped; relevance is the hit's similarity score.
+    """
+    candidates = [(message_id, score) for message_id, score in candidates if message_id in embeddings]
+    if not candidates:
+        return []
+    relevance = np.array([score for _, score in candidates], dtype=np.float32)
+    matrix = np.stack([embeddings[message_id] for message_id, _ in candidates])
+    order = mmr_order(relevance, matrix, k, mmr_lambda)
+    logger.debug(f"MMR (lambda={mmr_lambda}) kept {len(order)} of {len(candidates)} candidates")
+    return [candidates[i][0] for i in order]
@@ -1,6 +1,7 @@
 from sqlmodel import Field, SQLModel, Column, JSON
+from sqlalchemy import Index, LargeBinary
 from pgvector.sqlalchemy import Vector
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, List
 import uuid
 
@@ -18,6 +19,9 @@ class Message(SQLModel, table=True):
     embedding: Optional[list[float]] = Field(
         default=None, sa_column=Column(Vector(1536))  # OpenAI text-embedding-3-small
     )
+    # embedding_half halfvec(1536) and embedding_short vector(256) columns are trigger-maintained from
+    # embedding and only read by raw SQL searches (migrations 16-19, vector_index.vector_search_sql)
+    # Trigger-maintained message_tsv tsvector column (migrations 6-7) backs the full-text leg of hybrid_search
     meta_data: dict = Field(default={}, sa_column=Column(JSON))
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -40,6 +44,10 @@ class PersonalityDoc(SQLModel, table=True):
 class QueryLog(SQLModel, table=True):
     """Track all queries and responses for analysis"""
     __tablename__ = "query_logs"
+    __table_args__ = (
+        # Conversation history lookups and pagination
+        Index("ix_query_logs_conversation_id_created_at", "conversation_id", "created_at"),
+    )
 
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     conversation_id: uuid.UUID = Field(index=True)  # NEW: Track conversation continuity
@@ -74,10 +82,18 @@ class RagAnalytics(SQLModel, table=True):
     messages_after_filtering: int
     filtering_ratio: float  # after/before
     
-    # Context data for analysis
+    # Context data for analysis (empty in 'refs' storage mode)
     raw_retrieved_context: List[str] = Field(sa_column=Column(JSON))
     filtered_context: List[str] = Field(sa_column=Column(JSON))
     
+    # Compact storage: references instead of rendered passage text
+    storage_mode: str = Field(default="full")  # 'full' or 'refs'
+    passage_refs: Optional[dict] = Field(default=None, sa_column=Column(JSON))  # message ids, thread-days, doc ids with scores
+    filtered_passage_keys: Optional[List[str]] = Field(default=None, sa_column=Column(JSON))  # analytics_storage.passage_keys of the filtered passages
+    passage_tokens: Optional[List[int]] = Field(default=None, sa_column=Column(JSON))  # Estimated size of each raw conversation passage
+    context_blob: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))  # Sampled compressed full capture
+    blob_codec: Optional[str] = None  # 'zstd' or 'zlib'
+    
     # Performance timing
     query_expansion_ms: float
     retrieval_ms: float
@@ -87,5 +103,138 @@ class RagAnalytics(SQLModel, table=True):
     # Quality metrics
     context_relevance_score: Optional[float] = None
     fallback_used: bool = Field(default=False)  # Whether enhanced RAG failed and fell back
+    context_reused: bool = Field(default=False)  # Follow-up turn: filtered delta merged with the conversation's cached passages
     
-    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+class ChatJob(SQLModel, table=True):
+    """Asynchronous chat jobs submitted via POST /chat/jobs"""
+    __tablename__ = "chat_jobs"
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    status: str = Field(default="queued", index=True)  # 'queued', 'running', 'succeeded', 'failed'
+    conversation_id: Optional[uuid.UUID] = Field(default=None, index=True)
+    request: dict = Field(default={}, sa_column=Column(JSON))  # ChatRequest without the API key
+    result: Optional[dict] = Field(default=None, sa_column=Column(JSON))  # Serialized ChatResponse
+    error_details: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None  # Renewed by the owning worker while queued or running
+
+
+class ConversationSummary(SQLModel, table=True):
+    """Rolling summary of the conversation turns that fell out of the verbatim history window"""
+    __tablename__ = "conversation_summaries"
+
+    conversation_id: uuid.UUID = Field(primary_key=True)
+    summary: str = Field(default="")
+    summarized_through: Optional[datetime] = None  # created_at of the last QueryLog folded in
+    turns_summarized: int = Field(default=0)
+    model_used: Optional[str] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class AnalyticsHourlyRollup(SQLModel, table=True):
+    """Hourly aggregates of query_logs and rag_analytics, maintained by analytics_maintenance.refresh_rollups"""
+    __tablename__ = "analytics_hourly_rollups"
+
+    bucket_start: datetime = Field(primary_key=True)  # Start of the hour (UTC)
+
+    # From query_logs
+    request_count: Optional[int] = None
+    conversation_count: Optional[int] = None
+    total_tokens: Optional[int] = None
+    avg_tokens: Optional[float] = None
+    latency_p50_ms: Optional[float] = None
+    latency_p95_ms: Optional[float] = None
+    latency_p99_ms: Optional[float] = None
+
+    # From rag_analytics (enhanced RAG requests only)
+    rag_request_count: Optional[int] = None
+    fallback_count: Optional[int] = None
+    fallback_rate: Optional[float] = None
+    expansion_p50_ms: Optional[float] = None
+    expansion_p95_ms: Optional[float] = None
+    retrieval_p50_ms: Optional[float] = None
+    retrieval_p95_ms: Optional[float] = None
+    filtering_p50_ms: Optional[float] = None
+    filtering_p95_ms: Optional[float] = None
+    rag_total_p50_ms: Optional[float] = None
+    rag_total_p95_ms: Optional[float] = None
+    passage_count: Optional[int] = None  # Conversation passages across all rag_analytics rows of the hour
+    passage_tokens_p50: Optional[float] = None
+    passage_tokens_p95: Optional[float] = None
+    passage_tokens_max: Optional[int] = None
+
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class MessageChunk(SQLModel, table=True):
+    """Token-bounded conversation window around one of Matt's messages, rendered and embedded for retrieval"""
+    __tablename__ = "message_chunks"
+    __table_args__ = (
+        Index("ix_message_chunks_thread_id_anchor", "thread_id", "anchor_message_id", unique=True),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    thread_id: str = Field(index=True)
+    source: str = Field(index=True)
+    anchor_message_id: uuid.UUID  # Matt's message the window is centred on
+    message_ids: List[str] = Field(default=[], sa_column=Column(JSON))  # Window members in order
+    start_time: datetime
+    end_time: datetime
+    message_count: int
+    token_count: int  # Estimated tokens of the rendered text
+    content_hash: str  # Of the rendered text; unchanged chunks keep their embedding on re-chunking
+    text: str  # Rendered like retrievers.format_context_messages
+    embedding: Optional[list[float]] = Field(
+        default=None, sa_column=Column(Vector(1536))
+    )
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class MessageChunkThread(SQLModel, table=True):
+    """Per-thread chunking watermark; threads with newer messages are re-chunked"""
+    __tablename__ = "message_chunk_threads"
+
+    thread_id: str = Field(primary_key=True)
+    source_watermark: datetime  # MAX(messages.created_at) of the thread when it was chunked
+    chunk_count: int = Field(default=0)
+    chunked_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ThreadDayCentroid(SQLModel, table=True):
+    """Sum of one thread-day's message embeddings - its cosine direction is the centroid's (see thread_centroids)"""
+    __tablename__ = "thread_day_centroids"
+
+    thread_id: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    embedding_sum: Optional[list[float]] = Field(
+        default=None, sa_column=Column(Vector(1536))
+    )
+    message_count: int
+    source_watermark: datetime  # MAX(messages.created_at) aggregated
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class ThreadCentroid(SQLModel, table=True):
+    """Sum of all of a thread's message embeddings, derived from its thread-day rows"""
+    __tablename__ = "thread_centroids"
+
+    thread_id: str = Field(primary_key=True)
+    embedding_sum: Optional[list[float]] = Field(
+        default=None, sa_column=Column(Vector(1536))
+    )
+    message_count: int
+    day_count: int
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ThreadDayVersion(SQLModel, table=True):
+    """Insert counter per thread-day, bumped by the messages_bump_thread_day_versions trigger (migration 14)"""
+    __tablename__ = "thread_day_versions"
+
+    thread_id: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    version: int = Field(default=0)  # Thread-days with no row are version 0
@@ -0,0 +1,307 @@
+"""
+Retrieval Cache Service for Matt-GPT
+Per-worker cache of retrieval results, invalidated by new messages in the thread-days they cover
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, FrozenSet, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from retrieval_options import RetrievalOptions
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+KEY_TEXT = "text"
+KEY_EMBEDDING = "embedding"
+CACHE_KEY_MODES = (KEY_TEXT, KEY_EMBEDDING)
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+# 'text': normalized question text; 'embedding': query embedding rounded to 1/EMBEDDING_KEY_SCALE
+RETRIEVAL_CACHE_KEY = os.getenv("RETRIEVAL_CACHE_KEY", KEY_TEXT)
+EMBEDDING_KEY_SCALE = 64
+
+# Messages created this long before an entry was computed may still have been uncommitted at the time
+RETRIEVAL_CACHE_COMMIT_LAG = timedelta(seconds=float(os.getenv("RETRIEVAL_CACHE_COMMIT_LAG_SECONDS", "60")))
+
+PERSONALITY_DOCS_FINGERPRINT_SQL = """
+SELECT COUNT(*), md5(COALESCE(string_agg(id::text || md5(title || content), ',' ORDER BY id), ''))
+FROM personality_docs
+"""
+
+NEW_THREAD_DAYS_SQL = """
+SELECT thread_id, DATE(timestamp) AS day, MAX(created_at)
+FROM messages
+WHERE created_at > :since AND thread_id IS NOT NULL
+GROUP BY thread_id, DATE(timestamp)
+"""
+
+
+@dataclass
+class CachedRetrieval:
+    """One retrieval result and the thread-days its passages were rendered from"""
+    passages: List[str]
+    passage_refs: dict
+    thread_days: FrozenSet[Tuple[str, date]]
+    computed_at: datetime  # UTC, compared with messages.created_at
+    expires_at: float  # time.monotonic()
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def ref_thread_days(refs: dict) -> FrozenSet[Tuple[str, date]]:
+    """Every (thread_id, day) the message refs' passages span, including multi-day context windows"""
+    thread_days: Set[Tuple[str, date]] = set()
+    for hit in refs.get("messages", []):
+        if not hit.get("thread_id"):
+            continue
+        if hit.get("start") and hit.get("end"):
+            day = datetime.fromisoformat(hit["start"]).date()
+            last = datetime.fromisoformat(hit["end"]).date()
+            while day <= last:
+                thread_days.add((hit["thread_id"], day))
+                day += timedelta(days=1)
+        elif hit.get("day"):
+            thread_days.add((hit["thread_id"], date.fromisoformat(hit["day"])))
+    return frozenset(thread_days)
+
+
+class RetrievalResultCache:
+    """
+    LRU + TTL cache of (passages, passage refs) per question and retrieval settings
+
+    An entry is dropped as soon as a message lands in one of the thread-days
+    its passages came from, and everything is dropped when the personality
+    docs change. Writes from any process (other workers, import scripts) are
+    picked up by polling messages.created_at at most every sync_seconds; writes
+    from this worker are applied immediately via note_message(). New messages
+    in other thread-days can't change the cached passages, only whether a
+    different thread would now rank higher - that is what the TTL bounds.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 900.0, sync_seconds: float = 5.0,
+                 key_mode: str = KEY_TEXT, enabled: bool = True):
+        if key_mode not in CACHE_KEY_MODES:
+            logger.warning(f"Unknown RETRIEVAL_CACHE_KEY '{key_mode}', using '{KEY_TEXT}'")
+            key_mode = KEY_TEXT
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sync_seconds = sync_seconds
+        self.key_mode = key_mode
+        self.enabled = enabled
+
+        self._entries: "OrderedDict[Hashable, CachedRetrieval]" = OrderedDict()
+        self._by_thread_day: Dict[Tuple[str, date], Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._last_sync = 0.0
+        self._watermark = datetime.utcnow()
+        self._docs_fingerprint: Optional[Tuple[int, str]] = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidated = 0
+        self.uncacheable = 0
+        self.clears = 0
+        self.sync_failures = 0
+
+        logger.info(f"Retrieval cache initialized: enabled={enabled}, max_entries={max_entries}, "
+                    f"ttl={ttl_seconds}s, key={key_mode}")
+
+    @classmethod
+    def from_env(cls) -> "RetrievalResultCache":
+        """Build a cache from RETRIEVAL_CACHE_* environment variables"""
+        return cls(
+            max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1000")),
+            ttl_seconds=float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "900")),
+            sync_seconds=float(os.getenv("RETRIEVAL_CACHE_SYNC_SECONDS", "5")),
+            key_mode=RETRIEVAL_CACHE_KEY,
+            enabled=RETRIEVAL_CACHE_ENABLED,
+        )
+
+    def make_key(self, question: str, options: RetrievalOptions, scope: str,
+                 embedding: Optional[list] = None) -> Hashable:
+        """
+        Cache key for a question under the given retrieval settings
+
+        Args:
+            scope: which pipeline produced the result (e.g. 'enhanced' or 'standard')
+            embedding: the question's embedding, required for embedding keys; the cache
+                       never calls the embedding API itself. Without one the text key is used.
+        """
+        if self.key_mode == KEY_EMBEDDING and embedding is not None:
+            quantized = np.round(np.asarray(embedding, dtype=np.float32) * EMBEDDING_KEY_SCALE).astype(np.int8)
+            return (KEY_EMBEDDING, hashlib.sha256(quantized.tobytes()).hexdigest(), scope, options)
+        digest = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+        return (KEY_TEXT, digest, scope, options)
+
+    def get(self, key: Hashable) -> Optional[CachedRetrieval]:
+        if not self.enabled:
+            return None
+        self._maybe_sync()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def put(self, key: Hashable, passages: List[str], passage_refs: Optional[dict], computed_at: datetime):
+        """
+        Store a retrieval result
+
+        Args:
+            computed_at: UTC time retrieval started; messages created later invalidate the entry
+        """
+        if not self.enabled:
+            return
+        if passage_refs is None:
+            # Without refs the entry's thread-days are unknown and it could never be invalidated
+            self.uncacheable += 1
+            return
+
+        entry = CachedRetrieval(
+            passages=list(passages),
+            passage_refs=passage_refs,
+            thread_days=ref_thread_days(passage_refs),
+            computed_at=computed_at,
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            for thread_day in entry.thread_days:
+                self._by_thread_day.setdefault(thread_day, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+
+    def _remove(self, key: Hashable):
+        """Drop one entry and its thread-day index links (caller holds the lock)"""
+        entry = self._entries.pop(key)
+        for thread_day in entry.thread_days:
+            keys = self._by_thread_day.get(thread_day)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_thread_day[thread_day]
+
+    def invalidate_thread_day(self, thread_id: str, day: date, created_at: datetime) -> int:
+        """Drop entries covering the thread-day that may have been computed before a message created at created_at"""
+        with self._lock:
+            stale = [
+                key for key in self._by_thread_day.get((thread_id, day), ())
+                if self._entries[key].computed_at < created_at + RETRIEVAL_CACHE_COMMIT_LAG
+            ]
+            for key in stale:
+                self._remove(key)
+            self.invalidated += len(stale)
+        return len(stale)
+
+    def note_message(self, thread_id: Optional[str], timestamp: datetime, created_at: Optional[datetime] = None):
+        """Apply a message written by this worker without waiting for the next sync"""
+        if self.enabled and thread_id:
+            self.invalidate_thread_day(thread_id, timestamp.date(), created_at or datetime.utcnow())
+
+    def clear(self, reason: str = ""):
+        with self._lock:
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._by_thread_day.clear()
+            self.clears += 1
+        logger.info(f"Retrieval cache cleared ({dropped} entries){': ' + reason if reason else ''}")
+
+    def sync(self):
+        """Invalidate from messages created since the last sync and from personality doc changes"""
+        from database import engine
+
+        since = self._watermark - RETRIEVAL_CACHE_COMMIT_LAG
+        polled_at = datetime.utcnow()
+        with engine.connect() as conn:
+            fingerprint = tuple(conn.execute(text(PERSONALITY_DOCS_FINGERPRINT_SQL)).one())
+            thread_days = conn.execute(text(NEW_THREAD_DAYS_SQL), {"since": since}).all() if self._entries else []
+        if not self._entries:
+            # Nothing to invalidate; entries computed from now on can't predate older messages
+            self._watermark = polled_at
+
+        if self._docs_fingerprint is not None and fingerprint != self._docs_fingerprint:
+            self.clear("personality docs changed")
+        self._docs_fingerprint = fingerprint
+
+        invalidated = 0
+        for thread_id, day, created_at in thread_days:
+            invalidated += self.invalidate_thread_day(thread_id, day, created_at)
+            self._watermark = max(self._watermark, created_at)
+        if invalidated:
+            logger.debug(f"Retrieval cache: {invalidated} entries invalidated by {len(thread_days)} updated thread-days")
+        self._last_sync = time.monotonic()
+
+    def _maybe_sync(self):
+        if time.monotonic() - self._last_sync < self.sync_seconds:
+            return
+        # One thread polls; concurrent lookups keep using the current entries
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self.sync()
+        except Exception as e:
+            # Can't see writes any more - stop serving possibly stale entries until a sync succeeds
+            self._last_sync = time.monotonic()
+            self.sync_failures += 1
+            self.clear(f"sync failed: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "key": self.key_mode,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "thread_days_tracked": len(self._by_thread_day),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "invalidated": self.invalidated,
+            "uncacheable": self.uncacheable,
+            "clears": self.clears,
+            "sync_failures": self.sync_failures,
+        }
+
+
+_retrieval_cache: Optional[RetrievalResultCache] = None
+
+
+def get_retrieval_cache() -> RetrievalResultCache:
+    """This worker's retrieval cache"""
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        _retrieval_cache = RetrievalResultCache.from_env()
+    return _retrieval_cache
@@ -0,0 +1,81 @@
+"""
+Retrieval Options Service for Matt-GPT
+Per-request retrieval tuning with environment defaults
+"""
+
+import os
+import logging
+from dataclasses import dataclass, fields, replace
+from typing import Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# What a message search returns: single messages expanded to thread-days, or precomputed message_chunks windows
+UNIT_MESSAGES = "messages"
+UNIT_CHUNKS = "chunks"
+RETRIEVAL_UNITS = (UNIT_MESSAGES, UNIT_CHUNKS)
+
+
+@dataclass(frozen=True)
+class RetrievalOptions:
+    """
+    Knobs a client may override per request (ChatRequest.retrieval)
+
+    Frozen and hashable so it can be part of retrieval cache keys.
+    """
+    # Reciprocal rank fusion of the vector and full-text legs; lexical_weight=0 disables the full-text leg.
+    # Off by default until an eval shows fused ranking beats vector-only for this corpus
+    vector_weight: float = 1.0
+    lexical_weight: float = 0.0
+    rrf_k: int = 60
+    unit: str = UNIT_MESSAGES
+    # > 0: two-stage search over the messages of the nearest N thread(-day) centroids instead of the flat index
+    route_top_n: int = 0
+    # Context around each message hit: ±N messages and/or ±T minutes (0 = unbounded), capped at
+    # context_max_tokens per hit; context_messages = context_minutes = 0 (the default) expands hits to
+    # whole thread-days, which are served from the rendered thread-day cache
+    context_messages: int = 0
+    context_minutes: int = 0
+    context_max_tokens: int = 600
+    # Maximal-marginal-relevance re-ranking of message hits before context is fetched: pick from the top
+    # mmr_pool_size candidates by mmr_lambda * relevance - (1 - mmr_lambda) * redundancy; 1.0 (the default)
+    # disables it
+    mmr_lambda: float = 1.0
+    mmr_pool_size: int = 40
+
+    @classmethod
+    def from_env(cls) -> "RetrievalOptions":
+        return cls(
+            vector_weight=float(os.getenv("RETRIEVAL_VECTOR_WEIGHT", "1.0")),
+            lexical_weight=float(os.getenv("RETRIEVAL_LEXICAL_WEIGHT", "0")),
+            rrf_k=int(os.getenv("RETRIEVAL_RRF_K", "60")),
+            unit=os.getenv("RETRIEVAL_UNIT", UNIT_MESSAGES),
+            route_top_n=int(os.getenv("RETRIEVAL_ROUTE_TOP_N", "0")),
+            context_messages=int(os.getenv("RETRIEVAL_CONTEXT_MESSAGES", "0")),
+            context_minutes=int(os.getenv("RETRIEVAL_CONTEXT_MINUTES", "0")),
+            context_max_tokens=int(os.getenv("RETRIEVAL_CONTEXT_MAX_TOKENS", "600")),
+            mmr_lambda=float(os.getenv("RETRIEVAL_MMR_LAMBDA", "1.0")),
+            mmr_pool_size=int(os.getenv("RETRIEVAL_MMR_POOL_SIZE", "40")),
+        )
+
+    def with_overrides(self, overrides: Optional[dict]) -> "RetrievalOptions":
+        """Copy with the non-None values from `overrides` applied (unknown keys are rejected)"""
+        if not overrides:
+            return self
+        known = {f.name for f in fields(self)}
+        unknown = set(overrides) - known
+        if unknown:
+            raise ValueError(f"Unknown retrieval options: {', '.join(sorted(unknown))}")
+        return replace(self, **{key: value for key, value in overrides.items() if value is not None})
+
+    @property
+    def hybrid(self) -> bool:
+        return self.lexical_weight > 0
+
+    @property
+    def mmr(self) -> bool:
+        return self.mmr_lambda < 1.0
+
+
+DEFAULT_RETRIEVAL_OPTIONS = RetrievalOptions.from_env()
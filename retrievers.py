@@ -1,5 +1,6 @@
 import dspy
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from collections import defaultdict
 import logging
 import numpy as np
 from pgvector.psycopg import register_vector
@@ -7,6 +8,15 @@ import psycopg
 from datetime import datetime, timedelta
 from database import get_session
 from models import Message, PersonalityDoc
+from vector_index import apply_search_settings, ensure_shortlist_ef_search, vector_search_sql
+from vector_engine import get_vector_engine
+from hybrid_search import LEG_LEXICAL, LEG_VECTOR, hybrid_search_sql, lexical_search_sql, fuse_rows, tag_rows
+from retrieval_options import DEFAULT_RETRIEVAL_OPTIONS, UNIT_CHUNKS, RetrievalOptions
+from message_chunks import chunk_passages, search_chunks
+from thread_centroids import routed_search_sql
+from context_windows import build_hit_windows, window_bounds, window_ref, windowing_enabled
+from mmr import candidate_embeddings, diversify
+from thread_day_cache import render_thread_days
 from sqlmodel import select
 from sqlalchemy import text
 
@@ -21,6 +31,145 @@ def get_current_trace():
     return None
 
 
+def filter_sender_name(display_name: str, phone_number: str = "") -> str:
+    """Filter sender names to only show family members, others become 'Someone:'"""
+    if not display_name:
+        display_name = phone_number
+    
+    # Replace Sisterr<3 with Danielle Brooks
+    if display_name == "Sisterr<3":
+        display_name = "Danielle Brooks"
+    
+    # Family names to keep
+    family_names = {"Natalie Brooks", "Sarah Brooks", "Mom", "Dad", "Danielle Brooks"}
+    
+    if display_name in family_names:
+        return display_name
+    else:
+        return "Someone"
+
+
+def fetch_thread_day_messages(cur, thread_dates: Iterable[Tuple[str, Any]]) -> List[Tuple]:
+    """Fetch every message of each (thread_id, date) combination in format_context_messages row shape"""
+    all_context_messages = []
+    for thread_id, date in thread_dates:
+        context_query = """
+        SELECT message_text, timestamp, thread_id, meta_data, source, from_matt_gpt
+        FROM messages
+        WHERE thread_id = %s 
+        AND DATE(timestamp) = %s
+        ORDER BY timestamp
+        """
+        cur.execute(context_query, (thread_id, date))
+        thread_messages = cur.fetchall()
+        all_context_messages.extend(thread_messages)
+        logger.debug(f"Retrieved {len(thread_messages)} messages from thread {thread_id} on {date}")
+    return all_context_messages
+
+
+def format_context_messages(all_context_messages: List[Tuple]) -> List[str]:
+    """
+    Format (message_text, timestamp, thread_id, meta_data, source, from_matt_gpt) rows
+    into context lines grouped under '=== Thread X - date ===' headers
+    """
+    # Group and format messages by thread, date, and source type
+    grouped_messages = defaultdict(list)
+    
+    for text, timestamp, thread_id, meta_data, source, from_matt_gpt in all_context_messages:
+        date_str = timestamp.date().strftime("%Y-%m-%d")
+        
+        # Determine sender name based on message source
+        if source == "matt-gpt conversation":
+            # Matt-GPT conversation message
+            if from_matt_gpt:
+                sender_name = "Matt"
+            else:
+                sender_name = "User"
+            key = f"Matt-GPT Conversation {thread_id[-5:]} - {date_str}"
+        else:
+            # Text/Slack message
+            if meta_data and isinstance(meta_data, dict):
+                display_name = meta_data.get('display_name', '')
+                sender_name = filter_sender_name(display_name)
+            else:
+                sender_name = "Unknown"
+            key = f"Thread {thread_id} - {date_str}"
+        
+        grouped_messages[key].append((timestamp, text, sender_name, source))
+
+    # Format chronologically with thread/date headers
+    formatted = []
+    for thread_date, messages in sorted(grouped_messages.items()):
+        formatted.append(f"\n=== {thread_date} ===")
+        for timestamp, text, sender_name, source in sorted(messages):
+            formatted.append(f"{sender_name}: {text}")
+        formatted.append("")  # Add blank line between groups
+
+    logger.debug(f"Formatted {len(formatted)} message contexts in {len(grouped_messages)} thread/date groups")
+    return formatted
+
+
+MESSAGE_SEARCH_COLUMNS = "id, thread_id, message_text, timestamp"
+
+
+def search_messages(
+    cur,
+    embedding: list,
+    limit: int,
+    where: str,
+    engine_filters: Dict[str, Any],
+    query_text: Optional[str] = None,
+    options: RetrievalOptions = DEFAULT_RETRIEVAL_OPTIONS,
+) -> List[Tuple]:
+    """
+    Top `limit` messages as (id, thread_id, message_text, timestamp, distance) rows
+
+    Vector-only unless options enable the full-text leg and query_text is
+    given, in which case both legs are ranked and merged with reciprocal rank
+    fusion. With the in-process vector engine the vector leg runs in memory
+    (message_text is None for those rows) and `cur` is only used for the
+    full-text leg, so it may be None for vector-only searches. Otherwise
+    options.route_top_n > 0 swaps the flat vector leg for a two-stage search
+    routed through the nearest thread centroids.
+
+    Args:
+        where: SQL conditions starting with AND
+        engine_filters: the same conditions as InProcessVectorEngine.search keyword arguments
+    """
+    vector_engine = get_vector_engine()
+    hybrid = bool(query_text) and options.hybrid
+    candidate_limit = limit * 2 if hybrid else limit
+
+    if vector_engine is not None:
+        vector_rows = [
+            (message_id, thread_id, None, timestamp, distance)
+            for message_id, thread_id, timestamp, distance
+            in vector_engine.search(embedding, candidate_limit, **engine_filters)
+        ]
+        if not hybrid:
+            return vector_rows
+        sql, params = lexical_search_sql(MESSAGE_SEARCH_COLUMNS, "messages", where, query_text, embedding, candidate_limit)
+        cur.execute(sql, params)
+        lexical_rows = [row[:-1] for row in cur.fetchall()]  # Drop lexical_rank
+        return fuse_rows(tag_rows(LEG_VECTOR, vector_rows) + tag_rows(LEG_LEXICAL, lexical_rows), options, limit)
+
+    if options.route_top_n > 0:
+        vector_query = routed_search_sql(MESSAGE_SEARCH_COLUMNS, where, embedding, candidate_limit, options.route_top_n)
+    else:
+        vector_query = vector_search_sql(MESSAGE_SEARCH_COLUMNS, "messages", where, embedding, candidate_limit)
+        ensure_shortlist_ef_search(cur, candidate_limit)
+
+    if not hybrid:
+        cur.execute(*vector_query)
+        return cur.fetchall()
+
+    # Both legs in one round-trip
+    sql, params = hybrid_search_sql(MESSAGE_SEARCH_COLUMNS, "messages", where, embedding, query_text, limit,
+                                    candidate_limit, vector_query=vector_query)
+    cur.execute(sql, params)
+    return fuse_rows(cur.fetchall(), options, limit)
+
+
 class PostgreSQLVectorRetriever(dspy.Retrieve):
     """Custom retriever using PostgreSQL with pgvector"""
 
@@ -30,7 +179,7 @@ class PostgreSQLVectorRetriever(dspy.Retrieve):
         self.k = k
         logger.info(f"Initializing PostgreSQL Vector Retriever with k={k}")
 
-    def forward(self, query: str, **kwargs) -> dspy.Prediction:
+    def forward(self, query: str, message_limit: int = 15, retrieval_options: Optional[RetrievalOptions] = None, **kwargs) -> dspy.Prediction:
         """Retrieve relevant passages from PostgreSQL"""
         logger.info(f"Retrieving context for query: {query[:100]}...")
         
@@ -46,13 +195,20 @@ class PostgreSQLVectorRetriever(dspy.Retrieve):
         try:
             with psycopg.connect(self.conn_string) as conn:
                 register_vector(conn)
+                apply_search_settings(conn)
                 logger.debug("Connected to PostgreSQL with pgvector")
 
                 # 1. Find relevant messages with context
                 logger.debug("Retrieving relevant messages with context...")
-                messages = self._retrieve_messages_with_context(
-                    conn, query_embedding, limit=15, context_window=10
-                )
+                options = retrieval_options or DEFAULT_RETRIEVAL_OPTIONS
+                if options.unit == UNIT_CHUNKS:
+                    # Precomputed windows: one query, passages ready to use
+                    with conn.cursor() as cur:
+                        messages, hits = chunk_passages(search_chunks(cur, query_embedding, message_limit))
+                else:
+                    messages, hits = self._retrieve_messages_with_context(
+                        conn, query_embedding, limit=message_limit, query_text=query, options=options
+                    )
                 results.extend(messages)
                 logger.info(f"Retrieved {len(messages)} message contexts")
 
@@ -72,7 +228,7 @@ class PostgreSQLVectorRetriever(dspy.Retrieve):
 
                 # 2. Find relevant personality docs
                 logger.debug("Retrieving relevant personality documents...")
-                docs = self._retrieve_personality_docs(
+                docs, doc_refs = self._retrieve_personality_docs(
                     conn, query_embedding, limit=3
                 )
                 results.extend(docs)
@@ -100,58 +256,71 @@ class PostgreSQLVectorRetriever(dspy.Retrieve):
             trace.log_context_retrieval(messages, docs)
 
         logger.info(f"Total context items retrieved: {len(results)}")
-        return dspy.Prediction(passages=results)
+        return dspy.Prediction(
+            passages=results,
+            passage_refs={"messages": hits, "personality_docs": doc_refs}
+        )
 
     def _retrieve_messages_with_context(
-        self, conn, embedding: list, limit: int = 15, context_window: int = 10
-    ) -> List[str]:
-        """Retrieve the top N most relevant individual messages, then get full thread context for each"""
-        logger.debug(f"Searching for {limit} most relevant individual messages, then retrieving full thread context")
-
-        # First, find the most relevant individual messages (only those with >20 chars)
-        relevant_query = """
-        SELECT id, thread_id, message_text, timestamp, (embedding <=> %s::vector) as distance
-        FROM messages
-        WHERE embedding IS NOT NULL 
-        AND LENGTH(message_text) > 20
-        ORDER BY embedding <=> %s::vector
-        LIMIT %s
+        self, conn, embedding: list, limit: int = 15,
+        query_text: Optional[str] = None, options: RetrievalOptions = DEFAULT_RETRIEVAL_OPTIONS
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """
+        Retrieve the top N most relevant individual messages, then get the conversation around each
+
+        With options.mmr the N hits are chosen by maximal marginal relevance
+        from the top mmr_pool_size candidates, so they spread over more
+        threads instead of repeating one conversation. The context is a
+        token-capped window centred on each hit (see
+        context_windows.build_hit_windows), or the hit's whole thread-day when
+        options disable windowing.
+
+        Returns:
+            Tuple of (formatted context lines, hit references with message id, thread-day, window and score)
         """
+        logger.debug(f"Searching for {limit} most relevant individual messages, then retrieving thread context")
+        bounds = {}
 
         try:
             with conn.cursor() as cur:
-                # Get the top N most relevant individual messages
-                cur.execute(relevant_query, (embedding, embedding, limit))
-                relevant_messages = cur.fetchall()
+                # First, find the most relevant individual messages (only those with >20 chars)
+                relevant_messages = search_messages(
+                    cur, embedding, max(limit, options.mmr_pool_size) if options.mmr else limit,
+                    "AND LENGTH(message_text) > 20", {"min_length": 20},
+                    query_text=query_text, options=options
+                )
                 logger.debug(f"Found {len(relevant_messages)} most relevant individual messages")
 
+                if options.mmr and len(relevant_messages) > limit:
+                    # Spread the hits over more threads before paying for their context
+                    candidates = [(str(row[0]), 1.0 - float(row[-1])) for row in relevant_messages]
+                    by_id = {str(row[0]): row for row in relevant_messages}
+                    chosen = diversify(candidates, candidate_embeddings(cur, by_id), limit, options.mmr_lambda)
+                    relevant_messages = [by_id[message_id] for message_id in chosen]
+
                 if not relevant_messages:
-                    return []
-
-                # Get unique thread_id and date combinations from these specific messages
-                thread_dates = set()
-                for _, thread_id, _, timestamp, _ in relevant_messages:
-                    if thread_id:
-                        date_str = timestamp.date()
-                        thread_dates.add((thread_id, date_str))
-
-                logger.debug(f"Will retrieve full context from {len(thread_dates)} thread/date combinations")
-
-                # Now get ALL messages from those thread/date combinations for full context
-                all_context_messages = []
-                for thread_id, date in thread_dates:
-                    context_query = """
-                    SELECT message_text, timestamp, thread_id, meta_data, source, from_matt_gpt
-                    FROM messages
-                    WHERE thread_id = %s 
-                    AND DATE(timestamp) = %s
-                    ORDER BY timestamp
-                    """
-                    cur.execute(context_query, (thread_id, date))
-                    thread_messages = cur.fetchall()
-                    all_context_messages.extend(thread_messages)
-
-                logger.debug(f"Found {len(all_context_messages)} total contextual messages from {len(thread_dates)} thread/date groups")
+                    return [], []
+
+                if windowing_enabled(options):
+                    # Hit-centred windows depend on the query, so they bypass the thread-day cache
+                    windows = build_hit_windows(
+                        cur, [(message_id, thread_id, timestamp) for message_id, thread_id, _, timestamp, _ in relevant_messages],
+                        options
+                    )
+                    bounds = window_bounds(windows)
+                    all_context_messages = [row for window in windows for row in window.context_rows]
+                    context_lines = format_context_messages(all_context_messages)
+                    logger.debug(f"Found {len(all_context_messages)} contextual messages in {len(windows)} windows")
+                else:
+                    # Get unique thread_id and date combinations from these specific messages
+                    thread_dates = set()
+                    for _, thread_id, _, timestamp, _ in relevant_messages:
+                        if thread_id:
+                            thread_dates.add((thread_id, timestamp.date()))
+
+                    # Whole thread-days render the same for every hit on them - served from the LRU when unchanged
+                    context_lines = render_thread_days(cur, thread_dates)
+                    logger.debug(f"Rendered {len(thread_dates)} thread/date groups")
 
         except Exception as e:
             logger.error(f"Message retrieval query failed: {e}")
@@ -162,6 +331,7 @@ class PostgreSQLVectorRetriever(dspy.Retrieve):
         if trace:
             search_results = []
             for _, _, text, timestamp, distance in relevant_messages:
+                text = text or ""  # The in-process engine doesn't hold message text
                 search_results.append({
                     "text": text[:100] + "..." if len(text) > 100 else text,
                     "timestamp": str(timestamp),
@@ -170,78 +340,29 @@ class PostgreSQLVectorRetriever(dspy.Retrieve):
                 })
             trace.log_vector_search(embedding, search_results)
 
-        # Helper function to filter names for family only
-        def filter_sender_name(display_name: str, phone_number: str = "") -> str:
-            """Filter sender names to only show family members, others become 'Someone:'"""
-            if not display_name:
-                display_name = phone_number
-            
-            # Replace Sisterr<3 with Danielle Brooks
-            if display_name == "Sisterr<3":
-                display_name = "Danielle Brooks"
-            
-            # Family names to keep
-            family_names = {"Natalie Brooks", "Sarah Brooks", "Mom", "Dad", "Danielle Brooks"}
-            
-            if display_name in family_names:
-                return display_name
-            else:
-                return "Someone"
-        
-        # Group and format messages by thread, date, and source type
-        from collections import defaultdict
-        grouped_messages = defaultdict(list)
-        
-        for text, timestamp, thread_id, meta_data, source, from_matt_gpt in all_context_messages:
-            date_str = timestamp.date().strftime("%Y-%m-%d")
-            
-            # Determine sender name based on message source
-            if source == "matt-gpt conversation":
-                # Matt-GPT conversation message
-                if from_matt_gpt:
-                    sender_name = "Matt"
-                else:
-                    sender_name = "User"
-                key = f"Matt-GPT Conversation {thread_id[-5:]} - {date_str}"
-            else:
-                # Text/Slack message
-                if meta_data and isinstance(meta_data, dict):
-                    display_name = meta_data.get('display_name', '')
-                    sender_name = filter_sender_name(display_name)
-                else:
-                    sender_name = "Unknown"
-                key = f"Thread {thread_id} - {date_str}"
-            
-            grouped_messages[key].append((timestamp, text, sender_name, source))
-
-        # Format chronologically with thread/date headers
-        formatted = []
-        for thread_date, messages in sorted(grouped_messages.items()):
-            formatted.append(f"\n=== {thread_date} ===")
-            for timestamp, text, sender_name, source in sorted(messages):
-                formatted.append(f"{sender_name}: {text}")
-            formatted.append("")  # Add blank line between groups
-
-        logger.debug(f"Formatted {len(formatted)} message contexts in {len(grouped_messages)} thread/date groups")
-        return formatted
+        hits = [
+            window_ref({
+                "message_id": str(message_id),
+                "thread_id": thread_id,
+                "day": timestamp.date().isoformat(),
+                "score": round(1.0 - float(distance), 4)
+            }, bounds)
+            for message_id, thread_id, _, timestamp, distance in relevant_messages
+        ]
+        return context_lines, hits
 
     def _retrieve_personality_docs(
         self, conn, embedding: list, limit: int = 3
-    ) -> List[str]:
-        """Retrieve relevant personality documents"""
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """Retrieve relevant personality documents with their references"""
         logger.debug(f"Searching for {limit} most relevant personality documents")
 
-        query = """
-        SELECT title, content, (embedding <=> %s::vector) as distance
-        FROM personality_docs
-        WHERE embedding IS NOT NULL
-        ORDER BY embedding <=> %s::vector
-        LIMIT %s
-        """
+        query, params = vector_search_sql("id, title, content", "personality_docs", "", embedding, limit)
 
         try:
             with conn.cursor() as cur:
-                cur.execute(query, (embedding, embedding, limit))
+                ensure_shortlist_ef_search(cur, limit)
+                cur.execute(query, params)
                 results = cur.fetchall()
                 logger.debug(f"Found {len(results)} personality documents")
 
@@ -250,8 +371,10 @@ class PostgreSQLVectorRetriever(dspy.Retrieve):
             raise
 
         formatted = []
-        for title, content, distance in results:
+        refs = []
+        for doc_id, title, content, distance in results:
             formatted.append(f"=== {title} ===\n{content}")
+            refs.append({"doc_id": str(doc_id), "score": round(1.0 - float(distance), 4)})
 
         logger.debug(f"Formatted {len(formatted)} personality documents")
-        return formatted
\ No newline at end of file
+        return formatted, refs
\ No newline at end of file
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Partitioning, retention and rollup maintenance for query_logs and rag_analytics
+
+One-off:
+    python scripts/analytics_maintenance.py partition
+
+Scheduled (e.g. hourly):
+    python scripts/analytics_maintenance.py run --retention-mode archive --archive-dir /archive
+"""
+
+import sys
+import logging
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from analytics_maintenance import (
+    PARTITIONED_TABLES,
+    ANALYTICS_RETENTION_MONTHS,
+    partition_table,
+    ensure_partitions,
+    apply_retention,
+    refresh_rollups,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run_partition():
+    """Convert both telemetry tables to monthly partitions"""
+    for table in PARTITIONED_TABLES:
+        partition_table(table)
+
+
+def run_ensure(months_ahead: int):
+    for table in PARTITIONED_TABLES:
+        ensure_partitions(table, months_ahead=months_ahead)
+
+
+def run_retention(keep_months: int, mode: str, archive_dir: str, dry_run: bool):
+    for table in PARTITIONED_TABLES:
+        removed = apply_retention(table, keep_months=keep_months, mode=mode, archive_dir=archive_dir, dry_run=dry_run)
+        for name in removed:
+            logger.info(f"{'Would remove' if dry_run else 'Removed'} {name} ({mode})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain partitioned analytics tables and hourly rollups")
+    parser.add_argument("command", choices=["partition", "ensure", "retention", "rollup", "run"],
+                       help="partition: one-off conversion; run: ensure + rollup + retention")
+    parser.add_argument("--months-ahead", type=int, default=3,
+                       help="Monthly partitions to create ahead of the current month")
+    parser.add_argument("--keep-months", type=int, default=ANALYTICS_RETENTION_MONTHS,
+                       help="Months of raw telemetry to keep attached")
+    parser.add_argument("--retention-mode", choices=["detach", "archive", "drop"], default="detach",
+                       help="What to do with expired partitions")
+    parser.add_argument("--archive-dir", help="Directory for archived partitions (archive mode)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report expired partitions")
+    parser.add_argument("--full", action="store_true", help="Re-aggregate all rollup history")
+
+    args = parser.parse_args()
+
+    if args.command == "partition":
+        run_partition()
+    elif args.command == "ensure":
+        run_ensure(args.months_ahead)
+    elif args.command == "retention":
+        run_retention(args.keep_months, args.retention_mode, args.archive_dir, args.dry_run)
+    elif args.command == "rollup":
+        refresh_rollups(full=args.full)
+    else:
+        run_ensure(args.months_ahead)
+        refresh_rollups(full=args.full)
+        run_retention(args.keep_months, args.retention_mode, args.archive_dir, args.dry_run)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+ANN recall vs latency benchmark for the message HNSW index
+
+Compares HNSW search against exact brute-force top-k across ef_search values,
+retriever filters and (optionally) index build parameters, writes a JSON report
+and recommends - or applies - the cheapest ef_search that meets a target recall.
+
+    python scripts/benchmark_ann.py --queries synthetic --n 200 --ef-search 20,40,80,160
+    python scripts/benchmark_ann.py --queries query_logs --target-recall 0.95 --apply
+    python scripts/benchmark_ann.py --index-params 16:64,24:128   # rebuilds messages_embedding_idx
+"""
+
+import sys
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+import psycopg
+from pgvector.psycopg import register_vector
+
+from ann_benchmark import (
+    SEARCH_FILTERS,
+    get_connection_string,
+    sample_logged_queries,
+    sample_synthetic_queries,
+    exact_top_k,
+    hnsw_search,
+    measure,
+    set_ef_search,
+    recommend,
+)
+from vector_index import report_indexes, rebuild_index, set_database_ef_search
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run_benchmark(args) -> dict:
+    """Run the full sweep and return the report"""
+    filters = args.filters.split(",")
+    ef_values = [int(value) for value in args.ef_search.split(",")]
+    index_params = [tuple(int(part) for part in spec.split(":")) for spec in args.index_params.split(",")] if args.index_params else [None]
+
+    with psycopg.connect(get_connection_string()) as conn:
+        register_vector(conn)
+        conn.autocommit = True
+
+        logger.info(f"Sampling {args.n} {args.queries} queries...")
+        if args.queries == "query_logs":
+            queries = sample_logged_queries(conn, args.n, seed=args.seed)
+        else:
+            queries = sample_synthetic_queries(conn, args.n, seed=args.seed)
+        corpus_size = conn.execute("SELECT COUNT(*) FROM messages WHERE embedding IS NOT NULL").fetchone()[0]
+
+        logger.info(f"Computing exact top-{args.k} for {len(queries)} queries under {len(filters)} filters...")
+        exact = {name: exact_top_k(conn, queries, args.k, SEARCH_FILTERS[name]) for name in filters}
+
+        results = []
+        for params in index_params:
+            m, ef_construction, build = None, None, None
+            if params is not None:
+                m, ef_construction = params
+                build = rebuild_index("messages_embedding_idx", m=m, ef_construction=ef_construction,
+                                      maintenance_work_mem=args.maintenance_work_mem)
+            for ef_search in ef_values:
+                set_ef_search(conn, ef_search, args.iterative_scan)
+                for name in filters:
+                    stats = measure(conn, queries, exact[name], args.k, hnsw_search(SEARCH_FILTERS[name]))
+                    stats.update({"m": m, "ef_construction": ef_construction, "ef_search": ef_search,
+                                  "filter": name, "build_seconds": build["build_seconds"] if build else None})
+                    results.append(stats)
+                    logger.info(f"m={m} efc={ef_construction} ef_search={ef_search} filter={name}: "
+                                f"recall={stats['recall_mean']:.3f} p50={stats['latency_p50_ms']}ms p99={stats['latency_p99_ms']}ms")
+
+    return {
+        "benchmark": "ann_recall_latency",
+        "timestamp": datetime.utcnow().isoformat(),
+        "query_source": args.queries,
+        "queries": len(queries),
+        "corpus_size": corpus_size,
+        "k": args.k,
+        "iterative_scan": args.iterative_scan,
+        "target_recall": args.target_recall,
+        "indexes": report_indexes(),
+        "results": results,
+        "recommendation": recommend(results, args.target_recall),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark HNSW recall@k and latency against exact search")
+    parser.add_argument("--queries", choices=["synthetic", "query_logs"], default="synthetic")
+    parser.add_argument("--n", type=int, default=100, help="Number of sampled queries")
+    parser.add_argument("--k", type=int, default=15, help="Top-k (retrievers use 15 and 10)")
+    parser.add_argument("--ef-search", default="20,40,80,120,200", help="Comma-separated ef_search values")
+    parser.add_argument("--filters", default=",".join(SEARCH_FILTERS), help=f"Comma-separated from: {', '.join(SEARCH_FILTERS)}")
+    parser.add_argument("--index-params", help="Comma-separated m:ef_construction pairs; REBUILDS messages_embedding_idx for each")
+    parser.add_argument("--maintenance-work-mem", default="1GB")
+    parser.add_argument("--iterative-scan", choices=["off", "relaxed_order", "strict_order"],
+                       help="pgvector >= 0.8 iterative index scans for filtered queries")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Report path (default benchmarks/ann_<timestamp>.json)")
+    parser.add_argument("--apply", action="store_true", help="Persist the recommended ef_search as the database default")
+
+    args = parser.parse_args()
+    report = run_benchmark(args)
+
+    output = Path(args.output or f"benchmarks/ann_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    logger.info(f"Report written to {output}")
+
+    recommendation = report["recommendation"]
+    if recommendation is None:
+        logger.warning(f"No configuration reached recall {args.target_recall} - try larger ef_search or index parameters")
+    else:
+        logger.info(f"Recommended: {recommendation}")
+        if args.apply:
+            if args.index_params and recommendation["m"] != report["results"][-1]["m"]:
+                logger.warning("Recommended index parameters differ from the last build - rebuild with "
+                               f"scripts/hnsw_index.py rebuild messages_embedding_idx --m {recommendation['m']} "
+                               f"--ef-construction {recommendation['ef_construction']}")
+            set_database_ef_search(recommendation["ef_search"])
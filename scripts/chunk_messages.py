@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Build and maintain message_chunks - token-bounded conversation windows around Matt's messages
+
+update (re-)chunks every thread with messages newer than its chunking watermark,
+so the first run builds everything and later runs only touch changed threads.
+Unchanged windows keep their embeddings.
+
+    python scripts/chunk_messages.py update
+    python scripts/chunk_messages.py update --limit 100
+    python scripts/chunk_messages.py rechunk <thread_id>
+    python scripts/chunk_messages.py stats
+"""
+
+import os
+import sys
+import json
+import logging
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+import psycopg
+
+from message_chunks import CHUNK_MAX_TOKENS, update_stale_chunks, rechunk_thread_now, stale_threads
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def chunk_stats() -> dict:
+    """Chunk counts and size distribution"""
+    with psycopg.connect(os.getenv("DATABASE_URL")) as conn:
+        row = conn.execute("""
+            SELECT COUNT(*), COUNT(DISTINCT thread_id), AVG(token_count),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY token_count),
+                   MAX(token_count), AVG(message_count)
+            FROM message_chunks
+        """).fetchone()
+        with conn.cursor() as cur:
+            pending = len(stale_threads(cur))
+    chunks, threads, avg_tokens, p50_tokens, max_tokens, avg_messages = row
+    return {
+        "chunks": chunks,
+        "threads": threads,
+        "stale_threads": pending,
+        "token_budget": CHUNK_MAX_TOKENS,
+        "avg_tokens": round(float(avg_tokens or 0), 1),
+        "p50_tokens": p50_tokens,
+        "max_tokens": max_tokens,
+        "avg_messages": round(float(avg_messages or 0), 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build and maintain message_chunks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    update_parser = subparsers.add_parser("update", help="Re-chunk every stale thread")
+    update_parser.add_argument("--limit", type=int, help="Stop after this many threads (oldest changes first)")
+
+    rechunk_parser = subparsers.add_parser("rechunk", help="Re-chunk one thread")
+    rechunk_parser.add_argument("thread_id")
+
+    subparsers.add_parser("stats", help="Chunk counts and sizes")
+
+    args = parser.parse_args()
+
+    if args.command == "update":
+        print(json.dumps(update_stale_chunks(limit=args.limit), indent=2))
+    elif args.command == "rechunk":
+        print(json.dumps(rechunk_thread_now(args.thread_id), indent=2))
+    else:
+        print(json.dumps(chunk_stats(), indent=2, default=str))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped messages corpus snapshots for the in-process vector engine
+
+Run export periodically (e.g. nightly, or as a release step). Workers started
+with VECTOR_ENGINE=inprocess map the CURRENT snapshot and only fetch messages
+newer than its watermark from Postgres.
+
+    python scripts/corpus_snapshot.py export
+    python scripts/corpus_snapshot.py info
+    python scripts/corpus_snapshot.py prune --keep 2
+"""
+
+import sys
+import json
+import logging
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from corpus_snapshot import (
+    VECTOR_ENGINE_SNAPSHOT_DIR,
+    SNAPSHOTS_TO_KEEP,
+    export_snapshot,
+    open_current_snapshot,
+    prune_snapshots,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export and inspect messages corpus snapshots")
+    parser.add_argument("--dir", default=VECTOR_ENGINE_SNAPSHOT_DIR, help="Snapshot root directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("export", help="Write a new snapshot and make it CURRENT")
+    subparsers.add_parser("info", help="Show the CURRENT snapshot's manifest summary")
+    prune_parser = subparsers.add_parser("prune", help="Delete old snapshots")
+    prune_parser.add_argument("--keep", type=int, default=SNAPSHOTS_TO_KEEP)
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        path = export_snapshot(root=args.dir)
+        print(f"Snapshot written to {path}")
+    elif args.command == "info":
+        snapshot = open_current_snapshot(args.dir)
+        if snapshot is None:
+            print(f"No snapshot in {args.dir}")
+            sys.exit(1)
+        stats = snapshot.get_stats()
+        stats.update({"threads": len(snapshot.threads), "sources": snapshot.sources})
+        print(json.dumps(stats, indent=2, default=str))
+    else:
+        for path in prune_snapshots(args.dir, keep=args.keep):
+            print(f"Removed {path}")
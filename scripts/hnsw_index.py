@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+HNSW index maintenance
+
+    python scripts/hnsw_index.py report
+    python scripts/hnsw_index.py rebuild messages_embedding_idx --m 24 --ef-construction 128 --maintenance-work-mem 4GB
+    python scripts/hnsw_index.py prewarm messages_embedding_idx
+    python scripts/hnsw_index.py set-ef-search 80 --persist
+"""
+
+import sys
+import json
+import logging
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from vector_index import (
+    HNSW_INDEXES,
+    DEFAULT_M,
+    DEFAULT_EF_CONSTRUCTION,
+    report_indexes,
+    rebuild_index,
+    prewarm_index,
+    get_ef_search,
+    set_database_ef_search,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def print_report(as_json: bool):
+    """Print size, parameters and bloat of every HNSW index"""
+    report = report_indexes()
+    if as_json:
+        print(json.dumps({"ef_search": get_ef_search(), "indexes": report}, indent=2))
+        return
+
+    print(f"hnsw.ef_search (new sessions): {get_ef_search()}")
+    for entry in report:
+        print(f"\n{entry['index']} on {entry['table']}{'' if entry['valid'] else '  ** INVALID **'}")
+        print(f"  m={entry['m']} ef_construction={entry['ef_construction']}")
+        print(f"  size: {entry['size_mb']} MB, estimated bloat ratio: {entry['estimated_bloat_ratio']}")
+        print(f"  rows: {entry['live_rows']} live / {entry['dead_rows']} dead, scans: {entry['index_scans']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect, rebuild and tune HNSW vector indexes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="Index size, bloat and build parameters")
+    report_parser.add_argument("--json", action="store_true", help="Machine-readable output")
+
+    rebuild_parser = subparsers.add_parser("rebuild", help="Rebuild an index concurrently")
+    rebuild_parser.add_argument("index", choices=sorted(HNSW_INDEXES))
+    rebuild_parser.add_argument("--m", type=int, default=DEFAULT_M)
+    rebuild_parser.add_argument("--ef-construction", type=int, default=DEFAULT_EF_CONSTRUCTION)
+    rebuild_parser.add_argument("--maintenance-work-mem", default="1GB",
+                               help="Should fit the whole graph for a fast build")
+    rebuild_parser.add_argument("--parallel-workers", type=int, default=2)
+
+    prewarm_parser = subparsers.add_parser("prewarm", help="Load an index into shared buffers")
+    prewarm_parser.add_argument("index", choices=sorted(HNSW_INDEXES))
+
+    ef_parser = subparsers.add_parser("set-ef-search", help="Configure hnsw.ef_search for retrieval")
+    ef_parser.add_argument("value", type=int)
+    ef_parser.add_argument("--persist", action="store_true",
+                          help="Store as the database default (otherwise just print the HNSW_EF_SEARCH setting)")
+
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print_report(args.json)
+    elif args.command == "rebuild":
+        print(json.dumps(rebuild_index(
+            args.index,
+            m=args.m,
+            ef_construction=args.ef_construction,
+            maintenance_work_mem=args.maintenance_work_mem,
+            parallel_workers=args.parallel_workers,
+        ), indent=2))
+    elif args.command == "prewarm":
+        prewarm_index(args.index)
+    elif args.persist:
+        set_database_ef_search(args.value)
+    else:
+        print(f"Set HNSW_EF_SEARCH={args.value} in the API environment (per-session override), "
+              f"or re-run with --persist to change the database default")
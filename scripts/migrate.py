@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Apply or inspect versioned schema migrations
+
+    python scripts/migrate.py upgrade           # apply everything pending
+    python scripts/migrate.py upgrade --target 3
+    python scripts/migrate.py status
+"""
+
+import sys
+import logging
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from migrations import apply_migrations, migration_status, SCHEMA_VERSION
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def show_status():
+    """Print applied/pending state of every migration"""
+    print(f"Code schema version: {SCHEMA_VERSION}")
+    for entry in migration_status():
+        state = "applied" if entry["applied"] else "PENDING"
+        mode = " (concurrent)" if entry["concurrent"] else ""
+        print(f"  {entry['version']:>3}  {state:<8} {entry['name']}{mode}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Matt-GPT schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status"])
+    parser.add_argument("--target", type=int, help="Stop after this version (upgrade only)")
+
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = apply_migrations(target=args.target)
+        print(f"Applied {len(applied)} migrations: {applied}" if applied else "Nothing to apply")
+    else:
+        show_status()
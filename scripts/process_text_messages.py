@@ -7,6 +7,7 @@ from datetime import datetime, timezone
 from database import get_session
 from models import Message
 from llm_client import OpenRouterClient
+from message_chunks import MESSAGE_CHUNKS_ENABLED, update_stale_chunks
 from sqlmodel import select
 from tqdm import tqdm
 import os
@@ -361,6 +362,9 @@ def main():
         
         if stats["processed_messages"] > 0:
             logger.info("✅ Text message processing completed successfully!")
+            if MESSAGE_CHUNKS_ENABLED:
+                logger.info("Updating message chunks for changed threads...")
+                update_stale_chunks()
             return True
         else:
             logger.warning("⚠️ No messages were processed")
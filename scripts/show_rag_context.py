@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Show the retrieved and filtered RAG context for a query, whichever storage mode it was logged with
+"""
+
+import sys
+import uuid
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from sqlmodel import select
+
+from database import get_session
+from models import RagAnalytics, QueryLog
+from analytics_storage import load_rag_analytics_context, render_passage_refs
+
+
+def show_rag_context(query_id: str, filtered_only: bool = False):
+    """Print the context passages behind a query"""
+    query_uuid = uuid.UUID(query_id)
+
+    with get_session() as session:
+        analytics = session.exec(
+            select(RagAnalytics).where(RagAnalytics.query_id == query_uuid)
+        ).first()
+        query_log = session.get(QueryLog, query_uuid)
+
+    if analytics is not None:
+        context = load_rag_analytics_context(analytics)
+        source = "compressed capture" if analytics.context_blob is not None else analytics.storage_mode
+        print(f"Query: {analytics.original_query}")
+        print(f"Storage: {source}")
+        passages = context["filtered"] if filtered_only else context["raw"]
+        print(f"{len(context['raw'])} retrieved passages, {len(context['filtered'])} after filtering\n")
+    elif query_log is not None:
+        context_used = query_log.context_used or {}
+        print(f"Query: {query_log.query_text}")
+        print(f"Storage: {context_used.get('storage_mode', 'full')} (no RAG analytics row)\n")
+        if "passage_refs" in context_used:
+            passages = render_passage_refs(context_used["passage_refs"])
+        else:
+            passages = context_used.get("passages", [])
+    else:
+        print(f"No analytics or query log found for {query_id}")
+        return
+
+    for passage in passages:
+        print(passage)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Re-render the RAG context logged for a query")
+    parser.add_argument("query_id", help="QueryLog / RagAnalytics query id")
+    parser.add_argument("--filtered", action="store_true",
+                       help="Show only the passages that survived context filtering")
+
+    args = parser.parse_args()
+    show_rag_context(args.query_id, filtered_only=args.filtered)
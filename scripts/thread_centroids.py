@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Thread centroid routing index: maintenance and recall/latency benchmark
+
+refresh re-sums only thread-days that received messages since the last run;
+schedule it next to the analytics rollups. benchmark compares flat HNSW search
+with two-stage routed search (RETRIEVAL_ROUTE_TOP_N) against exact top-k.
+
+    python scripts/thread_centroids.py refresh
+    python scripts/thread_centroids.py refresh --full
+    python scripts/thread_centroids.py stats
+    python scripts/thread_centroids.py benchmark --queries query_logs --n 100 --top-n 10,25,50,100
+"""
+
+import sys
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+import psycopg
+from pgvector.psycopg import register_vector
+
+from ann_benchmark import (
+    SEARCH_FILTERS,
+    get_connection_string,
+    sample_logged_queries,
+    sample_synthetic_queries,
+    exact_top_k,
+    hnsw_search,
+    routed_search,
+    measure,
+)
+from thread_centroids import ROUTING_LEVELS, CENTROID_ROUTING_LEVEL, refresh_centroids, centroid_stats
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run_benchmark(args) -> dict:
+    """Flat vs routed search for every filter, routing level and top-N"""
+    filters = args.filters.split(",")
+    top_ns = [int(value) for value in args.top_n.split(",")]
+    levels = args.levels.split(",")
+
+    with psycopg.connect(get_connection_string()) as conn:
+        register_vector(conn)
+        conn.autocommit = True
+
+        logger.info(f"Sampling {args.n} {args.queries} queries...")
+        if args.queries == "query_logs":
+            queries = sample_logged_queries(conn, args.n, seed=args.seed)
+        else:
+            queries = sample_synthetic_queries(conn, args.n, seed=args.seed)
+
+        logger.info(f"Computing exact top-{args.k} for {len(queries)} queries under {len(filters)} filters...")
+        exact = {name: exact_top_k(conn, queries, args.k, SEARCH_FILTERS[name]) for name in filters}
+
+        results = []
+        for name in filters:
+            stats = measure(conn, queries, exact[name], args.k, hnsw_search(SEARCH_FILTERS[name]))
+            stats.update({"search": "flat_hnsw", "filter": name, "level": None, "top_n": None})
+            results.append(stats)
+            logger.info(f"flat filter={name}: recall={stats['recall_mean']:.3f} "
+                        f"p50={stats['latency_p50_ms']}ms p99={stats['latency_p99_ms']}ms")
+
+            for level in levels:
+                for top_n in top_ns:
+                    stats = measure(conn, queries, exact[name], args.k, routed_search(SEARCH_FILTERS[name], top_n, level))
+                    stats.update({"search": "routed", "filter": name, "level": level, "top_n": top_n})
+                    results.append(stats)
+                    logger.info(f"routed level={level} top_n={top_n} filter={name}: recall={stats['recall_mean']:.3f} "
+                                f"p50={stats['latency_p50_ms']}ms p99={stats['latency_p99_ms']}ms")
+
+    return {
+        "benchmark": "thread_centroid_routing",
+        "timestamp": datetime.utcnow().isoformat(),
+        "query_source": args.queries,
+        "queries": len(queries),
+        "k": args.k,
+        "centroids": centroid_stats(),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain and benchmark the thread centroid routing index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    refresh_parser = subparsers.add_parser("refresh", help="Re-sum thread-days with new messages")
+    refresh_parser.add_argument("--full", action="store_true", help="Re-aggregate every thread-day")
+
+    subparsers.add_parser("stats", help="Centroid counts and coverage")
+
+    bench_parser = subparsers.add_parser("benchmark", help="Recall@k and latency: flat vs routed")
+    bench_parser.add_argument("--queries", choices=["synthetic", "query_logs"], default="query_logs",
+                              help="query_logs is the realistic choice; synthetic queries sit on a stored message")
+    bench_parser.add_argument("--n", type=int, default=100)
+    bench_parser.add_argument("--k", type=int, default=10, help="Top-k (expanded queries use 10)")
+    bench_parser.add_argument("--top-n", default="10,25,50,100", help="Comma-separated routing fan-outs")
+    bench_parser.add_argument("--levels", default=CENTROID_ROUTING_LEVEL, help=f"Comma-separated from: {', '.join(ROUTING_LEVELS)}")
+    bench_parser.add_argument("--filters", default="min_length,matt_gpt_conversations",
+                              help=f"Comma-separated from: {', '.join(SEARCH_FILTERS)}")
+    bench_parser.add_argument("--seed", type=int, default=42)
+    bench_parser.add_argument("--output", help="Report path (default benchmarks/routing_<timestamp>.json)")
+
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        print(json.dumps(refresh_centroids(full=args.full), indent=2, default=str))
+    elif args.command == "stats":
+        print(json.dumps(centroid_stats(), indent=2, default=str))
+    else:
+        report = run_benchmark(args)
+        output = Path(args.output or f"benchmarks/routing_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2, default=str))
+        logger.info(f"Report written to {output}")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Compact embedding storage: halfvec columns, binary-quantized and Matryoshka shortlist indexes
+
+The derived columns, their sync triggers, backfills and HNSW indexes are schema
+migrations 16-19 (python scripts/migrate.py upgrade). Then:
+    python scripts/vector_storage.py benchmark          # compare memory, latency and recall
+    # set VECTOR_STORAGE=halfvec|binary|matryoshka in the API environment and deploy
+    python scripts/vector_storage.py drop-float-index   # optional: reclaim the float32 HNSW indexes
+"""
+
+import sys
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+import psycopg
+from pgvector.psycopg import register_vector
+
+from ann_benchmark import (
+    SEARCH_FILTERS,
+    get_connection_string,
+    sample_logged_queries,
+    sample_synthetic_queries,
+    exact_top_k,
+    storage_search,
+    measure,
+    set_ef_search,
+)
+from vector_index import (
+    STORAGE_FLOAT32,
+    STORAGE_HALFVEC,
+    STORAGE_BINARY,
+    STORAGE_MATRYOSHKA,
+    SHORTLIST_MODES,
+    drop_float32_indexes,
+    matryoshka_dimensions,
+    storage_footprint,
+    shortlist_size,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run_benchmark(args) -> dict:
+    """Recall@k and latency of each storage mode against exact float32 search"""
+    where = SEARCH_FILTERS[args.filter]
+    rerank_factors = [int(value) for value in args.rerank_factors.split(",")]
+
+    with psycopg.connect(get_connection_string()) as conn:
+        register_vector(conn)
+        conn.autocommit = True
+
+        if args.queries == "query_logs":
+            queries = sample_logged_queries(conn, args.n, seed=args.seed)
+        else:
+            queries = sample_synthetic_queries(conn, args.n, seed=args.seed)
+        exact = exact_top_k(conn, queries, args.k, where)
+        set_ef_search(conn, args.ef_search)
+
+        footprint = storage_footprint("messages")
+        migrated = footprint["avg_column_bytes"]
+
+        configurations = [(STORAGE_FLOAT32, None)]
+        if "embedding_half" in migrated:
+            configurations += [(STORAGE_HALFVEC, None)]
+            configurations += [(STORAGE_BINARY, factor) for factor in rerank_factors]
+        if "embedding_short" in migrated:
+            configurations += [(STORAGE_MATRYOSHKA, factor) for factor in rerank_factors]
+
+        dimensions = matryoshka_dimensions() if "embedding_short" in migrated else None
+        results = []
+        for mode, factor in configurations:
+            search = storage_search(mode, where, rerank_factor=factor)
+            stats = measure(conn, queries, exact, args.k, search)
+            # Shortlist modes search with ef_search raised to the shortlist size (ensure_shortlist_ef_search)
+            ef_search = max(args.ef_search, shortlist_size(args.k, factor)) if mode in SHORTLIST_MODES else args.ef_search
+            stats.update({"mode": mode, "rerank_factor": factor, "ef_search": ef_search, "filter": args.filter,
+                          "dimensions": dimensions if mode == STORAGE_MATRYOSHKA else None})
+            results.append(stats)
+            logger.info(f"{mode}{f' x{factor}' if factor else ''} ef_search={ef_search}: recall={stats['recall_mean']:.3f} "
+                        f"p50={stats['latency_p50_ms']}ms p99={stats['latency_p99_ms']}ms")
+
+    return {
+        "benchmark": "vector_storage",
+        "timestamp": datetime.utcnow().isoformat(),
+        "query_source": args.queries,
+        "queries": len(queries),
+        "k": args.k,
+        "footprint": footprint,
+        "results": results,
+    }
+
+
+def write_report(report: dict, output: str, prefix: str):
+    path = Path(output or f"benchmarks/{prefix}_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, default=str))
+    logger.info(f"Report written to {path}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark halfvec / binary-quantized / Matryoshka embedding storage")
+    parser.add_argument("command", choices=["benchmark", "drop-float-index"])
+    parser.add_argument("--queries", choices=["synthetic", "query_logs"], default="synthetic")
+    parser.add_argument("--n", type=int, default=100)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--filter", choices=sorted(SEARCH_FILTERS), default="min_length")
+    parser.add_argument("--rerank-factors", default="4,10,20", help="Binary shortlist sizes as multiples of k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Report path (default benchmarks/vector_storage_<timestamp>.json)")
+
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        write_report(run_benchmark(args), args.output, "vector_storage")
+    else:
+        drop_float32_indexes()
@@ -0,0 +1,192 @@
+"""
+Telemetry Writer for Matt-GPT
+Buffers analytics rows (RagAnalytics) in memory and batch-inserts them off the request path
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel
+
+from database import engine
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class TelemetryWriter:
+    """
+    Bounded in-process queue drained by a background flusher thread.
+
+    Rows are grouped by table and written with one multi-row INSERT per table
+    every `flush_interval_ms` or as soon as `batch_size` rows are waiting.
+    When the queue is full new rows are dropped (and counted) rather than
+    slowing down requests. Only for rows nothing reads back on the request
+    path: QueryLog is written directly, since conversation continuation and
+    summary folding read query_logs right after a turn.
+    """
+
+    def __init__(self, max_queue: int = 10000, flush_interval_ms: int = 500, batch_size: int = 200):
+        self.max_queue = max_queue
+        self.flush_interval_ms = flush_interval_ms
+        self.batch_size = batch_size
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self._flush_ms_total = 0.0
+        self.last_flush_rows = 0
+        self.high_water_mark = 0
+
+        logger.info(
+            f"Telemetry writer initialized: max_queue={max_queue}, "
+            f"flush_interval={flush_interval_ms}ms, batch_size={batch_size}"
+        )
+
+    @classmethod
+    def from_env(cls) -> "TelemetryWriter":
+        """Build a writer from TELEMETRY_* environment variables"""
+        return cls(
+            max_queue=int(os.getenv("TELEMETRY_MAX_QUEUE", "10000")),
+            flush_interval_ms=int(os.getenv("TELEMETRY_FLUSH_INTERVAL_MS", "500")),
+            batch_size=int(os.getenv("TELEMETRY_BATCH_SIZE", "200")),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+        logger.info("Telemetry writer started")
+
+    def stop(self, timeout: float = 10.0):
+        """Stop accepting new work and drain everything still queued"""
+        if not self.running:
+            return
+        logger.info(f"Draining telemetry writer ({self._queue.qsize()} rows queued)...")
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Telemetry writer did not drain within {timeout}s, {self._queue.qsize()} rows lost")
+        self._thread = None
+        logger.info("Telemetry writer stopped")
+
+    def submit(self, record: SQLModel) -> bool:
+        """
+        Queue a model instance for insertion without blocking
+
+        Returns:
+            True if queued, False if the queue was full and the row was dropped
+        """
+        row = record.model_dump()
+        try:
+            self._queue.put_nowait((record.__class__, row))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"Telemetry queue full ({self.max_queue}), dropped {self.dropped} rows so far")
+            return False
+
+        self.enqueued += 1
+        self.high_water_mark = max(self.high_water_mark, self._queue.qsize())
+        return True
+
+    def _run(self):
+        """Flusher loop: collect a batch, write it, repeat until stopped and drained"""
+        interval = self.flush_interval_ms / 1000.0
+        while True:
+            batch = []
+            deadline = time.monotonic() + interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._flush(batch)
+            elif self._stop.is_set():
+                return
+
+            if self._stop.is_set():
+                # Drain without waiting for the interval
+                interval = 0.001
+
+    def _flush(self, batch: list):
+        """Write a batch with one executemany INSERT per table"""
+        start = time.monotonic()
+        rows_by_model = defaultdict(list)
+        for model_cls, row in batch:
+            rows_by_model[model_cls].append(row)
+
+        for model_cls, rows in rows_by_model.items():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(model_cls.__table__), rows)
+                self.written += len(rows)
+            except Exception as e:
+                self.failed += len(rows)
+                logger.error(f"Failed to write {len(rows)} {model_cls.__tablename__} rows: {e}")
+
+        flush_ms = (time.monotonic() - start) * 1000
+        self.flushes += 1
+        self._flush_ms_total += flush_ms
+        self.last_flush_rows = len(batch)
+        logger.debug(f"Flushed {len(batch)} telemetry rows in {flush_ms:.1f}ms")
+
+    def get_stats(self) -> dict:
+        """Snapshot of queue depth, throughput and backpressure counters"""
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "high_water_mark": self.high_water_mark,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "avg_flush_ms": self._flush_ms_total / self.flushes if self.flushes else 0.0,
+            "last_flush_rows": self.last_flush_rows,
+        }
+
+
+# Process-wide writer shared by the API and retrievers
+telemetry_writer = TelemetryWriter.from_env()
+
+
+def record_telemetry(record: SQLModel):
+    """
+    Queue a telemetry row for batched insertion.
+    Falls back to a direct insert when the writer isn't running (scripts, tests).
+    """
+    if telemetry_writer.running:
+        telemetry_writer.submit(record)
+        return
+
+    from database import get_session
+    with get_session() as session:
+        session.add(record)
+        session.commit()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Test admission control slot limits, priority lanes and load shedding."""
+
+import asyncio
+from admission_control import AdmissionController, AdmissionRejected, LANE_INTERACTIVE, LANE_BATCH, retry_admission
+
+
+def test_admission_control():
+    """Test slot accounting, priority ordering and rejections"""
+    print("Testing admission controller...")
+
+    async def scenario():
+        controller = AdmissionController(
+            max_concurrent=1,
+            max_queue={LANE_INTERACTIVE: 1, LANE_BATCH: 1},
+            max_wait_seconds=0.5,
+        )
+
+        # First request takes the only slot immediately
+        assert await controller.acquire(LANE_BATCH) == 0.0
+        print("+ First request admitted without waiting")
+
+        order = []
+
+        async def waiter(lane):
+            await controller.acquire(lane)
+            order.append(lane)
+
+        # Batch queues first, interactive queues second
+        batch_task = asyncio.create_task(waiter(LANE_BATCH))
+        await asyncio.sleep(0)
+        interactive_task = asyncio.create_task(waiter(LANE_INTERACTIVE))
+        await asyncio.sleep(0)
+
+        # Both lanes are full now - a third batch request is shed with 429
+        try:
+            await controller.acquire(LANE_BATCH)
+            raise AssertionError("Expected queue-full rejection")
+        except AdmissionRejected as e:
+            assert e.status_code == 429
+            assert e.retry_after >= 1
+        print("+ Full queue rejected with 429 and Retry-After")
+
+        # Releasing wakes the interactive waiter before the older batch waiter
+        controller.release(10.0)
+        await interactive_task
+        controller.release(10.0)
+        await batch_task
+        assert order == [LANE_INTERACTIVE, LANE_BATCH], order
+        print("+ Interactive lane served before batch lane")
+
+        # A waiter that never gets a slot is rejected with 503
+        try:
+            await controller.acquire(LANE_INTERACTIVE)
+            raise AssertionError("Expected timeout rejection")
+        except AdmissionRejected as e:
+            assert e.status_code == 503
+        print("+ Queue wait timeout rejected with 503")
+
+        controller.release()
+        stats = controller.get_stats()
+        assert stats["in_flight"] == 0
+        assert stats["lanes"][LANE_BATCH]["rejected_queue_full"] == 1
+        assert stats["lanes"][LANE_INTERACTIVE]["rejected_timeout"] == 1
+        assert stats["lanes"][LANE_INTERACTIVE]["queue_length"] == 0
+        print("+ Stats report in-flight, rejections and queue length")
+
+    asyncio.run(scenario())
+    print("\n+ All admission control tests passed!")
+
+
+def test_timed_out_waiters_leave_queue():
+    """Test that a queue full of timed-out waiters neither rejects nor blocks new requests"""
+    print("Testing timed-out waiters...")
+
+    async def scenario():
+        controller = AdmissionController(
+            max_concurrent=1,
+            max_queue={LANE_INTERACTIVE: 2, LANE_BATCH: 2},
+            max_wait_seconds=0.05,
+        )
+        await controller.acquire(LANE_BATCH)
+
+        # Fill the interactive queue with waiters that all time out
+        for result in await asyncio.gather(
+            controller.acquire(LANE_INTERACTIVE), controller.acquire(LANE_INTERACTIVE),
+            return_exceptions=True,
+        ):
+            assert isinstance(result, AdmissionRejected) and result.status_code == 503, result
+        assert controller.get_stats()["lanes"][LANE_INTERACTIVE]["queue_length"] == 0
+        print("+ Timed-out waiters removed from the queue")
+
+        # The lane has room again: a new waiter queues instead of being shed with 429
+        waiter = asyncio.create_task(controller.acquire(LANE_INTERACTIVE))
+        await asyncio.sleep(0)
+        assert controller.get_stats()["lanes"][LANE_INTERACTIVE]["rejected_queue_full"] == 0
+        controller.release()
+        await waiter
+        print("+ New interactive request queued and admitted")
+
+        # No interactive caller is waiting any more, so batch takes a free slot directly
+        controller.release()
+        assert await controller.acquire(LANE_BATCH) == 0.0
+        print("+ Batch not held back by stale interactive waiters")
+
+        # A cancelled waiter leaves the queue too
+        cancelled = asyncio.create_task(controller.acquire(LANE_BATCH))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert len(controller._waiters[LANE_BATCH]) == 0
+        print("+ Cancelled waiter removed from the queue")
+
+    asyncio.run(scenario())
+
+
+
+def test_retry_admission_deadline():
+    """Test that rejected callers retry after Retry-After but give up at their deadline"""
+    print("Testing bounded admission retries...")
+
+    async def scenario():
+        attempts = []
+
+        async def admitted_on_third_try():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise AdmissionRejected(503, "Timed out waiting for a pipeline slot", retry_after=0)
+            return "done"
+
+        assert await retry_admission(admitted_on_third_try, deadline_seconds=5) == "done"
+        assert len(attempts) == 3
+        print("+ Retried until admitted")
+
+        attempts.clear()
+
+        async def always_saturated():
+            attempts.append(1)
+            raise AdmissionRejected(429, "Batch queue full", retry_after=2)
+
+        try:
+            await retry_admission(always_saturated, deadline_seconds=1)
+            raise AssertionError("Expected the last rejection once out of time")
+        except AdmissionRejected as e:
+            assert (e.status_code, e.retry_after) == (429, 2)
+        assert len(attempts) == 1
+        print("+ No retry past the deadline, last 429 and Retry-After surfaced")
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_admission_control()
+    test_timed_out_waiters_leave_queue()
+    test_retry_admission_deadline()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Test compact RAG analytics storage: payload compression and filtered passage mapping."""
+
+import zlib
+
+from analytics_storage import (
+    compress_payload, decompress_payload, filtered_passage_indexes, filtered_passage_keys, select_passages,
+)
+
+RAW_PASSAGES = [
+    "\n=== Thread a - 2025-01-01 ===", "Someone: hi", "Matt: ok", "",
+    "\n=== Thread b - 2025-01-02 ===", "Matt: ok", "Someone: bye", "",
+    "=== Values ===\nHonesty first",
+]
+
+
+def test_payload_round_trip():
+    """Test that compressed captures decompress to the same payload with either codec"""
+    print("Testing analytics payload compression...")
+    payload = {"raw": RAW_PASSAGES, "filtered": ["Matt: ok"]}
+
+    blob, codec = compress_payload(payload)
+    assert codec in ("zstd", "zlib")
+    assert decompress_payload(blob, codec) == payload
+
+    zlib_blob = zlib.compress(b'{"raw": [], "filtered": []}')
+    assert decompress_payload(zlib_blob, "zlib") == {"raw": [], "filtered": []}
+    try:
+        decompress_payload(blob, "lz4")
+        raise AssertionError("Expected ValueError for an unknown codec")
+    except ValueError:
+        pass
+    print(f"+ Payload round-trips ({codec}), unknown codec rejected")
+
+
+def test_filtered_passage_indexes():
+    """Test mapping filter output back to raw positions, including duplicates and rewrites"""
+    print("Testing filtered passage indexes...")
+    filtered = ["  Matt: ok  ", "Matt: ok", "Matt: rewritten by the filter", "=== Values ===\nHonesty first"]
+
+    assert filtered_passage_indexes(RAW_PASSAGES, filtered) == [2, 5, 8]
+    assert filtered_passage_indexes(RAW_PASSAGES, []) == []
+    print("+ Duplicates map to successive positions, rewrites left out")
+
+
+def test_filtered_passage_keys_survive_rerendering():
+    """Test that filtered keys select the same passages from a re-rendering in another order"""
+    print("Testing filtered passage keys...")
+    keys = filtered_passage_keys(RAW_PASSAGES, ["Matt: ok", "Someone: bye", "=== Values ===\nHonesty first"])
+    assert len(keys) == 3
+
+    # Blocks re-rendered in a different order, with a message added to thread a since
+    rerendered = [
+        "=== Values ===\nHonesty first",
+        "\n=== Thread b - 2025-01-02 ===", "Matt: ok", "Someone: bye", "",
+        "\n=== Thread a - 2025-01-01 ===", "Someone: hi", "Someone: new message", "Matt: ok", "",
+    ]
+    selected = select_passages(rerendered, keys)
+    assert selected == ["Matt: ok", "Someone: bye", "=== Values ===\nHonesty first"], selected
+    print("+ Keys pick the same lines after reordering")
+
+    # The kept 'Matt: ok' was thread a's: without thread a's block it is skipped, not taken from thread b
+    assert select_passages(rerendered[:5], keys) == ["Someone: bye", "=== Values ===\nHonesty first"]
+    print("+ Identical lines told apart by block, missing passages skipped")
+
+
+if __name__ == "__main__":
+    test_payload_round_trip()
+    test_filtered_passage_indexes()
+    test_filtered_passage_keys_survive_rerendering()
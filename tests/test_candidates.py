@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Test multi-candidate generation on the environment-key (DSPy) path: concurrent, one shared config."""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import matt_gpt as matt_gpt_module
+from matt_gpt import MattGPT
+from retrieval_cache import RetrievalResultCache
+
+
+class FakeChainOfThought:
+    """Records the config of every call; each call takes 0.2s"""
+
+    calls = []
+    lock = threading.Lock()
+
+    def __init__(self, signature):
+        pass
+
+    def __call__(self, config=None, **inputs):
+        time.sleep(0.2)
+        with FakeChainOfThought.lock:
+            FakeChainOfThought.calls.append(config)
+            return SimpleNamespace(response=f"candidate {len(FakeChainOfThought.calls)}")
+
+
+class FakeStandardRetriever:
+    def __call__(self, question, retrieval_options=None):
+        return SimpleNamespace(passages=[], passage_refs={"messages": [], "personality_docs": []})
+
+
+def run_forward(n_candidates):
+    FakeChainOfThought.calls = []
+    matt_gpt = MattGPT(FakeStandardRetriever())
+    matt_gpt.retrieval_cache = RetrievalResultCache(enabled=False)
+    chain_of_thought = matt_gpt_module.dspy.ChainOfThought
+    matt_gpt_module.dspy.ChainOfThought = FakeChainOfThought
+    try:
+        start = time.monotonic()
+        prediction = matt_gpt.forward("question", other_conversation_context=False, n_candidates=n_candidates)
+        return prediction, time.monotonic() - start
+    finally:
+        matt_gpt_module.dspy.ChainOfThought = chain_of_thought
+
+
+def test_candidates_generated_concurrently():
+    """Test that N candidates take about one call's time and share the same sampling config"""
+    print("Testing concurrent candidates...")
+    prediction, elapsed = run_forward(3)
+    assert len(prediction.candidates) == 3 and prediction.response == prediction.candidates[0]
+    assert elapsed < 0.5, elapsed
+    print(f"+ 3 candidates in {elapsed:.2f}s")
+
+    configs = sorted(FakeChainOfThought.calls, key=lambda config: config["rollout_id"])
+    assert configs == [{"rollout_id": 0}, {"rollout_id": 1}, {"rollout_id": 2}]
+    print("+ Same config for every candidate, distinct rollout_id only")
+
+
+def test_single_candidate_uses_default_call():
+    """Test that a single candidate is one plain call"""
+    print("Testing single candidate...")
+    prediction, _ = run_forward(1)
+    assert prediction.candidates == [prediction.response]
+    assert FakeChainOfThought.calls == [None]
+    print("+ One call without a rollout_id")
+
+
+if __name__ == "__main__":
+    test_candidates_generated_concurrently()
+    test_single_candidate_uses_default_call()
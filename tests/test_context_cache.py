@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Test passage block splitting, merging and own-conversation filtering for context reuse."""
+
+from context_cache import split_passage_blocks, merge_passages, drop_conversation_passages
+
+CONVERSATION_ID = "7f1c2a9e-5b3d-4c2a-9e1f-0a1b2c3abcde"
+OTHER_CONVERSATION_ID = "3b8e5d10-2c4f-4d1b-8a7e-9f8e7d6abcde"  # Same last 5 characters
+
+
+def block(header, *lines):
+    """Context lines of one '=== header ===' group as format_context_messages renders them"""
+    return [f"\n=== {header} ===", *lines, ""]
+
+
+def test_split_passage_blocks():
+    """Test grouping of line items into header blocks and personality docs"""
+    print("Testing passage block splitting...")
+    passages = (
+        block("Thread slack-1 - 2025-01-01", "Someone: hi", "Matt: hey")
+        + ["=== Values ===\nHonesty first"]
+        + block("Matt-GPT Conversation abcde - 2025-01-02", "User: question")
+    )
+    blocks = split_passage_blocks(passages)
+
+    assert [header for header, _ in blocks] == [
+        "=== Thread slack-1 - 2025-01-01 ===", None, "=== Matt-GPT Conversation abcde - 2025-01-02 ===",
+    ]
+    assert blocks[0][1] == block("Thread slack-1 - 2025-01-01", "Someone: hi", "Matt: hey")
+    assert blocks[1][1] == ["=== Values ===\nHonesty first"]
+    assert sum(len(items) for _, items in blocks) == len(passages)
+    print("+ Blocks keep their lines, personality docs stand alone")
+
+
+def test_merge_passages_fresh_first_and_capped():
+    """Test that fresh blocks come first, duplicates are dropped and the cap cuts cached blocks"""
+    print("Testing passage merging...")
+    cached = (
+        block("Thread a - 2025-01-01", "Matt: cached a")
+        + ["=== Old Doc ===\nstale"]
+        + block("Thread b - 2025-01-01", "Matt: cached b")
+        + block("Thread c - 2025-01-01", "Matt: cached c")
+    )
+    fresh = (
+        ["=== New Doc ===\ncurrent"]
+        + block("Thread b - 2025-01-01", "Matt: fresh b")
+        + block("Thread d - 2025-01-01", "Matt: fresh d")
+    )
+
+    merged = merge_passages(fresh, cached)
+    headers = [header for header, _ in split_passage_blocks(merged)]
+    assert headers == [
+        None, "=== Thread b - 2025-01-01 ===", "=== Thread d - 2025-01-01 ===",
+        "=== Thread a - 2025-01-01 ===", "=== Thread c - 2025-01-01 ===",
+    ], headers
+    assert "Matt: fresh b" in merged and "Matt: cached b" not in merged
+    assert "=== New Doc ===\ncurrent" in merged and "=== Old Doc ===\nstale" not in merged
+    print("+ Fresh blocks first, duplicates and cached personality docs dropped")
+
+    capped = merge_passages(fresh, cached, max_blocks=3)
+    headers = [header for header, _ in split_passage_blocks(capped)]
+    assert headers == [
+        None, "=== Thread b - 2025-01-01 ===", "=== Thread d - 2025-01-01 ===", "=== Thread a - 2025-01-01 ===",
+    ], headers
+    print("+ Block cap keeps every fresh block and drops cached ones")
+
+    # Merging the merged result again doesn't grow past the cap
+    assert len(split_passage_blocks(merge_passages(fresh, capped, max_blocks=3))) == 4
+
+
+def test_drop_conversation_passages_by_refs():
+    """Test that only the current conversation's blocks are dropped when refs identify them"""
+    print("Testing own-conversation filtering...")
+    passages = (
+        block("Matt-GPT Conversation abcde - 2025-01-02", "User: mine")
+        + block("Matt-GPT Conversation abcde - 2025-01-03", "User: other conversation, same suffix")
+        + block("Thread slack-1 - 2025-01-02", "Matt: unrelated")
+    )
+    refs = {
+        "messages": [
+            {"message_id": "m1", "thread_id": CONVERSATION_ID, "day": "2025-01-02", "score": 0.9},
+            {"message_id": "m2", "thread_id": OTHER_CONVERSATION_ID, "day": "2025-01-03", "score": 0.8},
+            {"message_id": "m3", "thread_id": "slack-1", "day": "2025-01-02", "score": 0.7},
+        ],
+        "personality_docs": [],
+    }
+
+    kept = drop_conversation_passages(passages, CONVERSATION_ID, refs)
+    assert "User: mine" not in kept
+    assert "User: other conversation, same suffix" in kept and "Matt: unrelated" in kept
+    print("+ Other conversation with the same id suffix kept")
+
+    # Context windows spanning several days drop every day they cover
+    window_refs = {"messages": [{
+        "message_id": "m1", "thread_id": CONVERSATION_ID, "day": "2025-01-02",
+        "start": "2025-01-02T23:50:00", "end": "2025-01-03T00:10:00", "score": 0.9,
+    }]}
+    kept = drop_conversation_passages(passages, CONVERSATION_ID, window_refs)
+    assert kept == block("Thread slack-1 - 2025-01-02", "Matt: unrelated")
+
+    # Without refs the display suffix is the only signal
+    kept = drop_conversation_passages(passages, CONVERSATION_ID)
+    assert kept == block("Thread slack-1 - 2025-01-02", "Matt: unrelated")
+    assert drop_conversation_passages(passages, None) == passages
+    print("+ Window spans and the no-refs fallback handled")
+
+
+if __name__ == "__main__":
+    test_split_passage_blocks()
+    test_merge_passages_fresh_first_and_capped()
+    test_drop_conversation_passages_by_refs()
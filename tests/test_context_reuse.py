@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Test follow-up context reuse: the delta search goes through the same pipeline and reuse is reported."""
+
+from types import SimpleNamespace
+
+from matt_gpt import CONTEXT_REUSE_DELTA_LIMIT, MattGPT
+from retrieval_cache import RetrievalResultCache
+
+CONVERSATION_ID = "7f1c2a9e-5b3d-4c2a-9e1f-0a1b2c3abcde"
+
+
+def block(thread, *lines):
+    return [f"\n=== Thread {thread} - 2025-05-30 ===", *lines, ""]
+
+
+def metrics(thread):
+    """The EnhancedRagMetrics fields MattGPT reads"""
+    hits = [{"message_id": f"{thread}-1", "thread_id": thread, "day": "2025-05-30", "score": 0.9}]
+    return SimpleNamespace(passage_refs={"messages": hits, "personality_docs": []}, fallback_used=False,
+                           context_reused=False)
+
+
+class FakeEnhancedRetriever:
+    """Records enhanced_retrieve calls; the unfiltered base retriever must not be used for deltas"""
+
+    def __init__(self):
+        self.calls = []
+        self.saved = []
+        self.base_retriever = SimpleNamespace(forward=self._unfiltered)
+
+    def _unfiltered(self, *args, **kwargs):
+        raise AssertionError("Reuse delta bypassed query filtering")
+
+    def enhanced_retrieve(self, query, query_id, retrieval_options=None, message_limit=None):
+        self.calls.append(message_limit)
+        thread = "full" if message_limit is None else "delta"
+        passages = block(thread, f"Matt: {thread} answer")
+        return passages, metrics(thread)
+
+    def save_analytics(self, query_id, rag_metrics):
+        self.saved.append(rag_metrics)
+
+    def get_personality_docs_only(self, query):
+        return []
+
+
+def make_matt_gpt(retriever):
+    matt_gpt = MattGPT(retriever)
+    matt_gpt.retrieval_cache = RetrievalResultCache(enabled=False)
+    matt_gpt._question_embedding = lambda question: [1.0, 0.0, 0.0]
+    return matt_gpt
+
+
+def test_enhanced_reuse_delta_is_filtered():
+    """Test that a similar follow-up runs a small enhanced (filtered) search and is flagged as reuse"""
+    print("Testing enhanced context reuse...")
+    retriever = FakeEnhancedRetriever()
+    matt_gpt = make_matt_gpt(retriever)
+
+    context, _, reused = matt_gpt._retrieve_with_reuse("first question", "q1", CONVERSATION_ID)
+    assert not reused and retriever.calls == [None]
+    assert not retriever.saved[-1].context_reused
+    print("+ First turn runs the full pipeline")
+
+    context, refs, reused = matt_gpt._retrieve_with_reuse("follow-up", "q2", CONVERSATION_ID)
+    assert reused and retriever.calls == [None, CONTEXT_REUSE_DELTA_LIMIT]
+    assert retriever.saved[-1].context_reused
+    assert context[0] == "\n=== Thread delta - 2025-05-30 ===" and "Matt: full answer" in context
+    assert {hit["thread_id"] for hit in refs["messages"]} == {"delta", "full"}
+    print("+ Follow-up delta filtered, merged ahead of cached passages, flagged in analytics")
+
+
+def test_no_reuse_without_conversation():
+    """Test that turns without a conversation never report reuse"""
+    print("Testing reuse without a conversation...")
+    retriever = FakeEnhancedRetriever()
+    matt_gpt = make_matt_gpt(retriever)
+    for question in ("first question", "follow-up"):
+        _, _, reused = matt_gpt._retrieve_with_reuse(question, None, None)
+        assert not reused
+    assert retriever.calls == [None, None]
+    print("+ Full retrieval every time")
+
+
+if __name__ == "__main__":
+    test_enhanced_reuse_delta_is_filtered()
+    test_no_reuse_without_conversation()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Test hit-centred context windows: growth limits, token cap and merging within a thread."""
+
+from datetime import datetime, timedelta
+
+from context_windows import (
+    WINDOW_HEADER_TOKENS, build_hit_windows, grow_window, merge_windows, message_cost, windowing_enabled,
+)
+from retrieval_options import RetrievalOptions
+
+START = datetime(2025, 3, 1, 9, 0)
+TEXT = "x" * 36  # 10 estimated tokens, 13 with the sender prefix
+
+
+def make_rows(thread_id, count):
+    """Rows in WINDOW_COLUMNS order, one message a minute"""
+    return [
+        (f"{thread_id}-{i:02d}", TEXT, START + timedelta(minutes=i), thread_id, {}, "slack", False)
+        for i in range(count)
+    ]
+
+
+class FakeCursor:
+    """Answers the neighbour queries with the whole thread; grow_window applies the actual limits"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+        self._result = []
+
+    def execute(self, sql, params):
+        self.queries += 1
+        self._result = [row for row in self.rows if row[3] == params[0]]
+
+    def fetchall(self):
+        return self._result
+
+
+def hit(row):
+    return row[0], row[3], row[2]
+
+
+def test_windowing_off_by_default():
+    """Test that the defaults expand hits to thread-days instead of windows"""
+    assert not windowing_enabled(RetrievalOptions())
+    assert windowing_enabled(RetrievalOptions(context_messages=3))
+    assert windowing_enabled(RetrievalOptions(context_minutes=5))
+    print("+ Thread-day expansion by default, windows when either limit is set")
+
+
+def test_overlapping_windows_merged():
+    """Test that overlapping windows in one thread merge and distant ones stay separate"""
+    print("Testing window merging...")
+    rows = make_rows("t1", 20) + make_rows("t2", 5)
+    cursor = FakeCursor(rows)
+    options = RetrievalOptions(context_messages=2, context_max_tokens=1000)
+
+    hits = [hit(rows[5]), hit(rows[8]), hit(rows[15]), hit(rows[22]), ("orphan", None, START)]
+    windows = build_hit_windows(cursor, hits, options)
+
+    spans = [(window.thread_id, window.rows[0][0], window.rows[-1][0], window.hit_ids) for window in windows]
+    assert spans == [
+        ("t1", "t1-03", "t1-10", ["t1-05", "t1-08"]),
+        ("t1", "t1-13", "t1-17", ["t1-15"]),
+        ("t2", "t2-00", "t2-04", ["t2-02"]),
+    ], spans
+    merged = windows[0]
+    assert [row[0] for row in merged.rows] == [f"t1-{i:02d}" for i in range(3, 11)]  # No duplicated rows
+    assert len(merged.context_rows[0]) == 6
+    print("+ Overlapping windows merged without duplicates, thread-less hits skipped")
+
+    touching = merge_windows("t1", make_rows("t1", 10), [(6, 8, "b"), (3, 5, "a")])
+    assert len(touching) == 1 and touching[0].hit_ids == ["a", "b"] and len(touching[0].rows) == 6
+    print("+ Touching windows merged")
+
+
+def test_token_cap():
+    """Test that each hit's window stays within context_max_tokens, growing alternately"""
+    print("Testing window token cap...")
+    rows = make_rows("t1", 20)
+    cost = message_cost(TEXT)
+
+    options = RetrievalOptions(context_minutes=60, context_max_tokens=WINDOW_HEADER_TOKENS + 3 * cost)
+    windows = build_hit_windows(FakeCursor(rows), [hit(rows[10])], options)
+    assert [row[0] for row in windows[0].rows] == ["t1-09", "t1-10", "t1-11"]
+    assert windows[0].token_count <= options.context_max_tokens
+    print("+ Window capped at the token budget, one message either side")
+
+    # At the start of a thread the budget is spent forwards
+    assert grow_window(rows, 0, options) == (0, 2)
+
+    # A hit larger than the cap is still kept on its own
+    big = [(rows[0][0], "y" * 4000) + rows[0][2:]]
+    assert grow_window(big, 0, RetrievalOptions(context_messages=5, context_max_tokens=50)) == (0, 0)
+    print("+ Budget spent forwards at thread start, oversized hit kept alone")
+
+
+if __name__ == "__main__":
+    test_windowing_off_by_default()
+    test_overlapping_windows_merged()
+    test_token_cap()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Test conversation history pagination cursors and prompt token budgeting."""
+
+import uuid
+from datetime import datetime, timedelta
+
+from conversation_history import ChatMessage, ConversationHistoryService, encode_cursor, decode_cursor
+
+
+def make_history(contents):
+    start = datetime(2025, 8, 19, 12, 0)
+    return [
+        ChatMessage(role="user" if i % 2 == 0 else "assistant", content=content,
+                    timestamp=start + timedelta(minutes=i), query_id=uuid.uuid4())
+        for i, content in enumerate(contents)
+    ]
+
+
+def test_cursor_round_trip():
+    """Test that a keyset cursor decodes to the position it was built from"""
+    print("Testing pagination cursors...")
+
+    created_at = datetime(2025, 8, 19, 16, 54, 0, 916931)
+    query_id = uuid.uuid4()
+    cursor = encode_cursor(created_at, query_id)
+
+    assert "|" not in cursor and "/" not in cursor and "+" not in cursor, cursor
+    assert decode_cursor(cursor) == (created_at, query_id)
+    print("+ Cursor is URL-safe and round-trips (created_at, id)")
+
+
+def test_malformed_cursor_rejected():
+    """Test that tampered or foreign cursors raise ValueError"""
+    for cursor in ["not-base64!", encode_cursor(datetime(2025, 1, 1), uuid.uuid4())[:-6], "aGVsbG8="]:
+        try:
+            decode_cursor(cursor)
+            raise AssertionError(f"Expected ValueError for {cursor!r}")
+        except ValueError:
+            pass
+    print("+ Malformed cursors rejected with ValueError")
+
+
+def test_history_token_budget():
+    """Test that the formatted history stays within its token budget, newest turns first"""
+    print("Testing history token budget...")
+    service = ConversationHistoryService(session=None)
+    history = make_history([f"message number {i} " + "x" * 300 for i in range(10)])
+
+    unbounded = service.format_history_for_llm(history, max_messages=10)
+    assert all(f"message number {i} " in unbounded for i in range(10))
+
+    formatted = service.format_history_for_llm(history, max_messages=10, token_budget=250)
+    assert len(formatted) <= 250 * 4, len(formatted)
+    assert "message number 9 " in formatted and "message number 0 " not in formatted
+    assert formatted.index("message number 8 ") < formatted.index("message number 9 ")
+    print("+ Oldest messages dropped first, order kept")
+
+
+def test_long_message_truncated():
+    """Test that one huge message is middle-truncated instead of crowding out the window"""
+    service = ConversationHistoryService(session=None)
+    history = make_history(["short question", "START" + "y" * 20000 + "END"])
+
+    formatted = service.format_history_for_llm(history, max_messages=10, token_budget=1000)
+    assert "short question" in formatted
+    assert "START" in formatted and "END" in formatted and "...[truncated]..." in formatted
+    assert len(formatted) <= 1000 * 4
+    print("+ Long message middle-truncated, earlier turn kept")
+
+
+def test_summary_capped():
+    """Test that the rolling summary takes at most a quarter of the budget"""
+    service = ConversationHistoryService(session=None)
+    history = make_history(["latest question"])
+
+    formatted = service.format_history_for_llm(history, summary="s" * 10000, token_budget=400)
+    summary_part, recent_part = formatted.split("\n\n[Recent messages]\n")
+    assert summary_part.startswith("[Summary of earlier conversation]\n")
+    assert len(summary_part) - len("[Summary of earlier conversation]\n") <= 400
+    assert "latest question" in recent_part
+    assert service.format_history_for_llm([], summary="") == ""
+    print("+ Summary capped at a quarter of the budget")
+
+
+if __name__ == "__main__":
+    test_cursor_round_trip()
+    test_malformed_cursor_rejected()
+    test_history_token_budget()
+    test_long_message_truncated()
+    test_summary_capped()
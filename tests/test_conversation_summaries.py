@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Test the summary fold boundary, FOLD_BATCH_TURNS batching and the concurrent-fold check on SQLite."""
+
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from models import ConversationSummary, QueryLog
+
+# conversation_summaries binds database.get_session at import; database itself needs a DATABASE_URL
+_database = sys.modules.get("database")
+sys.modules["database"] = SimpleNamespace(get_session=None, engine=None)
+try:
+    import conversation_summaries
+    from conversation_summaries import FOLD_BATCH_TURNS, ConversationSummarizer
+finally:
+    if _database is None:
+        del sys.modules["database"]
+    else:
+        sys.modules["database"] = _database
+
+START = datetime(2025, 3, 1, 9, 0)
+
+
+def make_store():
+    """In-memory SQLite with the two tables, installed as conversation_summaries' get_session"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine, tables=[QueryLog.__table__, ConversationSummary.__table__])
+
+    @contextmanager
+    def get_session():
+        with Session(engine) as session:
+            yield session
+
+    conversation_summaries.get_session = get_session
+    return get_session
+
+
+def add_turns(get_session, conversation_id, first, count):
+    """Turns numbered from `first`, one a minute"""
+    with get_session() as session:
+        for i in range(first, first + count):
+            session.add(QueryLog(
+                conversation_id=conversation_id, query_text=f"question {i}", response_text=f"answer {i}",
+                model_used="test", context_used={}, tokens_used=0, latency_ms=0.0, ip_address=None,
+                user_agent=None, created_at=START + timedelta(minutes=i),
+            ))
+        session.commit()
+
+
+def make_summarizer(folds, on_fold=None):
+    """Summarizer (window of 2 turns) whose fold records the turns instead of calling the model"""
+    summarizer = ConversationSummarizer(window_messages=4, model="test-model")
+
+    def fold(previous_summary, turns):
+        folds.append([turn[0] for turn in turns])
+        if on_fold:
+            on_fold()
+        return f"{previous_summary}+{len(turns)}"
+
+    summarizer._fold = fold
+    return summarizer
+
+
+def stored(get_session, conversation_id):
+    with get_session() as session:
+        record = session.get(ConversationSummary, conversation_id)
+        return record and (record.summary, record.summarized_through, record.turns_summarized)
+
+
+def test_fold_boundary():
+    """Test that only turns older than the verbatim window are folded, and each turn only once"""
+    print("Testing fold boundary...")
+    get_session = make_store()
+    conversation_id = uuid.uuid4()
+    folds = []
+    summarizer = make_summarizer(folds)
+
+    add_turns(get_session, conversation_id, 1, 2)
+    summarizer.update_summary(conversation_id)
+    assert folds == [] and stored(get_session, conversation_id) is None  # Everything still in the window
+
+    add_turns(get_session, conversation_id, 3, 3)
+    summarizer.update_summary(conversation_id)
+    # Turns 4 and 5 stay verbatim; the newest turn outside the window (3) is folded with the older ones
+    assert folds == [["question 1", "question 2", "question 3"]]
+    assert stored(get_session, conversation_id) == ("+3", START + timedelta(minutes=3), 3)
+
+    summarizer.update_summary(conversation_id)
+    assert len(folds) == 1  # Nothing new left the window
+
+    add_turns(get_session, conversation_id, 6, 1)
+    summarizer.update_summary(conversation_id)
+    assert folds[-1] == ["question 4"]
+    assert stored(get_session, conversation_id) == ("+3+1", START + timedelta(minutes=4), 4)
+    print("+ Folds stop at the window and resume after summarized_through")
+
+
+def test_fold_batch_turns():
+    """Test that a long backlog is folded FOLD_BATCH_TURNS at a time, oldest first"""
+    print("Testing fold batching...")
+    get_session = make_store()
+    conversation_id = uuid.uuid4()
+    folds = []
+    summarizer = make_summarizer(folds)
+
+    add_turns(get_session, conversation_id, 1, FOLD_BATCH_TURNS + 7)  # 5 outside the first batch, 2 in the window
+    summarizer.update_summary(conversation_id)
+    assert folds == [[f"question {i}" for i in range(1, FOLD_BATCH_TURNS + 1)]]
+
+    summarizer.update_summary(conversation_id)
+    assert folds[-1] == [f"question {i}" for i in range(FOLD_BATCH_TURNS + 1, FOLD_BATCH_TURNS + 6)]
+    summarizer.update_summary(conversation_id)
+    assert len(folds) == 2
+    assert stored(get_session, conversation_id)[2] == FOLD_BATCH_TURNS + 5
+    print(f"+ {FOLD_BATCH_TURNS} turns per call, remainder on the next update")
+
+
+def test_concurrent_fold_skipped():
+    """Test that a fold is discarded when another worker advanced summarized_through meanwhile"""
+    print("Testing concurrent summary update...")
+    for existing in (False, True):
+        get_session = make_store()
+        conversation_id = uuid.uuid4()
+        add_turns(get_session, conversation_id, 1, 6)
+        if existing:
+            make_summarizer([]).update_summary(conversation_id)
+            add_turns(get_session, conversation_id, 7, 2)
+        before = stored(get_session, conversation_id)
+
+        def other_worker_folds():
+            with get_session() as session:
+                record = session.get(ConversationSummary, conversation_id) \
+                    or ConversationSummary(conversation_id=conversation_id)
+                record.summary = "other worker"
+                record.summarized_through = START + timedelta(minutes=100)
+                record.turns_summarized = 99
+                session.add(record)
+                session.commit()
+
+        folds = []
+        make_summarizer(folds, on_fold=other_worker_folds).update_summary(conversation_id)
+        assert len(folds) == 1
+        assert stored(get_session, conversation_id) == ("other worker", START + timedelta(minutes=100), 99), before
+    print("+ The other worker's summary is kept, with or without a prior record")
+
+
+if __name__ == "__main__":
+    test_fold_boundary()
+    test_fold_batch_turns()
+    test_concurrent_fold_skipped()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Test reciprocal rank fusion of the vector and full-text search legs."""
+
+from hybrid_search import LEG_LEXICAL, LEG_VECTOR, fuse_rows, reciprocal_rank_fusion, tag_rows
+from retrieval_options import RetrievalOptions
+
+
+def test_rrf_scores_and_weights():
+    """Test fused scores, rrf_k and per-leg weights"""
+    print("Testing reciprocal rank fusion...")
+    ranked = {LEG_VECTOR: ["a", "b", "c"], LEG_LEXICAL: ["c", "d"]}
+
+    fused = dict(reciprocal_rank_fusion(ranked, {LEG_VECTOR: 1.0, LEG_LEXICAL: 1.0}, k=60))
+    assert abs(fused["a"] - 1 / 61) < 1e-12
+    assert abs(fused["c"] - (1 / 63 + 1 / 61)) < 1e-12
+    assert max(fused, key=fused.get) == "c"  # Found by both legs
+    print("+ Scores sum weight / (k + rank) over both legs")
+
+    # A small k rewards top ranks more: 'a' (vector #1) overtakes 'c' (vector #3, lexical #1)
+    fused = reciprocal_rank_fusion(ranked, {LEG_VECTOR: 2.0, LEG_LEXICAL: 1.0}, k=1)
+    assert fused[0][0] == "a", fused
+
+    fused = dict(reciprocal_rank_fusion(ranked, {LEG_VECTOR: 1.0, LEG_LEXICAL: 0.5}, k=60))
+    assert abs(fused["d"] - 0.5 / 62) < 1e-12
+    print("+ rrf_k and weights shift the ranking")
+
+
+def test_zero_weight_leg_ignored():
+    """Test that a zero-weight leg contributes no candidates at all"""
+    ranked = {LEG_VECTOR: ["a", "b"], LEG_LEXICAL: ["x", "a"]}
+    fused = reciprocal_rank_fusion(ranked, {LEG_VECTOR: 1.0, LEG_LEXICAL: 0.0})
+    assert [key for key, _ in fused] == ["a", "b"]
+    assert reciprocal_rank_fusion(ranked, {}) == []
+    print("+ Zero-weight leg contributes nothing")
+
+
+def test_fuse_rows_keeps_lexical_only_hits():
+    """Test that fuse_rows returns vector-shaped rows, including hits only full-text found"""
+    print("Testing fuse_rows...")
+    vector_rows = [("m1", "t1", "hello", None, 0.10), ("m2", "t1", "there", None, 0.20)]
+    lexical_rows = [("m3", "t2", "Zermatt trip", None, 0.60), ("m1", "t1", "hello", None, 0.10)]
+    rows = tag_rows(LEG_VECTOR, vector_rows) + tag_rows(LEG_LEXICAL, lexical_rows)
+
+    fused = fuse_rows(rows, RetrievalOptions(vector_weight=1.0, lexical_weight=1.0, rrf_k=60), limit=3)
+    assert [row[0] for row in fused] == ["m1", "m3", "m2"], fused
+    assert fused[1] == ("m3", "t2", "Zermatt trip", None, 0.60)
+    print("+ Lexical-only hit kept with its own distance")
+
+    fused = fuse_rows(rows, RetrievalOptions(vector_weight=1.0, lexical_weight=0.0), limit=3)
+    assert [row[0] for row in fused] == ["m1", "m2"]
+    assert len(fuse_rows(rows, RetrievalOptions(lexical_weight=1.0), limit=1)) == 1
+    print("+ Zero lexical weight is vector-only, limit applied")
+
+
+if __name__ == "__main__":
+    test_rrf_scores_and_weights()
+    test_zero_weight_leg_ignored()
+    test_fuse_rows_keeps_lexical_only_hits()
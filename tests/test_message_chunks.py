@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Test chunk window boundaries (budget, gaps, overlapping anchors) and the re-chunking diff."""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import message_chunks
+from message_chunks import build_windows, rechunk_thread
+
+START = datetime(2025, 3, 1, 9, 0)
+HEADER_TOKENS = 16
+
+
+def budget(messages):
+    """max_tokens that fits exactly this many make_rows messages"""
+    return HEADER_TOKENS + 13 * messages
+
+
+def make_rows(count, sent=(), gaps=None, thread_id="t1"):
+    """Rows in CHUNK_SOURCE_COLUMNS order, one a minute; gaps maps an index to extra silence before it"""
+    rows, timestamp = [], START
+    for i in range(count):
+        timestamp += timedelta(minutes=1) + (gaps or {}).get(i, timedelta(0))
+        text = f"{thread_id}-{i:02d} ".ljust(36, "x")  # 10 estimated tokens, 13 with the prefix
+        rows.append((f"{thread_id}-{i:02d}", text, timestamp, thread_id, {}, "slack", False, i in sent, timestamp))
+    return rows
+
+
+@contextmanager
+def plain_rendering():
+    """render_rows without retrievers (which needs a database): one line per message text"""
+    render_rows = message_chunks.render_rows
+    message_chunks.render_rows = lambda rows, max_tokens=None: "\n".join(row[1] for row in rows)
+    try:
+        yield
+    finally:
+        message_chunks.render_rows = render_rows
+
+
+def bounds(windows):
+    return [(window.anchor_index, window.start, window.end) for window in windows]
+
+
+def test_window_budget_cut():
+    """Test that a window grows alternately backwards and forwards until the token budget is spent"""
+    print("Testing window token budget...")
+    with plain_rendering():
+        assert bounds(build_windows(make_rows(12, sent={6}), max_tokens=budget(5))) == [(6, 4, 8)]
+        # At the start of a thread the budget is spent forwards
+        assert bounds(build_windows(make_rows(12, sent={0}), max_tokens=budget(5))) == [(0, 0, 4)]
+        assert bounds(build_windows(make_rows(12, sent={6}), max_tokens=budget(5) - 1)) == [(6, 4, 7)]
+    print("+ Windows stop at the budget, centred where the thread allows")
+
+
+def test_window_gap_split():
+    """Test that a window never spans a silence longer than CHUNK_MAX_GAP"""
+    print("Testing window gap split...")
+    gap = message_chunks.CHUNK_MAX_GAP + timedelta(minutes=1)
+    with plain_rendering():
+        windows = build_windows(make_rows(12, sent={6}, gaps={5: gap}), max_tokens=budget(5))
+        assert bounds(windows) == [(6, 5, 9)]
+
+        # Exactly CHUNK_MAX_GAP is still one conversation
+        windows = build_windows(make_rows(12, sent={6}, gaps={5: message_chunks.CHUNK_MAX_GAP - timedelta(minutes=1)}),
+                                max_tokens=budget(5))
+        assert bounds(windows) == [(6, 4, 8)]
+    print("+ Window grows away from the silence instead")
+
+
+def test_overlapping_anchors():
+    """Test that covered anchors don't start windows and neighbouring windows overlap on shared context"""
+    print("Testing overlapping anchors...")
+    with plain_rendering():
+        windows = build_windows(make_rows(14, sent={3, 4, 7, 12}), max_tokens=budget(5))
+    assert bounds(windows) == [(3, 1, 5), (7, 5, 9), (12, 9, 13)]
+    assert all(any(w.start <= anchor <= w.end for w in windows) for anchor in (3, 4, 7, 12))
+    assert [len(window.rows) for window in windows] == [5, 5, 5]
+    print("+ Anchor 4 covered by anchor 3's window, later windows share their edge messages")
+
+
+class ChunkCursor:
+    """Serves one thread's messages and existing chunks; records deletes and inserts"""
+
+    def __init__(self, rows, existing):
+        self.rows = rows
+        self.existing = existing  # content_hash -> chunk id
+        self.deleted = []
+        self.inserted = []
+        self._result = []
+
+    def execute(self, sql, params=None):
+        if "FROM messages" in sql:
+            self._result = self.rows
+        elif sql.lstrip().startswith("SELECT id, content_hash"):
+            self._result = [(chunk_id, content_hash) for content_hash, chunk_id in self.existing.items()]
+        elif sql.lstrip().startswith("DELETE FROM message_chunks"):
+            self.deleted.extend(params[0])
+        elif "INSERT INTO message_chunks " in sql:
+            self.inserted.append({"anchor_message_id": params[3], "content_hash": params[9], "text": params[10]})
+
+    def fetchall(self):
+        return self._result
+
+
+def test_rechunk_diff():
+    """Test that only changed windows are re-embedded and stale chunks are deleted"""
+    print("Testing re-chunking diff...")
+    gap = message_chunks.CHUNK_MAX_GAP + timedelta(hours=1)
+    rows = make_rows(11, sent={1, 7}, gaps={5: gap})  # Two conversations, each well within CHUNK_MAX_TOKENS
+
+    with plain_rendering():
+        before = build_windows(rows[:10])
+        assert bounds(before) == [(1, 0, 4), (7, 5, 9)]
+        existing = {window.content_hash: f"chunk-{i}" for i, window in enumerate(before)}
+        existing["no-longer-rendered"] = "chunk-removed"  # e.g. its messages were deleted
+
+        # A reply lands in the second conversation
+        embedded = []
+        cur = ChunkCursor(rows, existing)
+        counts = rechunk_thread(cur, "t1", embed=lambda text: embedded.append(text) or [0.0])
+
+    assert counts == {"kept": 1, "added": 1, "deleted": 2}, counts
+    assert sorted(cur.deleted) == ["chunk-1", "chunk-removed"]
+    assert [chunk["anchor_message_id"] for chunk in cur.inserted] == ["t1-07"]
+    assert embedded == [cur.inserted[0]["text"]] and embedded[0].count("\n") == 5
+    print("+ Unchanged chunk kept with its embedding, changed one re-embedded, removed one deleted")
+
+
+if __name__ == "__main__":
+    test_window_budget_cut()
+    test_window_gap_split()
+    test_overlapping_anchors()
+    test_rechunk_diff()
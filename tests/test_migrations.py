@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Test the versioned migration list: ordering, concurrent steps and the derived embedding column backfill."""
+
+import sys
+import types
+import uuid
+
+# migrations imports database.engine, which needs DATABASE_URL; nothing here touches it
+sys.modules.setdefault("database", types.SimpleNamespace(engine=None))
+
+import migrations  # noqa: E402
+from migrations import MIGRATIONS, SCHEMA_VERSION, _backfill_derived_column  # noqa: E402
+from vector_index import EMBEDDING_TABLES, MATRYOSHKA_DIMENSIONS, STORAGE_HALFVEC  # noqa: E402
+
+
+class BackfillConnection:
+    """Serves keyset pages of ids per table and records the updated batches"""
+
+    def __init__(self, ids_by_table):
+        self.ids_by_table = ids_by_table
+        self.updated = []
+
+    def execute(self, statement, params):
+        sql = str(statement)
+        table = next(table for table in EMBEDDING_TABLES if f" {table} " in f"{sql} ")
+        ids = sorted(self.ids_by_table[table])
+        if sql.lstrip().startswith("SELECT"):
+            after = params["after"]
+            return [(id_,) for id_ in ids if after is None or id_ > after][:params["limit"]]
+        self.updated.append((table, list(params["ids"])))
+        return types.SimpleNamespace(rowcount=len(params["ids"]))
+
+
+def test_versions_are_sequential():
+    """Test that migration versions are unique, ordered and end at SCHEMA_VERSION"""
+    print("Testing migration versions...")
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+    assert SCHEMA_VERSION == versions[-1]
+    print(f"+ Versions 1-{SCHEMA_VERSION} in order")
+
+
+def test_concurrent_index_builds():
+    """Test that every CREATE INDEX CONCURRENTLY runs in a concurrent migration that lists its index"""
+    print("Testing concurrent index builds...")
+    for migration in MIGRATIONS:
+        for step in migration.steps:
+            if isinstance(step, str) and "CONCURRENTLY" in step:
+                assert migration.concurrent, migration.name
+                assert any(name in step for name in migration.indexes), (migration.name, step)
+    print("+ Concurrent builds only in autocommit migrations, invalid leftovers droppable")
+
+
+def test_compact_embedding_migrations():
+    """Test that the derived columns, their triggers and their indexes are created on every embedding table"""
+    print("Testing compact embedding migrations...")
+    for columns_name, indexes_name, column, column_type, kinds in (
+        ("compact_embedding_columns", "compact_embedding_indexes", "embedding_half", "halfvec(1536)", ("half", "bit")),
+        ("matryoshka_embedding_columns", "matryoshka_embedding_indexes", "embedding_short",
+         f"vector({MATRYOSHKA_DIMENSIONS})", ("short",)),
+    ):
+        columns = next(m for m in MIGRATIONS if m.name == columns_name)
+        sql = "\n".join(step for step in columns.steps if isinstance(step, str))
+        assert f"CREATE OR REPLACE FUNCTION sync_{column}()" in sql
+        for table in EMBEDDING_TABLES:
+            assert f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}" in sql
+            assert f"CREATE TRIGGER {table}_sync_{column}" in sql
+
+        indexes = next(m for m in MIGRATIONS if m.name == indexes_name)
+        assert indexes.version == columns.version + 1
+        assert indexes.concurrent and callable(indexes.steps[0])
+        assert sorted(indexes.indexes) == sorted(
+            f"{table}_embedding_{kind}_idx" for table in EMBEDDING_TABLES for kind in kinds
+        )
+    print("+ Columns, triggers, backfills and HNSW indexes versioned")
+
+
+def test_derived_column_backfill_batches():
+    """Test that the backfill walks each table's primary key in batches"""
+    print("Testing derived column backfill...")
+    ids = {table: [uuid.UUID(int=i) for i in range(5)] for table in EMBEDDING_TABLES}
+    ids["personality_docs"] = ids["personality_docs"][:2]
+    conn = BackfillConnection(ids)
+
+    batch_size = migrations.DERIVED_BACKFILL_BATCH_SIZE
+    migrations.DERIVED_BACKFILL_BATCH_SIZE = 2
+    try:
+        _backfill_derived_column(STORAGE_HALFVEC)(conn)
+    finally:
+        migrations.DERIVED_BACKFILL_BATCH_SIZE = batch_size
+
+    assert [(table, len(batch)) for table, batch in conn.updated] == [
+        ("messages", 2), ("messages", 2), ("messages", 1), ("personality_docs", 2),
+    ]
+    assert [id_ for _, batch in conn.updated[:3] for id_ in batch] == ids["messages"]
+    print("+ Every row visited once, one commit per batch")
+
+
+if __name__ == "__main__":
+    test_versions_are_sequential()
+    test_concurrent_index_builds()
+    test_compact_embedding_migrations()
+    test_derived_column_backfill_batches()
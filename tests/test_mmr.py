@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Test maximal-marginal-relevance re-ranking and where candidate embeddings come from."""
+
+from datetime import datetime
+
+import numpy as np
+
+import vector_engine
+from mmr import candidate_embeddings, diversify, mmr_order
+from vector_engine import InProcessVectorEngine
+
+
+def unit(*values, dimensions=4):
+    vector = np.zeros(dimensions, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+def test_near_duplicates_pushed_down():
+    """Test that a near-identical second hit loses to a less relevant but different one"""
+    print("Testing MMR ordering...")
+    embeddings = np.stack([unit(1, 0), unit(1, 0.01), unit(0, 1)])
+    relevance = np.array([0.90, 0.89, 0.70], dtype=np.float32)
+
+    assert mmr_order(relevance, embeddings, 3, mmr_lambda=1.0) == [0, 1, 2]
+    assert mmr_order(relevance, embeddings, 3, mmr_lambda=0.5) == [0, 2, 1]
+    assert mmr_order(relevance, embeddings, 2, mmr_lambda=0.5) == [0, 2]
+    assert mmr_order(relevance, embeddings, 0, mmr_lambda=0.5) == []
+    print("+ Near-duplicate demoted, lambda 1.0 keeps relevance order")
+
+
+def test_zero_norm_rows():
+    """Test that all-zero embeddings count as unlike everything instead of producing NaNs"""
+    embeddings = np.stack([unit(1, 0), np.zeros(4, dtype=np.float32), unit(1, 0.01)])
+    relevance = np.array([0.9, 0.5, 0.8], dtype=np.float32)
+
+    order = mmr_order(relevance, embeddings, 3, mmr_lambda=0.5)
+    assert sorted(order) == [0, 1, 2] and order[:2] == [0, 1], order
+    print("+ Zero-norm row picked on relevance alone")
+
+
+def test_diversify_drops_candidates_without_embeddings():
+    """Test that candidates missing an embedding are dropped, not failed on"""
+    candidates = [("a", 0.9), ("gone", 0.85), ("b", 0.8)]
+    embeddings = {"a": unit(1, 0), "b": unit(0, 1)}
+
+    assert diversify(candidates, embeddings, 3, 0.7) == ["a", "b"]
+    assert diversify(candidates, {}, 3, 0.7) == []
+    print("+ Candidates without embeddings dropped")
+
+
+class RecordingCursor:
+    """Records which message ids were fetched from the database; finds none of them"""
+
+    def __init__(self):
+        self.fetched = []
+
+    def execute(self, sql, params, binary=False):
+        self.fetched.extend(params[0])
+
+    def fetchall(self):
+        return []
+
+
+def test_candidate_embeddings_from_engine():
+    """Test that a loaded in-process engine serves candidate embeddings without a database query"""
+    print("Testing candidate embeddings...")
+    engine = InProcessVectorEngine(conn_string="postgresql://unused", sync_seconds=3600)
+    now = datetime(2025, 1, 1)
+    engine._append([
+        ("m1", "t1", now, "slack", True, 30, now, unit(3, 4, dimensions=1536)),
+        ("m2", "t1", now, "slack", False, 30, now, unit(0, 1, dimensions=1536)),
+    ])
+
+    previous = vector_engine._engine
+    vector_engine._engine = engine
+    try:
+        cursor = RecordingCursor()
+        embeddings = candidate_embeddings(cursor, ["m1", "m2", "unsynced"])
+        assert set(embeddings) == {"m1", "m2"}
+        assert cursor.fetched == ["unsynced"]  # Only what the engine hasn't synced yet
+        assert embeddings["m1"].dtype == np.float32
+        assert np.allclose(embeddings["m1"][:2], [0.6, 0.8], atol=1e-3)
+
+        # Vector-only engine searches have no cursor; unsynced candidates are just left out
+        assert set(candidate_embeddings(None, ["m2", "unsynced"])) == {"m2"}
+    finally:
+        vector_engine._engine = previous
+    print("+ Engine embeddings used, database only for unsynced messages, no cursor needed")
+
+
+if __name__ == "__main__":
+    test_near_duplicates_pushed_down()
+    test_zero_norm_rows()
+    test_diversify_drops_candidates_without_embeddings()
+    test_candidate_embeddings_from_engine()
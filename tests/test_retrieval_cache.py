@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Test retrieval cache keys and invalidation by new messages and personality doc changes."""
+
+import sys
+import types
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from retrieval_cache import KEY_EMBEDDING, KEY_TEXT, RetrievalResultCache
+from retrieval_options import RetrievalOptions
+
+COMPUTED_AT = datetime(2025, 6, 1, 12, 0)
+REFS = {
+    "messages": [
+        {"message_id": "m1", "thread_id": "t1", "day": "2025-05-30", "score": 0.9},
+        {"message_id": "m2", "thread_id": "t2", "day": "2025-05-30", "score": 0.8,
+         "start": "2025-05-30T23:50:00", "end": "2025-05-31T00:10:00"},
+    ],
+    "personality_docs": [],
+}
+
+
+class FakeDatabase:
+    """Stands in for database.engine: serves the personality doc fingerprint and new thread-days"""
+
+    def __init__(self):
+        self.fingerprint = (3, "abc")
+        self.new_thread_days = []
+
+    @contextmanager
+    def connect(self):
+        yield self
+
+    def execute(self, statement, params=None):
+        rows = [self.fingerprint] if "personality_docs" in str(statement) else self.new_thread_days
+        return types.SimpleNamespace(one=lambda: rows[0], all=lambda: list(rows))
+
+
+@contextmanager
+def fake_database():
+    database = FakeDatabase()
+    previous = sys.modules.get("database")
+    sys.modules["database"] = types.SimpleNamespace(engine=database)
+    try:
+        yield database
+    finally:
+        if previous is None:
+            del sys.modules["database"]
+        else:
+            sys.modules["database"] = previous
+
+
+def make_cache(**kwargs):
+    cache = RetrievalResultCache(sync_seconds=0, **kwargs)
+    cache.put("q", ["passage"], REFS, COMPUTED_AT)
+    return cache
+
+
+def test_embedding_key_uses_given_embedding():
+    """Test that embedding keys come from the caller's embedding and fall back to text without one"""
+    print("Testing cache keys...")
+    cache = RetrievalResultCache(key_mode=KEY_EMBEDDING)
+    options = RetrievalOptions()
+
+    near = cache.make_key("q1", options, "standard", embedding=[0.5000, 0.25])
+    assert near == cache.make_key("different words", options, "standard", embedding=[0.5001, 0.25])
+    assert near[0] == KEY_EMBEDDING
+    assert cache.make_key("Hello  World", options, "standard") == cache.make_key("hello world", options, "standard")
+    assert cache.make_key("hello", options, "standard")[0] == KEY_TEXT
+    assert cache.make_key("hello", options, "standard") != cache.make_key("hello", options, "enhanced")
+    print("+ Embedding keys need no API call, text key without an embedding")
+
+
+def test_new_message_in_covered_thread_day_invalidates():
+    """Test that a message landing in one of an entry's thread-days drops it, elsewhere doesn't"""
+    print("Testing thread-day invalidation...")
+    with fake_database() as database:
+        cache = make_cache()
+        database.new_thread_days = [("t9", date(2025, 5, 30), COMPUTED_AT + timedelta(minutes=5))]
+        cache.sync()
+        assert cache.get("q") is not None
+        print("+ Message in another thread kept the entry")
+
+        # Second day of t2's context window
+        database.new_thread_days = [("t2", date(2025, 5, 31), COMPUTED_AT + timedelta(minutes=5))]
+        cache.sync()
+        assert cache.get("q") is None and cache.invalidated == 1
+        print("+ Message in a covered thread-day dropped the entry")
+
+    # Messages written by this worker apply without a sync
+    cache = RetrievalResultCache(sync_seconds=3600)
+    cache.put("q", ["passage"], REFS, COMPUTED_AT)
+    cache.note_message("t1", datetime(2025, 5, 30, 18, 0), COMPUTED_AT + timedelta(minutes=1))
+    assert cache.get("q") is None
+    print("+ note_message invalidates immediately")
+
+
+def test_personality_doc_change_clears():
+    """Test that a changed personality doc fingerprint clears every entry"""
+    print("Testing personality doc invalidation...")
+    with fake_database() as database:
+        cache = make_cache()
+        cache.sync()  # First sync records the fingerprint
+        assert cache.get("q") is not None
+
+        cache.sync()
+        assert cache.get("q") is not None and cache.clears == 0
+
+        database.fingerprint = (3, "def")
+        cache.sync()
+        assert cache.get("q") is None and cache.clears == 1
+    print("+ Fingerprint change cleared the cache")
+
+
+if __name__ == "__main__":
+    test_embedding_key_uses_given_embedding()
+    test_new_message_in_covered_thread_day_invalidates()
+    test_personality_doc_change_clears()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Test per-request retrieval option overrides."""
+
+from retrieval_options import RetrievalOptions
+
+
+def test_with_overrides():
+    """Test that overrides replace only the given, non-None fields"""
+    print("Testing retrieval option overrides...")
+    base = RetrievalOptions(vector_weight=1.0, lexical_weight=0.0, rrf_k=60)
+
+    assert base.with_overrides(None) is base
+    assert base.with_overrides({}) is base
+
+    options = base.with_overrides({"lexical_weight": 0.5, "rrf_k": None})
+    assert options.lexical_weight == 0.5 and options.rrf_k == 60 and options.vector_weight == 1.0
+    assert options.hybrid and not base.hybrid
+    assert base.lexical_weight == 0.0  # Frozen base untouched
+    print("+ Non-None overrides applied to a copy")
+
+
+def test_unknown_override_rejected():
+    """Test that unknown keys raise ValueError naming them"""
+    try:
+        RetrievalOptions().with_overrides({"lexical_weigth": 1.0, "rrf_k": 10})
+        raise AssertionError("Expected ValueError for an unknown option")
+    except ValueError as e:
+        assert "lexical_weigth" in str(e) and "rrf_k" not in str(e)
+    print("+ Unknown options rejected")
+
+
+def test_options_hashable():
+    """Test that equal options hash equally, so they can key the retrieval cache"""
+    assert hash(RetrievalOptions().with_overrides({"rrf_k": 10})) == hash(RetrievalOptions(rrf_k=10))
+    assert RetrievalOptions(mmr_lambda=1.0).mmr is False and RetrievalOptions(mmr_lambda=0.5).mmr is True
+    print("+ Options hashable, mmr flag follows mmr_lambda")
+
+
+if __name__ == "__main__":
+    test_with_overrides()
+    test_unknown_override_rejected()
+    test_options_hashable()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Test the telemetry writer's batched flushes, drain on stop and queue-full drop metrics."""
+
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from models import ConversationSummary, QueryLog
+
+# telemetry binds database.engine at import; database itself needs a DATABASE_URL
+_database = sys.modules.get("database")
+sys.modules["database"] = SimpleNamespace(engine=None, get_session=None)
+try:
+    import telemetry
+    from telemetry import TelemetryWriter
+finally:
+    if _database is None:
+        del sys.modules["database"]
+    else:
+        sys.modules["database"] = _database
+
+
+class RecordingEngine:
+    """engine.begin() stand-in recording (table name, row count) per INSERT"""
+
+    def __init__(self, delay=0.0, fail_table=None):
+        self.delay = delay
+        self.fail_table = fail_table
+        self.inserts = []
+        self._lock = threading.Lock()
+
+    def begin(self):
+        engine = self
+
+        class Connection:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement, rows):
+                time.sleep(engine.delay)
+                if statement.table.name == engine.fail_table:
+                    raise RuntimeError("insert failed")
+                with engine._lock:
+                    engine.inserts.append((statement.table.name, len(rows)))
+
+        return Connection()
+
+
+def query_log(i):
+    return QueryLog(conversation_id=uuid.uuid4(), query_text=f"q{i}", response_text="a", model_used="test",
+                    context_used={}, tokens_used=0, latency_ms=0.0, ip_address=None, user_agent=None)
+
+
+def summary(i):
+    return ConversationSummary(conversation_id=uuid.uuid4(), summary=f"s{i}", updated_at=datetime(2025, 3, 1))
+
+
+def with_engine(engine, run):
+    recorded = telemetry.engine
+    telemetry.engine = engine
+    try:
+        return run()
+    finally:
+        telemetry.engine = recorded
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_batched_flush():
+    """Test that queued rows are written batch_size at a time with one INSERT per table per batch"""
+    print("Testing batched flush...")
+    engine = RecordingEngine()
+    writer = TelemetryWriter(max_queue=100, flush_interval_ms=200, batch_size=5)
+    for i in range(12):
+        writer.submit(query_log(i) if i % 3 else summary(i))
+
+    def run():
+        writer.start()
+        wait_for(lambda: writer.written == 12)
+        writer.stop()
+
+    with_engine(engine, run)
+    stats = writer.get_stats()
+    assert stats["flushes"] == 3 and stats["last_flush_rows"] == 2, stats  # 5 + 5, then the rest at the interval
+    assert len(engine.inserts) <= 2 * stats["flushes"]
+    assert sum(count for table, count in engine.inserts if table == "query_logs") == 8
+    assert sum(count for table, count in engine.inserts if table == "conversation_summaries") == 4
+    assert stats["written"] == stats["enqueued"] == 12 and stats["failed"] == 0
+    print("+ 3 flushes of at most 5 rows, rows grouped per table")
+
+
+def test_drain_on_stop():
+    """Test that stop() writes everything still queued before returning"""
+    print("Testing drain on stop...")
+    engine = RecordingEngine(delay=0.02)
+    writer = TelemetryWriter(max_queue=100, flush_interval_ms=200, batch_size=10)
+
+    def run():
+        writer.start()
+        for i in range(50):
+            writer.submit(query_log(i))
+        assert writer.get_stats()["queued"] > 0  # Slow inserts leave a backlog
+        writer.stop()
+
+    with_engine(engine, run)
+    stats = writer.get_stats()
+    assert not stats["running"] and stats["queued"] == 0
+    assert stats["written"] == 50 and sum(count for _, count in engine.inserts) == 50
+    print("+ 50 of 50 rows written by the time stop() returned")
+
+
+def test_queue_full_drops():
+    """Test that a full queue drops new rows without blocking and counts them"""
+    print("Testing queue-full drops...")
+    writer = TelemetryWriter(max_queue=3, flush_interval_ms=50, batch_size=10)
+    assert [writer.submit(query_log(i)) for i in range(5)] == [True, True, True, False, False]
+    stats = writer.get_stats()
+    assert (stats["enqueued"], stats["dropped"], stats["queued"], stats["high_water_mark"]) == (3, 2, 3, 3)
+
+    engine = RecordingEngine()
+
+    def run():
+        writer.start()
+        writer.stop()
+
+    with_engine(engine, run)
+    stats = writer.get_stats()
+    assert stats["written"] == 3 and stats["dropped"] == 2
+    assert writer.submit(query_log(5))  # Room again once drained
+    print("+ Overflow dropped and counted, queued rows still written")
+
+
+def test_failed_insert_counted():
+    """Test that a failing table's rows are counted as failed without losing the other tables"""
+    print("Testing failed inserts...")
+    engine = RecordingEngine(fail_table="conversation_summaries")
+    writer = TelemetryWriter(max_queue=10, flush_interval_ms=50, batch_size=10)
+    for i in range(4):
+        writer.submit(query_log(i) if i % 2 else summary(i))
+    with_engine(engine, lambda: writer._flush([writer._queue.get_nowait() for _ in range(4)]))
+    assert (writer.written, writer.failed) == (2, 2)
+    assert engine.inserts == [("query_logs", 2)]
+    print("+ 2 written, 2 failed")
+
+
+if __name__ == "__main__":
+    test_batched_flush()
+    test_drain_on_stop()
+    test_queue_full_drops()
+    test_failed_insert_counted()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Test routed search SQL against vector_search_sql's row shape and the centroid refresh watermarks."""
+
+import re
+import sys
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import thread_centroids
+from thread_centroids import LEVEL_THREAD, LEVEL_THREAD_DAY, refresh_centroids, refresh_thread_day, routed_search_sql
+from vector_index import STORAGE_FLOAT32, vector_search_sql
+
+COLUMNS = "id, thread_id, message_text, timestamp"
+WHERE = "AND sent = true"
+EMBEDDING = [0.1] * 1536
+
+
+def outer_select_list(sql):
+    """Column list of the top-level SELECT (outside CTEs and subqueries)"""
+    depth = 0
+    for match in re.finditer(r"[()]|\bSELECT\b|\bFROM\b", sql):
+        token = match.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token == "SELECT":
+            start = match.end()
+        elif depth == 0 and token == "FROM":
+            return [column.strip() for column in sql[start:match.start()].split(",")]
+    raise AssertionError("no top-level SELECT")
+
+
+def test_routed_row_shape():
+    """Test that both routing levels return vector_search_sql's columns, distance and limit"""
+    print("Testing routed search row shape...")
+    flat_sql, flat_params = vector_search_sql(COLUMNS, "messages", WHERE, EMBEDDING, 20, mode=STORAGE_FLOAT32)
+    for level in (LEVEL_THREAD, LEVEL_THREAD_DAY):
+        sql, params = routed_search_sql(COLUMNS, WHERE, EMBEDDING, 20, 50, level=level)
+        assert outer_select_list(sql) == outer_select_list(flat_sql), outer_select_list(sql)
+        assert sql.count("%s") == len(params)
+        assert params == (EMBEDDING, 50, EMBEDDING, 20)
+        assert params[-1] == flat_params[-1]  # Same row limit
+        assert WHERE in sql.split("candidates AS MATERIALIZED", 1)[1]
+    thread_sql, _ = routed_search_sql(COLUMNS, WHERE, EMBEDDING, 20, 50, level=LEVEL_THREAD)
+    day_sql, _ = routed_search_sql(COLUMNS, WHERE, EMBEDDING, 20, 50, level=LEVEL_THREAD_DAY)
+    assert "FROM thread_centroids" in thread_sql and "routed.day" not in thread_sql
+    assert "FROM thread_day_centroids" in day_sql and "timestamp < routed.day + 1" in day_sql
+    print("+ Both levels select (columns..., distance) like flat search")
+
+
+def test_unknown_level_raises():
+    """Test that an unknown routing level is rejected rather than silently searching flat"""
+    print("Testing unknown routing level...")
+    try:
+        routed_search_sql(COLUMNS, WHERE, EMBEDDING, 20, 50, level="thread_week")
+    except ValueError as e:
+        assert "thread_week" in str(e)
+    else:
+        raise AssertionError("Expected ValueError")
+    print("+ ValueError names the level")
+
+
+class RecordingEngine:
+    """sqlalchemy engine stand-in: begin() yields a connection that records statements"""
+
+    def __init__(self, watermark):
+        self.watermark = watermark
+        self.executed = []
+
+    def begin(self):
+        engine = self
+
+        class Connection:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement, params=None):
+                engine.executed.append((str(statement), params))
+                return SimpleNamespace(scalar=lambda: engine.watermark, rowcount=1)
+
+        return Connection()
+
+
+def with_engine(engine, run):
+    database = sys.modules.get("database")
+    sys.modules["database"] = SimpleNamespace(engine=engine)
+    try:
+        return run()
+    finally:
+        if database is None:
+            del sys.modules["database"]
+        else:
+            sys.modules["database"] = database
+
+
+def test_refresh_lateness_window():
+    """Test that refresh resumes CENTROID_LATENESS before the watermark, and from the epoch when full"""
+    print("Testing refresh lateness window...")
+    watermark = datetime(2025, 3, 1, 12, 0)
+    engine = RecordingEngine(watermark)
+    result = with_engine(engine, refresh_centroids)
+    assert result["since"] == watermark - thread_centroids.CENTROID_LATENESS == watermark - timedelta(minutes=60)
+    days_sql, days_params = engine.executed[1]
+    assert days_sql == thread_centroids.REFRESH_THREAD_DAYS_SQL and days_params["since"] == result["since"]
+    assert engine.executed[2][1]["refreshed_at"] == days_params["refreshed_at"]  # Threads of just-refreshed days
+
+    engine = RecordingEngine(watermark)
+    result = with_engine(engine, lambda: refresh_centroids(full=True))
+    assert result["since"] == thread_centroids.EPOCH
+    assert "MAX(source_watermark)" not in engine.executed[0][0]
+    print("+ 60-minute lateness window, full refresh from the epoch")
+
+
+def test_ingest_refresh_keeps_watermark():
+    """Test that the ingest hook re-sums one thread-day without moving refresh's watermark"""
+    print("Testing ingest centroid refresh...")
+    engine = RecordingEngine(None)
+    with_engine(engine, lambda: refresh_thread_day("conversation-1", date(2025, 3, 1)))
+    (day_sql, day_params), (thread_sql, thread_params) = engine.executed
+    assert day_params["thread_id"] == "conversation-1" and day_params["day"] == date(2025, 3, 1)
+    assert day_params["epoch"] == thread_centroids.EPOCH
+    assert "source_watermark = thread_day_centroids.source_watermark" in day_sql
+    assert "MAX(m.created_at)" not in day_sql
+    assert thread_sql == thread_centroids.REFRESH_THREADS_SQL
+    assert thread_params["refreshed_at"] == day_params["refreshed_at"]
+    assert "source_watermark = EXCLUDED.source_watermark" in thread_centroids.REFRESH_THREAD_DAYS_SQL
+    print("+ New rows carry the epoch, existing rows keep their watermark")
+
+
+if __name__ == "__main__":
+    test_routed_row_shape()
+    test_unknown_level_raises()
+    test_refresh_lateness_window()
+    test_ingest_refresh_keeps_watermark()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Test rendered thread-day caching: reuse while a thread-day's version holds, re-render once it is bumped."""
+
+import sys
+import types
+from contextlib import contextmanager
+from datetime import date
+
+import thread_day_cache
+from thread_day_cache import ThreadDayPassageCache, render_thread_days
+
+DAY = date(2025, 5, 30)
+
+
+class VersionCursor:
+    """Answers the thread_day_versions lookup from a dict"""
+
+    def __init__(self, versions):
+        self.versions = versions
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        assert "thread_day_versions" in sql
+        self._rows = [(thread_id, day, version) for (thread_id, day), version in self.versions.items()]
+
+    def fetchall(self):
+        return self._rows
+
+
+@contextmanager
+def fake_retrievers(messages):
+    """Stands in for retrievers (which needs a database) and records which thread-days get fetched"""
+    fetched = []
+
+    def fetch_thread_day_messages(cur, thread_dates):
+        fetched.extend(thread_dates)
+        return [(thread_id, day, text) for thread_id, day in thread_dates for text in messages[(thread_id, day)]]
+
+    def format_context_messages(rows):
+        lines = []
+        for thread_id, day, text in rows:
+            header = f"\n=== Thread {thread_id} - {day} ==="
+            if header not in lines:
+                lines.append(header)
+            lines.append(text)
+        return lines
+
+    previous = sys.modules.get("retrievers")
+    sys.modules["retrievers"] = types.SimpleNamespace(
+        fetch_thread_day_messages=fetch_thread_day_messages, format_context_messages=format_context_messages,
+    )
+    previous_cache = thread_day_cache._thread_day_cache
+    thread_day_cache._thread_day_cache = ThreadDayPassageCache(max_entries=10)
+    try:
+        yield fetched
+    finally:
+        thread_day_cache._thread_day_cache = previous_cache
+        if previous is None:
+            del sys.modules["retrievers"]
+        else:
+            sys.modules["retrievers"] = previous
+
+
+def test_version_bump_rerenders_block():
+    """Test that cached blocks are reused until thread_day_versions moves, then rendered afresh"""
+    print("Testing thread-day version invalidation...")
+    messages = {("a", DAY): ["Someone: hi"], ("b", DAY): ["Matt: ok"]}
+    cur = VersionCursor({("a", DAY): 1, ("b", DAY): 4})
+
+    with fake_retrievers(messages) as fetched:
+        first = render_thread_days(cur, [("b", DAY), ("a", DAY)])
+        assert first == ["\n=== Thread a - 2025-05-30 ===", "Someone: hi", "\n=== Thread b - 2025-05-30 ===", "Matt: ok"]
+        assert len(fetched) == 2
+
+        assert render_thread_days(cur, [("a", DAY), ("b", DAY)]) == first
+        assert len(fetched) == 2
+        print("+ Unchanged versions served from the cache")
+
+        # A message lands in thread a; the trigger bumps its version
+        messages[("a", DAY)].append("Someone: new message")
+        cur.versions[("a", DAY)] = 2
+        second = render_thread_days(cur, [("a", DAY), ("b", DAY)])
+        assert second[:3] == ["\n=== Thread a - 2025-05-30 ===", "Someone: hi", "Someone: new message"]
+        assert fetched[2:] == [("a", DAY)]
+        print("+ Bumped thread-day re-rendered, the other still cached")
+
+        stats = thread_day_cache.get_thread_day_cache().get_stats()
+        assert (stats["hits"], stats["misses"]) == (3, 3)
+
+
+def test_unversioned_thread_day_uses_version_zero():
+    """Test that thread-days with no thread_day_versions row are still cached (as version 0)"""
+    print("Testing unversioned thread-days...")
+    cur = VersionCursor({})
+    with fake_retrievers({("a", DAY): ["Someone: hi"]}) as fetched:
+        render_thread_days(cur, [("a", DAY)])
+        render_thread_days(cur, [("a", DAY)])
+        assert fetched == [("a", DAY)]
+        assert thread_day_cache.get_thread_day_cache().get(("a", DAY, 0)) is not None
+    print("+ Version 0 key reused")
+
+
+if __name__ == "__main__":
+    test_version_bump_rerenders_block()
+    test_unversioned_thread_day_uses_version_zero()
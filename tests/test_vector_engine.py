@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Test the in-process vector engine's filters, watermark-overlap dedup and ordering on an in-memory corpus."""
+
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from corpus_snapshot import CorpusSnapshot
+from vector_engine import EMBEDDING_DIMENSIONS, InProcessVectorEngine
+
+START = datetime(2025, 3, 1, 9, 0)
+SOURCES = ["slack", "email", "sms"]
+
+
+def make_rows(count, seed, offset=0):
+    """(id, thread_id, timestamp, source, sent, length, created_at, embedding) rows, as _fetch yields them"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(offset, offset + count):
+        created_at = START + timedelta(minutes=i)
+        rows.append((
+            str(uuid.UUID(int=i + 1)), f"thread-{i % 7}", created_at, SOURCES[i % 3], i % 2 == 0,
+            10 + (i * 37) % 200, created_at, rng.standard_normal(EMBEDDING_DIMENSIONS).tolist(),
+        ))
+    return rows
+
+
+def make_snapshot(rows):
+    """CorpusSnapshot over in-memory arrays, laid out like export_snapshot writes them"""
+    vectors = np.asarray([row[7] for row in rows], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    threads = sorted({row[1] for row in rows})
+    manifest = {
+        "rows": len(rows), "watermark": max(row[6] for row in rows).isoformat(),
+        "threads": threads, "sources": SOURCES,
+    }
+    arrays = {
+        "embeddings": vectors.astype(np.float16),
+        "ids": np.asarray([row[0] for row in rows], dtype="U36"),
+        "thread_codes": np.asarray([threads.index(row[1]) for row in rows], dtype=np.int32),
+        "timestamps": np.asarray([row[2] for row in rows], dtype="datetime64[us]"),
+        "thread_days": np.asarray([row[2].date() for row in rows], dtype="datetime64[D]"),
+        "source_codes": np.asarray([SOURCES.index(row[3]) for row in rows], dtype=np.int16),
+        "sent": np.asarray([row[4] for row in rows], dtype=bool),
+        "lengths": np.asarray([row[5] for row in rows], dtype=np.int32),
+    }
+    return CorpusSnapshot(Path("memory"), manifest, arrays)
+
+
+def make_engine(feed):
+    """Engine whose change feed serves `feed` (rows at or after `since`) instead of Postgres"""
+    engine = InProcessVectorEngine(conn_string="postgresql://unused", sync_seconds=3600)
+    engine._fetch = lambda since: iter([[row for row in feed if since is None or row[6] >= since]])
+    return engine
+
+
+def exact_search(rows, query, limit, keep=lambda row: True):
+    """Reference float32 cosine top-k"""
+    rows = [row for row in rows if keep(row)]
+    vectors = np.asarray([row[7] for row in rows], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = np.asarray(query, dtype=np.float32) / np.linalg.norm(query)
+    scores = vectors @ query
+    order = np.argsort(-scores)[:limit]
+    return [rows[i][0] for i in order], [float(1.0 - scores[i]) for i in order]
+
+
+def test_filter_masks():
+    """Test the source, sent and min_length masks alone and combined"""
+    print("Testing filter masks...")
+    lengths = np.array([5, 50, 100, 150])
+    source_codes = np.array([0, 1, 0, 2])
+    sent = np.array([True, False, True, False])
+    mask = InProcessVectorEngine._filter_mask
+
+    assert mask(lengths, source_codes, sent, 0, None, None).tolist() == [True] * 4
+    assert mask(lengths, source_codes, sent, 50, None, None).tolist() == [False, False, True, True]  # Strictly longer
+    assert mask(lengths, source_codes, sent, 0, 0, None).tolist() == [True, False, True, False]
+    assert mask(lengths, source_codes, sent, 0, -1, None).tolist() == [False] * 4  # Unknown source
+    assert mask(lengths, source_codes, sent, 0, None, False).tolist() == [False, True, False, True]
+    assert mask(lengths, source_codes, sent, 50, 0, True).tolist() == [False, False, True, False]
+
+    rows = make_rows(60, seed=1)
+    engine = make_engine(rows)
+    engine.load()
+    query = make_rows(1, seed=2)[0][7]
+    for source, sent_flag, min_length in [("email", None, 0), (None, True, 0), (None, None, 120),
+                                          ("sms", False, 60), ("fax", None, 0)]:
+        results = engine.search(query, 100, min_length=min_length, source=source, sent=sent_flag)
+        expected = {
+            row[0] for row in rows
+            if (source is None or row[3] == source) and (sent_flag is None or row[4] == sent_flag)
+            and row[5] > min_length
+        }
+        assert {result[0] for result in results} == expected, (source, sent_flag, min_length)
+    print("+ Each filter and their combination keep exactly the matching rows")
+
+
+def test_sync_overlap_dedup():
+    """Test that rows re-read behind the watermark are not appended twice, snapshot rows included"""
+    print("Testing watermark overlap dedup...")
+    snapshot_rows = make_rows(20, seed=3)
+    newer_rows = make_rows(5, seed=4, offset=20)
+    engine = make_engine(snapshot_rows + newer_rows)
+
+    engine.load_snapshot(make_snapshot(snapshot_rows))
+    # The catch-up read 60s behind the snapshot watermark, which covers its last row
+    assert engine.size == 25 and engine._size == 5, (engine.size, engine._size)
+    assert engine._row_by_id[snapshot_rows[0][0]] == -1
+    assert engine._row_by_id[snapshot_rows[19][0]] == -20
+    assert engine._row_by_id[newer_rows[0][0]] == 0
+    assert engine.watermark == newer_rows[-1][6]
+
+    # A later sync re-reads the last delta rows and appends only what is new
+    latest = make_rows(2, seed=5, offset=25)
+    engine._fetch = make_engine(snapshot_rows + newer_rows + latest)._fetch
+    assert engine.sync() == 2
+    assert engine.sync() == 0
+    assert engine.size == 27
+
+    # get_embeddings resolves both segments
+    embeddings = engine.get_embeddings([snapshot_rows[3][0], latest[1][0], "unknown"])
+    assert set(embeddings) == {snapshot_rows[3][0], latest[1][0]}
+    expected = np.asarray(snapshot_rows[3][7]) / np.linalg.norm(snapshot_rows[3][7])
+    assert np.allclose(embeddings[snapshot_rows[3][0]], expected, atol=1e-3)
+    print("+ Overlapping rows skipped, snapshot ids stored as -1 - i")
+
+
+def test_ordering_matches_exact_search():
+    """Test that float16 search across snapshot and delta ranks like an exact float32 search"""
+    print("Testing ordering against exact float32 search...")
+    snapshot_rows = make_rows(400, seed=6)
+    delta_rows = make_rows(200, seed=7, offset=400)
+    engine = make_engine(snapshot_rows + delta_rows)
+    engine.load_snapshot(make_snapshot(snapshot_rows))
+    corpus = snapshot_rows + delta_rows
+
+    rng = np.random.default_rng(8)
+    for _ in range(5):
+        # Queries near a corpus row, so the top hits are well separated from the rest
+        anchor = corpus[int(rng.integers(len(corpus)))][7]
+        query = (np.asarray(anchor) + 0.8 * rng.standard_normal(EMBEDDING_DIMENSIONS)).tolist()
+        cases = [(lambda row: True, {}), (lambda row: row[3] == "slack" and row[4], {"source": "slack", "sent": True})]
+        for keep, filters in cases:
+            results = engine.search(query, 10, **filters)
+            expected_ids, expected_distances = exact_search(corpus, query, 10, keep)
+            assert [result[0] for result in results] == expected_ids
+            assert np.allclose([result[3] for result in results], expected_distances, atol=2e-3)
+    print("+ Same nearest neighbours and distances within float16 rounding")
+
+
+if __name__ == "__main__":
+    test_filter_masks()
+    test_sync_overlap_dedup()
+    test_ordering_matches_exact_search()
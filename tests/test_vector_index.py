@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Test shortlist query building and the ef_search floor for shortlist storage modes."""
+
+import vector_index
+from vector_index import (
+    STORAGE_BINARY, STORAGE_FLOAT32, STORAGE_MATRYOSHKA, ensure_shortlist_ef_search, shortlist_size, vector_search_sql,
+)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+def test_shortlist_limit():
+    """Test that shortlist modes fetch limit * rerank_factor candidates before re-ranking"""
+    print("Testing shortlist size...")
+    embedding = [0.1] * 1536
+    for mode in (STORAGE_BINARY, STORAGE_MATRYOSHKA):
+        _, params = vector_search_sql("id", "messages", "", embedding, 20, mode=mode, rerank_factor=10, dimensions=256)
+        assert params[-2:] == (200, 20), params[-2:]
+    assert shortlist_size(20, 10) == 200
+    print("+ 200-row shortlist re-ranked to 20")
+
+
+def test_matryoshka_uses_recorded_dimensions():
+    """Test that Matryoshka queries are truncated to the migrated column's width, not a configured one"""
+    print("Testing Matryoshka width...")
+    recorded = vector_index._matryoshka_dimensions
+    vector_index._matryoshka_dimensions = 128  # As read from messages.embedding_short's type
+    try:
+        sql, _ = vector_search_sql("id", "messages", "", [0.1] * 1536, 20, mode=STORAGE_MATRYOSHKA)
+    finally:
+        vector_index._matryoshka_dimensions = recorded
+    assert "subvector(%s::vector, 1, 128))::vector(128)" in sql
+    assert "vector(256)" not in sql
+    print("+ Query truncated to the recorded vector(128)")
+
+
+def test_ensure_shortlist_ef_search():
+    """Test that ef_search is raised to the shortlist size for shortlist modes only"""
+    print("Testing ef_search floor...")
+    cur = RecordingCursor()
+    ensure_shortlist_ef_search(cur, 20, mode=STORAGE_BINARY, rerank_factor=10)
+    ensure_shortlist_ef_search(cur, 15, mode=STORAGE_MATRYOSHKA, rerank_factor=4)
+    assert [params for _, params in cur.executed] == [(200,), (60,)]
+    assert all("GREATEST" in sql and "hnsw.ef_search" in sql for sql, _ in cur.executed)
+
+    cur = RecordingCursor()
+    ensure_shortlist_ef_search(cur, 20, mode=STORAGE_FLOAT32)
+    assert cur.executed == []
+    print("+ ef_search at least the shortlist, nothing set for exact-index modes")
+
+
+if __name__ == "__main__":
+    test_shortlist_limit()
+    test_matryoshka_uses_recorded_dimensions()
+    test_ensure_shortlist_ef_search()
@@ -0,0 +1,189 @@
+"""
+Thread Centroids Service for Matt-GPT
+Coarse per-thread / per-thread-day centroid index for two-stage routed vector search
+"""
+
+import os
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LEVEL_THREAD = "thread"
+LEVEL_THREAD_DAY = "thread_day"
+ROUTING_LEVELS = (LEVEL_THREAD, LEVEL_THREAD_DAY)
+
+# Re-sum a conversation's thread-day on ingest (needs migrations 10 and 11); other messages wait for `refresh`
+THREAD_CENTROIDS_ENABLED = os.getenv("THREAD_CENTROIDS_ENABLED", "false").lower() == "true"
+# Granularity of stage one; whole threads can hold tens of thousands of SMS, so thread-days are the default
+CENTROID_ROUTING_LEVEL = os.getenv("CENTROID_ROUTING_LEVEL", LEVEL_THREAD_DAY)
+# Thread-days whose messages arrived this long before the newest aggregated one are re-summed
+# (covers inserts that commit out of created_at order)
+CENTROID_LATENESS = timedelta(minutes=float(os.getenv("CENTROID_LATENESS_MINUTES", "60")))
+EPOCH = datetime(1970, 1, 1)
+
+# Embeddings are unit length, so the cosine direction of the sum equals that of the mean:
+# the sum is stored and searched directly, with no normalization pass.
+THREAD_DAYS_SQL = """
+WITH touched AS ({touched})
+INSERT INTO thread_day_centroids (thread_id, day, embedding_sum, message_count, source_watermark, updated_at)
+SELECT m.thread_id, touched.day, SUM(m.embedding), COUNT(*), {watermark}, :refreshed_at
+FROM messages m
+JOIN touched ON m.thread_id = touched.thread_id
+    AND m.timestamp >= touched.day AND m.timestamp < touched.day + 1
+WHERE m.embedding IS NOT NULL
+GROUP BY m.thread_id, touched.day
+ON CONFLICT (thread_id, day) DO UPDATE SET
+    embedding_sum = EXCLUDED.embedding_sum,
+    message_count = EXCLUDED.message_count,
+    source_watermark = {watermark_update},
+    updated_at = EXCLUDED.updated_at
+"""
+
+REFRESH_THREAD_DAYS_SQL = THREAD_DAYS_SQL.format(
+    touched="""
+    SELECT DISTINCT thread_id, DATE(timestamp) AS day
+    FROM messages
+    WHERE created_at >= :since AND thread_id IS NOT NULL AND embedding IS NOT NULL
+    """,
+    watermark="MAX(m.created_at)",
+    watermark_update="EXCLUDED.source_watermark",
+)
+
+# The ingest hook must not advance the watermark `refresh` resumes from: other threads' messages
+# below it would never be summed. New rows get the epoch and keep whatever `refresh` later records.
+REFRESH_THREAD_DAY_SQL = THREAD_DAYS_SQL.format(
+    touched="SELECT CAST(:thread_id AS VARCHAR) AS thread_id, CAST(:day AS DATE) AS day",
+    watermark="CAST(:epoch AS TIMESTAMP)",
+    watermark_update="thread_day_centroids.source_watermark",
+)
+
+REFRESH_THREADS_SQL = """
+INSERT INTO thread_centroids (thread_id, embedding_sum, message_count, day_count, updated_at)
+SELECT thread_id, SUM(embedding_sum), SUM(message_count), COUNT(*), :refreshed_at
+FROM thread_day_centroids
+WHERE thread_id IN (SELECT thread_id FROM thread_day_centroids WHERE updated_at = :refreshed_at)
+GROUP BY thread_id
+ON CONFLICT (thread_id) DO UPDATE SET
+    embedding_sum = EXCLUDED.embedding_sum,
+    message_count = EXCLUDED.message_count,
+    day_count = EXCLUDED.day_count,
+    updated_at = EXCLUDED.updated_at
+"""
+
+
+def refresh_centroids(full: bool = False) -> dict:
+    """
+    Incrementally refresh thread_day_centroids and thread_centroids
+
+    Every thread-day that received a message since the newest aggregated
+    created_at (minus CENTROID_LATENESS) is re-summed from scratch, which is
+    idempotent, and the threads owning those days are re-derived from their
+    day rows. Messages without a thread_id can't be routed to and are skipped.
+
+    Args:
+        full: re-aggregate every thread-day (e.g. after a re-embed or deletes)
+    """
+    from database import engine
+
+    refreshed_at = datetime.utcnow()
+    with engine.begin() as conn:
+        watermark = None if full else conn.execute(
+            text("SELECT MAX(source_watermark) FROM thread_day_centroids")
+        ).scalar()
+        since = watermark - CENTROID_LATENESS if watermark else EPOCH
+
+        days = conn.execute(text(REFRESH_THREAD_DAYS_SQL), {"since": since, "refreshed_at": refreshed_at}).rowcount
+        threads = conn.execute(text(REFRESH_THREADS_SQL), {"refreshed_at": refreshed_at}).rowcount
+
+    logger.info(f"Refreshed centroids since {since}: {days} thread-days, {threads} threads")
+    return {"since": since, "thread_days": days, "threads": threads}
+
+
+def refresh_thread_day(thread_id: str, day: date) -> dict:
+    """Re-sum one thread-day and its thread (ingest hook), leaving the refresh watermark alone"""
+    from database import engine
+
+    refreshed_at = datetime.utcnow()
+    with engine.begin() as conn:
+        days = conn.execute(text(REFRESH_THREAD_DAY_SQL), {
+            "thread_id": thread_id, "day": day, "epoch": EPOCH, "refreshed_at": refreshed_at,
+        }).rowcount
+        threads = conn.execute(text(REFRESH_THREADS_SQL), {"refreshed_at": refreshed_at}).rowcount
+    return {"thread_days": days, "threads": threads}
+
+
+def routed_search_sql(columns: str, where: str, embedding: list, limit: int, top_n: int,
+                      level: Optional[str] = None) -> Tuple[str, tuple]:
+    """
+    Two-stage nearest-neighbour query over messages
+
+    Stage one picks the top_n nearest thread (or thread-day) centroids via
+    their small HNSW index; stage two ranks only those threads' messages
+    exactly. The candidate set is MATERIALIZED so the planner cannot fall
+    back to a filtered scan of the message-level HNSW index.
+
+    Args:
+        columns: plain comma-separated messages columns; a cosine `distance` column is appended
+        where: extra conditions on messages starting with AND (may be empty)
+
+    Returns:
+        Tuple of (sql, params) in vector_search_sql's row shape
+    """
+    level = level or CENTROID_ROUTING_LEVEL
+    if level == LEVEL_THREAD:
+        routed = """
+            SELECT thread_id FROM thread_centroids
+            ORDER BY embedding_sum <=> %s::vector
+            LIMIT %s
+        """
+        day_filter = ""
+    elif level == LEVEL_THREAD_DAY:
+        routed = """
+            SELECT thread_id, day FROM thread_day_centroids
+            ORDER BY embedding_sum <=> %s::vector
+            LIMIT %s
+        """
+        day_filter = "AND timestamp >= routed.day AND timestamp < routed.day + 1"
+    else:
+        raise ValueError(f"Unknown routing level '{level}' (expected one of {', '.join(ROUTING_LEVELS)})")
+
+    sql = f"""
+    WITH routed AS ({routed}),
+    candidates AS MATERIALIZED (
+        SELECT {columns}, embedding
+        FROM messages
+        JOIN routed USING (thread_id)
+        WHERE embedding IS NOT NULL {day_filter} {where}
+    )
+    SELECT {columns}, (embedding <=> %s::vector) as distance
+    FROM candidates
+    ORDER BY distance
+    LIMIT %s
+    """
+    return sql, (embedding, top_n, embedding, limit)
+
+
+def centroid_stats() -> dict:
+    from database import engine
+
+    with engine.connect() as conn:
+        days, day_messages, last_refresh = conn.execute(text(
+            "SELECT COUNT(*), COALESCE(SUM(message_count), 0), MAX(updated_at) FROM thread_day_centroids"
+        )).one()
+        threads = conn.execute(text("SELECT COUNT(*) FROM thread_centroids")).scalar()
+        embedded = conn.execute(text(
+            "SELECT COUNT(*) FROM messages WHERE embedding IS NOT NULL AND thread_id IS NOT NULL"
+        )).scalar()
+    return {
+        "threads": threads,
+        "thread_days": days,
+        "messages_covered": day_messages,
+        "messages_routable": embedded,
+        "avg_messages_per_thread_day": round(day_messages / days, 1) if days else 0.0,
+        "last_refresh": last_refresh,
+    }
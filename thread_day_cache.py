@@ -0,0 +1,129 @@
+"""
+Thread-Day Cache Service for Matt-GPT
+LRU of rendered thread-day passages keyed by (thread_id, day, version)
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+THREAD_DAY_CACHE_SIZE = int(os.getenv("THREAD_DAY_CACHE_SIZE", "2000"))
+
+ThreadDayKey = Tuple[str, date, int]
+
+
+class ThreadDayPassageCache:
+    """
+    Per-worker LRU of format_context_messages output for single thread-days
+
+    thread_day_versions.version is bumped by a trigger whenever messages are
+    inserted into a thread-day, so a key never goes stale: new messages make
+    the old key unreachable and it ages out of the LRU.
+    """
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[ThreadDayKey, Tuple[str, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls) -> "ThreadDayPassageCache":
+        return cls(max_entries=THREAD_DAY_CACHE_SIZE)
+
+    def get(self, key: ThreadDayKey) -> Optional[Tuple[str, ...]]:
+        with self._lock:
+            lines = self._entries.get(key)
+            if lines is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return lines
+
+    def put(self, key: ThreadDayKey, lines: List[str]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = tuple(lines)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+        }
+
+
+_thread_day_cache: Optional[ThreadDayPassageCache] = None
+
+
+def get_thread_day_cache() -> ThreadDayPassageCache:
+    """This worker's rendered thread-day cache"""
+    global _thread_day_cache
+    if _thread_day_cache is None:
+        _thread_day_cache = ThreadDayPassageCache.from_env()
+    return _thread_day_cache
+
+
+def thread_day_versions(cur, thread_dates: List[Tuple[str, date]]) -> Dict[Tuple[str, date], int]:
+    """Current version of each thread-day in one query (0 for thread-days never inserted into since migration 14)"""
+    if not thread_dates:
+        return {}
+    cur.execute("""
+        SELECT thread_id, day, version
+        FROM thread_day_versions
+        WHERE (thread_id, day) IN (SELECT * FROM unnest(%s::text[], %s::date[]))
+    """, ([thread_id for thread_id, _ in thread_dates], [day for _, day in thread_dates]))
+    versions = {(thread_id, day): version for thread_id, day, version in cur.fetchall()}
+    return {thread_day: versions.get(thread_day, 0) for thread_day in thread_dates}
+
+
+def render_thread_days(cur, thread_dates: Iterable[Tuple[str, date]]) -> List[str]:
+    """
+    format_context_messages(fetch_thread_day_messages(cur, thread_dates)), cached per thread-day
+
+    Cached thread-days cost neither their context query nor their
+    formatting; only the version lookup runs, once for all of them. Blocks
+    are emitted in format_context_messages' header order, so the result is
+    identical to rendering everything at once.
+    """
+    from retrievers import fetch_thread_day_messages, format_context_messages
+
+    cache = get_thread_day_cache()
+    thread_dates = sorted(set(thread_dates))
+    versions = thread_day_versions(cur, thread_dates)
+
+    blocks = []
+    rendered = 0
+    for thread_id, day in thread_dates:
+        key = (thread_id, day, versions[(thread_id, day)])
+        lines = cache.get(key)
+        if lines is None:
+            lines = format_context_messages(fetch_thread_day_messages(cur, [(thread_id, day)]))
+            cache.put(key, lines)
+            rendered += 1
+        if lines:
+            blocks.append(lines)
+
+    logger.debug(f"Rendered {rendered} of {len(thread_dates)} thread-days ({len(thread_dates) - rendered} cached)")
+    # Each block is one '\n=== header ===' group
+    return [line for block in sorted(blocks, key=lambda block: block[0]) for line in block]
@@ -0,0 +1,365 @@
+"""
+Vector Engine Service for Matt-GPT
+In-process float16 mirror of message embeddings for sub-millisecond vector search
+"""
+
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from corpus_snapshot import CorpusSnapshot, open_current_snapshot
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# 'inprocess' serves message vector search from memory; 'postgres' (default) uses HNSW
+VECTOR_ENGINE = os.getenv("VECTOR_ENGINE", "postgres")
+# Seconds between change-feed polls (checked lazily on search)
+VECTOR_ENGINE_SYNC_SECONDS = float(os.getenv("VECTOR_ENGINE_SYNC_SECONDS", "5"))
+# Re-read rows this far behind the watermark, for inserts that committed out of created_at order
+VECTOR_ENGINE_SYNC_OVERLAP_SECONDS = float(os.getenv("VECTOR_ENGINE_SYNC_OVERLAP_SECONDS", "60"))
+# Start from the memory-mapped corpus snapshot (scripts/corpus_snapshot.py) when one exists
+VECTOR_ENGINE_USE_SNAPSHOT = os.getenv("VECTOR_ENGINE_USE_SNAPSHOT", "true").lower() == "true"
+
+EMBEDDING_DIMENSIONS = 1536
+LOAD_BATCH_ROWS = 5000
+# Rows upcast to float32 per matmul block during brute-force search
+SEARCH_BLOCK_ROWS = 16384
+
+
+class InProcessVectorEngine:
+    """
+    Brute-force cosine search over a float16 matrix of normalized message embeddings.
+
+    Metadata needed by the retrievers' filters (source, sent, message length)
+    is kept in parallel arrays so filtering never touches Postgres. New rows
+    are picked up from a created_at watermark; updates and deletes of existing
+    rows are only seen after a reload.
+
+    The corpus is held in two segments: an optional read-only memory-mapped
+    snapshot shared by every worker, and an in-process delta of the rows
+    inserted since the snapshot's watermark.
+    """
+
+    def __init__(self, conn_string: Optional[str] = None, sync_seconds: float = VECTOR_ENGINE_SYNC_SECONDS):
+        self.conn_string = conn_string or os.getenv("DATABASE_URL")
+        self.sync_seconds = sync_seconds
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.snapshot: Optional[CorpusSnapshot] = None
+        self._size = 0
+        self._embeddings = np.zeros((0, EMBEDDING_DIMENSIONS), dtype=np.float16)
+        self._ids = np.empty(0, dtype=object)
+        self._thread_ids = np.empty(0, dtype=object)
+        self._timestamps = np.empty(0, dtype=object)
+        self._source_codes = np.empty(0, dtype=np.int16)
+        self._sent = np.empty(0, dtype=bool)
+        self._lengths = np.empty(0, dtype=np.int32)
+        self._sources: Dict[str, int] = {}
+        self._row_by_id: Dict[str, int] = {}
+
+        self.watermark: Optional[datetime] = None
+        self._last_sync = 0.0
+
+        # Metrics
+        self.searches = 0
+        self.syncs = 0
+        self.rows_synced = 0
+        self._search_ms_total = 0.0
+        self.load_seconds = 0.0
+
+    @property
+    def size(self) -> int:
+        return self._size + (self.snapshot.rows if self.snapshot else 0)
+
+    def _reserve(self, extra: int):
+        """Grow the arrays geometrically so appends stay amortized O(1)"""
+        needed = self._size + extra
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+
+        def grow(array, shape_tail=()):
+            grown = np.zeros((new_capacity,) + shape_tail, dtype=array.dtype) if array.dtype != object \
+                else np.empty((new_capacity,) + shape_tail, dtype=object)
+            grown[:self._size] = array[:self._size]
+            return grown
+
+        self._embeddings = grow(self._embeddings, (EMBEDDING_DIMENSIONS,))
+        self._ids = grow(self._ids)
+        self._thread_ids = grow(self._thread_ids)
+        self._timestamps = grow(self._timestamps)
+        self._source_codes = grow(self._source_codes)
+        self._sent = grow(self._sent)
+        self._lengths = grow(self._lengths)
+
+    def _source_code(self, source: Optional[str]) -> int:
+        if source not in self._sources:
+            self._sources[source] = len(self._sources)
+        return self._sources[source]
+
+    def _append(self, rows: list):
+        """Append (id, thread_id, timestamp, source, sent, length, created_at, embedding) rows"""
+        rows = [row for row in rows if str(row[0]) not in self._row_by_id]
+        if not rows:
+            return 0
+
+        vectors = np.asarray([row[7] for row in rows], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+
+        with self._lock:
+            self._reserve(len(rows))
+            start = self._size
+            end = start + len(rows)
+            self._embeddings[start:end] = vectors.astype(np.float16)
+            for offset, (message_id, thread_id, timestamp, source, sent, length, created_at, _) in enumerate(rows):
+                row = start + offset
+                message_id = str(message_id)
+                self._ids[row] = message_id
+                self._thread_ids[row] = thread_id
+                self._timestamps[row] = timestamp
+                self._source_codes[row] = self._source_code(source)
+                self._sent[row] = bool(sent)
+                self._lengths[row] = length
+                self._row_by_id[message_id] = row
+                if self.watermark is None or created_at > self.watermark:
+                    self.watermark = created_at
+            self._size = end
+        return len(rows)
+
+    def _fetch(self, since: Optional[datetime]):
+        import psycopg
+        from pgvector.psycopg import register_vector
+
+        query = """
+            SELECT id, thread_id, timestamp, source, sent, LENGTH(message_text), created_at, embedding
+            FROM messages
+            WHERE embedding IS NOT NULL {since_clause}
+            ORDER BY created_at
+        """.format(since_clause="AND created_at >= %s" if since is not None else "")
+
+        with psycopg.connect(self.conn_string) as conn:
+            register_vector(conn)
+            # Server-side cursor so the corpus streams in batches instead of one huge result
+            with conn.cursor(name="vector_engine_load") as cur:
+                cur.execute(query, (since,) if since is not None else None)
+                while True:
+                    rows = cur.fetchmany(LOAD_BATCH_ROWS)
+                    if not rows:
+                        break
+                    yield rows
+
+    def load(self):
+        """Load the full corpus"""
+        start = time.time()
+        for rows in self._fetch(None):
+            self._append(rows)
+        self.load_seconds = time.time() - start
+        self._last_sync = time.monotonic()
+        logger.info(f"Vector engine loaded {self._size} message embeddings in {self.load_seconds:.1f}s "
+                    f"({self._embeddings[:self._size].nbytes / 1024 / 1024:.0f} MB float16), watermark {self.watermark}")
+
+    def load_snapshot(self, snapshot: CorpusSnapshot):
+        """Map a snapshot as the base segment, then catch up from its watermark"""
+        start = time.time()
+        self.snapshot = snapshot
+        # The catch-up query overlaps the watermark, so snapshot rows must be recognised as known;
+        # they are stored as -1 - snapshot row to tell them apart from delta rows
+        self._row_by_id.update((str(message_id), -1 - i) for i, message_id in enumerate(snapshot.ids))
+        self.watermark = snapshot.watermark
+        added = self.sync()
+        self.load_seconds = time.time() - start
+        logger.info(f"Vector engine mapped snapshot {snapshot.path} ({snapshot.rows} messages) "
+                    f"and caught up {added} newer messages in {self.load_seconds:.1f}s")
+
+    def sync(self) -> int:
+        """Append messages inserted since the watermark"""
+        since = self.watermark - timedelta(seconds=VECTOR_ENGINE_SYNC_OVERLAP_SECONDS) if self.watermark else None
+        added = 0
+        for rows in self._fetch(since):
+            added += self._append(rows)
+        self.syncs += 1
+        self.rows_synced += added
+        self._last_sync = time.monotonic()
+        if added:
+            logger.info(f"Vector engine synced {added} new messages (watermark {self.watermark})")
+        return added
+
+    def _maybe_sync(self):
+        if time.monotonic() - self._last_sync < self.sync_seconds:
+            return
+        # One thread polls; concurrent searches keep serving the current arrays
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self.sync()
+        except Exception as e:
+            # Serve from the current snapshot rather than failing the search
+            self._last_sync = time.monotonic()
+            logger.warning(f"Vector engine sync failed: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def search(
+        self,
+        embedding: list,
+        limit: int,
+        min_length: int = 0,
+        source: Optional[str] = None,
+        sent: Optional[bool] = None,
+    ) -> List[Tuple[str, Optional[str], datetime, float]]:
+        """
+        Exact cosine top-k with optional metadata filters
+
+        Returns:
+            List of (message_id, thread_id, timestamp, cosine distance), nearest first
+        """
+        self._maybe_sync()
+        start = time.perf_counter()
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        snapshot = self.snapshot
+        with self._lock:
+            size = self._size
+            embeddings = self._embeddings
+            ids, thread_ids, timestamps = self._ids, self._thread_ids, self._timestamps
+            delta_mask = self._filter_mask(
+                self._lengths[:size], self._source_codes[:size], self._sent[:size],
+                min_length, self._sources.get(source, -1) if source is not None else None, sent
+            )
+
+        base_rows = snapshot.rows if snapshot else 0
+        if snapshot:
+            base_mask = self._filter_mask(
+                snapshot.lengths, snapshot.source_codes, snapshot.sent,
+                min_length, snapshot.source_code(source) if source is not None else None, sent
+            )
+            scores = np.concatenate([
+                self._score(snapshot.embeddings, base_mask, query),
+                self._score(embeddings[:size], delta_mask, query),
+            ])
+            candidates = int(base_mask.sum() + delta_mask.sum())
+        else:
+            scores = self._score(embeddings[:size], delta_mask, query)
+            candidates = int(delta_mask.sum())
+
+        k = min(limit, candidates)
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.searches += 1
+        self._search_ms_total += elapsed_ms
+
+        results = []
+        for i in top:
+            distance = float(1.0 - scores[i])
+            if i < base_rows:
+                results.append(snapshot.row(i) + (distance,))
+            else:
+                row = i - base_rows
+                results.append((ids[row], thread_ids[row], timestamps[row], distance))
+        return results
+
+    def get_embeddings(self, message_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Normalized embeddings of the given messages as float32 arrays (e.g. for MMR re-ranking)
+
+        Served from memory, so no database round trip; messages the engine
+        hasn't synced yet are left out.
+        """
+        snapshot = self.snapshot
+        embeddings = {}
+        with self._lock:
+            for message_id in message_ids:
+                row = self._row_by_id.get(str(message_id))
+                if row is None:
+                    continue
+                vector = snapshot.embeddings[-1 - row] if row < 0 else self._embeddings[row]
+                embeddings[str(message_id)] = np.asarray(vector, dtype=np.float32)
+        return embeddings
+
+    @staticmethod
+    def _filter_mask(lengths, source_codes, sent_flags, min_length: int, source_code: Optional[int],
+                     sent: Optional[bool]) -> np.ndarray:
+        mask = np.ones(len(lengths), dtype=bool)
+        if min_length:
+            mask &= lengths > min_length
+        if source_code is not None:
+            mask &= source_codes == source_code
+        if sent is not None:
+            mask &= sent_flags == sent
+        return mask
+
+    @staticmethod
+    def _score(embeddings: np.ndarray, mask: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity per row (-inf where filtered out), upcasting float16 blocks"""
+        size = len(mask)
+        scores = np.full(size, -np.inf, dtype=np.float32)
+        for block_start in range(0, size, SEARCH_BLOCK_ROWS):
+            block_end = min(block_start + SEARCH_BLOCK_ROWS, size)
+            block_mask = mask[block_start:block_end]
+            if not block_mask.any():
+                continue
+            block = np.asarray(embeddings[block_start:block_end], dtype=np.float32)
+            block_scores = block @ query
+            block_scores[~block_mask] = -np.inf
+            scores[block_start:block_end] = block_scores
+        return scores
+
+    def get_stats(self) -> dict:
+        return {
+            "rows": self.size,
+            "delta_rows": self._size,
+            "snapshot": self.snapshot.get_stats() if self.snapshot else None,
+            "memory_mb": round(self._embeddings.nbytes / 1024 / 1024, 1),
+            "watermark": self.watermark,
+            "load_seconds": round(self.load_seconds, 1),
+            "syncs": self.syncs,
+            "rows_synced": self.rows_synced,
+            "searches": self.searches,
+            "avg_search_ms": self._search_ms_total / self.searches if self.searches else 0.0,
+        }
+
+
+_engine: Optional[InProcessVectorEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_vector_engine() -> Optional[InProcessVectorEngine]:
+    """The process-wide engine when VECTOR_ENGINE=inprocess and it has been loaded, else None"""
+    return _engine
+
+
+def load_vector_engine(conn_string: Optional[str] = None) -> Optional[InProcessVectorEngine]:
+    """Load the process-wide engine (startup) if VECTOR_ENGINE=inprocess"""
+    global _engine
+    if VECTOR_ENGINE != "inprocess":
+        return None
+    with _engine_lock:
+        if _engine is None:
+            engine = InProcessVectorEngine(conn_string)
+            snapshot = None
+            if VECTOR_ENGINE_USE_SNAPSHOT:
+                try:
+                    snapshot = open_current_snapshot()
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable corpus snapshot: {e}")
+            if snapshot is not None:
+                engine.load_snapshot(snapshot)
+            else:
+                engine.load()
+            _engine = engine
+    return _engine
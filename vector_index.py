@@ -0,0 +1,420 @@
+"""
+Vector Index Service for Matt-GPT
+HNSW index inspection, concurrent rebuilds, prewarming and ef_search configuration
+"""
+
+import os
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import psycopg
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Embedding storage / search modes
+STORAGE_FLOAT32 = "float32"  # embedding vector(1536)
+STORAGE_HALFVEC = "halfvec"  # embedding_half halfvec(1536)
+STORAGE_BINARY = "binary"  # Hamming shortlist on binary_quantize(embedding_half), re-ranked by cosine
+STORAGE_MATRYOSHKA = "matryoshka"  # Shortlist on truncated embedding_short, re-ranked with full 1536-d vectors
+STORAGE_MODES = (STORAGE_FLOAT32, STORAGE_HALFVEC, STORAGE_BINARY, STORAGE_MATRYOSHKA)
+# Modes whose index scan returns a shortlist that is re-ranked exactly afterwards
+SHORTLIST_MODES = (STORAGE_BINARY, STORAGE_MATRYOSHKA)
+
+# Tables with an embedding column that can use the compact storage modes
+EMBEDDING_TABLES = ("messages", "personality_docs")
+
+# Managed HNSW indexes: name -> (table, column or expression, operator class)
+HNSW_INDEXES: Dict[str, tuple] = {
+    "messages_embedding_idx": ("messages", "embedding", "vector_cosine_ops"),
+    "personality_docs_embedding_idx": ("personality_docs", "embedding", "vector_cosine_ops"),
+    "messages_embedding_half_idx": ("messages", "embedding_half", "halfvec_cosine_ops"),
+    "personality_docs_embedding_half_idx": ("personality_docs", "embedding_half", "halfvec_cosine_ops"),
+    "messages_embedding_bit_idx": ("messages", "(binary_quantize(embedding_half)::bit(1536))", "bit_hamming_ops"),
+    "personality_docs_embedding_bit_idx": ("personality_docs", "(binary_quantize(embedding_half)::bit(1536))", "bit_hamming_ops"),
+    "messages_embedding_short_idx": ("messages", "embedding_short", "vector_cosine_ops"),
+    "personality_docs_embedding_short_idx": ("personality_docs", "embedding_short", "vector_cosine_ops"),
+    "message_chunks_embedding_idx": ("message_chunks", "embedding", "vector_cosine_ops"),
+    "thread_day_centroids_embedding_idx": ("thread_day_centroids", "embedding_sum", "vector_cosine_ops"),
+    "thread_centroids_embedding_idx": ("thread_centroids", "embedding_sum", "vector_cosine_ops"),
+}
+
+# pgvector defaults, used when an index was built without explicit options
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 64
+EMBEDDING_DIMENSIONS = 1536
+
+# Per-session hnsw.ef_search for retrieval connections; unset means the database default
+HNSW_EF_SEARCH = os.getenv("HNSW_EF_SEARCH")
+
+# Which embedding representation the retrievers search (columns and indexes come from migrations 16-19)
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", STORAGE_FLOAT32)
+# Binary / Matryoshka modes shortlist limit * factor candidates before exact re-ranking
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "10"))
+# Width migration 18 builds embedding_short with. Searches use the width recorded in the schema
+# (matryoshka_dimensions); changing this takes a new migration that rebuilds the column and index.
+MATRYOSHKA_DIMENSIONS = 256
+
+if VECTOR_STORAGE not in STORAGE_MODES:
+    logger.warning(f"Unknown VECTOR_STORAGE '{VECTOR_STORAGE}', using '{STORAGE_FLOAT32}'")
+    VECTOR_STORAGE = STORAGE_FLOAT32
+
+
+def shortlist_size(limit: int, rerank_factor: Optional[int] = None) -> int:
+    """Candidates the binary / Matryoshka index scan fetches for exact re-ranking"""
+    return limit * (rerank_factor or VECTOR_RERANK_FACTOR)
+
+
+def vector_search_sql(columns: str, table: str, where: str, embedding: list, limit: int,
+                      mode: Optional[str] = None, rerank_factor: Optional[int] = None,
+                      dimensions: Optional[int] = None) -> Tuple[str, tuple]:
+    """
+    Build a nearest-neighbour query for the configured storage mode
+
+    Args:
+        columns: plain comma-separated column names to return; a cosine
+                 `distance` column is always appended
+        where: extra conditions starting with AND (may be empty)
+        dimensions: Matryoshka shortlist width; defaults to the width of the
+                    migrated embedding_short column
+
+    Shortlist modes need hnsw.ef_search of at least the shortlist size, or the
+    index scan silently returns fewer candidates - run
+    ensure_shortlist_ef_search in the same transaction first.
+
+    Returns:
+        Tuple of (sql, params) ordered by ascending cosine distance
+    """
+    mode = mode or VECTOR_STORAGE
+    if mode == STORAGE_FLOAT32:
+        sql = f"""
+        SELECT {columns}, (embedding <=> %s::vector) as distance
+        FROM {table}
+        WHERE embedding IS NOT NULL {where}
+        ORDER BY embedding <=> %s::vector
+        LIMIT %s
+        """
+        return sql, (embedding, embedding, limit)
+
+    if mode == STORAGE_HALFVEC:
+        sql = f"""
+        SELECT {columns}, (embedding_half <=> %s::halfvec(1536)) as distance
+        FROM {table}
+        WHERE embedding_half IS NOT NULL {where}
+        ORDER BY embedding_half <=> %s::halfvec(1536)
+        LIMIT %s
+        """
+        return sql, (embedding, embedding, limit)
+
+    shortlist = shortlist_size(limit, rerank_factor)
+    if mode == STORAGE_MATRYOSHKA:
+        # The query is truncated in SQL exactly like the stored column (see derived_column)
+        _, _, short_expression = derived_column(STORAGE_MATRYOSHKA, dimensions or matryoshka_dimensions())
+        sql = f"""
+        SELECT {columns}, (embedding <=> %s::vector) as distance
+        FROM (
+            SELECT {columns}, embedding
+            FROM {table}
+            WHERE embedding_short IS NOT NULL {where}
+            ORDER BY embedding_short <=> {short_expression.format(source="%s::vector")}
+            LIMIT %s
+        ) shortlist
+        ORDER BY distance
+        LIMIT %s
+        """
+        return sql, (embedding, embedding, shortlist, limit)
+
+    sql = f"""
+    SELECT {columns}, (embedding_half <=> %s::halfvec(1536)) as distance
+    FROM (
+        SELECT {columns}, embedding_half
+        FROM {table}
+        WHERE embedding_half IS NOT NULL {where}
+        ORDER BY binary_quantize(embedding_half)::bit(1536) <~> binary_quantize(%s::halfvec(1536))
+        LIMIT %s
+    ) shortlist
+    ORDER BY distance
+    LIMIT %s
+    """
+    return sql, (embedding, embedding, shortlist, limit)
+
+
+def get_connection_string() -> str:
+    return os.getenv("DATABASE_URL")
+
+
+_matryoshka_dimensions: Optional[int] = None
+
+
+def matryoshka_dimensions(conn_string: Optional[str] = None) -> int:
+    """
+    Width of messages.embedding_short as the migrations built it, read once per process
+
+    The column type is the record: a query truncated to any other width
+    would fail against it (or, after a rebuild, silently mis-rank).
+    """
+    global _matryoshka_dimensions
+    if _matryoshka_dimensions is None:
+        with psycopg.connect(conn_string or get_connection_string()) as conn:
+            typmod = _column_typmod(conn, "messages", "embedding_short")
+        if typmod is None or typmod <= 0:
+            raise RuntimeError("messages.embedding_short doesn't exist - run 'python scripts/migrate.py upgrade'")
+        if typmod != MATRYOSHKA_DIMENSIONS:
+            logger.warning(f"embedding_short is vector({typmod}) but migrations build vector({MATRYOSHKA_DIMENSIONS}); "
+                           f"searching with the migrated width")
+        _matryoshka_dimensions = typmod
+    return _matryoshka_dimensions
+
+
+def apply_search_settings(conn, ef_search: Optional[int] = None):
+    """
+    Apply per-session ANN search settings to a retrieval connection.
+    Explicit ef_search wins over HNSW_EF_SEARCH; with neither the database default
+    (see `scripts/hnsw_index.py set-ef-search --persist`) is used.
+    """
+    value = ef_search if ef_search is not None else HNSW_EF_SEARCH
+    if value is None:
+        return
+    conn.execute(f"SET hnsw.ef_search = {int(value)}")
+
+
+def ensure_shortlist_ef_search(cur, limit: int, mode: Optional[str] = None, rerank_factor: Optional[int] = None):
+    """
+    Raise hnsw.ef_search for the current transaction to at least the shortlist size
+
+    An HNSW scan returns at most ef_search rows, so a binary / Matryoshka
+    shortlist of limit * rerank_factor candidates (200 at limit 20) would be
+    cut to the ef_search default of 40 before re-ranking. A larger configured
+    ef_search is kept. No-op for the other modes. `cur` may be a cursor or a
+    connection; outside a transaction the setting doesn't outlive the statement.
+    """
+    mode = mode or VECTOR_STORAGE
+    if mode not in SHORTLIST_MODES:
+        return
+    cur.execute(
+        "SELECT set_config('hnsw.ef_search', GREATEST(current_setting('hnsw.ef_search', true)::int, %s)::text, true)",
+        (shortlist_size(limit, rerank_factor),)
+    )
+
+
+def _parse_reloptions(reloptions: Optional[List[str]]) -> dict:
+    options = {}
+    for option in reloptions or []:
+        key, _, value = option.partition("=")
+        options[key] = value
+    return options
+
+
+# Bytes per dimension stored in the index tuple for each operator class family
+BYTES_PER_DIMENSION = {"vector": 4, "halfvec": 2, "bit": 1 / 8}
+
+
+def estimate_index_bytes(rows: float, m: int, dimensions: int = EMBEDDING_DIMENSIONS, opclass: str = "vector_cosine_ops") -> float:
+    """
+    Rough size of a freshly built HNSW index: a full vector copy per tuple,
+    tuple headers, and ~2*m neighbour TIDs (6 bytes each) on the base layer
+    """
+    bytes_per_dimension = BYTES_PER_DIMENSION.get(opclass.split("_")[0], 4)
+    return rows * (dimensions * bytes_per_dimension + 24 + 2 * m * 6)
+
+
+def report_indexes(conn_string: Optional[str] = None) -> List[dict]:
+    """
+    Size, build parameters, usage and estimated bloat of every HNSW index
+
+    Bloat is estimated as actual size over the size of a fresh build for the
+    table's current live rows; dead tuples on the table are reported alongside
+    since HNSW only reclaims them on VACUUM.
+    """
+    with psycopg.connect(conn_string or get_connection_string()) as conn:
+        rows = conn.execute("""
+            SELECT
+                idx.relname,
+                tbl.relname,
+                idx.reloptions,
+                pg_relation_size(idx.oid),
+                tbl.reltuples,
+                COALESCE(stat.n_live_tup, 0),
+                COALESCE(stat.n_dead_tup, 0),
+                COALESCE(istat.idx_scan, 0),
+                i.indisvalid,
+                (SELECT opcname FROM pg_opclass WHERE oid = i.indclass[0])
+            FROM pg_index i
+            JOIN pg_class idx ON idx.oid = i.indexrelid
+            JOIN pg_class tbl ON tbl.oid = i.indrelid
+            JOIN pg_am am ON am.oid = idx.relam
+            LEFT JOIN pg_stat_user_tables stat ON stat.relid = tbl.oid
+            LEFT JOIN pg_stat_user_indexes istat ON istat.indexrelid = idx.oid
+            WHERE am.amname = 'hnsw'
+            ORDER BY idx.relname
+        """).fetchall()
+
+    report = []
+    for name, table, reloptions, size_bytes, reltuples, live_rows, dead_rows, scans, valid, opclass in rows:
+        options = _parse_reloptions(reloptions)
+        m = int(options.get("m", DEFAULT_M))
+        ef_construction = int(options.get("ef_construction", DEFAULT_EF_CONSTRUCTION))
+        expected = estimate_index_bytes(max(live_rows, reltuples, 0), m, opclass=opclass)
+        report.append({
+            "index": name,
+            "table": table,
+            "opclass": opclass,
+            "valid": valid,
+            "m": m,
+            "ef_construction": ef_construction,
+            "size_bytes": size_bytes,
+            "size_mb": round(size_bytes / 1024 / 1024, 1),
+            "live_rows": live_rows,
+            "dead_rows": dead_rows,
+            "index_scans": scans,
+            "estimated_bloat_ratio": round(size_bytes / expected, 2) if expected else None,
+        })
+    return report
+
+
+def get_ef_search(conn_string: Optional[str] = None) -> str:
+    """Effective hnsw.ef_search for a new session"""
+    with psycopg.connect(conn_string or get_connection_string()) as conn:
+        return conn.execute("SHOW hnsw.ef_search").fetchone()[0]
+
+
+def set_database_ef_search(ef_search: int, conn_string: Optional[str] = None):
+    """Persist hnsw.ef_search as the database default for all new sessions"""
+    with psycopg.connect(conn_string or get_connection_string(), autocommit=True) as conn:
+        database = conn.execute("SELECT current_database()").fetchone()[0]
+        conn.execute(f'ALTER DATABASE "{database}" SET hnsw.ef_search = {int(ef_search)}')
+    logger.info(f"Default hnsw.ef_search for database {database} set to {ef_search} (applies to new connections)")
+
+
+def rebuild_index(
+    name: str,
+    m: int = DEFAULT_M,
+    ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+    maintenance_work_mem: str = "1GB",
+    parallel_workers: int = 2,
+    conn_string: Optional[str] = None,
+) -> dict:
+    """
+    Rebuild an HNSW index without blocking writes
+
+    Builds <name>_rebuild with CREATE INDEX CONCURRENTLY, then drops the old
+    index concurrently and renames the new one into place. Retrieval keeps
+    using the old index until the swap. If the build fails, the invalid
+    <name>_rebuild index is dropped and the old index is untouched.
+
+    Returns:
+        Build timing and the new index size
+    """
+    if name not in HNSW_INDEXES:
+        raise ValueError(f"Unknown HNSW index '{name}' (known: {', '.join(HNSW_INDEXES)})")
+    table, column, opclass = HNSW_INDEXES[name]
+    new_name = f"{name}_rebuild"
+
+    with psycopg.connect(conn_string or get_connection_string(), autocommit=True) as conn:
+        conn.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}'")
+        conn.execute(f"SET max_parallel_maintenance_workers = {int(parallel_workers)}")
+        conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}")
+
+        logger.info(f"Building {new_name} on {table} (m={m}, ef_construction={ef_construction}, "
+                    f"maintenance_work_mem={maintenance_work_mem}, parallel_workers={parallel_workers})")
+        start = time.time()
+        try:
+            conn.execute(f"""
+                CREATE INDEX CONCURRENTLY {new_name}
+                ON {table} USING hnsw ({column} {opclass})
+                WITH (m = {int(m)}, ef_construction = {int(ef_construction)})
+            """)
+        except Exception:
+            conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}")
+            raise
+        build_seconds = time.time() - start
+
+        conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        conn.execute(f"ALTER INDEX {new_name} RENAME TO {name}")
+        size_bytes = conn.execute("SELECT pg_relation_size(%s::regclass)", (name,)).fetchone()[0]
+
+    logger.info(f"Rebuilt {name} in {build_seconds:.1f}s ({size_bytes / 1024 / 1024:.1f} MB)")
+    return {"index": name, "m": m, "ef_construction": ef_construction,
+            "build_seconds": round(build_seconds, 1), "size_bytes": size_bytes}
+
+
+def prewarm_index(name: str, conn_string: Optional[str] = None) -> int:
+    """
+    Load an index into shared buffers with pg_prewarm
+
+    Returns:
+        Number of blocks loaded
+    """
+    with psycopg.connect(conn_string or get_connection_string(), autocommit=True) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+        blocks = conn.execute("SELECT pg_prewarm(%s::regclass)", (name,)).fetchone()[0]
+    logger.info(f"Prewarmed {name}: {blocks} blocks")
+    return blocks
+
+
+def derived_column(mode: str, dimensions: Optional[int] = None) -> Tuple[str, str, str]:
+    """
+    Column derived from `embedding` that a storage mode searches
+
+    Returns:
+        Tuple of (column name, column type, SQL expression over `{source}`)
+    """
+    if mode in (STORAGE_HALFVEC, STORAGE_BINARY):
+        return "embedding_half", "halfvec(1536)", "{source}::halfvec(1536)"
+    if mode == STORAGE_MATRYOSHKA:
+        dimensions = int(dimensions or MATRYOSHKA_DIMENSIONS)
+        # Matryoshka truncation: leading dimensions, renormalized to unit length
+        return "embedding_short", f"vector({dimensions})", f"l2_normalize(subvector({{source}}, 1, {dimensions}))::vector({dimensions})"
+    raise ValueError(f"Storage mode '{mode}' has no derived column")
+
+
+def _column_typmod(conn, table: str, column: str) -> Optional[int]:
+    row = conn.execute(
+        "SELECT atttypmod FROM pg_attribute WHERE attrelid = %s::regclass AND attname = %s AND NOT attisdropped",
+        (table, column)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def drop_float32_indexes(conn_string: Optional[str] = None):
+    """
+    After switching VECTOR_STORAGE: drop the float32 HNSW indexes,
+    which are the largest consumer of shared_buffers. The float32 column stays
+    as the source of truth for the sync trigger and exact re-ranking, so the
+    tables grow by the derived columns - only index size goes down.
+    """
+    with psycopg.connect(conn_string or get_connection_string(), autocommit=True) as conn:
+        for table in EMBEDDING_TABLES:
+            conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {table}_embedding_idx")
+            logger.info(f"Dropped {table}_embedding_idx")
+
+
+def storage_footprint(table: str = "messages", conn_string: Optional[str] = None) -> dict:
+    """Average per-row embedding bytes and index sizes for each storage mode"""
+    with psycopg.connect(conn_string or get_connection_string()) as conn:
+        columns = ["embedding"] + [
+            column for column in ("embedding_half", "embedding_short")
+            if _column_typmod(conn, table, column) is not None
+        ]
+        averages = ", ".join(f"AVG(pg_column_size({column}))" for column in columns)
+        row_bytes = conn.execute(f"""
+            SELECT {averages}
+            FROM (SELECT * FROM {table} WHERE embedding IS NOT NULL LIMIT 1000) sample
+        """).fetchone()
+
+        index_sizes = {}
+        for name, (index_table, _, _) in HNSW_INDEXES.items():
+            if index_table != table:
+                continue
+            size = conn.execute("SELECT pg_relation_size(to_regclass(%s))", (name,)).fetchone()[0]
+            index_sizes[name] = size
+
+    return {
+        "table": table,
+        "avg_column_bytes": {
+            column: float(value) if value is not None else None
+            for column, value in zip(columns, row_bytes)
+        },
+        "index_bytes": index_sizes,
+    }